@@ -74,7 +74,6 @@ MIDDLEWARE = [
 # Configuración de CORS
 CORS_ALLOWED_ORIGINS = [
     "https://jordydavbl.github.io",
-    "https://jordydavbl.github.io/frontend-Web-Fapecafes",
 ]
 
 CORS_ALLOW_CREDENTIALS = True
@@ -146,6 +145,44 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Archivos generados por el servidor (reportes, exportaciones)
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Trabajos en segundo plano (python manage.py procesar_trabajos)
+TRABAJOS_DIR = MEDIA_ROOT / 'trabajos'
+TRABAJOS_PROCESOS = 2
+TRABAJOS_INTERVALO_SEGUNDOS = 2
+TRABAJOS_TIEMPO_MAXIMO_MINUTOS = 30
+TRABAJOS_MAX_INTENTOS = 3
+# Cada cuánto el worker busca trabajos abandonados por otro worker
+TRABAJOS_RECUPERACION_SEGUNDOS = 60
+
+# Reportes PDF cacheados por lote y versión de contenido
+REPORTES_DIR = MEDIA_ROOT / 'reportes'
+
+# Cachés: 'generaciones' se comparte entre workers para invalidar las cachés en memoria de cada proceso
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'generaciones': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': MEDIA_ROOT / 'cache' / 'generaciones',
+    },
+}
+CACHE_GENERACIONES_ALIAS = 'generaciones'
+CACHE_PROPIETARIOS_MAXIMO = 5000
+CACHE_PROPIETARIOS_TTL_SEGUNDOS = 300
+CACHE_CALIDAD_MAXIMO = 2000
+CACHE_CALIDAD_TTL_SEGUNDOS = 600
+CACHE_INVENTARIO_MAXIMO = 50
+CACHE_INVENTARIO_TTL_SEGUNDOS = 3600
+CACHE_DESCARGAS_MAXIMO = 200
+CACHE_DESCARGAS_TTL_SEGUNDOS = 600
+
+# Días que tarda en llegar un pedido de insumos (pronóstico de reorden)
+INVENTARIO_PLAZO_ENTREGA_DIAS = 7
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
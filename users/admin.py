@@ -1,5 +1,9 @@
-from django.contrib import admin
-from .models import Organizacion, LoteCafe, PropietarioCafe, MuestraCafe, ProcesoAnalisis, RegistroBitacora, RegistroDescarga, Insumo, RegistroUsoMaquinaria, Proceso, TareaProceso
+from django.contrib import admin, messages
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from .models import Organizacion, LoteCafe, PropietarioCafe, PropietarioMaestro, MuestraCafe, ProcesoAnalisis, RegistroBitacora, RegistroDescarga, Insumo, RegistroUsoMaquinaria, Proceso, TareaProceso, EstadoAnalisisPropietario, LoteEvento, TrabajoAsincrono, MovimientoInventario, ConsumoRecursoLote, MedicionFase
+from . import duplicados, trabajos
 
 @admin.register(Organizacion)
 class OrganizacionAdmin(admin.ModelAdmin):
@@ -14,19 +18,85 @@ class LoteCafeAdmin(admin.ModelAdmin):
     search_fields = ['numero_lote', 'organizacion__nombre']
     readonly_fields = ['fecha_creacion']
 
+@admin.register(PropietarioMaestro)
+class PropietarioMaestroAdmin(admin.ModelAdmin):
+    list_display = ['nombre_completo', 'cedula', 'comunidad', 'municipio', 'total_entregas', 'total_quintales_historicos', 'activo']
+    list_filter = ['activo', 'departamento', 'municipio']
+    search_fields = ['nombre_completo', 'nombre_normalizado', 'cedula']
+    readonly_fields = ['nombre_normalizado', 'total_entregas', 'total_quintales_historicos', 'fecha_registro']
+    ordering = ['nombre_completo']
+    actions = ['fusionar_seleccionados']
+    change_list_template = 'admin/users/propietariomaestro/change_list.html'
+    
+    @admin.action(description='Fusionar seleccionados en el propietario con más entregas')
+    def fusionar_seleccionados(self, request, queryset):
+        propietarios = list(queryset.order_by('-total_entregas', 'id'))
+        if len(propietarios) < 2:
+            self.message_user(request, 'Seleccione al menos dos propietarios para fusionar', messages.WARNING)
+            return
+        principal, *resto = propietarios
+        reasignadas = duplicados.fusionar_propietarios(principal, resto, request.user)
+        self.message_user(request, f'{len(resto)} propietarios fusionados en {principal} ({reasignadas} entregas reasignadas)')
+    
+    def get_urls(self):
+        return [
+            path('duplicados/', self.admin_site.admin_view(self.reporte_duplicados), name='users_propietariomaestro_duplicados'),
+        ] + super().get_urls()
+    
+    def reporte_duplicados(self, request):
+        """Pares candidatos del último trabajo DETECTAR_DUPLICADOS, con acciones para detectar de nuevo y fusionar"""
+        if request.method == 'POST' and self.has_change_permission(request):
+            if 'detectar' in request.POST:
+                trabajo = trabajos.encolar('DETECTAR_DUPLICADOS', usuario=request.user, umbral=float(request.POST.get('umbral') or duplicados.UMBRAL_PREDETERMINADO))
+                self.message_user(request, f'Detección encolada (trabajo #{trabajo.id})')
+            elif 'fusionar' in request.POST:
+                principal = PropietarioMaestro.objects.get(id=request.POST['principal'], activo=True)
+                duplicado = PropietarioMaestro.objects.get(id=request.POST['duplicado'], activo=True)
+                reasignadas = duplicados.fusionar_propietarios(principal, [duplicado], request.user)
+                self.message_user(request, f'{duplicado} fusionado en {principal} ({reasignadas} entregas reasignadas)')
+            return redirect('admin:users_propietariomaestro_duplicados')
+        
+        ultimo = TrabajoAsincrono.objects.filter(tipo='DETECTAR_DUPLICADOS', estado='COMPLETADO').order_by('-fecha_finalizacion').first()
+        en_curso = TrabajoAsincrono.objects.filter(tipo='DETECTAR_DUPLICADOS', estado__in=['PENDIENTE', 'EN_EJECUCION']).first()
+        candidatos = ultimo.resultado.get('candidatos', []) if ultimo else []
+        
+        # Ocultar los pares que ya no aplican (un propietario fusionado o desactivado desde entonces)
+        ids = {c['propietario_a'] for c in candidatos} | {c['propietario_b'] for c in candidatos}
+        activos = set(PropietarioMaestro.objects.filter(id__in=ids, activo=True).values_list('id', flat=True))
+        candidatos = [c for c in candidatos if c['propietario_a'] in activos and c['propietario_b'] in activos]
+        
+        return TemplateResponse(request, 'admin/users/propietariomaestro/duplicados.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Propietarios posiblemente duplicados',
+            'trabajo': ultimo,
+            'en_curso': en_curso,
+            'candidatos': candidatos[:500],
+            'total_candidatos': len(candidatos),
+            'umbral': ultimo.resultado.get('umbral') if ultimo else duplicados.UMBRAL_PREDETERMINADO,
+            'puede_modificar': self.has_change_permission(request),
+        })
+
 @admin.register(PropietarioCafe)
 class PropietarioCafeAdmin(admin.ModelAdmin):
     list_display = ['nombre_completo', 'cedula', 'lote', 'quintales_entregados']
     list_filter = ['lote__organizacion', 'lote']
-    search_fields = ['nombre_completo', 'cedula', 'lote__numero_lote']
+    search_fields = ['nombre_completo_propio', 'propietario_maestro__nombre_completo', 'cedula', 'lote__numero_lote']
 
 @admin.register(MuestraCafe)
 class MuestraCafeAdmin(admin.ModelAdmin):
     list_display = ['numero_muestra', 'propietario', 'lote', 'estado', 'fecha_toma_muestra', 'analista']
     list_filter = ['estado', 'fecha_toma_muestra', 'lote__organizacion']
-    search_fields = ['numero_muestra', 'propietario__nombre_completo', 'lote__numero_lote']
+    search_fields = ['numero_muestra', 'propietario__nombre_completo_propio', 'propietario__propietario_maestro__nombre_completo', 'lote__numero_lote']
     readonly_fields = ['fecha_toma_muestra']
 
+@admin.register(EstadoAnalisisPropietario)
+class EstadoAnalisisPropietarioAdmin(admin.ModelAdmin):
+    list_display = ['propietario', 'lote', 'estado', 'quintales', 'muestra_decisiva', 'fecha_actualizacion']
+    list_filter = ['estado', 'lote__organizacion']
+    search_fields = ['propietario__nombre_completo_propio', 'propietario__propietario_maestro__nombre_completo', 'propietario__cedula', 'lote__numero_lote']
+    readonly_fields = ['propietario', 'lote', 'estado', 'muestra_decisiva', 'quintales', 'fecha_actualizacion']
+
 @admin.register(ProcesoAnalisis)
 class ProcesoAnalisisAdmin(admin.ModelAdmin):
     list_display = ['lote', 'tipo_proceso', 'fecha_inicio', 'fecha_finalizacion', 'aprobado', 'usuario_proceso']
@@ -34,6 +104,20 @@ class ProcesoAnalisisAdmin(admin.ModelAdmin):
     search_fields = ['lote__numero_lote']
     readonly_fields = ['fecha_inicio']
 
+@admin.register(LoteEvento)
+class LoteEventoAdmin(admin.ModelAdmin):
+    list_display = ['lote', 'tipo', 'fecha', 'usuario']
+    list_filter = ['tipo', 'fecha']
+    search_fields = ['lote__numero_lote']
+    readonly_fields = ['lote', 'tipo', 'fecha', 'usuario', 'datos']
+    
+    # El historial de eventos solo lo escriben las transiciones del lote
+    def has_add_permission(self, request):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 @admin.register(RegistroBitacora)
 class RegistroBitacoraAdmin(admin.ModelAdmin):
     list_display = ['fecha', 'usuario', 'accion', 'modulo', 'descripcion_corta', 'ip_address']
@@ -62,7 +146,8 @@ class InsumoAdmin(admin.ModelAdmin):
     list_display = ['nombre', 'codigo', 'tipo', 'cantidad_disponible', 'unidad_medida', 'estado_inventario', 'activo', 'fecha_creacion']
     list_filter = ['tipo', 'activo', 'unidad_medida', 'fecha_creacion']
     search_fields = ['nombre', 'codigo', 'descripcion', 'marca', 'modelo']
-    readonly_fields = ['fecha_creacion', 'fecha_ultima_actualizacion', 'estado_inventario']
+    # La existencia cambia solo con movimientos de inventario
+    readonly_fields = ['cantidad_disponible', 'fecha_creacion', 'fecha_ultima_actualizacion', 'estado_inventario']
     ordering = ['nombre']
     
     fieldsets = (
@@ -97,6 +182,28 @@ class InsumoAdmin(admin.ModelAdmin):
     estado_inventario.allow_tags = True
     estado_inventario.short_description = 'Estado del Inventario'
 
+@admin.register(MovimientoInventario)
+class MovimientoInventarioAdmin(admin.ModelAdmin):
+    list_display = ['fecha', 'insumo', 'tipo', 'cantidad', 'saldo_resultante', 'usuario', 'lote']
+    list_filter = ['tipo', 'fecha']
+    search_fields = ['insumo__nombre', 'insumo__codigo', 'lote__numero_lote', 'observaciones']
+    readonly_fields = ['insumo', 'tipo', 'cantidad', 'saldo_resultante', 'fecha', 'usuario', 'tarea', 'descarga', 'lote']
+    ordering = ['-fecha']
+
+@admin.register(ConsumoRecursoLote)
+class ConsumoRecursoLoteAdmin(admin.ModelAdmin):
+    list_display = ['lote', 'tipo_recurso', 'insumo', 'cantidad', 'minutos', 'registros', 'fecha_actualizacion']
+    list_filter = ['tipo_recurso']
+    search_fields = ['lote__numero_lote', 'insumo__nombre', 'insumo__codigo']
+    readonly_fields = ['lote', 'tipo_recurso', 'insumo', 'cantidad', 'minutos', 'registros', 'fecha_actualizacion']
+
+@admin.register(MedicionFase)
+class MedicionFaseAdmin(admin.ModelAdmin):
+    list_display = ['proceso', 'fase', 'metrica', 'valor', 'unidad', 'fecha_registro']
+    list_filter = ['fase', 'metrica']
+    search_fields = ['proceso__numero', 'metrica']
+    readonly_fields = ['proceso', 'fase', 'metrica', 'valor', 'unidad', 'fecha_registro']
+
 @admin.register(RegistroUsoMaquinaria)
 class RegistroUsoMaquinariaAdmin(admin.ModelAdmin):
     list_display = ['empleado', 'insumo_usado', 'lote', 'hora_inicio', 'hora_fin', 'tiempo_uso_minutos', 'peso_total_descargado']
@@ -180,3 +287,10 @@ class TareaProcesoAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('proceso', 'empleado')
+
+@admin.register(TrabajoAsincrono)
+class TrabajoAsincronoAdmin(admin.ModelAdmin):
+    list_display = ['id', 'tipo', 'estado', 'progreso', 'usuario', 'fecha_creacion', 'fecha_finalizacion']
+    list_filter = ['estado', 'tipo', 'fecha_creacion']
+    search_fields = ['tipo', 'mensaje', 'usuario__username']
+    readonly_fields = ['fecha_creacion', 'fecha_inicio', 'fecha_finalizacion', 'intentos']
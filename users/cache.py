@@ -0,0 +1,175 @@
+"""
+Caché en memoria por proceso para consultas frecuentes de propietarios maestros.
+
+Cada worker mantiene su propio LRU acotado con TTL. Para que una modificación hecha en
+otro worker se vea de inmediato, las invalidaciones incrementan una clave de generación
+compartida (caché CACHE_GENERACIONES_ALIAS); al detectar una generación distinta, el
+worker vacía su copia local.
+"""
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+class CacheLRU:
+    def __init__(self, nombre, maximo, ttl_segundos):
+        self.nombre = nombre
+        self.maximo = maximo
+        self.ttl_segundos = ttl_segundos
+        self._entradas = OrderedDict()
+        self._bloqueo = threading.Lock()
+        self._generacion = None
+        self._estadisticas = dict.fromkeys(['aciertos', 'fallos', 'expirados', 'desalojados', 'invalidaciones'], 0)
+
+    @property
+    def _clave_generacion(self):
+        return f'generacion:{self.nombre}'
+
+    def _sincronizar_generacion(self):
+        """Vacía la copia local si otro proceso invalidó la caché (se llama con el bloqueo tomado)"""
+        generacion = caches[settings.CACHE_GENERACIONES_ALIAS].get(self._clave_generacion, 0)
+        if generacion != self._generacion:
+            if self._entradas:
+                self._estadisticas['invalidaciones'] += 1
+            self._entradas.clear()
+            self._generacion = generacion
+
+    def obtener(self, clave):
+        """Retorna (encontrado, valor)"""
+        with self._bloqueo:
+            self._sincronizar_generacion()
+            return self._obtener_local(clave)
+
+    def obtener_varios(self, claves):
+        """
+        Retorna {clave: valor} de las claves en caché. Consulta la generación compartida una
+        sola vez para todo el lote, no una por clave.
+        """
+        encontrados = {}
+        with self._bloqueo:
+            self._sincronizar_generacion()
+            for clave in claves:
+                en_cache, valor = self._obtener_local(clave)
+                if en_cache:
+                    encontrados[clave] = valor
+        return encontrados
+
+    def _obtener_local(self, clave):
+        """Busca en la copia local (se llama con el bloqueo tomado y la generación sincronizada)"""
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            self._estadisticas['fallos'] += 1
+            return False, None
+        valor, expira = entrada
+        if expira < time.monotonic():
+            del self._entradas[clave]
+            self._estadisticas['expirados'] += 1
+            self._estadisticas['fallos'] += 1
+            return False, None
+        self._entradas.move_to_end(clave)
+        self._estadisticas['aciertos'] += 1
+        return True, valor
+
+    def generacion(self):
+        with self._bloqueo:
+            self._sincronizar_generacion()
+            return self._generacion
+
+    def guardar(self, clave, valor, generacion=None):
+        """
+        Guarda el valor. Si se indica la generación vigente cuando se consultó el valor y
+        desde entonces hubo una invalidación, no se guarda (el valor podría estar obsoleto).
+        """
+        with self._bloqueo:
+            # Se compara con la generación compartida: una invalidación de otro proceso mientras
+            # se consultaba el valor también lo descarta
+            if generacion is not None:
+                self._sincronizar_generacion()
+                if generacion != self._generacion:
+                    return
+            self._entradas[clave] = (valor, time.monotonic() + self.ttl_segundos)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.maximo:
+                self._entradas.popitem(last=False)
+                self._estadisticas['desalojados'] += 1
+
+    def invalidar(self):
+        """
+        Invalida la caché en todos los workers al confirmarse la transacción en curso (de
+        inmediato fuera de una). Antes del commit otro worker aún leería los datos anteriores
+        y los guardaría con la generación nueva.
+        """
+        transaction.on_commit(self._invalidar_ahora)
+
+    def _invalidar_ahora(self):
+        cache_generaciones = caches[settings.CACHE_GENERACIONES_ALIAS]
+        try:
+            cache_generaciones.incr(self._clave_generacion)
+        except ValueError:
+            cache_generaciones.set(self._clave_generacion, 1, timeout=None)
+        with self._bloqueo:
+            self._entradas.clear()
+            self._generacion = None
+            self._estadisticas['invalidaciones'] += 1
+
+    def estadisticas(self):
+        with self._bloqueo:
+            consultas = self._estadisticas['aciertos'] + self._estadisticas['fallos']
+            return {
+                'nombre': self.nombre,
+                'pid': os.getpid(),
+                'entradas': len(self._entradas),
+                'maximo': self.maximo,
+                'ttl_segundos': self.ttl_segundos,
+                'generacion': self._generacion,
+                **self._estadisticas,
+                'tasa_aciertos': round(self._estadisticas['aciertos'] / consultas, 4) if consultas else None,
+            }
+
+cache_propietarios = CacheLRU('propietarios_maestros', settings.CACHE_PROPIETARIOS_MAXIMO, settings.CACHE_PROPIETARIOS_TTL_SEGUNDOS)
+# Historial de calidad de propietarios (users.calidad); se invalida al cambiar entregas o muestras
+cache_calidad = CacheLRU('historial_calidad', settings.CACHE_CALIDAD_MAXIMO, settings.CACHE_CALIDAD_TTL_SEGUNDOS)
+# Pronóstico de consumo de insumos (users.pronostico); se invalida con cada movimiento de inventario
+cache_inventario = CacheLRU('pronostico_inventario', settings.CACHE_INVENTARIO_MAXIMO, settings.CACHE_INVENTARIO_TTL_SEGUNDOS)
+# Rendimiento de descargas por rango (users.rendimiento); se invalida al cambiar una descarga
+cache_descargas = CacheLRU('rendimiento_descargas', settings.CACHE_DESCARGAS_MAXIMO, settings.CACHE_DESCARGAS_TTL_SEGUNDOS)
+
+def _propietarios_por(campo, valores):
+    """
+    Propietarios maestros (activos o no) por id o cédula: {valor: propietario}. Los que no
+    están en caché se traen en una sola consulta; también se recuerdan los inexistentes.
+    Retorna copias, de modo que modificarlas no altera la caché.
+    """
+    from .models import PropietarioMaestro
+
+    valores = set(valores)
+    en_cache = cache_propietarios.obtener_varios([(campo, valor) for valor in valores])
+    encontrados = {
+        valor: copy.copy(propietario) for (_, valor), propietario in en_cache.items() if propietario is not None
+    }
+    faltantes = [valor for valor in valores if (campo, valor) not in en_cache]
+
+    if faltantes:
+        generacion = cache_propietarios.generacion()
+        for propietario in PropietarioMaestro.objects.filter(**{f'{campo}__in': faltantes}):
+            encontrados[getattr(propietario, campo)] = copy.copy(propietario)
+            cache_propietarios.guardar(('id', propietario.id), propietario, generacion)
+            cache_propietarios.guardar(('cedula', propietario.cedula), propietario, generacion)
+        for valor in faltantes:
+            if valor not in encontrados:
+                cache_propietarios.guardar((campo, valor), None, generacion)
+    return encontrados
+
+def propietarios_por_id(ids):
+    return _propietarios_por('id', ids)
+
+def propietarios_por_cedula(cedulas):
+    return _propietarios_por('cedula', cedulas)
+
+def propietario_por_cedula(cedula):
+    return propietarios_por_cedula([cedula]).get(cedula)
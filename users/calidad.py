@@ -0,0 +1,186 @@
+"""
+Historial de calidad de los propietarios maestros.
+
+Las entregas (PropietarioCafe) de los propietarios solicitados se traen junto con sus
+muestras en una sola consulta values(); los conteos y tasas de contaminación del primer y
+segundo muestreo se calculan con group-bys de pandas. Los resultados se guardan en una
+caché LRU por proceso que se invalida al cambiar cualquier entrega o muestra.
+"""
+import pandas as pd
+from django.conf import settings
+
+from .cache import cache_calidad
+from .models import PropietarioCafe, PropietarioMaestro
+
+PERIODOS = {'mes': 'M', 'trimestre': 'Q', 'anio': 'Y'}
+PERIODO_PREDETERMINADO = 'mes'
+# Suavizado del índice de riesgo: un propietario con una sola muestra contaminada no
+# debe quedar por encima de otro con muchas muestras y una tasa alta sostenida
+MUESTRAS_PREVIAS_RIESGO = 2
+
+COLUMNAS = [
+    'entrega', 'propietario', 'quintales', 'fecha_entrega', 'organizacion',
+    'muestra', 'estado', 'es_segundo_muestreo',
+]
+
+def _consultar(filtros):
+    """Una fila por muestra (o una sola fila sin muestra) de cada entrega que cumple los filtros"""
+    registros = PropietarioCafe.objects.filter(propietario_maestro__isnull=False, **filtros).values_list(
+        'id', 'propietario_maestro_id', 'quintales_entregados', 'lote__fecha_entrega', 'lote__organizacion_id',
+        'muestracafe__id', 'muestracafe__estado', 'muestracafe__es_segundo_muestreo',
+    )
+    datos = pd.DataFrame.from_records(list(registros.iterator(chunk_size=5000)), columns=COLUMNAS)
+    datos['quintales'] = datos['quintales'].astype(float)
+    fechas = pd.to_datetime(datos['fecha_entrega'], utc=True).dt.tz_convert(settings.TIME_ZONE).dt.tz_localize(None)
+    datos['fecha_entrega'] = fechas
+    return datos
+
+def _tasa(contaminadas, analizadas):
+    return round(contaminadas / analizadas, 4) if analizadas else None
+
+def _resumen_muestreo(fila, prefijo):
+    analizadas = fila[f'{prefijo}_analizadas']
+    contaminadas = fila[f'{prefijo}_contaminadas']
+    return {
+        'muestras': fila[f'{prefijo}_muestras'],
+        'analizadas': analizadas,
+        'contaminadas': contaminadas,
+        'tasa_contaminacion': _tasa(contaminadas, analizadas),
+    }
+
+def _conteos_muestras(muestras, claves):
+    """Muestras, analizadas y contaminadas por clave y muestreo, en columnas primer_*/segundo_*"""
+    conteos = muestras.groupby(claves + ['es_segundo_muestreo']).agg(
+        muestras=('muestra', 'size'),
+        analizadas=('analizada', 'sum'),
+        contaminadas=('contaminada', 'sum'),
+    ).unstack('es_segundo_muestreo', fill_value=0)
+    conteos.columns = [f"{'segundo' if segundo else 'primer'}_{columna}" for columna, segundo in conteos.columns]
+    return conteos
+
+def _registros(tabla):
+    """Filas de la tabla como diccionarios de valores de Python, con todas las columnas de conteo"""
+    columnas = [f'{prefijo}_{columna}' for prefijo in ('primer', 'segundo') for columna in ('muestras', 'analizadas', 'contaminadas')]
+    tabla = tabla.reindex(columns=list(tabla.columns) + [c for c in columnas if c not in tabla.columns]).fillna(0)
+    tabla[columnas] = tabla[columnas].astype(int)
+    # to_dict es mucho más rápido que iterrows para miles de propietarios y periodos
+    return tabla.reset_index().to_dict('records')
+
+def calcular_historial(datos, periodo=PERIODO_PREDETERMINADO):
+    """
+    Calcula el historial de cada propietario presente en `datos` (ver _consultar).
+    Retorna {propietario_maestro_id: historial}.
+    """
+    if datos.empty:
+        return {}
+
+    entregas = datos.drop_duplicates('entrega')
+    entregas = entregas.assign(periodo=entregas['fecha_entrega'].dt.to_period(PERIODOS[periodo]).astype(str))
+    muestras = datos[datos['muestra'].notna()].copy()
+    muestras['es_segundo_muestreo'] = muestras['es_segundo_muestreo'].astype(bool)
+    muestras['analizada'] = muestras['estado'] != 'PENDIENTE'
+    muestras['contaminada'] = muestras['estado'] == 'CONTAMINADA'
+    muestras['periodo'] = muestras['entrega'].map(entregas.set_index('entrega')['periodo'])
+
+    # Entregas cuyo primer muestreo resultó contaminado, con sus quintales
+    contaminadas = muestras.loc[muestras['contaminada'] & ~muestras['es_segundo_muestreo'], 'entrega'].unique()
+    entregas = entregas.assign(contaminada=entregas['entrega'].isin(contaminadas))
+    entregas = entregas.assign(quintales_contaminados=entregas['quintales'].where(entregas['contaminada'], 0.0))
+
+    totales = entregas.groupby('propietario').agg(
+        total_entregas=('entrega', 'size'),
+        total_quintales=('quintales', 'sum'),
+        entregas_contaminadas=('contaminada', 'sum'),
+        quintales_contaminados=('quintales_contaminados', 'sum'),
+        primera_entrega=('fecha_entrega', 'min'),
+        ultima_entrega=('fecha_entrega', 'max'),
+    )
+    por_periodo = entregas.groupby(['propietario', 'periodo']).agg(
+        entregas=('entrega', 'size'),
+        quintales=('quintales', 'sum'),
+    )
+    if not muestras.empty:
+        totales = totales.join(_conteos_muestras(muestras, ['propietario']))
+        por_periodo = por_periodo.join(_conteos_muestras(muestras, ['propietario', 'periodo']))
+
+    resultado = {}
+    for fila in _registros(totales):
+        primer = _resumen_muestreo(fila, 'primer')
+        segundo = _resumen_muestreo(fila, 'segundo')
+        resultado[fila['propietario']] = {
+            'propietario_maestro': fila['propietario'],
+            'total_entregas': fila['total_entregas'],
+            'total_quintales': round(fila['total_quintales'], 2),
+            'entregas_contaminadas': int(fila['entregas_contaminadas']),
+            'quintales_contaminados': round(fila['quintales_contaminados'], 2),
+            'primera_entrega': fila['primera_entrega'].isoformat(),
+            'ultima_entrega': fila['ultima_entrega'].isoformat(),
+            'primer_muestreo': primer,
+            'segundo_muestreo': segundo,
+            'indice_riesgo': round(
+                (primer['contaminadas'] + segundo['contaminadas']) / (primer['analizadas'] + MUESTRAS_PREVIAS_RIESGO), 4
+            ),
+            'historial': [],
+        }
+    for fila in _registros(por_periodo):
+        primer = _resumen_muestreo(fila, 'primer')
+        segundo = _resumen_muestreo(fila, 'segundo')
+        resultado[fila['propietario']]['historial'].append({
+            'periodo': fila['periodo'],
+            'entregas': fila['entregas'],
+            'quintales': round(fila['quintales'], 2),
+            'tasa_contaminacion_primer_muestreo': primer['tasa_contaminacion'],
+            'tasa_contaminacion_segundo_muestreo': segundo['tasa_contaminacion'],
+            'muestras_analizadas': primer['analizadas'] + segundo['analizadas'],
+        })
+    return resultado
+
+def _agregar_propietarios(historiales):
+    """Completa nombre y cédula de los propietarios en una sola consulta"""
+    propietarios = PropietarioMaestro.objects.filter(id__in=[h['propietario_maestro'] for h in historiales]).values_list(
+        'id', 'nombre_completo', 'cedula'
+    )
+    datos = {id_: (nombre, cedula) for id_, nombre, cedula in propietarios}
+    for historial in historiales:
+        historial['nombre_completo'], historial['cedula'] = datos.get(historial['propietario_maestro'], ('', ''))
+    return historiales
+
+def historial_propietarios(ids, periodo=PERIODO_PREDETERMINADO):
+    """
+    Historial de calidad de varios propietarios maestros: {id: historial}. Los que no están
+    en caché se calculan juntos con una sola consulta. Un propietario sin entregas no aparece.
+    """
+    encontrados = {}
+    faltantes = []
+    for id_ in set(ids):
+        en_cache, historial = cache_calidad.obtener(('propietario', id_, periodo))
+        if not en_cache:
+            faltantes.append(id_)
+        elif historial is not None:
+            encontrados[id_] = historial
+
+    if faltantes:
+        generacion = cache_calidad.generacion()
+        calculados = calcular_historial(_consultar({'propietario_maestro_id__in': faltantes}), periodo)
+        _agregar_propietarios(list(calculados.values()))
+        for id_ in faltantes:
+            cache_calidad.guardar(('propietario', id_, periodo), calculados.get(id_), generacion)
+        encontrados.update(calculados)
+    return encontrados
+
+def ranking_organizacion(organizacion_id, periodo=PERIODO_PREDETERMINADO):
+    """
+    Propietarios que entregaron a la organización, ordenados del mayor al menor índice de
+    riesgo. Solo se consideran sus entregas en lotes de esa organización.
+    """
+    clave = ('organizacion', organizacion_id, periodo)
+    en_cache, ranking = cache_calidad.obtener(clave)
+    if en_cache:
+        return ranking
+
+    generacion = cache_calidad.generacion()
+    calculados = calcular_historial(_consultar({'lote__organizacion_id': organizacion_id}), periodo)
+    ranking = sorted(calculados.values(), key=lambda h: (-h['indice_riesgo'], -h['quintales_contaminados'], h['propietario_maestro']))
+    _agregar_propietarios(ranking)
+    cache_calidad.guardar(clave, ranking, generacion)
+    return ranking
@@ -0,0 +1,227 @@
+"""
+Detección y fusión de propietarios maestros duplicados.
+
+Comparar todos contra todos es O(n²). En su lugar los propietarios se agrupan en bloques
+(apellido normalizado + comunidad, y cédula normalizada) y solo se comparan dentro de cada
+bloque. Un bloque de más de MAXIMO_MIEMBROS_BLOQUE propietarios (un apellido común sin
+comunidad) se divide por la inicial del nombre; si aun así lo excede no se compara y se
+informa como omitido. La similitud de nombres es el coseno entre vectores de bigramas de caracteres y la
+de cédulas la proporción de dígitos coincidentes, ambas calculadas con numpy para el bloque
+completo de una vez.
+"""
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+
+from .cache import cache_calidad, cache_propietarios
+from .models import CAMPOS_HEREDADOS_MAESTRO, PropietarioMaestro, PropietarioCafe, RegistroBitacora, normalizar_texto
+
+DIMENSION_BIGRAMAS = 512
+LONGITUD_CEDULA = 10
+TAMANO_MAXIMO_BLOQUE = 2000
+# Con más miembros las matrices de comparación del bloque ocuparían cientos de MB
+MAXIMO_MIEMBROS_BLOQUE = 1000
+UMBRAL_PREDETERMINADO = 0.8
+PESO_NOMBRE = 0.7
+PESO_CEDULA = 0.3
+
+def normalizar_cedula(cedula):
+    """Solo dígitos y sin ceros a la izquierda: '0102-030405' y '102030405' coinciden"""
+    return re.sub(r'\D', '', cedula or '').lstrip('0')
+
+def _indices_bigramas(nombre):
+    texto = f' {nombre} '
+    return sorted({zlib.crc32(texto[i:i + 2].encode()) % DIMENSION_BIGRAMAS for i in range(len(texto) - 1)})
+
+def _claves_bloque(nombre, comunidad):
+    """
+    Un propietario se ubica en el bloque de su primer y de su último apellido posible
+    (los nombres se escriben tanto 'Apellidos Nombres' como 'Nombres Apellidos'). Cada clave
+    va con la inicial de la palabra del otro extremo, que divide los bloques demasiado grandes.
+    """
+    palabras = [palabra for palabra in nombre.split() if len(palabra) > 2] or nombre.split()
+    if not palabras:
+        return set()
+    return {(('nombre', palabras[0], comunidad), palabras[-1][0]), (('nombre', palabras[-1], comunidad), palabras[0][0])}
+
+def _bloques_comparables(bloques, omitidos):
+    """
+    Miembros de cada bloque con más de un propietario. Los que exceden MAXIMO_MIEMBROS_BLOQUE
+    se dividen por su subclave; las partes que aún lo exceden se agregan a `omitidos`.
+    """
+    comparables = []
+    for clave, miembros in bloques.items():
+        if len(miembros) <= MAXIMO_MIEMBROS_BLOQUE:
+            partes = {None: [posicion for posicion, _ in miembros]}
+        else:
+            partes = defaultdict(list)
+            for posicion, subclave in miembros:
+                partes[subclave].append(posicion)
+        for subclave, posiciones in partes.items():
+            if len(posiciones) > MAXIMO_MIEMBROS_BLOQUE:
+                omitidos.append({
+                    'bloque': ' / '.join(str(parte) for parte in (*clave[1:], subclave) if parte),
+                    'propietarios': len(posiciones),
+                })
+            elif len(posiciones) > 1:
+                comparables.append(posiciones)
+    return comparables
+
+def _matriz_bigramas(indices):
+    matriz = np.zeros((len(indices), DIMENSION_BIGRAMAS), dtype=np.float32)
+    for fila, columnas in enumerate(indices):
+        matriz[fila, columnas] = 1.0
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    return matriz / np.maximum(normas, 1e-9)
+
+def _matriz_cedulas(cedulas):
+    """Dígitos alineados a la derecha en una matriz (n, LONGITUD_CEDULA); -1 donde no hay dígito"""
+    matriz = np.full((len(cedulas), LONGITUD_CEDULA), -1, dtype=np.int8)
+    for fila, cedula in enumerate(cedulas):
+        digitos = cedula[-LONGITUD_CEDULA:]
+        if digitos:
+            matriz[fila, LONGITUD_CEDULA - len(digitos):] = np.frombuffer(digitos.encode(), dtype=np.uint8) - ord('0')
+    return matriz
+
+def _comparar_bloque(miembros, bigramas, digitos, umbral):
+    """Retorna los pares (i, j, puntaje, puntaje_nombre, puntaje_cedula) del bloque con puntaje >= umbral"""
+    pares = []
+    # Los vectores se arman por bloque: una matriz densa de todos los propietarios no cabría en memoria
+    vectores = _matriz_bigramas([bigramas[posicion] for posicion in miembros])
+    for inicio in range(0, len(miembros), TAMANO_MAXIMO_BLOQUE):
+        filas = miembros[inicio:inicio + TAMANO_MAXIMO_BLOQUE]
+        similitud_nombre = vectores[inicio:inicio + TAMANO_MAXIMO_BLOQUE] @ vectores.T
+        iguales = (digitos[filas][:, None, :] == digitos[miembros][None, :, :]) & (digitos[filas][:, None, :] >= 0)
+        similitud_cedula = iguales.sum(axis=2) / LONGITUD_CEDULA
+        puntaje = PESO_NOMBRE * similitud_nombre + PESO_CEDULA * similitud_cedula
+
+        # Solo la mitad superior de la matriz del bloque: cada par una vez y sin comparar consigo mismo
+        posicion_fila = np.arange(inicio, inicio + len(filas))[:, None]
+        posicion_columna = np.arange(len(miembros))[None, :]
+        a, b = np.nonzero((puntaje >= umbral) & (posicion_columna > posicion_fila))
+        for x, y in zip(a, b):
+            pares.append((filas[x], miembros[y], float(puntaje[x, y]), float(similitud_nombre[x, y]), float(similitud_cedula[x, y])))
+    return pares
+
+def detectar_duplicados(umbral=UMBRAL_PREDETERMINADO, limite=None, al_avanzar=None, omitidos=None):
+    """
+    Busca pares de propietarios maestros activos que probablemente sean la misma persona.
+    Retorna una lista de diccionarios ordenada por puntaje descendente. Si se pasa la lista
+    `omitidos`, se le agregan los bloques que no se compararon por su tamaño.
+    """
+    omitidos = omitidos if omitidos is not None else []
+    registros = list(
+        PropietarioMaestro.objects.filter(activo=True)
+        .values_list('id', 'nombre_normalizado', 'cedula', 'comunidad', 'total_entregas')
+        .order_by('id')
+        .iterator(chunk_size=5000)
+    )
+    if not registros:
+        return []
+
+    ids = np.array([registro[0] for registro in registros])
+    cedulas = [normalizar_cedula(registro[2]) for registro in registros]
+    bigramas = [_indices_bigramas(registro[1]) for registro in registros]
+    digitos = _matriz_cedulas(cedulas)
+
+    # Clave del bloque -> [(posición, subclave)]
+    bloques = defaultdict(list)
+    for posicion, (_, nombre, _, comunidad, _) in enumerate(registros):
+        for clave, subclave in _claves_bloque(nombre, normalizar_texto(comunidad)):
+            bloques[clave].append((posicion, subclave))
+        if cedulas[posicion]:
+            bloques[('cedula', cedulas[posicion])].append((posicion, None))
+
+    candidatos = {}
+    bloques_comparables = _bloques_comparables(bloques, omitidos)
+    for numero, miembros in enumerate(bloques_comparables, 1):
+        for i, j, puntaje, puntaje_nombre, puntaje_cedula in _comparar_bloque(np.array(miembros), bigramas, digitos, umbral):
+            par = (min(i, j), max(i, j))
+            if par not in candidatos or candidatos[par][0] < puntaje:
+                candidatos[par] = (puntaje, puntaje_nombre, puntaje_cedula)
+        if al_avanzar and numero % 1000 == 0:
+            al_avanzar(numero / len(bloques_comparables))
+
+    resultado = []
+    for (i, j), (puntaje, puntaje_nombre, puntaje_cedula) in sorted(candidatos.items(), key=lambda item: -item[1][0]):
+        resultado.append({
+            'propietario_a': int(ids[i]),
+            'propietario_b': int(ids[j]),
+            'nombre_a': registros[i][1],
+            'nombre_b': registros[j][1],
+            'cedula_a': registros[i][2],
+            'cedula_b': registros[j][2],
+            'comunidad': registros[i][3] if registros[i][3] == registros[j][3] else f'{registros[i][3]} / {registros[j][3]}',
+            'puntaje': round(puntaje, 4),
+            'puntaje_nombre': round(puntaje_nombre, 4),
+            'puntaje_cedula': round(puntaje_cedula, 4),
+            'misma_cedula': bool(cedulas[i]) and cedulas[i] == cedulas[j],
+        })
+        if limite and len(resultado) >= limite:
+            break
+    return resultado
+
+@transaction.atomic
+def fusionar_propietarios(principal, duplicados, usuario=None):
+    """
+    Fusiona los propietarios duplicados en el principal: sus entregas pasan al principal en
+    una sola actualización, se completan los datos vacíos del principal y los duplicados
+    quedan inactivos. Retorna el número de entregas reasignadas.
+    """
+    duplicados = [duplicado for duplicado in duplicados if duplicado.id != principal.id]
+    if not duplicados:
+        return 0
+    ids_duplicados = [duplicado.id for duplicado in duplicados]
+
+    # Las entregas que heredaban los datos de un duplicado los conservan al pasar al principal
+    PropietarioCafe.fijar_datos_heredados({id_: CAMPOS_HEREDADOS_MAESTRO for id_ in ids_duplicados})
+    reasignadas = PropietarioCafe.objects.filter(propietario_maestro_id__in=ids_duplicados).update(propietario_maestro=principal)
+
+    campos_completados = []
+    for campo in ['telefono', 'departamento', 'municipio', 'comunidad', 'calle', 'numero_casa', 'referencias']:
+        if not getattr(principal, campo):
+            valor = next((getattr(duplicado, campo) for duplicado in duplicados if getattr(duplicado, campo)), '')
+            if valor:
+                setattr(principal, campo, valor)
+                campos_completados.append(campo)
+    if campos_completados:
+        principal.save(update_fields=campos_completados)
+
+    PropietarioMaestro.objects.filter(id__in=ids_duplicados).update(activo=False)
+    # update() no emite señales: contadores y caché se ajustan explícitamente
+    PropietarioMaestro.reconciliar(PropietarioMaestro.objects.filter(id__in=ids_duplicados + [principal.id]))
+    cache_propietarios.invalidar()
+    cache_calidad.invalidar()
+
+    if usuario is not None:
+        RegistroBitacora.registrar_accion(
+            usuario=usuario,
+            accion='FUSIONAR_PROPIETARIOS',
+            modulo='PERSONAL',
+            descripcion=f'Propietarios fusionados en {principal.nombre_completo} ({principal.cedula}): '
+                        f'{", ".join(f"{d.nombre_completo} ({d.cedula})" for d in duplicados)} - {reasignadas} entregas reasignadas',
+            detalles_adicionales={
+                'propietario_principal': principal.id,
+                'propietarios_fusionados': ids_duplicados,
+                'entregas_reasignadas': reasignadas,
+                'campos_completados': campos_completados
+            }
+        )
+    return reasignadas
+
+# Manejador del trabajo DETECTAR_DUPLICADOS
+
+def detectar_duplicados_trabajo(trabajo):
+    umbral = float(trabajo.parametros.get('umbral', UMBRAL_PREDETERMINADO))
+    limite = trabajo.parametros.get('limite', 5000)
+    omitidos = []
+    candidatos = detectar_duplicados(
+        umbral=umbral,
+        limite=limite,
+        al_avanzar=lambda avance: trabajo.actualizar_progreso(min(int(avance * 100), 99), 'Comparando bloques'),
+        omitidos=omitidos
+    )
+    return {'umbral': umbral, 'total_candidatos': len(candidatos), 'candidatos': candidatos, 'bloques_omitidos': omitidos}
@@ -0,0 +1,195 @@
+"""
+Importación masiva de padrones de productores (PropietarioMaestro) desde CSV o XLSX.
+
+El archivo se lee por bloques sin cargarlo completo en memoria. Cada bloque se deduplica
+por cédula, se consulta una sola vez contra la base de datos y se inserta o actualiza con
+bulk_create(update_conflicts=True).
+"""
+import csv
+import io
+import os
+from itertools import islice
+
+from django.conf import settings
+
+from .cache import cache_propietarios
+from .models import CAMPOS_HEREDADOS_MAESTRO, PropietarioCafe, PropietarioMaestro, normalizar_texto
+
+TAMANO_BLOQUE = 1000
+MAXIMO_ERRORES_REPORTADOS = 100
+EXTENSIONES_PERMITIDAS = ('.csv', '.xlsx')
+
+# Columnas del archivo (normalizadas) -> campo de PropietarioMaestro
+COLUMNAS = {
+    'cedula': 'cedula',
+    'nombre_completo': 'nombre_completo',
+    'nombre': 'nombre_completo',
+    'nombres': 'nombre_completo',
+    'telefono': 'telefono',
+    'celular': 'telefono',
+    'departamento': 'departamento',
+    'provincia': 'departamento',
+    'municipio': 'municipio',
+    'ciudad': 'municipio',
+    'canton': 'municipio',
+    'comunidad': 'comunidad',
+    'barrio': 'comunidad',
+    'calle': 'calle',
+    'finca': 'calle',
+    'numero_casa': 'numero_casa',
+    'referencias': 'referencias',
+}
+
+def guardar_archivo(archivo_subido):
+    """Copia el archivo subido a TRABAJOS_DIR por fragmentos y retorna su ruta relativa"""
+    carpeta = settings.TRABAJOS_DIR / 'importaciones'
+    os.makedirs(carpeta, exist_ok=True)
+    base, extension = os.path.splitext(os.path.basename(archivo_subido.name))
+    ruta = carpeta / f"{normalizar_texto(base).replace(' ', '_')[:50] or 'padron'}_{os.urandom(4).hex()}{extension.lower()}"
+    with open(ruta, 'wb') as destino:
+        for fragmento in archivo_subido.chunks():
+            destino.write(fragmento)
+    return str(ruta.relative_to(settings.TRABAJOS_DIR))
+
+def _campo_columna(encabezado):
+    return COLUMNAS.get(normalizar_texto(str(encabezado or '')).replace(' ', '_'))
+
+def _valor_celda(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        # Las cédulas y teléfonos numéricos en Excel llegan como float
+        valor = int(valor)
+    return str(valor).strip()
+
+def _filas_csv(ruta):
+    """Genera (encabezados, avance) y luego las filas de un CSV; el avance es la fracción de bytes leídos"""
+    with open(ruta, 'rb') as binario:
+        tamano = max(os.fstat(binario.fileno()).st_size, 1)
+        muestra = binario.read(4096).decode('utf-8-sig', errors='ignore')
+        binario.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=',;\t')
+        except csv.Error:
+            dialecto = csv.excel
+        lector = csv.reader(io.TextIOWrapper(binario, encoding='utf-8-sig', newline=''), dialecto)
+        yield next(lector, [])
+        for fila in lector:
+            yield fila, binario.tell() / tamano
+
+def _filas_xlsx(ruta):
+    """Igual que _filas_csv para la primera hoja de un XLSX, leída en modo de solo lectura"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise RuntimeError('La importación de archivos XLSX requiere el paquete openpyxl')
+    libro = load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        hoja = libro.worksheets[0]
+        total = max(hoja.max_row or 1, 1)
+        filas = hoja.iter_rows(values_only=True)
+        yield [_valor_celda(valor) for valor in next(filas, ())]
+        for indice, fila in enumerate(filas, 2):
+            yield [_valor_celda(valor) for valor in fila], indice / total
+    finally:
+        libro.close()
+
+def importar_archivo(ruta, al_avanzar=None):
+    """
+    Importa el padrón y retorna el resumen. Una cédula repetida dentro del archivo se
+    toma de su primera aparición; las columnas ausentes del archivo no se modifican.
+    """
+    filas = _filas_xlsx(ruta) if str(ruta).lower().endswith('.xlsx') else _filas_csv(ruta)
+    encabezados = [_campo_columna(encabezado) for encabezado in next(filas)]
+    if 'cedula' not in encabezados or 'nombre_completo' not in encabezados:
+        raise ValueError('El archivo debe tener las columnas cedula y nombre_completo (o nombre)')
+    campos = [campo for campo in dict.fromkeys(encabezados) if campo]
+    campos_actualizar = [campo for campo in campos if campo != 'cedula'] + ['nombre_normalizado']
+
+    resumen = {'filas': 0, 'creados': 0, 'actualizados': 0, 'duplicados': 0, 'total_errores': 0, 'errores': []}
+    cedulas_vistas = set()
+    numero_fila = 1
+
+    while True:
+        bloque = list(islice(filas, TAMANO_BLOQUE))
+        if not bloque:
+            break
+
+        propietarios = {}
+        for fila, avance in bloque:
+            numero_fila += 1
+            if not any(fila):
+                continue
+            resumen['filas'] += 1
+            valores = {}
+            for campo, valor in zip(encabezados, fila):
+                if campo and campo not in valores:
+                    valores[campo] = (valor or '').strip()
+
+            error = None
+            if not valores.get('cedula'):
+                error = 'Cédula vacía'
+            elif not valores.get('nombre_completo'):
+                error = 'Nombre vacío'
+            elif len(valores['cedula']) > 20:
+                error = 'Cédula con más de 20 caracteres'
+            if error:
+                resumen['total_errores'] += 1
+                if len(resumen['errores']) < MAXIMO_ERRORES_REPORTADOS:
+                    resumen['errores'].append({'fila': numero_fila, 'cedula': valores.get('cedula', ''), 'error': error})
+                continue
+
+            if valores['cedula'] in cedulas_vistas:
+                resumen['duplicados'] += 1
+                continue
+            cedulas_vistas.add(valores['cedula'])
+
+            for campo in campos:
+                limite = PropietarioMaestro._meta.get_field(campo).max_length
+                valores[campo] = valores.get(campo, '')[:limite]
+            propietarios[valores['cedula']] = PropietarioMaestro(
+                nombre_normalizado=normalizar_texto(valores['nombre_completo']), **valores
+            )
+
+        if propietarios:
+            campos_heredados = [campo for campo in campos if campo in CAMPOS_HEREDADOS_MAESTRO]
+            existentes = {
+                actual['cedula']: actual
+                for actual in PropietarioMaestro.objects.filter(cedula__in=propietarios).values('id', 'cedula', *campos_heredados)
+            }
+            # bulk_create no emite pre_save: las entregas anteriores conservan los datos que cambian
+            PropietarioCafe.fijar_datos_heredados({
+                actual['id']: [campo for campo in campos_heredados if actual[campo] != getattr(propietarios[cedula], campo)]
+                for cedula, actual in existentes.items()
+            })
+            PropietarioMaestro.objects.bulk_create(
+                propietarios.values(),
+                update_conflicts=True,
+                unique_fields=['cedula'],
+                update_fields=campos_actualizar,
+            )
+            # bulk_create no emite post_save: se invalida la caché de propietarios en todos los workers
+            cache_propietarios.invalidar()
+            resumen['actualizados'] += len(existentes)
+            resumen['creados'] += len(propietarios) - len(existentes)
+
+        if al_avanzar:
+            al_avanzar(bloque[-1][1], resumen)
+
+    return resumen
+
+# Manejador del trabajo IMPORTAR_PROPIETARIOS
+
+def importar_propietarios(trabajo):
+    ruta = settings.TRABAJOS_DIR / trabajo.parametros['archivo']
+
+    def al_avanzar(avance, resumen):
+        trabajo.actualizar_progreso(
+            min(int(avance * 100), 99),
+            f"{resumen['filas']} filas: {resumen['creados']} nuevos, {resumen['actualizados']} actualizados"
+        )
+
+    resumen = importar_archivo(ruta, al_avanzar)
+    # El archivo solo se elimina si la importación terminó; un reintento vuelve a leerlo
+    ruta.unlink(missing_ok=True)
+    return resumen
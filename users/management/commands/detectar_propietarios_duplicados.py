@@ -0,0 +1,43 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users import duplicados
+
+
+class Command(BaseCommand):
+    help = 'Busca propietarios maestros activos que probablemente estén duplicados (por bloques de apellido/comunidad y cédula)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--umbral', type=float, default=duplicados.UMBRAL_PREDETERMINADO,
+                            help='Puntaje mínimo (0 a 1) para reportar un par')
+        parser.add_argument('--limite', type=int, default=None,
+                            help='Número máximo de pares a reportar')
+        parser.add_argument('--csv', dest='archivo_csv',
+                            help='Ruta de un archivo CSV donde escribir los pares encontrados')
+
+    def handle(self, *args, **options):
+        if not 0 < options['umbral'] <= 1:
+            raise CommandError('El umbral debe estar entre 0 y 1')
+
+        inicio = time.monotonic()
+        omitidos = []
+        candidatos = duplicados.detectar_duplicados(umbral=options['umbral'], limite=options['limite'], omitidos=omitidos)
+        duracion = time.monotonic() - inicio
+
+        if options['archivo_csv']:
+            with open(options['archivo_csv'], 'w', newline='', encoding='utf-8-sig') as archivo:
+                escritor = csv.DictWriter(archivo, fieldnames=list(candidatos[0].keys()) if candidatos else ['propietario_a', 'propietario_b', 'puntaje'])
+                escritor.writeheader()
+                escritor.writerows(candidatos)
+        else:
+            for candidato in candidatos:
+                self.stdout.write(
+                    f"{candidato['puntaje']:.3f}  #{candidato['propietario_a']} {candidato['nombre_a']} ({candidato['cedula_a']})"
+                    f"  <->  #{candidato['propietario_b']} {candidato['nombre_b']} ({candidato['cedula_b']})"
+                )
+
+        for bloque in omitidos:
+            self.stdout.write(self.style.WARNING(f"Bloque omitido por su tamaño: {bloque['bloque']} ({bloque['propietarios']} propietarios)"))
+        self.stdout.write(self.style.SUCCESS(f'{len(candidatos)} pares candidatos encontrados en {duracion:.1f} s'))
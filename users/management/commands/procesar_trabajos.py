@@ -0,0 +1,68 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+def _inicializar_proceso():
+    # Los procesos del pool se crean con 'spawn': configuran Django y abren su propia conexión
+    import django
+    django.setup()
+
+
+def _ejecutar_en_proceso(trabajo_id):
+    from users import trabajos
+    try:
+        return trabajos.ejecutar(trabajo_id)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta los trabajos en segundo plano (exportaciones, reportes, importaciones) en un pool de procesos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procesos', type=int, default=settings.TRABAJOS_PROCESOS,
+                            help='Número de procesos del pool')
+        parser.add_argument('--intervalo', type=float, default=settings.TRABAJOS_INTERVALO_SEGUNDOS,
+                            help='Segundos de espera cuando no hay trabajos pendientes')
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Procesa los trabajos pendientes y termina')
+
+    def handle(self, *args, **options):
+        from users import trabajos
+
+        procesos = max(1, options['procesos'])
+        contexto = multiprocessing.get_context('spawn')
+        en_curso = {}
+        ultima_recuperacion = None
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto, initializer=_inicializar_proceso) as pool:
+            while True:
+                # Los trabajos de un worker caído se recuperan también mientras este sigue activo
+                if ultima_recuperacion is None or time.monotonic() - ultima_recuperacion >= settings.TRABAJOS_RECUPERACION_SEGUNDOS:
+                    reintentados, fallidos = trabajos.recuperar_abandonados(excluir=en_curso.values())
+                    if reintentados or fallidos:
+                        self.stdout.write(f'Trabajos abandonados: {reintentados} reintentados, {fallidos} fallidos')
+                    ultima_recuperacion = time.monotonic()
+
+                for futuro in [f for f in en_curso if f.done()]:
+                    trabajo_id = en_curso.pop(futuro)
+                    estado = 'completado' if futuro.exception() is None and futuro.result() else 'fallido'
+                    self.stdout.write(f'Trabajo {trabajo_id} {estado}')
+
+                reclamados = 0
+                while len(en_curso) < procesos:
+                    trabajo = trabajos.reclamar_siguiente()
+                    if trabajo is None:
+                        break
+                    self.stdout.write(f'Trabajo {trabajo.id} ({trabajo.tipo}) iniciado')
+                    en_curso[pool.submit(_ejecutar_en_proceso, trabajo.id)] = trabajo.id
+                    reclamados += 1
+
+                if options['una_vez'] and not en_curso and not reclamados:
+                    break
+                if not reclamados:
+                    time.sleep(options['intervalo'] if not en_curso else 0.2)
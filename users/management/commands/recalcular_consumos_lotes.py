@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from users.models import ConsumoRecursoLote, LoteCafe
+
+TAMANO_BLOQUE = 500
+
+
+class Command(BaseCommand):
+    help = ('Recalcula la tabla de consumo de recursos por lote (insumos, minutos de maquinaria y de mano de obra) '
+            'desde las tareas, descargas, usos de maquinaria y tareas de proceso')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, action='append', dest='lotes',
+                            help='ID de lote a recalcular (se puede repetir); por defecto todos')
+
+    def handle(self, *args, **options):
+        lote_ids = options['lotes'] or list(LoteCafe.objects.order_by('id').values_list('id', flat=True))
+
+        for inicio in range(0, len(lote_ids), TAMANO_BLOQUE):
+            ConsumoRecursoLote.recalcular(lote_ids[inicio:inicio + TAMANO_BLOQUE])
+        self.stdout.write(self.style.SUCCESS(f'Consumo de recursos recalculado para {len(lote_ids)} lotes'))
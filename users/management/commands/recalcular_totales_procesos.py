@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from users.models import Proceso
+
+TAMANO_BLOQUE = 500
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los quintales y pesos totales de los procesos activos desde sus lotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--proceso', type=int, action='append', dest='procesos',
+                            help='ID de proceso a recalcular (se puede repetir); por defecto todos los activos')
+
+    def handle(self, *args, **options):
+        proceso_ids = options['procesos'] or list(Proceso.objects.filter(activo=True).order_by('id').values_list('id', flat=True))
+
+        actualizados = 0
+        for inicio in range(0, len(proceso_ids), TAMANO_BLOQUE):
+            actualizados += Proceso.recalcular_totales(proceso_ids[inicio:inicio + TAMANO_BLOQUE])
+        self.stdout.write(self.style.SUCCESS(f'Totales recalculados para {actualizados} procesos'))
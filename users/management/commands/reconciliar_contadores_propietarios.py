@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from users.models import PropietarioMaestro
+
+
+class Command(BaseCommand):
+    help = 'Recalcula total_entregas y total_quintales_historicos de los propietarios maestros desde sus entregas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--propietario', type=int, action='append', dest='propietarios',
+                            help='ID de propietario maestro a reconciliar (se puede repetir); por defecto todos')
+
+    def handle(self, *args, **options):
+        queryset = PropietarioMaestro.objects.all()
+        if options['propietarios']:
+            queryset = queryset.filter(id__in=options['propietarios'])
+
+        corregidos = PropietarioMaestro.reconciliar(queryset)
+        self.stdout.write(self.style.SUCCESS(f'{corregidos} propietarios con contadores corregidos'))
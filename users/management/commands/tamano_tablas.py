@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from users.models import PropietarioCafe, PropietarioMaestro, MuestraCafe
+
+
+def _tamano_en_disco(cursor, tabla):
+    """Bytes de la tabla y sus índices, o None si el motor no lo informa"""
+    if connection.vendor == 'postgresql':
+        cursor.execute('SELECT pg_relation_size(%s), pg_indexes_size(%s)', [tabla, tabla])
+        return cursor.fetchone()
+    if connection.vendor == 'sqlite':
+        try:
+            cursor.execute('SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name = %s', [tabla])
+            datos = cursor.fetchone()[0]
+            cursor.execute(
+                "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN "
+                "(SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s)", [tabla]
+            )
+            return datos, cursor.fetchone()[0]
+        except Exception:
+            # SQLite compilado sin la tabla virtual dbstat
+            return None
+    return None
+
+
+class Command(BaseCommand):
+    help = ('Informa el tamaño de las tablas (filas, bytes en disco y bytes de texto por columna). '
+            'Sirve para comparar el almacenamiento antes y después de una migración')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tabla', action='append', dest='tablas',
+                            help='Nombre de la tabla (se puede repetir); por defecto las de propietarios y muestras')
+
+    def handle(self, *args, **options):
+        tablas = options['tablas'] or [modelo._meta.db_table for modelo in (PropietarioCafe, PropietarioMaestro, MuestraCafe)]
+
+        with connection.cursor() as cursor:
+            for tabla in tablas:
+                cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(tabla)}')
+                filas = cursor.fetchone()[0]
+
+                # Columnas leídas de la base de datos (no del modelo) para poder comparar con
+                # el esquema anterior a una migración
+                columnas = [
+                    columna.name for columna in connection.introspection.get_table_description(cursor, tabla)
+                    if connection.introspection.get_field_type(columna.type_code, columna) in ('CharField', 'TextField')
+                ]
+                bytes_columnas, nulos = {}, {}
+                if columnas and filas:
+                    nombres = [connection.ops.quote_name(columna) for columna in columnas]
+                    cursor.execute('SELECT {}, {} FROM {}'.format(
+                        ', '.join(f'COALESCE(SUM(LENGTH({nombre})), 0)' for nombre in nombres),
+                        ', '.join(f'COUNT(*) - COUNT({nombre})' for nombre in nombres),
+                        connection.ops.quote_name(tabla)
+                    ))
+                    resultado = cursor.fetchone()
+                    bytes_columnas = dict(zip(columnas, resultado[:len(columnas)]))
+                    nulos = dict(zip(columnas, resultado[len(columnas):]))
+
+                self.stdout.write(self.style.MIGRATE_HEADING(tabla))
+                self.stdout.write(f'  Filas: {filas}')
+                en_disco = _tamano_en_disco(cursor, tabla)
+                if en_disco:
+                    self.stdout.write(f'  En disco: {en_disco[0]} bytes de datos, {en_disco[1]} bytes de índices')
+                self.stdout.write(f'  Texto: {sum(bytes_columnas.values())} caracteres')
+                for columna in columnas:
+                    if bytes_columnas.get(columna) or nulos.get(columna):
+                        self.stdout.write(f'    {columna:<28} {bytes_columnas.get(columna, 0):>12}   nulos: {nulos.get(columna, 0)}')
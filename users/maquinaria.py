@@ -0,0 +1,304 @@
+"""
+Utilización de la maquinaria a partir de los registros de uso.
+
+Los registros del rango se traen en una sola consulta ordenada por máquina y hora de
+inicio. Con numpy se cortan en los límites de cada día o turno y se recorren como una
+línea de barrido por grupo (máquina, periodo): la unión de los intervalos da los minutos
+ocupados y los huecos entre usos, y la suma acumulada de eventos de inicio (+1) y fin (-1)
+da la concurrencia máxima. Los kilogramos de un uso se reparten entre los periodos que
+abarca en proporción a su duración.
+
+La auditoría de solapamientos recorre los usos de cada máquina en orden de inicio con un
+montículo de los usos aún abiertos, de modo que cada par que se cruza se reporta una vez.
+"""
+import heapq
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db.models import CharField, F, FloatField, Q
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import Insumo, RegistroUsoMaquinaria
+
+AGRUPACIONES = ('dia', 'turno')
+# Nombre y hora de inicio de cada turno; el último termina al comenzar el primero del día siguiente
+TURNOS = [('MANANA', 6), ('TARDE', 14), ('NOCHE', 22)]
+MAXIMO_DIAS = 366
+MAXIMO_CONFLICTOS = 5000
+SEGUNDOS_DIA = 86400
+# Desplazamiento por grupo para el máximo acumulado segmentado (mayor que cualquier instante)
+_DESPLAZAMIENTO_GRUPO = 10 ** 11
+
+def _segundos_locales(fechas):
+    """Segundos desde la época, en hora local sin zona, de fechas en texto ISO (UTC si no indican zona)"""
+    locales = pd.to_datetime(pd.Series(fechas, dtype=object), utc=True, format='ISO8601').dt.tz_convert(settings.TIME_ZONE).dt.tz_localize(None)
+    return locales.to_numpy().astype('datetime64[s]').astype(np.int64)
+
+def _limites(desde, hasta, agrupacion):
+    """Inicio (segundos locales) de cada periodo que toca el rango de días, con su etiqueta (fecha, turno)"""
+    # Desde el día anterior: el turno de noche previo al rango termina dentro de él
+    dias = np.arange(np.datetime64(desde - timedelta(days=1)), np.datetime64(hasta + timedelta(days=2)), dtype='datetime64[D]')
+    bases = dias.astype('datetime64[s]').astype(np.int64)
+    if agrupacion == 'dia':
+        return bases, [(str(dia), None) for dia in dias]
+    desplazamientos = np.array([hora * 3600 for _, hora in TURNOS], dtype=np.int64)
+    inicios = (bases[:, None] + desplazamientos[None, :]).ravel()
+    return inicios, [(str(dia), nombre) for dia in dias for nombre, _ in TURNOS]
+
+def _barrido(grupo, inicio, fin):
+    """
+    Recorre los intervalos ordenados por (grupo, inicio). Retorna por grupo: segundos
+    ocupados, número de huecos entre usos, hueco más largo y concurrencia máxima.
+    """
+    total_grupos = int(grupo.max()) + 1
+    primero = np.ones(len(grupo), dtype=bool)
+    primero[1:] = grupo[1:] != grupo[:-1]
+
+    # Unión de intervalos: un uso abre un bloque nuevo si empieza después del fin más tardío anterior
+    desplazamiento = grupo.astype(np.int64) * _DESPLAZAMIENTO_GRUPO
+    fin_acumulado = np.maximum.accumulate(fin + desplazamiento) - desplazamiento
+    nuevo_bloque = primero.copy()
+    nuevo_bloque[1:] |= inicio[1:] > fin_acumulado[:-1]
+    posiciones = np.flatnonzero(nuevo_bloque)
+    ultimos = np.append(posiciones[1:] - 1, len(grupo) - 1)
+    grupo_bloque = grupo[posiciones]
+    inicio_bloque = inicio[posiciones]
+    fin_bloque = fin_acumulado[ultimos]
+    ocupados = np.bincount(grupo_bloque, weights=fin_bloque - inicio_bloque, minlength=total_grupos)
+
+    mismo_grupo = grupo_bloque[1:] == grupo_bloque[:-1]
+    huecos = (inicio_bloque[1:] - fin_bloque[:-1])[mismo_grupo]
+    grupo_hueco = grupo_bloque[1:][mismo_grupo]
+    cantidad_huecos = np.bincount(grupo_hueco, minlength=total_grupos)
+    hueco_maximo = np.zeros(total_grupos, dtype=np.int64)
+    np.maximum.at(hueco_maximo, grupo_hueco, huecos)
+
+    # Concurrencia: los fines se ordenan antes que los inicios del mismo instante (usos contiguos no se solapan)
+    tiempos = np.concatenate([inicio, fin])
+    deltas = np.concatenate([np.ones(len(inicio), dtype=np.int64), -np.ones(len(fin), dtype=np.int64)])
+    grupos_evento = np.concatenate([grupo, grupo])
+    orden = np.lexsort((deltas, tiempos, grupos_evento))
+    # Los eventos de cada grupo suman cero, así que la suma acumulada global se reinicia en cada grupo
+    concurrencia = np.cumsum(deltas[orden])
+    concurrencia_maxima = np.zeros(total_grupos, dtype=np.int64)
+    np.maximum.at(concurrencia_maxima, grupos_evento[orden], concurrencia)
+
+    return ocupados, cantidad_huecos, hueco_maximo, concurrencia_maxima
+
+def _kg_por_hora(kg, segundos):
+    return round(kg / (segundos / 3600), 2) if segundos else None
+
+def calcular_utilizacion(desde, hasta, agrupacion='dia', maquinaria_id=None):
+    """
+    Utilización por máquina (Insumo de tipo MAQUINARIA) entre los días `desde` y `hasta`
+    (incluidos), agrupada por día o por turno. Solo se listan los periodos con uso.
+    """
+    if agrupacion not in AGRUPACIONES:
+        raise ValueError(f"Agrupación inválida. Use una de: {', '.join(AGRUPACIONES)}")
+    if hasta < desde:
+        raise ValueError('La fecha final debe ser posterior a la inicial')
+    if (hasta - desde).days >= MAXIMO_DIAS:
+        raise ValueError(f'El rango no puede superar {MAXIMO_DIAS} días')
+
+    inicio_rango = timezone.make_aware(datetime.combine(desde, time.min))
+    fin_rango = timezone.make_aware(datetime.combine(hasta + timedelta(days=1), time.min))
+    registros = RegistroUsoMaquinaria.objects.filter(
+        maquinaria__tipo='MAQUINARIA', hora_inicio__lt=fin_rango, hora_fin__gt=inicio_rango
+    )
+    if maquinaria_id:
+        registros = registros.filter(maquinaria_id=maquinaria_id)
+    # Las fechas y pesos se leen como texto y float: convertir cada fila a datetime y Decimal
+    # en Python costaría más que todo el cálculo. pandas las interpreta de una vez
+    registros = list(registros.order_by('maquinaria_id', 'hora_inicio').annotate(
+        inicio_texto=Cast('hora_inicio', CharField()),
+        fin_texto=Cast('hora_fin', CharField()),
+        kg=Cast('peso_total_descargado', FloatField()),
+    ).values_list('maquinaria_id', 'inicio_texto', 'fin_texto', 'kg'))
+
+    maquinas = Insumo.objects.filter(tipo='MAQUINARIA')
+    if maquinaria_id:
+        maquinas = maquinas.filter(id=maquinaria_id)
+    maquinas = list(maquinas.filter(Q(activo=True) | Q(id__in={registro[0] for registro in registros})).values_list(
+        'id', 'nombre', 'codigo', 'capacidad_maxima'
+    ).order_by('nombre'))
+    posicion_maquina = {maquina[0]: posicion for posicion, maquina in enumerate(maquinas)}
+
+    segundos_rango = (hasta - desde).days * SEGUNDOS_DIA + SEGUNDOS_DIA
+    resumen = [
+        {
+            'maquinaria_id': id_,
+            'nombre': nombre,
+            'codigo': codigo,
+            'capacidad_maxima': float(capacidad) if capacidad is not None else None,
+            'minutos_ocupados': 0.0,
+            'utilizacion': 0.0,
+            'kg_movidos': 0.0,
+            'kg_por_hora': None,
+            'concurrencia_maxima': 0,
+            'usos': 0,
+            'periodos': [],
+        }
+        for id_, nombre, codigo, capacidad in maquinas
+    ]
+    registros = [registro for registro in registros if registro[0] in posicion_maquina]
+    if not registros:
+        return resumen
+
+    limites, etiquetas = _limites(desde, hasta, agrupacion)
+    limites = np.append(limites, limites[-1] + SEGUNDOS_DIA)
+    inicio_ventana = np.datetime64(desde).astype('datetime64[s]').astype(np.int64)
+    ventana = (inicio_ventana, inicio_ventana + segundos_rango)
+
+    maquina = np.array([posicion_maquina[registro[0]] for registro in registros], dtype=np.int64)
+    inicio_uso = _segundos_locales([registro[1] for registro in registros])
+    fin_uso = _segundos_locales([registro[2] for registro in registros])
+    kg = np.array([registro[3] for registro in registros], dtype=np.float64)
+    duracion = fin_uso - inicio_uso
+    validos = duracion > 0
+    maquina, inicio_uso, fin_uso, kg, duracion = maquina[validos], inicio_uso[validos], fin_uso[validos], kg[validos], duracion[validos]
+    usos = np.bincount(maquina, minlength=len(maquinas))
+    if not len(maquina):
+        return resumen
+
+    # Cortar cada uso en los límites de los periodos que abarca dentro del rango
+    inicio = np.maximum(inicio_uso, ventana[0])
+    fin = np.minimum(fin_uso, ventana[1])
+    primer_periodo = np.searchsorted(limites, inicio, side='right') - 1
+    ultimo_periodo = np.searchsorted(limites, fin, side='left') - 1
+    piezas = ultimo_periodo - primer_periodo + 1
+    origen = np.repeat(np.arange(len(inicio)), piezas)
+    periodo = primer_periodo[origen] + (np.arange(piezas.sum()) - np.repeat(np.cumsum(piezas) - piezas, piezas))
+    inicio_pieza = np.maximum(inicio[origen], limites[periodo])
+    fin_pieza = np.minimum(fin[origen], limites[periodo + 1])
+    kg_pieza = kg[origen] * (fin_pieza - inicio_pieza) / duracion[origen]
+
+    total_periodos = len(limites) - 1
+    clave = maquina[origen] * total_periodos + periodo
+    orden = np.lexsort((inicio_pieza, clave))
+    claves, grupo = np.unique(clave[orden], return_inverse=True)
+    ocupados, huecos, hueco_maximo, concurrencia = _barrido(grupo, inicio_pieza[orden], fin_pieza[orden])
+    kg_grupo = np.bincount(grupo, weights=kg_pieza[orden], minlength=len(claves))
+    piezas_grupo = np.bincount(grupo, minlength=len(claves))
+
+    # Métricas de todos los periodos como arreglos; las filas se arman con listas de Python
+    posiciones, numeros_periodo = np.divmod(claves, total_periodos)
+    duracion_periodo = np.minimum(limites[numeros_periodo + 1], ventana[1]) - np.maximum(limites[numeros_periodo], ventana[0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kg_hora = np.where(ocupados > 0, np.round(kg_grupo / (ocupados / 3600), 2), np.nan)
+    columnas = zip(
+        posiciones.tolist(), numeros_periodo.tolist(),
+        np.round(ocupados / 60, 1).tolist(),
+        np.round((duracion_periodo - ocupados) / 60, 1).tolist(),
+        np.round(ocupados / duracion_periodo, 4).tolist(),
+        huecos.tolist(), np.round(hueco_maximo / 60, 1).tolist(), concurrencia.tolist(),
+        piezas_grupo.tolist(), np.round(kg_grupo, 2).tolist(), kg_hora.tolist(),
+    )
+    for posicion, numero_periodo, minutos, ociosos, utilizacion, cantidad_huecos, maximo_hueco, maxima, piezas_periodo, kg_periodo, kg_por_hora in columnas:
+        fecha, turno = etiquetas[numero_periodo]
+        periodo_resumen = {'fecha': fecha, 'turno': turno} if turno else {'fecha': fecha}
+        periodo_resumen.update({
+            'minutos_ocupados': minutos,
+            'minutos_ociosos': ociosos,
+            'utilizacion': utilizacion,
+            'huecos': cantidad_huecos,
+            'hueco_maximo_minutos': maximo_hueco,
+            'concurrencia_maxima': maxima,
+            'usos': piezas_periodo,
+            'kg_movidos': kg_periodo,
+            'kg_por_hora': None if kg_por_hora != kg_por_hora else kg_por_hora,
+        })
+        resumen[posicion]['periodos'].append(periodo_resumen)
+
+    ocupados_maquina = np.bincount(posiciones, weights=ocupados, minlength=len(maquinas))
+    kg_maquina = np.bincount(posiciones, weights=kg_grupo, minlength=len(maquinas))
+    concurrencia_maquina = np.zeros(len(maquinas), dtype=np.int64)
+    np.maximum.at(concurrencia_maquina, posiciones, concurrencia)
+    for posicion, maquina_resumen in enumerate(resumen):
+        segundos = float(ocupados_maquina[posicion])
+        kg_total = float(kg_maquina[posicion])
+        maquina_resumen.update({
+            'minutos_ocupados': round(segundos / 60, 1),
+            'utilizacion': round(segundos / segundos_rango, 4),
+            'kg_movidos': round(kg_total, 2),
+            'kg_por_hora': _kg_por_hora(kg_total, segundos),
+            'concurrencia_maxima': int(concurrencia_maquina[posicion]),
+            'usos': int(usos[posicion]),
+        })
+    return resumen
+
+def _registros_auditoria(desde, hasta, maquinaria_id):
+    registros = RegistroUsoMaquinaria.objects.filter(maquinaria__isnull=False)
+    if maquinaria_id:
+        registros = registros.filter(maquinaria_id=maquinaria_id)
+    if desde:
+        registros = registros.filter(hora_fin__gt=timezone.make_aware(datetime.combine(desde, time.min)))
+    if hasta:
+        registros = registros.filter(hora_inicio__lt=timezone.make_aware(datetime.combine(hasta + timedelta(days=1), time.min)))
+    return registros
+
+def detectar_solapamientos(desde=None, hasta=None, maquinaria_id=None, limite=MAXIMO_CONFLICTOS):
+    """
+    Pares de usos de la misma máquina que se cruzan en el tiempo, opcionalmente entre los
+    días `desde` y `hasta`. Ordenados por máquina y hora de inicio del solapamiento.
+    Retorna (conflictos, truncado): el recorrido se detiene al reunir `limite` conflictos.
+    """
+    if limite < 1:
+        raise ValueError('El límite debe ser mayor o igual a 1')
+    registros = _registros_auditoria(desde, hasta, maquinaria_id).order_by('maquinaria_id', 'hora_inicio', 'id').values_list(
+        'id', 'maquinaria_id', 'maquinaria__nombre', 'hora_inicio', 'hora_fin', 'empleado__username', 'lote__numero_lote'
+    )
+
+    conflictos = []
+    abiertos = []
+    maquina_actual = None
+    for id_, maquina, nombre, inicio, fin, empleado, lote in registros.iterator(chunk_size=5000):
+        if maquina != maquina_actual:
+            maquina_actual = maquina
+            abiertos = []
+        # Los usos que terminaron antes de este inicio ya no pueden cruzarse con ninguno posterior
+        while abiertos and abiertos[0][0] <= inicio:
+            heapq.heappop(abiertos)
+        for fin_otro, id_otro, empleado_otro, lote_otro in abiertos:
+            if len(conflictos) >= limite:
+                return conflictos, True
+            fin_solape = min(fin, fin_otro)
+            conflictos.append({
+                'maquinaria_id': maquina,
+                'maquinaria_nombre': nombre,
+                'inicio_solapamiento': inicio.isoformat(),
+                'fin_solapamiento': fin_solape.isoformat(),
+                'minutos_solapados': round((fin_solape - inicio).total_seconds() / 60, 1),
+                'registro_a': {'id': id_otro, 'empleado': empleado_otro, 'lote': lote_otro},
+                'registro_b': {'id': id_, 'empleado': empleado, 'lote': lote},
+            })
+        if fin > inicio:
+            heapq.heappush(abiertos, (fin, id_, empleado, lote))
+    return conflictos, False
+
+def usos_excedidos(desde=None, hasta=None, maquinaria_id=None):
+    """
+    Usos que duran más de MAXIMO_HORAS_USO. La validación de nuevos usos los rechaza, pero
+    los registrados antes de ella quedan fuera de la ventana con la que `solapados` busca
+    cruces, así que se listan aparte para corregirlos.
+    """
+    registros = _registros_auditoria(desde, hasta, maquinaria_id).filter(
+        hora_fin__gt=F('hora_inicio') + timedelta(hours=RegistroUsoMaquinaria.MAXIMO_HORAS_USO)
+    ).order_by('maquinaria_id', 'hora_inicio', 'id').values_list(
+        'id', 'maquinaria_id', 'maquinaria__nombre', 'hora_inicio', 'hora_fin', 'empleado__username', 'lote__numero_lote'
+    )
+    return [
+        {
+            'id': id_,
+            'maquinaria_id': maquina,
+            'maquinaria_nombre': nombre,
+            'hora_inicio': inicio.isoformat(),
+            'hora_fin': fin.isoformat(),
+            'horas': round((fin - inicio).total_seconds() / 3600, 1),
+            'empleado': empleado,
+            'lote': lote,
+        }
+        for id_, maquina, nombre, inicio, fin, empleado, lote in registros[:MAXIMO_CONFLICTOS]
+    ]
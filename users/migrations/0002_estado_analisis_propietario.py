@@ -0,0 +1,79 @@
+# Generated by Django 5.2.3 on 2026-10-19 05:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Copia de users.models.derivar_estado_analisis al crear esta migración: las migraciones
+# no deben depender de código del modelo que puede cambiar después
+def derivar_estado_analisis(muestras):
+    """
+    Deriva el estado de análisis de un propietario a partir de sus muestras (ordenadas por id).
+    Retorna una tupla (estado, muestra_decisiva).
+    """
+    muestra_inicial = next((m for m in muestras if not m.es_segundo_muestreo), None)
+    muestra_seguimiento = next((m for m in muestras if m.es_segundo_muestreo), None)
+
+    if muestra_inicial is None:
+        return 'SIN_MUESTRA', None
+    if muestra_inicial.estado == 'APROBADA':
+        return 'APROBADA', muestra_inicial
+    if muestra_inicial.estado == 'CONTAMINADA':
+        if muestra_seguimiento is None:
+            return 'CONTAMINADA', muestra_inicial
+        if muestra_seguimiento.estado == 'APROBADA':
+            return 'APROBADA_SEGUNDO', muestra_seguimiento
+        if muestra_seguimiento.estado == 'CONTAMINADA':
+            return 'CONTAMINADA_CONFIRMADA', muestra_seguimiento
+        return 'SEGUNDO_PENDIENTE', muestra_seguimiento
+    return 'PENDIENTE', muestra_inicial
+
+
+def poblar_estados_analisis(apps, schema_editor):
+    PropietarioCafe = apps.get_model('users', 'PropietarioCafe')
+    MuestraCafe = apps.get_model('users', 'MuestraCafe')
+    EstadoAnalisisPropietario = apps.get_model('users', 'EstadoAnalisisPropietario')
+
+    muestras_por_propietario = {}
+    for muestra in MuestraCafe.objects.order_by('id').iterator():
+        muestras_por_propietario.setdefault(muestra.propietario_id, []).append(muestra)
+
+    estados = []
+    for propietario in PropietarioCafe.objects.iterator():
+        estado, muestra_decisiva = derivar_estado_analisis(muestras_por_propietario.get(propietario.id, []))
+        estados.append(EstadoAnalisisPropietario(
+            propietario_id=propietario.id,
+            lote_id=propietario.lote_id,
+            estado=estado,
+            muestra_decisiva=muestra_decisiva,
+            quintales=propietario.quintales_entregados,
+        ))
+    EstadoAnalisisPropietario.objects.bulk_create(estados, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadoAnalisisPropietario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('SIN_MUESTRA', 'Sin muestra tomada'), ('PENDIENTE', 'Muestra inicial pendiente de análisis'), ('APROBADA', 'Aprobada en análisis inicial'), ('CONTAMINADA', 'Contaminada - Requiere confirmación'), ('SEGUNDO_PENDIENTE', 'Segundo muestreo pendiente de análisis'), ('APROBADA_SEGUNDO', 'Aprobada en segundo muestreo'), ('CONTAMINADA_CONFIRMADA', 'Contaminación confirmada en segundo muestreo')], default='SIN_MUESTRA', max_length=25)),
+                ('quintales', models.DecimalField(decimal_places=2, help_text='Quintales entregados por el propietario', max_digits=8)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('lote', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estados_analisis', to='users.lotecafe')),
+                ('muestra_decisiva', models.ForeignKey(blank=True, help_text='Muestra cuyo resultado determina el estado actual', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='users.muestracafe')),
+                ('propietario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='estado_analisis', to='users.propietariocafe')),
+            ],
+            options={
+                'verbose_name': 'Estado de Análisis de Propietario',
+                'verbose_name_plural': 'Estados de Análisis de Propietarios',
+                'indexes': [models.Index(fields=['lote', 'estado'], name='estado_analisis_lote_idx')],
+            },
+        ),
+        migrations.RunPython(poblar_estados_analisis, migrations.RunPython.noop),
+    ]
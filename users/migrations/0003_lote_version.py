@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 05:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_estado_analisis_propietario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lotecafe',
+            name='version',
+            field=models.PositiveIntegerField(default=1, help_text='Versión del registro para control de concurrencia optimista'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.3 on 2026-10-19 05:17
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_lote_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoteEvento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('tipo', models.CharField(choices=[('LOTE_CREADO', 'Lote creado'), ('LOTE_ACTUALIZADO', 'Lote actualizado'), ('MUESTRAS_SELECCIONADAS', 'Muestras seleccionadas'), ('RESULTADO_MUESTRA', 'Resultado de muestra registrado'), ('SEGUNDO_MUESTREO_CREADO', 'Segundo muestreo creado'), ('SEPARACION_APLICADA', 'Separación de quintales aplicada'), ('LOTE_RECUPERADO', 'Lote recuperado en segundo muestreo'), ('PARTE_LIMPIA_ENVIADA', 'Parte limpia enviada a limpieza'), ('LIMPIEZA', 'Limpieza completada'), ('SEPARACION_COLORES', 'Separación por colores completada'), ('RECEPCION_FINAL', 'Recepción final'), ('INGRESO_PROCESO', 'Ingreso a proceso de producción'), ('PROCESO_FINALIZADO', 'Proceso de producción finalizado')], max_length=30)),
+                ('datos', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='Datos del evento según su tipo')),
+                ('lote', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='eventos', to='users.lotecafe')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Evento de Lote',
+                'verbose_name_plural': 'Eventos de Lotes',
+                'ordering': ['fecha', 'id'],
+                'indexes': [models.Index(fields=['lote', 'fecha'], name='lote_evento_lote_fecha_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.3 on 2026-10-19 05:19
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_lote_evento'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoAsincrono',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(help_text='Tipo de trabajo registrado en users.trabajos.MANEJADORES', max_length=50)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_EJECUCION', 'En ejecución'), ('COMPLETADO', 'Completado'), ('FALLIDO', 'Fallido')], default='PENDIENTE', max_length=20)),
+                ('parametros', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('progreso', models.PositiveSmallIntegerField(default=0, help_text='Porcentaje de avance (0-100)')),
+                ('mensaje', models.CharField(blank=True, help_text='Descripción del paso actual', max_length=255)),
+                ('resultado', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('archivo_resultado', models.CharField(blank=True, help_text='Ruta del archivo generado, relativa a TRABAJOS_DIR', max_length=255)),
+                ('error', models.TextField(blank=True)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_inicio', models.DateTimeField(blank=True, null=True)),
+                ('fecha_finalizacion', models.DateTimeField(blank=True, null=True)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trabajos', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Trabajo Asíncrono',
+                'verbose_name_plural': 'Trabajos Asíncronos',
+                'ordering': ['-fecha_creacion'],
+                'indexes': [models.Index(fields=['estado', 'fecha_creacion'], name='trabajo_estado_fecha_idx')],
+            },
+        ),
+    ]
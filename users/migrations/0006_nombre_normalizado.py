@@ -0,0 +1,71 @@
+# Generated by Django 5.2.3 on 2026-10-19 05:24
+
+from django.db import migrations, models
+from unidecode import unidecode
+
+
+# Copia de users.models.normalizar_texto al crear esta migración
+def normalizar_texto(valor):
+    """Forma de búsqueda de un texto: sin tildes, en minúsculas y con espacios simples"""
+    return ' '.join(unidecode(valor or '').lower().split())
+
+
+def poblar_nombres_normalizados(apps, schema_editor):
+    for modelo, campo in [('Organizacion', 'nombre'), ('PropietarioMaestro', 'nombre_completo'), ('PropietarioCafe', 'nombre_completo')]:
+        Modelo = apps.get_model('users', modelo)
+        pendientes = []
+        for objeto in Modelo.objects.only('id', campo).iterator(chunk_size=2000):
+            objeto.nombre_normalizado = normalizar_texto(getattr(objeto, campo))
+            pendientes.append(objeto)
+            if len(pendientes) == 2000:
+                Modelo.objects.bulk_update(pendientes, ['nombre_normalizado'])
+                pendientes = []
+        Modelo.objects.bulk_update(pendientes, ['nombre_normalizado'])
+
+
+TABLAS_TRIGRAMA = ['users_organizacion', 'users_propietariomaestro', 'users_propietariocafe']
+
+
+def crear_indices_trigrama(apps, schema_editor):
+    # En PostgreSQL las búsquedas por contenido (LIKE '%texto%') usan un índice GIN de trigramas
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for tabla in TABLAS_TRIGRAMA:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {tabla}_nombre_trgm ON {tabla} USING gin (nombre_normalizado gin_trgm_ops)'
+        )
+
+
+def eliminar_indices_trigrama(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for tabla in TABLAS_TRIGRAMA:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {tabla}_nombre_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_trabajo_asincrono'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organizacion',
+            name='nombre_normalizado',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='propietariocafe',
+            name='nombre_normalizado',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='propietariomaestro',
+            name='nombre_normalizado',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=200),
+        ),
+        migrations.RunPython(poblar_nombres_normalizados, migrations.RunPython.noop),
+        migrations.RunPython(crear_indices_trigrama, eliminar_indices_trigrama),
+    ]
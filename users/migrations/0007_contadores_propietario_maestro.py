@@ -0,0 +1,41 @@
+# Generated by Django 5.2.3 on 2026-10-19 05:27
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def poblar_contadores(apps, schema_editor):
+    PropietarioMaestro = apps.get_model('users', 'PropietarioMaestro')
+    PropietarioCafe = apps.get_model('users', 'PropietarioCafe')
+    entregas = PropietarioCafe.objects.filter(propietario_maestro=OuterRef('pk')).order_by().values('propietario_maestro')
+    PropietarioMaestro.objects.update(
+        total_entregas=Coalesce(Subquery(entregas.annotate(total=Count('id')).values('total')), 0),
+        total_quintales_historicos=Coalesce(
+            Subquery(entregas.annotate(total=Sum('quintales_entregados')).values('total')), Decimal('0'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2)
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_nombre_normalizado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='propietariomaestro',
+            name='total_entregas',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, help_text='Número total de entregas realizadas'),
+        ),
+        migrations.AddField(
+            model_name='propietariomaestro',
+            name='total_quintales_historicos',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, help_text='Total de quintales entregados históricamente', max_digits=12),
+        ),
+        migrations.RunPython(poblar_contadores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 05:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_accion_importar_propietarios'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='registrobitacora',
+            name='accion',
+            field=models.CharField(choices=[('CREAR_LOTE', 'Crear Lote'), ('ACTUALIZAR_LOTE', 'Actualizar Lote'), ('ELIMINAR_LOTE', 'Eliminar Lote'), ('TOMAR_MUESTRA', 'Tomar Muestra'), ('ANALIZAR_MUESTRA', 'Analizar Muestra'), ('ACTUALIZAR_MUESTRA', 'Actualizar Muestra'), ('SEGUNDO_MUESTREO', 'Segundo Muestreo'), ('GENERAR_REPORTE', 'Generar Reporte'), ('EXPORTAR_PDF', 'Exportar PDF'), ('EXPORTAR_CSV', 'Exportar CSV'), ('CONSULTAR_PERSONAL', 'Consultar Personal'), ('LOGIN', 'Inicio de Sesión'), ('LOGOUT', 'Cierre de Sesión'), ('CREAR_ORGANIZACION', 'Crear Organización'), ('ACTUALIZAR_ORGANIZACION', 'Actualizar Organización'), ('INICIAR_PROCESO', 'Iniciar Proceso'), ('FINALIZAR_PROCESO', 'Finalizar Proceso'), ('PROCESAR_LIMPIEZA', 'Procesar Limpieza'), ('SEPARACION_COLORES', 'Separación por Colores'), ('RECEPCION_FINAL', 'Recepción Final'), ('ENVIAR_LIMPIEZA_PARCIAL', 'Enviar Parte Limpia a Limpieza'), ('REGISTRAR_USO_MAQUINARIA', 'Registrar Uso de Maquinaria'), ('IMPORTAR_PROPIETARIOS', 'Importar Propietarios'), ('FUSIONAR_PROPIETARIOS', 'Fusionar Propietarios')], max_length=30),
+        ),
+    ]
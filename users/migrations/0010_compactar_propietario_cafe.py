@@ -0,0 +1,92 @@
+# Generated by Django 5.2.3 on 2026-10-19 06:02
+
+from django.db import migrations, models
+from django.db.models import Case, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+CAMPOS_HEREDADOS_MAESTRO = ['nombre_completo', 'telefono', 'departamento', 'municipio', 'comunidad',
+                            'calle', 'numero_casa', 'referencias']
+
+
+def _valor_maestro(apps, campo):
+    PropietarioMaestro = apps.get_model('users', 'PropietarioMaestro')
+    return Subquery(PropietarioMaestro.objects.filter(id=OuterRef('propietario_maestro_id')).values(campo)[:1])
+
+
+def compactar_entregas(apps, schema_editor):
+    """Deja en NULL, en una sola pasada por la tabla, los datos que repiten los del maestro"""
+    PropietarioCafe = apps.get_model('users', 'PropietarioCafe')
+    PropietarioCafe.objects.filter(propietario_maestro__isnull=False).update(**{
+        f'{campo}_propio': Case(
+            When(Q(**{f'{campo}_propio': _valor_maestro(apps, campo)}), then=Value(None)),
+            default=f'{campo}_propio',
+        )
+        for campo in CAMPOS_HEREDADOS_MAESTRO
+    })
+
+
+def expandir_entregas(apps, schema_editor):
+    PropietarioCafe = apps.get_model('users', 'PropietarioCafe')
+    PropietarioCafe.objects.update(**{
+        f'{campo}_propio': Coalesce(f'{campo}_propio', _valor_maestro(apps, campo), Value(''))
+        for campo in CAMPOS_HEREDADOS_MAESTRO
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_accion_fusionar_propietarios'),
+    ]
+
+    operations = [
+        migrations.RenameField(model_name='propietariocafe', old_name='nombre_completo', new_name='nombre_completo_propio'),
+        migrations.RenameField(model_name='propietariocafe', old_name='telefono', new_name='telefono_propio'),
+        migrations.RenameField(model_name='propietariocafe', old_name='departamento', new_name='departamento_propio'),
+        migrations.RenameField(model_name='propietariocafe', old_name='municipio', new_name='municipio_propio'),
+        migrations.RenameField(model_name='propietariocafe', old_name='comunidad', new_name='comunidad_propio'),
+        migrations.RenameField(model_name='propietariocafe', old_name='calle', new_name='calle_propio'),
+        migrations.RenameField(model_name='propietariocafe', old_name='numero_casa', new_name='numero_casa_propio'),
+        migrations.RenameField(model_name='propietariocafe', old_name='referencias', new_name='referencias_propio'),
+        migrations.AlterField(
+            model_name='propietariocafe',
+            name='nombre_completo_propio',
+            field=models.CharField(blank=True, help_text='Nombre al momento de la entrega, si difiere del maestro', max_length=200, null=True),
+        ),
+        migrations.AlterField(
+            model_name='propietariocafe',
+            name='telefono_propio',
+            field=models.CharField(blank=True, help_text='Teléfono al momento de la entrega, si difiere del maestro', max_length=20, null=True),
+        ),
+        migrations.AlterField(
+            model_name='propietariocafe',
+            name='departamento_propio',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='propietariocafe',
+            name='municipio_propio',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='propietariocafe',
+            name='comunidad_propio',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='propietariocafe',
+            name='calle_propio',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AlterField(
+            model_name='propietariocafe',
+            name='numero_casa_propio',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AlterField(
+            model_name='propietariocafe',
+            name='referencias_propio',
+            field=models.CharField(blank=True, max_length=300, null=True),
+        ),
+        migrations.RunPython(compactar_entregas, expandir_entregas),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.3 on 2026-10-19 05:51
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def abrir_libro(apps, schema_editor):
+    """Un movimiento de apertura por insumo con existencia, para que el libro cuadre con el saldo actual"""
+    Insumo = apps.get_model('users', 'Insumo')
+    MovimientoInventario = apps.get_model('users', 'MovimientoInventario')
+    ahora = django.utils.timezone.now()
+    MovimientoInventario.objects.bulk_create([
+        MovimientoInventario(
+            insumo_id=id_, tipo='AJUSTE', cantidad=cantidad, saldo_resultante=cantidad, fecha=ahora,
+            observaciones='Saldo de apertura del libro de movimientos'
+        )
+        for id_, cantidad in Insumo.objects.exclude(cantidad_disponible=0).values_list('id', 'cantidad_disponible').iterator()
+    ], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_compactar_propietario_cafe'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimientoInventario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('ENTRADA', 'Entrada'), ('SALIDA', 'Salida'), ('AJUSTE', 'Ajuste')], max_length=10)),
+                ('cantidad', models.DecimalField(decimal_places=2, help_text='Positiva para entradas, negativa para salidas', max_digits=12)),
+                ('saldo_resultante', models.DecimalField(decimal_places=2, help_text='Existencia del insumo después del movimiento', max_digits=12)),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('observaciones', models.TextField(blank=True)),
+                ('descarga', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos_inventario', to='users.registrodescarga')),
+                ('insumo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimientos', to='users.insumo')),
+                ('lote', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos_inventario', to='users.lotecafe')),
+                ('tarea', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos', to='users.tareainsumo')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos_inventario', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Movimiento de Inventario',
+                'verbose_name_plural': 'Movimientos de Inventario',
+                'ordering': ['-fecha', '-id'],
+                'indexes': [models.Index(fields=['insumo', 'fecha'], name='movimiento_insumo_fecha_idx'), models.Index(fields=['tipo', 'fecha'], name='movimiento_tipo_fecha_idx')],
+            },
+        ),
+        migrations.RunPython(abrir_libro, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-19 05:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_libro_movimientos_inventario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='registrousomaquinaria',
+            index=models.Index(fields=['maquinaria', 'hora_inicio', 'hora_fin'], name='uso_maquinaria_intervalo_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-19 06:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_indice_intervalo_uso_maquinaria'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='registrodescarga',
+            index=models.Index(fields=['fecha_registro'], name='descarga_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-19 06:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_clave_idempotencia_registros'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsumoRecursoLote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo_recurso', models.CharField(choices=[('INSUMO', 'Insumo'), ('MAQUINARIA', 'Maquinaria'), ('MANO_OBRA', 'Mano de obra')], max_length=20)),
+                ('cantidad', models.DecimalField(decimal_places=2, default=0, help_text='Cantidad del insumo usada en el lote', max_digits=12)),
+                ('minutos', models.DecimalField(decimal_places=2, default=0, help_text='Minutos de uso o de trabajo atribuidos al lote', max_digits=12)),
+                ('registros', models.IntegerField(default=0, help_text='Registros de origen que suman en la fila')),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('insumo', models.ForeignKey(blank=True, help_text='Insumo o máquina; vacío en mano de obra y en maquinaria registrada solo por tipo', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='consumos_lotes', to='users.insumo')),
+                ('lote', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumos_recursos', to='users.lotecafe')),
+            ],
+            options={
+                'verbose_name': 'Consumo de Recursos por Lote',
+                'verbose_name_plural': 'Consumos de Recursos por Lote',
+                'ordering': ['lote', 'tipo_recurso', 'insumo'],
+                'indexes': [models.Index(fields=['lote', 'tipo_recurso'], name='consumo_recurso_lote_idx')],
+            },
+        ),
+    ]
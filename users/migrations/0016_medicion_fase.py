@@ -0,0 +1,121 @@
+# Generated by Django 5.2.3 on 2026-10-19 06:13
+
+from decimal import Decimal, InvalidOperation
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+# Copia de la extracción de users.models al crear esta migración
+METRICAS_FASE = {
+    'PILADO': ('datos_pilado', [
+        ('peso_impurezas_removidas', ('peso_impurezas_removidas',), 'kg'),
+        ('tiempo_canteado', ('tareas_realizadas', 'tiempo_canteado'), 'min'),
+    ]),
+    'CLASIFICACION': ('datos_clasificacion', [
+        ('numero_malla_ocupada', ('numero_malla_ocupada',), ''),
+        ('peso_cafe_caracolillo', ('peso_cafe_caracolillo',), 'kg'),
+        ('peso_cafe_exportacion', ('peso_cafe_exportacion',), 'kg'),
+    ]),
+    'DENSIDAD_1': ('datos_densidad_1', [('peso_cafe_densidad_1', ('peso_cafe_densidad_1',), 'kg')]),
+    'DENSIDAD_2': ('datos_densidad_2', [('peso_cafe_densidad_2', ('peso_cafe_densidad_2',), 'kg')]),
+    'COLOR': ('datos_color', [('duracion_proceso', ('duracion_proceso',), 'min')]),
+    'EMPAQUE': ('datos_empaquetado', [
+        ('cafe_caracolillo', ('cafe_caracolillo',), 'kg'),
+        ('cafe_descarte', ('cafe_descarte',), 'kg'),
+        ('cafe_exportacion', ('cafe_exportacion',), 'kg'),
+    ]),
+}
+# Mayor valor que admite MedicionFase.valor
+LIMITE_VALOR_MEDICION = Decimal('1e9')
+
+
+def _valor_numerico(valor):
+    """Decimal del valor del formulario ('12,5', 12.5...) o None si vacío o no numérico"""
+    if valor is None or isinstance(valor, bool):
+        return None
+    try:
+        numero = Decimal(str(valor).strip().replace(',', '.'))
+    except InvalidOperation:
+        return None
+    return numero if numero.is_finite() and abs(numero) < LIMITE_VALOR_MEDICION else None
+
+
+def extraer_mediciones_fase(fase, datos):
+    """
+    (métrica, valor, unidad, fecha) de cada valor numérico de los datos JSON de una fase. La
+    fecha es la de guardado de los datos (None si no la tienen). En COLOR el peso de cada
+    color de la clasificación es una métrica peso_color_<color>.
+    """
+    if not isinstance(datos, dict):
+        return []
+    try:
+        fecha = parse_datetime(datos['fecha_guardado']) if isinstance(datos.get('fecha_guardado'), str) else None
+    except ValueError:
+        fecha = None
+    if fecha is not None and timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    mediciones = []
+    for metrica, ruta, unidad in METRICAS_FASE[fase][1]:
+        valor = datos
+        for clave in ruta:
+            valor = valor.get(clave) if isinstance(valor, dict) else None
+        valor = _valor_numerico(valor)
+        if valor is not None:
+            mediciones.append((metrica, valor, unidad, fecha))
+    if fase == 'COLOR' and isinstance(datos.get('clasificacion_colores'), dict):
+        for color, detalle in datos['clasificacion_colores'].items():
+            valor = _valor_numerico(detalle.get('peso') if isinstance(detalle, dict) else detalle)
+            if valor is not None:
+                mediciones.append((f'peso_color_{color}'[:60], valor, 'kg', fecha))
+    return mediciones
+
+
+def poblar_mediciones(apps, schema_editor):
+    """Mediciones de los datos de fase ya guardados; sin fecha de guardado se usa la última actualización del proceso"""
+    Proceso = apps.get_model('users', 'Proceso')
+    MedicionFase = apps.get_model('users', 'MedicionFase')
+    campos = {fase: campo for fase, (campo, _) in METRICAS_FASE.items()}
+    pendientes = []
+    for proceso in Proceso.objects.only('id', 'fecha_actualizacion', *campos.values()).iterator(chunk_size=2000):
+        for fase, campo in campos.items():
+            for metrica, valor, unidad, fecha in extraer_mediciones_fase(fase, getattr(proceso, campo)):
+                pendientes.append(MedicionFase(
+                    proceso_id=proceso.id, fase=fase, metrica=metrica, valor=valor, unidad=unidad,
+                    fecha_registro=fecha or proceso.fecha_actualizacion
+                ))
+        if len(pendientes) >= 2000:
+            MedicionFase.objects.bulk_create(pendientes)
+            pendientes = []
+    MedicionFase.objects.bulk_create(pendientes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0015_consumo_recursos_lote'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicionFase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fase', models.CharField(choices=[('PILADO', 'Pilado'), ('CLASIFICACION', 'Clasificación'), ('DENSIDAD_1', 'Densidad (parte 1)'), ('DENSIDAD_2', 'Densimetría 2'), ('COLOR', 'Color'), ('EMPAQUE', 'Empaque')], max_length=20)),
+                ('metrica', models.CharField(max_length=60)),
+                ('valor', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('unidad', models.CharField(blank=True, max_length=10)),
+                ('fecha_registro', models.DateTimeField(help_text='Fecha en que se guardaron los datos de la fase')),
+                ('proceso', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mediciones', to='users.proceso')),
+            ],
+            options={
+                'verbose_name': 'Medición de Fase',
+                'verbose_name_plural': 'Mediciones de Fase',
+                'ordering': ['proceso', 'fase', 'metrica'],
+                'indexes': [models.Index(fields=['fase', 'metrica', 'fecha_registro'], name='medicion_fase_metrica_idx'), models.Index(fields=['proceso', 'fase'], name='medicion_proceso_fase_idx')],
+            },
+        ),
+        migrations.RunPython(poblar_mediciones, migrations.RunPython.noop),
+    ]
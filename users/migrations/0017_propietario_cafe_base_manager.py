@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-19 06:24
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0016_medicion_fase'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='propietariocafe',
+            options={'base_manager_name': 'objects', 'verbose_name_plural': 'Propietarios de Café'},
+        ),
+    ]
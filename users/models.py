@@ -1,8 +1,19 @@
-from django.db import models
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, NullIf
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.core.serializers.json import DjangoJSONEncoder
+from unidecode import unidecode
+
+def normalizar_texto(valor):
+    """Forma de búsqueda de un texto: sin tildes, en minúsculas y con espacios simples"""
+    return ' '.join(unidecode(valor or '').lower().split())
 
 class UserProfile(models.Model):
     ROLES_CHOICES = [
@@ -62,6 +73,7 @@ def save_user_profile(sender, instance, **kwargs):
 
 class Organizacion(models.Model):
     nombre = models.CharField(max_length=200)
+    nombre_normalizado = models.CharField(max_length=200, blank=True, editable=False, db_index=True)
     tipo = models.CharField(max_length=50, blank=True, null=True, help_text="Tipo de organización (Cooperativa, Asociación, etc.)")
     ruc = models.CharField(max_length=13, blank=True, null=True, help_text="RUC de la organización")
     mail = models.EmailField(max_length=100, blank=True)
@@ -81,6 +93,10 @@ class Organizacion(models.Model):
     def __str__(self):
         return self.nombre
     
+    def save(self, *args, **kwargs):
+        self.nombre_normalizado = normalizar_texto(self.nombre)
+        super().save(*args, **kwargs)
+    
     @property
     def ubicacion_completa(self):
         """Retorna la ubicación completa concatenada"""
@@ -93,6 +109,19 @@ class Organizacion(models.Model):
             partes.append(self.provincia)
         return ', '.join(partes) if partes else 'Sin ubicación especificada'
 
+class ConflictoVersionLote(Exception):
+    """El lote fue modificado por otra petición entre su lectura y la transición"""
+    def __init__(self, lote_id):
+        self.lote_id = lote_id
+        super().__init__(f"El lote {lote_id} fue modificado por otra operación")
+
+class StockInsuficiente(Exception):
+    """La salida dejaría el insumo con existencia negativa"""
+    def __init__(self, insumo, cantidad):
+        self.insumo = insumo
+        self.cantidad = cantidad
+        super().__init__(f"Stock insuficiente de {insumo.nombre}: se requieren {cantidad} {insumo.get_unidad_medida_display()}")
+
 class LoteCafe(models.Model):
     ESTADOS_CHOICES = [
         ('PENDIENTE', 'Pendiente de análisis'),
@@ -143,6 +172,10 @@ class LoteCafe(models.Model):
     observaciones = models.TextField(blank=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     usuario_registro = models.ForeignKey(User, on_delete=models.CASCADE)
+    version = models.PositiveIntegerField(default=1, help_text="Versión del registro para control de concurrencia optimista")
+    
+    # Campos que suman en los totales de los procesos que incluyen el lote
+    CAMPOS_TOTALES_PROCESO = {'total_quintales', 'peso_total_inicial', 'peso_total_final'}
     
     class Meta:
         verbose_name_plural = "Lotes de Café"
@@ -150,6 +183,45 @@ class LoteCafe(models.Model):
     def __str__(self):
         return f"Lote {self.numero_lote} - {self.organizacion.nombre}"
     
+    def save(self, *args, **kwargs):
+        """
+        Toda escritura del lote incrementa su versión, condicionada a la versión que se leyó:
+        si otra operación lo modificó desde entonces lanza ConflictoVersionLote
+        """
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        with transaction.atomic():
+            # El UPDATE condicional bloquea la fila hasta que se escriben los demás campos
+            if not LoteCafe.objects.filter(pk=self.pk, version=self.version).update(version=models.F('version') + 1):
+                raise ConflictoVersionLote(self.pk)
+            self.version += 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'version'}
+            super().save(*args, **kwargs)
+    
+    def transicionar(self, estados_validos=None, **campos):
+        """
+        Aplica los campos al lote con un UPDATE condicional sobre id, versión y estado.
+        Si otra operación modificó el lote desde que se leyó, lanza ConflictoVersionLote.
+        """
+        if estados_validos is None:
+            estados_validos = [self.estado]
+        actualizados = LoteCafe.objects.filter(
+            pk=self.pk,
+            version=self.version,
+            estado__in=estados_validos
+        ).update(version=models.F('version') + 1, **campos)
+        if not actualizados:
+            raise ConflictoVersionLote(self.pk)
+        for campo, valor in campos.items():
+            setattr(self, campo, valor)
+        self.version += 1
+        # El UPDATE no emite post_save: los totales de sus procesos se recalculan aquí
+        if self.CAMPOS_TOTALES_PROCESO.intersection(campos):
+            recalcular_totales_procesos_lote(self.pk)
+    
     @property
     def diferencia_peso(self):
         """Calcula la diferencia entre peso inicial y final"""
@@ -168,6 +240,7 @@ class LoteCafe(models.Model):
 class PropietarioMaestro(models.Model):
     """Modelo maestro para almacenar propietarios únicos que pueden ser reutilizados"""
     nombre_completo = models.CharField(max_length=200)
+    nombre_normalizado = models.CharField(max_length=200, blank=True, editable=False, db_index=True)
     cedula = models.CharField(max_length=20, unique=True)
     telefono = models.CharField(max_length=20, blank=True)
     
@@ -183,6 +256,12 @@ class PropietarioMaestro(models.Model):
     fecha_registro = models.DateTimeField(auto_now_add=True)
     activo = models.BooleanField(default=True)
     
+    # Contadores mantenidos por las señales de PropietarioCafe (ver reconciliar_contadores_propietarios)
+    total_entregas = models.PositiveIntegerField(default=0, db_index=True, editable=False,
+                                                 help_text="Número total de entregas realizadas")
+    total_quintales_historicos = models.DecimalField(max_digits=12, decimal_places=2, default=0, db_index=True, editable=False,
+                                                     help_text="Total de quintales entregados históricamente")
+    
     class Meta:
         verbose_name = "Propietario Maestro"
         verbose_name_plural = "Propietarios Maestros"
@@ -191,6 +270,10 @@ class PropietarioMaestro(models.Model):
     def __str__(self):
         return f"{self.nombre_completo} ({self.cedula})"
     
+    def save(self, *args, **kwargs):
+        self.nombre_normalizado = normalizar_texto(self.nombre_completo)
+        super().save(*args, **kwargs)
+    
     @property
     def direccion_completa(self):
         """Retorna la dirección completa concatenada"""
@@ -209,17 +292,104 @@ class PropietarioMaestro(models.Model):
             partes.append(self.referencias)
         return ', '.join(partes) if partes else 'Sin dirección registrada'
     
-    @property
-    def total_entregas(self):
-        """Retorna el número total de entregas realizadas por este propietario"""
-        return self.entregas_cafe.count()
+    @classmethod
+    def ajustar_contadores(cls, propietario_maestro_id, entregas, quintales):
+        """Suma (o resta, con valores negativos) entregas y quintales a los contadores del propietario"""
+        if propietario_maestro_id is None or (not entregas and not quintales):
+            return
+        cls.objects.filter(id=propietario_maestro_id).update(
+            total_entregas=models.F('total_entregas') + entregas,
+            total_quintales_historicos=models.F('total_quintales_historicos') + quintales
+        )
+        cls._invalidar_cache_contadores()
     
-    @property
-    def total_quintales_historicos(self):
-        """Retorna el total de quintales entregados históricamente"""
-        return self.entregas_cafe.aggregate(
-            total=models.Sum('quintales_entregados')
-        )['total'] or 0
+    @classmethod
+    def registrar_entregas(cls, entregas):
+        """Suma a los contadores entregas creadas con bulk_create (que no emite post_save) en una sola consulta"""
+        totales = {}
+        for entrega in entregas:
+            if entrega.propietario_maestro_id is None:
+                continue
+            cantidad, quintales = totales.get(entrega.propietario_maestro_id, (0, Decimal('0')))
+            totales[entrega.propietario_maestro_id] = (cantidad + 1, quintales + Decimal(str(entrega.quintales_entregados)))
+        cls.ajustar_contadores_en_bloque(totales)
+    
+    @classmethod
+    def ajustar_contadores_en_bloque(cls, ajustes):
+        """Aplica {propietario_maestro_id: (entregas, quintales)} a los contadores en una sola consulta"""
+        ajustes = {id_: ajuste for id_, ajuste in ajustes.items() if id_ is not None and any(ajuste)}
+        if not ajustes:
+            return
+        cls.objects.filter(id__in=ajustes).update(
+            total_entregas=models.F('total_entregas') + models.Case(
+                *[models.When(id=id_, then=models.Value(cantidad)) for id_, (cantidad, _) in ajustes.items()],
+                output_field=models.IntegerField()
+            ),
+            total_quintales_historicos=models.F('total_quintales_historicos') + models.Case(
+                *[models.When(id=id_, then=models.Value(quintales)) for id_, (_, quintales) in ajustes.items()],
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)
+            )
+        )
+        cls._invalidar_cache_contadores()
+    
+    @classmethod
+    def reconciliar(cls, queryset=None):
+        """
+        Recalcula los contadores desde las entregas y corrige los que no coincidan.
+        Retorna el número de propietarios corregidos.
+        """
+        queryset = cls.objects.all() if queryset is None else queryset
+        reales = queryset.annotate(
+            entregas_reales=models.Count('entregas_cafe'),
+            quintales_reales=Coalesce(
+                models.Sum('entregas_cafe__quintales_entregados'), Decimal('0'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)
+            )
+        ).values_list('id', 'total_entregas', 'total_quintales_historicos', 'entregas_reales', 'quintales_reales')
+        
+        corregidos = 0
+        for id_, entregas, quintales, entregas_reales, quintales_reales in reales.iterator(chunk_size=2000):
+            if entregas != entregas_reales or quintales != quintales_reales:
+                cls.objects.filter(id=id_).update(total_entregas=entregas_reales, total_quintales_historicos=quintales_reales)
+                corregidos += 1
+        if corregidos:
+            cls._invalidar_cache_contadores()
+        return corregidos
+    
+    @staticmethod
+    def _invalidar_cache_contadores():
+        # update() no emite post_save: la caché de propietarios (que incluye los contadores)
+        # se invalida aquí para que buscar-propietario no muestre totales anteriores
+        from .cache import cache_propietarios
+        cache_propietarios.invalidar()
+
+# Datos de la entrega que, salvo que difieran, se toman del propietario maestro
+CAMPOS_HEREDADOS_MAESTRO = ['nombre_completo', 'telefono', 'departamento', 'municipio', 'comunidad',
+                            'calle', 'numero_casa', 'referencias']
+
+def _campo_heredado(campo):
+    """
+    Propiedad que lee el valor propio de la entrega (`<campo>_propio`) o, si es NULL, el del
+    propietario maestro. Las consultas que la leen deben traer el maestro con select_related.
+    """
+    campo_propio = f'{campo}_propio'
+
+    def obtener(self):
+        valor = getattr(self, campo_propio)
+        if valor is not None:
+            return valor
+        maestro = self.propietario_maestro
+        return getattr(maestro, campo) if maestro else ''
+
+    def asignar(self, valor):
+        setattr(self, campo_propio, valor)
+
+    return property(obtener, asignar)
+
+class PropietarioCafeManager(models.Manager):
+    def get_queryset(self):
+        # Los datos heredados se leen del maestro: se trae en la misma consulta
+        return super().get_queryset().select_related('propietario_maestro')
 
 class PropietarioCafe(models.Model):
     lote = models.ForeignKey(LoteCafe, on_delete=models.CASCADE, related_name='propietarios')
@@ -232,52 +402,98 @@ class PropietarioCafe(models.Model):
     )
     quintales_entregados = models.DecimalField(max_digits=8, decimal_places=2)
     
-    # Campos de datos específicos para esta entrega (pueden diferir del maestro)
-    nombre_completo = models.CharField(max_length=200, help_text="Copia del nombre al momento de la entrega")
+    # Datos específicos de esta entrega: NULL cuando coinciden con los del propietario maestro
+    # (se leen con las propiedades de CAMPOS_HEREDADOS_MAESTRO)
+    nombre_completo_propio = models.CharField(max_length=200, null=True, blank=True, help_text="Nombre al momento de la entrega, si difiere del maestro")
+    nombre_normalizado = models.CharField(max_length=200, blank=True, editable=False, db_index=True)
     cedula = models.CharField(max_length=20, help_text="Copia de la cédula al momento de la entrega")
-    telefono = models.CharField(max_length=20, blank=True, help_text="Teléfono al momento de la entrega")
+    telefono_propio = models.CharField(max_length=20, null=True, blank=True, help_text="Teléfono al momento de la entrega, si difiere del maestro")
     
     # Campos de dirección específicos para esta entrega
-    departamento = models.CharField(max_length=100, blank=True)
-    municipio = models.CharField(max_length=100, blank=True)
-    comunidad = models.CharField(max_length=100, blank=True)
-    calle = models.CharField(max_length=200, blank=True)
-    numero_casa = models.CharField(max_length=50, blank=True)
-    referencias = models.CharField(max_length=300, blank=True)
+    departamento_propio = models.CharField(max_length=100, null=True, blank=True)
+    municipio_propio = models.CharField(max_length=100, null=True, blank=True)
+    comunidad_propio = models.CharField(max_length=100, null=True, blank=True)
+    calle_propio = models.CharField(max_length=200, null=True, blank=True)
+    numero_casa_propio = models.CharField(max_length=50, null=True, blank=True)
+    referencias_propio = models.CharField(max_length=300, null=True, blank=True)
     
     # Mantener el campo direccion para compatibilidad
     direccion = models.TextField(blank=True)
     
+    nombre_completo = _campo_heredado('nombre_completo')
+    telefono = _campo_heredado('telefono')
+    departamento = _campo_heredado('departamento')
+    municipio = _campo_heredado('municipio')
+    comunidad = _campo_heredado('comunidad')
+    calle = _campo_heredado('calle')
+    numero_casa = _campo_heredado('numero_casa')
+    referencias = _campo_heredado('referencias')
+    
+    objects = PropietarioCafeManager()
+    
     class Meta:
         verbose_name_plural = "Propietarios de Café"
         unique_together = ['lote', 'cedula']
+        # El acceso por relación (muestra.propietario) también trae el maestro en la misma consulta
+        base_manager_name = 'objects'
     
     def __str__(self):
         return f"{self.nombre_completo} - {self.quintales_entregados} quintales"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Valores cargados, para ajustar los contadores del propietario maestro al guardar
+        instancia._contador_original = (instancia.__dict__.get('propietario_maestro_id'), instancia.__dict__.get('quintales_entregados'))
+        return instancia
+    
+    def compactar(self):
+        """
+        Deja en NULL los datos que coinciden con el propietario maestro para no repetirlos en
+        cada entrega. Un valor vacío se toma como no indicado y también se hereda del maestro.
+        Sin maestro, los datos se guardan completos.
+        """
+        maestro = self.propietario_maestro
+        for campo in CAMPOS_HEREDADOS_MAESTRO:
+            campo_propio = f'{campo}_propio'
+            valor = getattr(self, campo_propio)
+            if maestro is None:
+                if valor is None:
+                    setattr(self, campo_propio, '')
+            elif valor in (None, '') or valor == getattr(maestro, campo):
+                setattr(self, campo_propio, None)
+        self.nombre_normalizado = normalizar_texto(self.nombre_completo)
+    
     def save(self, *args, **kwargs):
-        # Copiar datos del propietario maestro si no están establecidos
-        if self.propietario_maestro:
-            if not self.nombre_completo:
-                self.nombre_completo = self.propietario_maestro.nombre_completo
-            if not self.cedula:
-                self.cedula = self.propietario_maestro.cedula
-            if not self.telefono:
-                self.telefono = self.propietario_maestro.telefono
-            if not self.departamento:
-                self.departamento = self.propietario_maestro.departamento
-            if not self.municipio:
-                self.municipio = self.propietario_maestro.municipio
-            if not self.comunidad:
-                self.comunidad = self.propietario_maestro.comunidad
-            if not self.calle:
-                self.calle = self.propietario_maestro.calle
-            if not self.numero_casa:
-                self.numero_casa = self.propietario_maestro.numero_casa
-            if not self.referencias:
-                self.referencias = self.propietario_maestro.referencias
+        if self.propietario_maestro and not self.cedula:
+            self.cedula = self.propietario_maestro.cedula
+        self.compactar()
         super().save(*args, **kwargs)
     
+    @classmethod
+    def fijar_datos_heredados(cls, cambios):
+        """
+        Antes de modificar propietarios maestros, copia sus valores actuales a las entregas que
+        los heredan, para que las entregas anteriores conserven los datos con que se registraron.
+        `cambios` es {propietario_maestro_id: campos que van a cambiar}. Una sola consulta.
+        """
+        maestros_por_campo = {}
+        for maestro_id, campos in cambios.items():
+            for campo in campos:
+                maestros_por_campo.setdefault(campo, []).append(maestro_id)
+        if not maestros_por_campo:
+            return 0
+        return cls.objects.filter(propietario_maestro__in=list(cambios)).update(**{
+            f'{campo}_propio': models.Case(
+                models.When(propietario_maestro__in=maestros, then=Coalesce(
+                    f'{campo}_propio',
+                    models.Subquery(PropietarioMaestro.objects.filter(id=models.OuterRef('propietario_maestro_id')).values(campo)[:1])
+                )),
+                default=f'{campo}_propio'
+            )
+            for campo, maestros in maestros_por_campo.items()
+        })
+    
     @property
     def direccion_completa(self):
         """Retorna la dirección completa concatenada"""
@@ -325,6 +541,197 @@ class MuestraCafe(models.Model):
     def __str__(self):
         return f"Muestra {self.numero_muestra} - {self.propietario.nombre_completo}"
 
+def derivar_estado_analisis(muestras):
+    """
+    Deriva el estado de análisis de un propietario a partir de sus muestras (ordenadas por id).
+    Retorna una tupla (estado, muestra_decisiva).
+    """
+    muestra_inicial = next((m for m in muestras if not m.es_segundo_muestreo), None)
+    muestra_seguimiento = next((m for m in muestras if m.es_segundo_muestreo), None)
+
+    if muestra_inicial is None:
+        return 'SIN_MUESTRA', None
+    if muestra_inicial.estado == 'APROBADA':
+        return 'APROBADA', muestra_inicial
+    if muestra_inicial.estado == 'CONTAMINADA':
+        if muestra_seguimiento is None:
+            return 'CONTAMINADA', muestra_inicial
+        if muestra_seguimiento.estado == 'APROBADA':
+            return 'APROBADA_SEGUNDO', muestra_seguimiento
+        if muestra_seguimiento.estado == 'CONTAMINADA':
+            return 'CONTAMINADA_CONFIRMADA', muestra_seguimiento
+        return 'SEGUNDO_PENDIENTE', muestra_seguimiento
+    return 'PENDIENTE', muestra_inicial
+
+class EstadoAnalisisPropietario(models.Model):
+    """Estado materializado del análisis de cada propietario de un lote"""
+    ESTADOS_ANALISIS = [
+        ('SIN_MUESTRA', 'Sin muestra tomada'),
+        ('PENDIENTE', 'Muestra inicial pendiente de análisis'),
+        ('APROBADA', 'Aprobada en análisis inicial'),
+        ('CONTAMINADA', 'Contaminada - Requiere confirmación'),
+        ('SEGUNDO_PENDIENTE', 'Segundo muestreo pendiente de análisis'),
+        ('APROBADA_SEGUNDO', 'Aprobada en segundo muestreo'),
+        ('CONTAMINADA_CONFIRMADA', 'Contaminación confirmada en segundo muestreo'),
+    ]
+
+    # Estados agrupados según la decisión que se toma sobre los quintales
+    ESTADOS_CONSERVAR = ['APROBADA', 'APROBADA_SEGUNDO']
+    ESTADOS_SEPARAR = ['CONTAMINADA', 'CONTAMINADA_CONFIRMADA']
+    ESTADOS_SEGUNDO_MUESTREO = ['SEGUNDO_PENDIENTE', 'APROBADA_SEGUNDO', 'CONTAMINADA_CONFIRMADA']
+
+    propietario = models.OneToOneField(PropietarioCafe, on_delete=models.CASCADE, related_name='estado_analisis')
+    lote = models.ForeignKey(LoteCafe, on_delete=models.CASCADE, related_name='estados_analisis')
+    estado = models.CharField(max_length=25, choices=ESTADOS_ANALISIS, default='SIN_MUESTRA')
+    muestra_decisiva = models.ForeignKey(
+        MuestraCafe,
+        on_delete=models.SET_NULL,
+        null=True, blank=True,
+        related_name='+',
+        help_text="Muestra cuyo resultado determina el estado actual"
+    )
+    quintales = models.DecimalField(max_digits=8, decimal_places=2, help_text="Quintales entregados por el propietario")
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Estado de Análisis de Propietario"
+        verbose_name_plural = "Estados de Análisis de Propietarios"
+        indexes = [
+            models.Index(fields=['lote', 'estado'], name='estado_analisis_lote_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.propietario.nombre_completo} - {self.get_estado_display()}"
+
+    @classmethod
+    def recalcular(cls, propietario_id, crear=True):
+        """Recalcula el estado de un propietario a partir de sus muestras"""
+        muestras = list(MuestraCafe.objects.filter(propietario_id=propietario_id).order_by('id'))
+        estado, muestra_decisiva = derivar_estado_analisis(muestras)
+        valores = {
+            'estado': estado,
+            'muestra_decisiva': muestra_decisiva,
+            'fecha_actualizacion': timezone.now(),
+        }
+
+        if crear:
+            propietario = PropietarioCafe.objects.select_related(None).only('id', 'lote_id', 'quintales_entregados').get(id=propietario_id)
+            valores['lote_id'] = propietario.lote_id
+            valores['quintales'] = propietario.quintales_entregados
+            cls.objects.update_or_create(propietario_id=propietario_id, defaults=valores)
+        else:
+            cls.objects.filter(propietario_id=propietario_id).update(**valores)
+
+    @classmethod
+    def agrupar_por_estado(cls, lote):
+        """Retorna los estados del lote agrupados por estado (una sola consulta indexada)"""
+        grupos = {estado: [] for estado, _ in cls.ESTADOS_ANALISIS}
+        estados = cls.objects.filter(lote=lote).select_related(
+            'propietario', 'propietario__propietario_maestro', 'muestra_decisiva'
+        ).order_by('propietario_id')
+        for estado_analisis in estados:
+            grupos[estado_analisis.estado].append(estado_analisis)
+        return grupos
+
+    @classmethod
+    def inicializar(cls, propietarios):
+        """Crea en bloque los estados de propietarios recién creados con bulk_create (sin señales)"""
+        return cls.objects.bulk_create([
+            cls(propietario=propietario, lote_id=propietario.lote_id, estado='SIN_MUESTRA',
+                quintales=propietario.quintales_entregados)
+            for propietario in propietarios
+        ])
+
+    @classmethod
+    def actualizar_quintales(cls, propietarios):
+        """Copia en una sola consulta los quintales de propietarios modificados con bulk_update (sin señales)"""
+        if not propietarios:
+            return 0
+        return cls.objects.filter(propietario__in=propietarios).update(
+            quintales=models.Case(
+                *[models.When(propietario_id=propietario.id, then=models.Value(propietario.quintales_entregados))
+                  for propietario in propietarios],
+                output_field=models.DecimalField(max_digits=8, decimal_places=2)
+            ),
+            fecha_actualizacion=timezone.now()
+        )
+
+@receiver(post_save, sender=PropietarioCafe)
+def sincronizar_estado_analisis_propietario(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        EstadoAnalisisPropietario.recalcular(instance.id)
+    else:
+        EstadoAnalisisPropietario.objects.filter(propietario=instance).exclude(
+            lote_id=instance.lote_id,
+            quintales=instance.quintales_entregados
+        ).update(
+            lote_id=instance.lote_id,
+            quintales=instance.quintales_entregados,
+            fecha_actualizacion=timezone.now()
+        )
+
+@receiver(pre_save, sender=PropietarioMaestro)
+def conservar_datos_entregas(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Las entregas que heredan datos del maestro conservan los anteriores si estos cambian
+    if raw or instance.pk is None:
+        return
+    campos = [campo for campo in CAMPOS_HEREDADOS_MAESTRO if update_fields is None or campo in update_fields]
+    anterior = PropietarioMaestro.objects.filter(pk=instance.pk).values(*campos).first() if campos else None
+    if anterior:
+        PropietarioCafe.fijar_datos_heredados({instance.pk: [campo for campo in campos if anterior[campo] != getattr(instance, campo)]})
+
+@receiver(post_save, sender=PropietarioMaestro)
+@receiver(post_delete, sender=PropietarioMaestro)
+def invalidar_cache_propietarios(sender, **kwargs):
+    from .cache import cache_propietarios
+    cache_propietarios.invalidar()
+
+@receiver(post_save, sender=PropietarioCafe)
+@receiver(post_delete, sender=PropietarioCafe)
+@receiver(post_save, sender=MuestraCafe)
+@receiver(post_delete, sender=MuestraCafe)
+def invalidar_cache_calidad(sender, raw=False, **kwargs):
+    if raw:
+        return
+    from .cache import cache_calidad
+    cache_calidad.invalidar()
+
+@receiver(post_save, sender=PropietarioCafe)
+def actualizar_contadores_por_entrega(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    quintales = Decimal(str(instance.quintales_entregados))
+    if created:
+        PropietarioMaestro.ajustar_contadores(instance.propietario_maestro_id, 1, quintales)
+    else:
+        maestro_anterior, quintales_anteriores = getattr(instance, '_contador_original', (None, None))
+        if quintales_anteriores is None:
+            # Instancia no cargada de la base de datos: se recalcula desde las entregas
+            PropietarioMaestro.reconciliar(PropietarioMaestro.objects.filter(id=instance.propietario_maestro_id))
+        elif maestro_anterior != instance.propietario_maestro_id:
+            PropietarioMaestro.ajustar_contadores(maestro_anterior, -1, -quintales_anteriores)
+            PropietarioMaestro.ajustar_contadores(instance.propietario_maestro_id, 1, quintales)
+        else:
+            PropietarioMaestro.ajustar_contadores(instance.propietario_maestro_id, 0, quintales - quintales_anteriores)
+    instance._contador_original = (instance.propietario_maestro_id, quintales)
+
+@receiver(post_delete, sender=PropietarioCafe)
+def actualizar_contadores_por_entrega_eliminada(sender, instance, **kwargs):
+    PropietarioMaestro.ajustar_contadores(instance.propietario_maestro_id, -1, -Decimal(str(instance.quintales_entregados)))
+
+@receiver(post_save, sender=MuestraCafe)
+def actualizar_estado_analisis_por_muestra(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    EstadoAnalisisPropietario.recalcular(instance.propietario_id)
+
+@receiver(post_delete, sender=MuestraCafe)
+def actualizar_estado_analisis_por_muestra_eliminada(sender, instance, **kwargs):
+    # Si el propietario también se está eliminando, su estado ya no existe y no se recrea
+    EstadoAnalisisPropietario.recalcular(instance.propietario_id, crear=False)
+
 class ProcesoAnalisis(models.Model):
     TIPOS_PROCESO = [
         ('INICIAL', 'Análisis inicial (5 muestras)'),
@@ -347,6 +754,51 @@ class ProcesoAnalisis(models.Model):
     def __str__(self):
         return f"Proceso {self.tipo_proceso} - Lote {self.lote.numero_lote}"
 
+class LoteEvento(models.Model):
+    """Historial inmutable de los eventos de un lote con datos compactos por tipo"""
+    TIPOS_EVENTO = [
+        ('LOTE_CREADO', 'Lote creado'),
+        ('LOTE_ACTUALIZADO', 'Lote actualizado'),
+        ('MUESTRAS_SELECCIONADAS', 'Muestras seleccionadas'),
+        ('RESULTADO_MUESTRA', 'Resultado de muestra registrado'),
+        ('SEGUNDO_MUESTREO_CREADO', 'Segundo muestreo creado'),
+        ('SEPARACION_APLICADA', 'Separación de quintales aplicada'),
+        ('LOTE_RECUPERADO', 'Lote recuperado en segundo muestreo'),
+        ('PARTE_LIMPIA_ENVIADA', 'Parte limpia enviada a limpieza'),
+        ('LIMPIEZA', 'Limpieza completada'),
+        ('SEPARACION_COLORES', 'Separación por colores completada'),
+        ('RECEPCION_FINAL', 'Recepción final'),
+        ('INGRESO_PROCESO', 'Ingreso a proceso de producción'),
+        ('PROCESO_FINALIZADO', 'Proceso de producción finalizado'),
+    ]
+    
+    lote = models.ForeignKey(LoteCafe, on_delete=models.CASCADE, related_name='eventos')
+    fecha = models.DateTimeField(default=timezone.now)
+    tipo = models.CharField(max_length=30, choices=TIPOS_EVENTO)
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    datos = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder, help_text="Datos del evento según su tipo")
+    
+    class Meta:
+        verbose_name = "Evento de Lote"
+        verbose_name_plural = "Eventos de Lotes"
+        ordering = ['fecha', 'id']
+        indexes = [
+            models.Index(fields=['lote', 'fecha'], name='lote_evento_lote_fecha_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_tipo_display()} - Lote {self.lote_id} ({self.fecha:%Y-%m-%d %H:%M})"
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Los eventos de lote no se pueden modificar")
+        super().save(*args, **kwargs)
+    
+    @classmethod
+    def registrar(cls, lote, tipo, usuario=None, **datos):
+        """Agrega un evento al historial del lote"""
+        return cls.objects.create(lote=lote, tipo=tipo, usuario=usuario, datos=datos)
+
 class RegistroBitacora(models.Model):
     ACCIONES_CHOICES = [
         ('CREAR_LOTE', 'Crear Lote'),
@@ -371,6 +823,9 @@ class RegistroBitacora(models.Model):
         ('RECEPCION_FINAL', 'Recepción Final'),
         ('ENVIAR_LIMPIEZA_PARCIAL', 'Enviar Parte Limpia a Limpieza'),
         ('REGISTRAR_USO_MAQUINARIA', 'Registrar Uso de Maquinaria'),
+        ('IMPORTAR_PROPIETARIOS', 'Importar Propietarios'),
+        ('FUSIONAR_PROPIETARIOS', 'Fusionar Propietarios'),
+        ('SINCRONIZAR_REGISTROS', 'Sincronizar Registros'),
     ]
     
     MODULOS_CHOICES = [
@@ -436,9 +891,30 @@ class RegistroBitacora(models.Model):
         )
         
         return registro
+    
+    @classmethod
+    def filtrar(cls, filtros):
+        """Aplica los filtros de exportación de la bitácora (fechas, acción, módulo, usuario)"""
+        queryset = cls.objects.all()
+        
+        if filtros.get('fecha_desde'):
+            queryset = queryset.filter(fecha__date__gte=filtros['fecha_desde'])
+        if filtros.get('fecha_hasta'):
+            queryset = queryset.filter(fecha__date__lte=filtros['fecha_hasta'])
+        if filtros.get('accion'):
+            queryset = queryset.filter(accion=filtros['accion'])
+        if filtros.get('modulo'):
+            queryset = queryset.filter(modulo=filtros['modulo'])
+        if filtros.get('usuario'):
+            queryset = queryset.filter(usuario_id=filtros['usuario'])
+        
+        return queryset
 
 class RegistroDescarga(models.Model):
     """Modelo para registrar las descargas de lotes realizadas directamente por empleados"""
+    # Tipos de insumo cuyo uso en una descarga se descuenta del stock
+    TIPOS_INSUMO_QUE_RESTAN = ['CONTENEDOR', 'EQUIPO_MEDICION', 'OTRO']
+    
     lote = models.ForeignKey(LoteCafe, on_delete=models.CASCADE, related_name='descargas')
     empleado = models.ForeignKey(User, on_delete=models.CASCADE, related_name='mis_descargas', help_text="Empleado que realizó la descarga")
     insumo = models.ForeignKey('Insumo', on_delete=models.CASCADE, related_name='descargas_realizadas', null=True, blank=True, help_text="Insumo utilizado en la descarga")
@@ -450,22 +926,29 @@ class RegistroDescarga(models.Model):
     tiempo_descarga_minutos = models.IntegerField(null=True, blank=True, help_text="Duración de la descarga en minutos")
     fecha_registro = models.DateTimeField(default=timezone.now, help_text="Fecha cuando se registró la descarga")
     observaciones = models.TextField(blank=True)
+    clave_idempotencia = models.CharField(max_length=64, unique=True, null=True, blank=True, help_text="Clave generada por el dispositivo para no duplicar registros reenviados")
     
     class Meta:
         verbose_name = "Registro de Descarga"
         verbose_name_plural = "Registros de Descargas"
         ordering = ['-fecha_registro']
+        indexes = [
+            models.Index(fields=['fecha_registro'], name='descarga_fecha_idx'),
+        ]
     
     def __str__(self):
         insumo_info = f" con {self.cantidad_insumo_usado} {self.insumo.get_unidad_medida_display()} de {self.insumo.nombre}" if self.insumo and self.cantidad_insumo_usado else ""
         tiempo_uso_info = f" durante {self.tiempo_uso_insumo} min" if self.tiempo_uso_insumo else ""
         return f"{self.empleado.get_full_name() or self.empleado.username} descargó {self.peso_descargado} kg{insumo_info}{tiempo_uso_info} - Lote {self.lote.numero_lote} ({self.tiempo_descarga_minutos} min)"
     
-    def save(self, *args, **kwargs):
+    def completar_tiempo(self):
         # Calcular automáticamente el tiempo de descarga si no se proporciona
         if not self.tiempo_descarga_minutos and self.hora_inicio and self.hora_fin:
             diferencia = self.hora_fin - self.hora_inicio
             self.tiempo_descarga_minutos = int(diferencia.total_seconds() / 60)
+    
+    def save(self, *args, **kwargs):
+        self.completar_tiempo()
         super().save(*args, **kwargs)
 
 class Insumo(models.Model):
@@ -535,6 +1018,16 @@ class Insumo(models.Model):
             return 'BAJO'
         else:
             return 'NORMAL'
+    
+    def save(self, *args, **kwargs):
+        # Una vez creado, la existencia solo cambia con MovimientoInventario. Guardar el insumo
+        # completo no debe pisar el saldo que otra petición acaba de mover con F()
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                campo.name for campo in self._meta.concrete_fields
+                if not campo.primary_key and campo.name != 'cantidad_disponible'
+            ]
+        super().save(*args, **kwargs)
 
 class RegistroUsoMaquinaria(models.Model):
     """Modelo para registrar el uso de maquinaria realizado directamente por empleados"""
@@ -545,6 +1038,8 @@ class RegistroUsoMaquinaria(models.Model):
         ('CARRETILLA', 'Carretilla'),
         ('OTRO', 'Otro'),
     ]
+    # Duración máxima de un registro de uso; acota la búsqueda de solapamientos
+    MAXIMO_HORAS_USO = 24
     
     empleado = models.ForeignKey(User, on_delete=models.CASCADE, related_name='mis_usos_maquinaria', help_text="Empleado que usó la maquinaria")
     maquinaria = models.ForeignKey(Insumo, on_delete=models.CASCADE, related_name='registros_uso', null=True, blank=True)
@@ -556,11 +1051,15 @@ class RegistroUsoMaquinaria(models.Model):
     peso_total_descargado = models.DecimalField(max_digits=8, decimal_places=2, help_text="Peso total descargado con esta maquinaria en kg")
     observaciones = models.TextField(blank=True)
     fecha_registro = models.DateTimeField(auto_now_add=True)
+    clave_idempotencia = models.CharField(max_length=64, unique=True, null=True, blank=True, help_text="Clave generada por el dispositivo para no duplicar registros reenviados")
     
     class Meta:
         verbose_name = "Registro de Uso de Maquinaria"
         verbose_name_plural = "Registros de Uso de Maquinaria"
         ordering = ['-fecha_registro']
+        indexes = [
+            models.Index(fields=['maquinaria', 'hora_inicio', 'hora_fin'], name='uso_maquinaria_intervalo_idx'),
+        ]
     
     def __str__(self):
         maquinaria_info = self.maquinaria.nombre if self.maquinaria else self.get_tipo_maquinaria_display()
@@ -573,11 +1072,31 @@ class RegistroUsoMaquinaria(models.Model):
             return dict(self.TIPOS_MAQUINARIA).get(self.tipo_maquinaria, self.tipo_maquinaria)
         return "No especificado"
     
-    def save(self, *args, **kwargs):
+    @classmethod
+    def solapados(cls, maquinaria_id, hora_inicio, hora_fin, excluir_id=None):
+        """
+        Usos de la máquina que se cruzan con el intervalo. El límite inferior de hora_inicio
+        (nadie usa una máquina más de MAXIMO_HORAS_USO seguidas) acota el recorrido del
+        índice (maquinaria, hora_inicio, hora_fin) a una ventana corta.
+        """
+        usos = cls.objects.filter(
+            maquinaria_id=maquinaria_id,
+            hora_inicio__gt=hora_inicio - timedelta(hours=cls.MAXIMO_HORAS_USO),
+            hora_inicio__lt=hora_fin,
+            hora_fin__gt=hora_inicio
+        )
+        if excluir_id is not None:
+            usos = usos.exclude(id=excluir_id)
+        return usos.order_by('hora_inicio')
+    
+    def completar_tiempo(self):
         # Calcular automáticamente el tiempo de uso si no se proporciona
         if not self.tiempo_uso_minutos and self.hora_inicio and self.hora_fin:
             diferencia = self.hora_fin - self.hora_inicio
             self.tiempo_uso_minutos = int(diferencia.total_seconds() / 60)
+    
+    def save(self, *args, **kwargs):
+        self.completar_tiempo()
         super().save(*args, **kwargs)
 
 # Nuevo modelo para registrar tareas de insumos utilizados
@@ -617,12 +1136,145 @@ class TareaInsumo(models.Model):
         return f"{empleado_nombre}: {self.insumo.nombre}{muestra_info}{lote_info}"
     
     def save(self, *args, **kwargs):
-        # Actualizar el stock del insumo si se especifica cantidad
-        if self.cantidad and self.pk is None:  # Solo al crear, no al actualizar
-            if self.insumo.cantidad_disponible >= self.cantidad:
-                self.insumo.cantidad_disponible -= self.cantidad
-                self.insumo.save()
-        super().save(*args, **kwargs)
+        creando = self.pk is None
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # Descontar el insumo solo al crear y solo si alcanza la existencia
+            if creando and self.cantidad:
+                try:
+                    MovimientoInventario.registrar(
+                        self.insumo, 'SALIDA', self.cantidad, usuario=self.empleado, exigir_existencia=True,
+                        tarea=self, lote=self.lote, observaciones='Uso en tarea'
+                    )
+                except StockInsuficiente:
+                    pass
+
+class MovimientoInventario(models.Model):
+    """
+    Libro de movimientos del inventario de insumos. Cada movimiento suma su cantidad (con
+    signo) a Insumo.cantidad_disponible con una expresión F() en la misma transacción y
+    guarda el saldo resultante: la existencia a una fecha es el saldo del último movimiento
+    hasta esa fecha y el consumo de un periodo es la suma de sus salidas.
+    """
+    TIPOS_MOVIMIENTO = [
+        ('ENTRADA', 'Entrada'),
+        ('SALIDA', 'Salida'),
+        ('AJUSTE', 'Ajuste'),
+    ]
+    
+    insumo = models.ForeignKey(Insumo, on_delete=models.CASCADE, related_name='movimientos')
+    tipo = models.CharField(max_length=10, choices=TIPOS_MOVIMIENTO)
+    cantidad = models.DecimalField(max_digits=12, decimal_places=2, help_text="Positiva para entradas, negativa para salidas")
+    saldo_resultante = models.DecimalField(max_digits=12, decimal_places=2, help_text="Existencia del insumo después del movimiento")
+    fecha = models.DateTimeField(default=timezone.now)
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos_inventario')
+    
+    # Origen del movimiento
+    tarea = models.ForeignKey(TareaInsumo, on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos')
+    descarga = models.ForeignKey(RegistroDescarga, on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos_inventario')
+    lote = models.ForeignKey(LoteCafe, on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos_inventario')
+    observaciones = models.TextField(blank=True)
+    
+    class Meta:
+        verbose_name = "Movimiento de Inventario"
+        verbose_name_plural = "Movimientos de Inventario"
+        ordering = ['-fecha', '-id']
+        indexes = [
+            models.Index(fields=['insumo', 'fecha'], name='movimiento_insumo_fecha_idx'),
+            models.Index(fields=['tipo', 'fecha'], name='movimiento_tipo_fecha_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.cantidad} - {self.insumo.nombre} (saldo {self.saldo_resultante})"
+    
+    @property
+    def saldo_anterior(self):
+        return self.saldo_resultante - self.cantidad
+    
+    @classmethod
+    def registrar(cls, insumo, tipo, cantidad, usuario=None, exigir_existencia=False, **referencias):
+        """
+        Aplica el movimiento a la existencia del insumo y lo guarda. Las entradas suman y las
+        salidas restan el valor absoluto de `cantidad`; los ajustes suman `cantidad` con su signo.
+        Con `exigir_existencia` una salida mayor que la existencia lanza StockInsuficiente.
+        El movimiento se fecha ahora: su saldo resultante es la existencia de este momento.
+        """
+        cantidad = Decimal(str(cantidad))
+        if tipo == 'ENTRADA':
+            cantidad = abs(cantidad)
+        elif tipo == 'SALIDA':
+            cantidad = -abs(cantidad)
+        
+        with transaction.atomic():
+            filas = Insumo.objects.filter(id=insumo.id)
+            if exigir_existencia and cantidad < 0:
+                filas = filas.filter(cantidad_disponible__gte=-cantidad)
+            if not filas.update(cantidad_disponible=models.F('cantidad_disponible') + cantidad, fecha_ultima_actualizacion=timezone.now()):
+                raise StockInsuficiente(insumo, -cantidad)
+            # La fila queda bloqueada por el UPDATE hasta el fin de la transacción: el saldo
+            # leído es el que dejó este movimiento
+            saldo = Insumo.objects.filter(id=insumo.id).values_list('cantidad_disponible', flat=True).get()
+            movimiento = cls.objects.create(
+                insumo=insumo, tipo=tipo, cantidad=cantidad, saldo_resultante=saldo,
+                fecha=timezone.now(), usuario=usuario, **referencias
+            )
+        insumo.cantidad_disponible = saldo
+        return movimiento
+    
+    @classmethod
+    def ajustar(cls, insumo, nueva_cantidad, usuario=None, **referencias):
+        """Lleva la existencia a `nueva_cantidad` (un conteo físico) con un movimiento AJUSTE por la diferencia"""
+        with transaction.atomic():
+            actual = Insumo.objects.select_for_update().filter(id=insumo.id).values_list('cantidad_disponible', flat=True).get()
+            return cls.registrar(insumo, 'AJUSTE', Decimal(str(nueva_cantidad)) - actual, usuario=usuario, **referencias)
+    
+    @classmethod
+    def registrar_existencia_inicial(cls, insumo, usuario=None):
+        """Registra como entrada la existencia con la que se creó el insumo (ya guardada en el insumo)"""
+        if not insumo.cantidad_disponible:
+            return None
+        return cls.objects.create(
+            insumo=insumo, tipo='ENTRADA', cantidad=insumo.cantidad_disponible,
+            saldo_resultante=insumo.cantidad_disponible, usuario=usuario, observaciones='Existencia inicial'
+        )
+    
+    @classmethod
+    def existencias_a_fecha(cls, insumos, fecha):
+        """Anota en `insumos` la existencia al momento `fecha` como `existencia` (None si no tenía movimientos)"""
+        ultimo = cls.objects.filter(insumo=models.OuterRef('pk'), fecha__lte=fecha).order_by('-fecha', '-id')
+        return insumos.annotate(existencia=models.Subquery(ultimo.values('saldo_resultante')[:1]))
+    
+    @classmethod
+    def resumen_por_periodo(cls, movimientos, truncar):
+        """Entradas, salidas y ajustes por insumo y periodo; `truncar` es una función Trunc* de Django"""
+        decimal = models.DecimalField(max_digits=14, decimal_places=2)
+        return movimientos.annotate(periodo=truncar('fecha')).values(
+            'insumo', 'insumo__nombre', 'insumo__codigo', 'insumo__unidad_medida', 'periodo'
+        ).annotate(
+            entradas=Coalesce(models.Sum('cantidad', filter=models.Q(tipo='ENTRADA')), Decimal('0'), output_field=decimal),
+            salidas=Coalesce(-models.Sum('cantidad', filter=models.Q(tipo='SALIDA')), Decimal('0'), output_field=decimal),
+            ajustes=Coalesce(models.Sum('cantidad', filter=models.Q(tipo='AJUSTE')), Decimal('0'), output_field=decimal),
+            movimientos=models.Count('id'),
+        ).order_by('insumo__nombre', 'periodo')
+
+@receiver(post_save, sender=MovimientoInventario)
+@receiver(post_delete, sender=MovimientoInventario)
+@receiver(post_save, sender=Insumo)
+@receiver(post_save, sender=TareaInsumo)
+@receiver(post_save, sender=RegistroDescarga)
+def invalidar_cache_inventario(sender, raw=False, **kwargs):
+    if raw:
+        return
+    from .cache import cache_inventario
+    cache_inventario.invalidar()
+
+@receiver(post_save, sender=RegistroDescarga)
+@receiver(post_delete, sender=RegistroDescarga)
+def invalidar_cache_descargas(sender, raw=False, **kwargs):
+    if raw:
+        return
+    from .cache import cache_descargas
+    cache_descargas.invalidar()
 
 # Nuevo modelo para procesos de producción
 class Proceso(models.Model):
@@ -699,12 +1351,27 @@ class Proceso(models.Model):
         verbose_name_plural = "Procesos de Producción"
         ordering = ['-fecha_inicio']
     
+    # Totales derivados de los lotes, mantenidos por recalcular_totales
+    CAMPOS_TOTALES = ['quintales_totales', 'peso_total_inicial', 'peso_total_actual']
+    
     def __str__(self):
         return f"{self.numero} - {self.nombre}"
     
+    def save(self, *args, **kwargs):
+        # Una vez creado, los totales solo cambian con recalcular_totales. Guardar el proceso
+        # completo no debe pisar los que acaba de actualizar el cambio de un lote
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                campo.name for campo in self._meta.concrete_fields
+                if not campo.primary_key and campo.name not in self.CAMPOS_TOTALES
+            ]
+        super().save(*args, **kwargs)
+    
     @property
     def total_lotes(self):
-        """Retorna el número total de lotes en el proceso"""
+        """Retorna el número total de lotes en el proceso (sin consulta si los lotes están precargados)"""
+        if 'lotes' in getattr(self, '_prefetched_objects_cache', {}):
+            return len(self.lotes.all())
         return self.lotes.count()
     
     @property
@@ -745,16 +1412,34 @@ class Proceso(models.Model):
             pass
         return False
     
+    @classmethod
+    def recalcular_totales(cls, proceso_ids):
+        """
+        Recalcula quintales y pesos de los procesos con un solo UPDATE: cada total es una
+        subconsulta agregada sobre los lotes del proceso. Un peso que suma 0 queda en None y
+        el peso actual de cada lote es el final o, si aún no lo tiene, el inicial.
+        """
+        proceso_ids = {proceso_id for proceso_id in proceso_ids if proceso_id is not None}
+        if not proceso_ids:
+            return 0
+        lotes_proceso = cls.lotes.through.objects.filter(proceso_id=models.OuterRef('pk')).values('proceso_id').order_by()
+
+        def total(expresion):
+            return models.Subquery(lotes_proceso.annotate(total=models.Sum(expresion)).values('total'))
+
+        return cls.objects.filter(pk__in=proceso_ids).update(
+            quintales_totales=Coalesce(total('lotecafe__total_quintales'), 0),
+            peso_total_inicial=NullIf(total('lotecafe__peso_total_inicial'), Decimal('0')),
+            peso_total_actual=NullIf(
+                total(Coalesce(NullIf('lotecafe__peso_total_final', Decimal('0')), 'lotecafe__peso_total_inicial')), Decimal('0')
+            ),
+            fecha_actualizacion=timezone.now()
+        )
+    
     def calcular_totales(self):
         """Calcula los totales de peso y quintales basado en los lotes"""
-        lotes = self.lotes.all()
-        if lotes:
-            self.quintales_totales = sum(lote.total_quintales for lote in lotes)
-            peso_inicial = sum(lote.peso_total_inicial or 0 for lote in lotes)
-            peso_actual = sum(lote.peso_total_final or lote.peso_total_inicial or 0 for lote in lotes)
-            self.peso_total_inicial = peso_inicial if peso_inicial > 0 else None
-            self.peso_total_actual = peso_actual if peso_actual > 0 else None
-            self.save()
+        self.recalcular_totales([self.pk])
+        self.refresh_from_db(fields=self.CAMPOS_TOTALES + ['fecha_actualizacion'])
     
     def agregar_nota_tecnica(self, fase, nota):
         """Agrega una nota técnica para una fase específica"""
@@ -772,6 +1457,151 @@ class Proceso(models.Model):
         self.save()
 
 
+def recalcular_totales_procesos_lote(lote_id):
+    """Recalcula los totales de los procesos que incluyen el lote"""
+    Proceso.recalcular_totales(
+        Proceso.lotes.through.objects.filter(lotecafe_id=lote_id).values_list('proceso_id', flat=True)
+    )
+
+@receiver(post_save, sender=LoteCafe)
+def actualizar_totales_procesos_por_lote(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Un lote nuevo todavía no está en ningún proceso
+    if raw or created:
+        return
+    if update_fields is None or LoteCafe.CAMPOS_TOTALES_PROCESO.intersection(update_fields):
+        recalcular_totales_procesos_lote(instance.pk)
+
+@receiver(pre_delete, sender=LoteCafe)
+def recordar_procesos_lote_eliminado(sender, instance, **kwargs):
+    # La cascada borra las filas de la relación sin emitir m2m_changed
+    instance._procesos_totales = list(
+        Proceso.lotes.through.objects.filter(lotecafe_id=instance.pk).values_list('proceso_id', flat=True)
+    )
+
+@receiver(post_delete, sender=LoteCafe)
+def actualizar_totales_procesos_por_lote_eliminado(sender, instance, **kwargs):
+    Proceso.recalcular_totales(getattr(instance, '_procesos_totales', ()))
+
+@receiver(m2m_changed, sender=Proceso.lotes.through)
+def actualizar_totales_por_lotes_proceso(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            Proceso.recalcular_totales([instance.pk])
+    elif action == 'pre_clear':
+        # Después del clear ya no se sabe en qué procesos estaba el lote
+        instance._procesos_totales = list(sender.objects.filter(lotecafe_id=instance.pk).values_list('proceso_id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        Proceso.recalcular_totales(pk_set)
+    elif action == 'post_clear':
+        Proceso.recalcular_totales(getattr(instance, '_procesos_totales', ()))
+
+
+# Fase de los datos de proceso -> (campo JSON de Proceso, [(métrica, ruta del valor en el JSON, unidad)])
+METRICAS_FASE = {
+    'PILADO': ('datos_pilado', [
+        ('peso_impurezas_removidas', ('peso_impurezas_removidas',), 'kg'),
+        ('tiempo_canteado', ('tareas_realizadas', 'tiempo_canteado'), 'min'),
+    ]),
+    'CLASIFICACION': ('datos_clasificacion', [
+        ('numero_malla_ocupada', ('numero_malla_ocupada',), ''),
+        ('peso_cafe_caracolillo', ('peso_cafe_caracolillo',), 'kg'),
+        ('peso_cafe_exportacion', ('peso_cafe_exportacion',), 'kg'),
+    ]),
+    'DENSIDAD_1': ('datos_densidad_1', [('peso_cafe_densidad_1', ('peso_cafe_densidad_1',), 'kg')]),
+    'DENSIDAD_2': ('datos_densidad_2', [('peso_cafe_densidad_2', ('peso_cafe_densidad_2',), 'kg')]),
+    'COLOR': ('datos_color', [('duracion_proceso', ('duracion_proceso',), 'min')]),
+    'EMPAQUE': ('datos_empaquetado', [
+        ('cafe_caracolillo', ('cafe_caracolillo',), 'kg'),
+        ('cafe_descarte', ('cafe_descarte',), 'kg'),
+        ('cafe_exportacion', ('cafe_exportacion',), 'kg'),
+    ]),
+}
+# Mayor valor que admite MedicionFase.valor
+LIMITE_VALOR_MEDICION = Decimal('1e9')
+
+def _valor_numerico(valor):
+    """Decimal del valor del formulario ('12,5', 12.5...) o None si vacío o no numérico"""
+    if valor is None or isinstance(valor, bool):
+        return None
+    try:
+        numero = Decimal(str(valor).strip().replace(',', '.'))
+    except InvalidOperation:
+        return None
+    return numero if numero.is_finite() and abs(numero) < LIMITE_VALOR_MEDICION else None
+
+def extraer_mediciones_fase(fase, datos):
+    """
+    (métrica, valor, unidad, fecha) de cada valor numérico de los datos JSON de una fase. La
+    fecha es la de guardado de los datos (None si no la tienen). En COLOR el peso de cada
+    color de la clasificación es una métrica peso_color_<color>.
+    """
+    if not isinstance(datos, dict):
+        return []
+    try:
+        fecha = parse_datetime(datos['fecha_guardado']) if isinstance(datos.get('fecha_guardado'), str) else None
+    except ValueError:
+        fecha = None
+    if fecha is not None and timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    mediciones = []
+    for metrica, ruta, unidad in METRICAS_FASE[fase][1]:
+        valor = datos
+        for clave in ruta:
+            valor = valor.get(clave) if isinstance(valor, dict) else None
+        valor = _valor_numerico(valor)
+        if valor is not None:
+            mediciones.append((metrica, valor, unidad, fecha))
+    if fase == 'COLOR' and isinstance(datos.get('clasificacion_colores'), dict):
+        for color, detalle in datos['clasificacion_colores'].items():
+            valor = _valor_numerico(detalle.get('peso') if isinstance(detalle, dict) else detalle)
+            if valor is not None:
+                mediciones.append((f'peso_color_{color}'[:60], valor, 'kg', fecha))
+    return mediciones
+
+class MedicionFase(models.Model):
+    """
+    Valores numéricos de los datos guardados en cada fase de un proceso, una fila por métrica,
+    para consultar entre procesos sin leer los JSON. Refleja los datos vigentes de la fase: se
+    reemplaza cada vez que se guardan.
+    """
+    FASES_CHOICES = [
+        ('PILADO', 'Pilado'),
+        ('CLASIFICACION', 'Clasificación'),
+        ('DENSIDAD_1', 'Densidad (parte 1)'),
+        ('DENSIDAD_2', 'Densimetría 2'),
+        ('COLOR', 'Color'),
+        ('EMPAQUE', 'Empaque'),
+    ]
+    
+    proceso = models.ForeignKey(Proceso, on_delete=models.CASCADE, related_name='mediciones')
+    fase = models.CharField(max_length=20, choices=FASES_CHOICES)
+    metrica = models.CharField(max_length=60)
+    valor = models.DecimalField(max_digits=14, decimal_places=4)
+    unidad = models.CharField(max_length=10, blank=True)
+    fecha_registro = models.DateTimeField(help_text="Fecha en que se guardaron los datos de la fase")
+    
+    class Meta:
+        verbose_name = "Medición de Fase"
+        verbose_name_plural = "Mediciones de Fase"
+        ordering = ['proceso', 'fase', 'metrica']
+        indexes = [
+            models.Index(fields=['fase', 'metrica', 'fecha_registro'], name='medicion_fase_metrica_idx'),
+            models.Index(fields=['proceso', 'fase'], name='medicion_proceso_fase_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.proceso_id} {self.fase} {self.metrica}={self.valor} {self.unidad}".strip()
+    
+    @classmethod
+    def registrar(cls, proceso, fase, datos):
+        """Reemplaza las mediciones de la fase del proceso por las de sus datos recién guardados"""
+        cls.objects.filter(proceso=proceso, fase=fase).delete()
+        return cls.objects.bulk_create([
+            cls(proceso=proceso, fase=fase, metrica=metrica, valor=valor, unidad=unidad,
+                fecha_registro=fecha or timezone.now())
+            for metrica, valor, unidad, fecha in extraer_mediciones_fase(fase, datos)
+        ])
+
 class TareaProceso(models.Model):
     """Modelo para registrar tareas específicas dentro de un proceso"""
     TIPOS_TAREA = [
@@ -837,3 +1667,214 @@ class TareaProceso(models.Model):
             diferencia = fin - inicio
             self.duracion_minutos = int(diferencia.total_seconds() / 60)
             self.save()
+
+class ConsumoRecursoLote(models.Model):
+    """
+    Recursos consumidos por cada lote: una fila por lote, tipo de recurso e insumo (o máquina)
+    con la cantidad usada y los minutos. Se recalcula para los lotes afectados cada vez que
+    se escribe una tarea con insumo, una descarga, un uso de maquinaria o una tarea de proceso;
+    los minutos de las tareas de proceso se reparten entre los lotes del proceso según sus quintales.
+    """
+    TIPOS_RECURSO = [
+        ('INSUMO', 'Insumo'),
+        ('MAQUINARIA', 'Maquinaria'),
+        ('MANO_OBRA', 'Mano de obra'),
+    ]
+    
+    lote = models.ForeignKey(LoteCafe, on_delete=models.CASCADE, related_name='consumos_recursos')
+    tipo_recurso = models.CharField(max_length=20, choices=TIPOS_RECURSO)
+    insumo = models.ForeignKey(Insumo, on_delete=models.CASCADE, null=True, blank=True, related_name='consumos_lotes',
+                               help_text="Insumo o máquina; vacío en mano de obra y en maquinaria registrada solo por tipo")
+    cantidad = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Cantidad del insumo usada en el lote")
+    minutos = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Minutos de uso o de trabajo atribuidos al lote")
+    registros = models.IntegerField(default=0, help_text="Registros de origen que suman en la fila")
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Consumo de Recursos por Lote"
+        verbose_name_plural = "Consumos de Recursos por Lote"
+        ordering = ['lote', 'tipo_recurso', 'insumo']
+        indexes = [
+            models.Index(fields=['lote', 'tipo_recurso'], name='consumo_recurso_lote_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Lote {self.lote_id} - {self.get_tipo_recurso_display()}: {self.cantidad} / {self.minutos} min"
+    
+    @classmethod
+    def calcular(cls, lote_ids):
+        """{(lote_id, tipo_recurso, insumo_id): [cantidad, minutos, registros]} de los lotes, desde los registros de origen"""
+        totales = defaultdict(lambda: [Decimal('0'), Decimal('0'), 0])
+        
+        def sumar(clave, cantidad, minutos, registros):
+            fila = totales[clave]
+            fila[0] += Decimal(str(cantidad or 0))
+            fila[1] += Decimal(str(minutos or 0))
+            fila[2] += registros
+        
+        tareas = TareaInsumo.objects.filter(lote_id__in=lote_ids).values('lote_id', 'insumo_id', 'insumo__tipo').annotate(
+            total_cantidad=models.Sum('cantidad'), total_minutos=models.Sum('tiempo_uso'), total=models.Count('id')
+        ).order_by()
+        for fila in tareas:
+            tipo_recurso = 'MAQUINARIA' if fila['insumo__tipo'] == 'MAQUINARIA' else 'INSUMO'
+            sumar((fila['lote_id'], tipo_recurso, fila['insumo_id']), fila['total_cantidad'], fila['total_minutos'], fila['total'])
+        
+        # Las descargas aportan el insumo usado y los minutos de trabajo de la descarga
+        descargas = RegistroDescarga.objects.filter(lote_id__in=lote_ids).values('lote_id', 'insumo_id', 'insumo__tipo').annotate(
+            total_cantidad=models.Sum('cantidad_insumo_usado'), minutos_insumo=models.Sum('tiempo_uso_insumo'),
+            minutos_descarga=models.Sum('tiempo_descarga_minutos'), total=models.Count('id')
+        ).order_by()
+        for fila in descargas:
+            if fila['insumo_id']:
+                tipo_recurso = 'MAQUINARIA' if fila['insumo__tipo'] == 'MAQUINARIA' else 'INSUMO'
+                sumar((fila['lote_id'], tipo_recurso, fila['insumo_id']), fila['total_cantidad'], fila['minutos_insumo'], fila['total'])
+            sumar((fila['lote_id'], 'MANO_OBRA', None), 0, fila['minutos_descarga'], fila['total'])
+        
+        usos = RegistroUsoMaquinaria.objects.filter(lote_id__in=lote_ids).values('lote_id', 'maquinaria_id').annotate(
+            total_minutos=models.Sum('tiempo_uso_minutos'), total=models.Count('id')
+        ).order_by()
+        for fila in usos:
+            sumar((fila['lote_id'], 'MAQUINARIA', fila['maquinaria_id']), 0, fila['total_minutos'], fila['total'])
+        
+        # Las tareas de proceso son de todo el proceso: cada lote recibe la parte de sus quintales
+        miembros = Proceso.lotes.through.objects
+        procesos = set(miembros.filter(lotecafe_id__in=lote_ids).values_list('proceso_id', flat=True))
+        minutos_proceso = {}
+        if procesos:
+            minutos_proceso = {
+                proceso_id: (minutos, total) for proceso_id, minutos, total in
+                TareaProceso.objects.filter(proceso_id__in=procesos, duracion_minutos__gt=0).values('proceso_id').annotate(
+                    total_minutos=models.Sum('duracion_minutos'), total=models.Count('id')
+                ).order_by().values_list('proceso_id', 'total_minutos', 'total')
+            }
+        if minutos_proceso:
+            quintales = defaultdict(dict)
+            for proceso_id, lote_id, total_quintales in miembros.filter(proceso_id__in=minutos_proceso).values_list(
+                    'proceso_id', 'lotecafe_id', 'lotecafe__total_quintales'):
+                quintales[proceso_id][lote_id] = Decimal(str(total_quintales or 0))
+            for proceso_id, (minutos, total) in minutos_proceso.items():
+                lotes_proceso = quintales[proceso_id]
+                suma = sum(lotes_proceso.values())
+                for lote_id, quintales_lote in lotes_proceso.items():
+                    if lote_id in lote_ids:
+                        parte = quintales_lote / suma if suma else Decimal(1) / len(lotes_proceso)
+                        sumar((lote_id, 'MANO_OBRA', None), 0, (Decimal(minutos) * parte).quantize(Decimal('0.01')), total)
+        return totales
+    
+    @classmethod
+    def recalcular(cls, lote_ids):
+        """Reemplaza las filas de los lotes indicados; las de lotes que ya no existen solo se borran"""
+        lote_ids = {lote_id for lote_id in lote_ids if lote_id is not None}
+        if not lote_ids:
+            return
+        with transaction.atomic():
+            # El bloqueo de los lotes evita que dos recálculos simultáneos dupliquen filas
+            existentes = set(LoteCafe.objects.select_for_update().filter(id__in=lote_ids).order_by('id').values_list('id', flat=True))
+            totales = cls.calcular(existentes) if existentes else {}
+            cls.objects.filter(lote_id__in=lote_ids).delete()
+            cls.objects.bulk_create([
+                cls(lote_id=lote_id, tipo_recurso=tipo_recurso, insumo_id=insumo_id,
+                    cantidad=cantidad, minutos=minutos, registros=registros)
+                for (lote_id, tipo_recurso, insumo_id), (cantidad, minutos, registros) in totales.items()
+            ])
+
+def recalcular_consumo_lotes(lote_ids):
+    """
+    Recalcula el consumo de los lotes al confirmar la transacción en curso: en una eliminación
+    en cascada el lote todavía existe cuando se borran sus registros
+    """
+    lote_ids = {lote_id for lote_id in lote_ids if lote_id is not None}
+    if lote_ids:
+        transaction.on_commit(lambda: ConsumoRecursoLote.recalcular(lote_ids))
+
+@receiver(pre_save, sender=TareaInsumo)
+@receiver(pre_save, sender=RegistroDescarga)
+@receiver(pre_save, sender=RegistroUsoMaquinaria)
+def recordar_lote_consumo(sender, instance, raw=False, **kwargs):
+    # Si el registro cambia de lote también hay que recalcular el anterior
+    if raw or instance.pk is None:
+        return
+    instance._lote_consumo_anterior = sender.objects.filter(pk=instance.pk).values_list('lote_id', flat=True).first()
+
+@receiver(post_save, sender=TareaInsumo)
+@receiver(post_delete, sender=TareaInsumo)
+@receiver(post_save, sender=RegistroDescarga)
+@receiver(post_delete, sender=RegistroDescarga)
+@receiver(post_save, sender=RegistroUsoMaquinaria)
+@receiver(post_delete, sender=RegistroUsoMaquinaria)
+def actualizar_consumo_por_registro(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    recalcular_consumo_lotes({instance.lote_id, getattr(instance, '_lote_consumo_anterior', None)})
+
+@receiver(post_save, sender=TareaProceso)
+@receiver(pre_delete, sender=TareaProceso)
+def actualizar_consumo_por_tarea_proceso(sender, instance, raw=False, **kwargs):
+    # Antes de eliminar: en la cascada de un proceso sus lotes dejan de estar asociados
+    if raw:
+        return
+    recalcular_consumo_lotes(Proceso.lotes.through.objects.filter(proceso_id=instance.proceso_id).values_list('lotecafe_id', flat=True))
+
+@receiver(m2m_changed, sender=Proceso.lotes.through)
+def actualizar_consumo_por_lotes_proceso(sender, instance, action, reverse, pk_set, **kwargs):
+    # Al cambiar los lotes de un proceso cambia la parte de cada lote en los minutos del proceso
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        procesos = pk_set if pk_set is not None else sender.objects.filter(lotecafe_id=instance.pk).values_list('proceso_id', flat=True)
+        lotes = set(sender.objects.filter(proceso_id__in=procesos).values_list('lotecafe_id', flat=True)) | {instance.pk}
+    else:
+        lotes = set(sender.objects.filter(proceso_id=instance.pk).values_list('lotecafe_id', flat=True)) | set(pk_set or ())
+    recalcular_consumo_lotes(lotes)
+
+class TrabajoAsincrono(models.Model):
+    """Trabajo pesado ejecutado fuera de la petición por el comando procesar_trabajos"""
+    ESTADOS_CHOICES = [
+        ('PENDIENTE', 'Pendiente'),
+        ('EN_EJECUCION', 'En ejecución'),
+        ('COMPLETADO', 'Completado'),
+        ('FALLIDO', 'Fallido'),
+    ]
+    
+    tipo = models.CharField(max_length=50, help_text="Tipo de trabajo registrado en users.trabajos.MANEJADORES")
+    estado = models.CharField(max_length=20, choices=ESTADOS_CHOICES, default='PENDIENTE')
+    parametros = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    progreso = models.PositiveSmallIntegerField(default=0, help_text="Porcentaje de avance (0-100)")
+    mensaje = models.CharField(max_length=255, blank=True, help_text="Descripción del paso actual")
+    resultado = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    archivo_resultado = models.CharField(max_length=255, blank=True, help_text="Ruta del archivo generado, relativa a TRABAJOS_DIR")
+    error = models.TextField(blank=True)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='trabajos')
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_finalizacion = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = "Trabajo Asíncrono"
+        verbose_name_plural = "Trabajos Asíncronos"
+        ordering = ['-fecha_creacion']
+        indexes = [
+            models.Index(fields=['estado', 'fecha_creacion'], name='trabajo_estado_fecha_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.tipo} #{self.id} - {self.get_estado_display()}"
+    
+    @property
+    def terminado(self):
+        return self.estado in ['COMPLETADO', 'FALLIDO']
+    
+    @property
+    def ruta_archivo(self):
+        """Ruta absoluta del archivo generado (None si el trabajo no generó archivo)"""
+        from django.conf import settings
+        if not self.archivo_resultado:
+            return None
+        return settings.TRABAJOS_DIR / self.archivo_resultado
+    
+    def actualizar_progreso(self, progreso, mensaje=''):
+        """Guarda el avance sin reescribir el resto de la fila"""
+        self.progreso = max(0, min(100, int(progreso)))
+        self.mensaje = mensaje[:255]
+        TrabajoAsincrono.objects.filter(pk=self.pk).update(progreso=self.progreso, mensaje=self.mensaje)
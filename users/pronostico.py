@@ -0,0 +1,136 @@
+"""
+Pronóstico de consumo y puntos de reorden de los insumos.
+
+El consumo de los últimos DIAS_HISTORIAL días sale de tres fuentes, leídas en una sola
+consulta (UNION ALL): las salidas del libro de movimientos, y las tareas y descargas que
+usaron insumo sin generar movimiento (registradas antes del libro o de tipos que no
+descuentan stock). Con numpy se arma una matriz insumo × día y se calculan medias móviles
+de 7 y 30 días sobre sumas acumuladas. El resultado se guarda en una caché LRU que se
+invalida con cada movimiento de inventario.
+"""
+import math
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import cache_inventario
+from .models import Insumo, MovimientoInventario, RegistroDescarga, TareaInsumo
+
+DIAS_HISTORIAL = 90
+VENTANA_CORTA = 7
+VENTANA_LARGA = 30
+# Nivel de servicio de ~95% para el stock de seguridad
+FACTOR_SEGURIDAD = 1.65
+
+def _consumos(desde):
+    """(insumo_id, fecha, cantidad) de cada consumo desde `desde`, en una sola consulta"""
+    # Sin order_by: el orden por defecto de los modelos no se admite dentro de un UNION
+    salidas = MovimientoInventario.objects.filter(tipo='SALIDA', fecha__gte=desde).annotate(
+        consumo=-F('cantidad')
+    ).values_list('insumo_id', 'fecha', 'consumo').order_by()
+    tareas = TareaInsumo.objects.filter(
+        cantidad__gt=0, fecha_creacion__gte=desde, movimientos__isnull=True
+    ).values_list('insumo_id', 'fecha_creacion', 'cantidad').order_by()
+    descargas = RegistroDescarga.objects.filter(
+        insumo__isnull=False, cantidad_insumo_usado__gt=0, fecha_registro__gte=desde, movimientos_inventario__isnull=True
+    ).values_list('insumo_id', 'fecha_registro', 'cantidad_insumo_usado').order_by()
+    return list(salidas.union(tareas, descargas, all=True))
+
+def _medias_moviles(diario, ventana):
+    """Media de cada ventana de `ventana` días terminada en cada día (columnas), por insumo (filas)"""
+    acumulado = np.cumsum(np.pad(diario, ((0, 0), (1, 0))), axis=1)
+    return (acumulado[:, ventana:] - acumulado[:, :-ventana]) / ventana
+
+def _matriz_diaria(consumos, posiciones, hoy):
+    """Consumo por insumo (filas) y día (columnas, el último es hoy)"""
+    diario = np.zeros((len(posiciones), DIAS_HISTORIAL), dtype=np.float64)
+    if not consumos:
+        return diario
+    filas, columnas, cantidades = [], [], []
+    for insumo_id, fecha, cantidad in consumos:
+        if insumo_id not in posiciones:
+            continue
+        columna = DIAS_HISTORIAL - 1 - (hoy - timezone.localtime(fecha).date()).days
+        if 0 <= columna < DIAS_HISTORIAL:
+            filas.append(posiciones[insumo_id])
+            columnas.append(columna)
+            cantidades.append(float(cantidad))
+    np.add.at(diario, (np.array(filas, dtype=np.intp), np.array(columnas, dtype=np.intp)), cantidades)
+    return diario
+
+def calcular_pronostico(plazo_entrega, tipo=None):
+    """
+    Tasa de consumo, días de cobertura, punto de reorden y fecha sugerida de reorden de
+    cada insumo activo, ordenados por la fecha de reorden (los más urgentes primero).
+    """
+    hoy = timezone.localdate()
+    insumos = Insumo.objects.filter(activo=True)
+    if tipo:
+        insumos = insumos.filter(tipo=tipo)
+    insumos = list(insumos.values_list('id', 'nombre', 'codigo', 'unidad_medida', 'cantidad_disponible', 'cantidad_minima').order_by('id'))
+    if not insumos:
+        return []
+
+    posiciones = {insumo[0]: posicion for posicion, insumo in enumerate(insumos)}
+    desde = timezone.make_aware(datetime.combine(hoy - timedelta(days=DIAS_HISTORIAL - 1), time.min))
+    diario = _matriz_diaria(_consumos(desde), posiciones, hoy)
+
+    medias_cortas = _medias_moviles(diario, VENTANA_CORTA)
+    medias_largas = _medias_moviles(diario, VENTANA_LARGA)
+    tasa_corta = medias_cortas[:, -1]
+    tasa_larga = medias_largas[:, -1]
+    # Conservadora: si el consumo se aceleró en la última semana manda la semana
+    tasa = np.maximum(tasa_corta, tasa_larga)
+    desviacion = diario[:, -VENTANA_LARGA:].std(axis=1)
+    pico_semanal = medias_cortas.max(axis=1)
+
+    disponible = np.array([float(insumo[4]) for insumo in insumos])
+    minima = np.array([float(insumo[5]) for insumo in insumos])
+    punto_reorden = np.maximum(minima, tasa * plazo_entrega + FACTOR_SEGURIDAD * desviacion * math.sqrt(plazo_entrega))
+    con_consumo = tasa > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dias_cobertura = np.where(con_consumo, disponible / tasa, np.inf)
+        dias_para_reorden = np.where(con_consumo, (disponible - punto_reorden) / tasa, np.inf)
+    # Sin consumo solo hay que reponer si ya se está bajo el mínimo
+    dias_para_reorden = np.where(disponible <= punto_reorden, 0, np.maximum(dias_para_reorden, 0))
+
+    resultado = []
+    for posicion, (id_, nombre, codigo, unidad_medida, _, _) in enumerate(insumos):
+        cobertura = dias_cobertura[posicion]
+        reorden = dias_para_reorden[posicion]
+        resultado.append({
+            'insumo_id': id_,
+            'nombre': nombre,
+            'codigo': codigo,
+            'unidad_medida': unidad_medida,
+            'cantidad_disponible': float(disponible[posicion]),
+            'cantidad_minima': float(minima[posicion]),
+            'consumo_diario': round(float(tasa[posicion]), 4),
+            'consumo_diario_7_dias': round(float(tasa_corta[posicion]), 4),
+            'consumo_diario_30_dias': round(float(tasa_larga[posicion]), 4),
+            'pico_consumo_semanal': round(float(pico_semanal[posicion]), 4),
+            'consumo_total_periodo': round(float(diario[posicion].sum()), 2),
+            'dias_cobertura': round(float(cobertura), 1) if math.isfinite(cobertura) else None,
+            'fecha_agotamiento': (hoy + timedelta(days=int(cobertura))).isoformat() if math.isfinite(cobertura) else None,
+            'punto_reorden': round(float(punto_reorden[posicion]), 2),
+            'fecha_reorden': (hoy + timedelta(days=int(reorden))).isoformat() if math.isfinite(reorden) else None,
+            'reponer_ahora': bool(reorden == 0),
+        })
+    resultado.sort(key=lambda fila: (fila['fecha_reorden'] is None, fila['fecha_reorden'] or '', fila['nombre']))
+    return resultado
+
+def pronostico_inventario(plazo_entrega=None, tipo=None):
+    """Pronóstico de los insumos activos, desde la caché mientras no haya movimientos nuevos"""
+    plazo_entrega = plazo_entrega or settings.INVENTARIO_PLAZO_ENTREGA_DIAS
+    clave = ('pronostico', plazo_entrega, tipo, timezone.localdate())
+    en_cache, pronostico = cache_inventario.obtener(clave)
+    if en_cache:
+        return pronostico
+
+    generacion = cache_inventario.generacion()
+    pronostico = calcular_pronostico(plazo_entrega, tipo)
+    cache_inventario.guardar(clave, pronostico, generacion)
+    return pronostico
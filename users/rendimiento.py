@@ -0,0 +1,126 @@
+"""
+Rendimiento de las descargas (kg por minuto) por empleado, lote, insumo y hora del día.
+
+Las descargas del rango se traen en una sola consulta proyectada con la hora del día
+calculada por la base de datos. Con numpy se agrupan por cada dimensión: los totales son
+sumas por grupo (bincount) y los percentiles del rendimiento de cada descarga se calculan
+para todos los grupos a la vez sobre los valores ordenados por grupo. Los resultados se
+guardan por rango y filtros en una caché LRU que se invalida al cambiar una descarga.
+"""
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.db.models import FloatField
+from django.db.models.functions import Cast, Coalesce, ExtractHour
+from django.utils import timezone
+
+from .cache import cache_descargas
+from .models import RegistroDescarga
+
+PERCENTILES = (10, 25, 50, 75, 90)
+# Dimensión -> (columna del id, columna de la etiqueta)
+DIMENSIONES = {
+    'empleado': ('empleado_id', 'empleado__username'),
+    'lote': ('lote_id', 'lote__numero_lote'),
+    'insumo': ('insumo_id', 'insumo__nombre'),
+    'hora': ('hora', None),
+}
+
+def _consultar(desde, hasta, filtros):
+    """Una fila por descarga con duración conocida: ids y etiquetas de cada dimensión, kg y minutos"""
+    descargas = RegistroDescarga.objects.filter(
+        fecha_registro__gte=timezone.make_aware(datetime.combine(desde, time.min)),
+        fecha_registro__lt=timezone.make_aware(datetime.combine(hasta + timedelta(days=1), time.min)),
+        tiempo_descarga_minutos__gt=0,
+        **filtros
+    )
+    columnas = ['empleado_id', 'empleado__username', 'lote_id', 'lote__numero_lote', 'insumo_id', 'insumo__nombre', 'hora', 'kg', 'tiempo_descarga_minutos']
+    return list(descargas.annotate(
+        hora=ExtractHour(Coalesce('hora_inicio', 'fecha_registro')),
+        kg=Cast('peso_descargado', FloatField()),
+    ).order_by().values_list(*columnas)), columnas
+
+def _percentiles_por_grupo(grupo, valores, total_grupos):
+    """Percentiles (interpolación lineal, como numpy.percentile) de `valores` en cada grupo"""
+    orden = np.lexsort((valores, grupo))
+    ordenados = valores[orden]
+    cantidad = np.bincount(grupo, minlength=total_grupos)
+    inicio = np.concatenate([[0], np.cumsum(cantidad)[:-1]])
+    resultado = {}
+    for percentil in PERCENTILES:
+        posicion = inicio + (cantidad - 1) * percentil / 100
+        bajo = np.floor(posicion).astype(np.int64)
+        alto = np.ceil(posicion).astype(np.int64)
+        resultado[percentil] = ordenados[bajo] + (ordenados[alto] - ordenados[bajo]) * (posicion - bajo)
+    return resultado
+
+def _agrupar(ids, etiquetas, kg, minutos, rendimiento):
+    """Totales y percentiles por cada valor distinto de `ids` (None agrupa lo no informado)"""
+    claves = np.array([-1 if id_ is None else id_ for id_ in ids], dtype=np.int64)
+    unicos, grupo = np.unique(claves, return_inverse=True)
+    grupo = grupo.ravel()
+    total_grupos = len(unicos)
+    kg_total = np.bincount(grupo, weights=kg, minlength=total_grupos)
+    minutos_total = np.bincount(grupo, weights=minutos, minlength=total_grupos)
+    descargas = np.bincount(grupo, minlength=total_grupos)
+    percentiles = _percentiles_por_grupo(grupo, rendimiento, total_grupos)
+
+    nombres = {}
+    if etiquetas is not None:
+        for id_, etiqueta in zip(ids, etiquetas):
+            nombres.setdefault(id_, etiqueta)
+
+    filas = []
+    for indice, clave in enumerate(unicos.tolist()):
+        id_ = None if clave == -1 else clave
+        filas.append({
+            'id': id_,
+            'nombre': nombres.get(id_) if etiquetas is not None else id_,
+            'descargas': int(descargas[indice]),
+            'kg_total': round(float(kg_total[indice]), 2),
+            'minutos_total': int(minutos_total[indice]),
+            'kg_por_minuto': round(float(kg_total[indice] / minutos_total[indice]), 3),
+            'percentiles_kg_por_minuto': {f'p{p}': round(float(percentiles[p][indice]), 3) for p in PERCENTILES},
+        })
+    return filas
+
+def calcular_rendimiento(desde, hasta, filtros=None):
+    """Rendimiento global y por dimensión de las descargas entre los días `desde` y `hasta` (incluidos)"""
+    filas, columnas = _consultar(desde, hasta, filtros or {})
+    resultado = {'descargas': len(filas), 'kg_total': 0.0, 'minutos_total': 0, 'kg_por_minuto': None,
+                 'percentiles_kg_por_minuto': {}, **{dimension: [] for dimension in DIMENSIONES}}
+    if not filas:
+        return resultado
+
+    datos = dict(zip(columnas, zip(*filas)))
+    kg = np.array(datos['kg'], dtype=np.float64)
+    minutos = np.array(datos['tiempo_descarga_minutos'], dtype=np.float64)
+    rendimiento = kg / minutos
+
+    resultado.update({
+        'kg_total': round(float(kg.sum()), 2),
+        'minutos_total': int(minutos.sum()),
+        'kg_por_minuto': round(float(kg.sum() / minutos.sum()), 3),
+        'percentiles_kg_por_minuto': {
+            f'p{p}': round(float(valor), 3) for p, valor in zip(PERCENTILES, np.percentile(rendimiento, PERCENTILES))
+        },
+    })
+    for dimension, (columna_id, columna_etiqueta) in DIMENSIONES.items():
+        filas_dimension = _agrupar(
+            datos[columna_id], datos[columna_etiqueta] if columna_etiqueta else None, kg, minutos, rendimiento
+        )
+        resultado[dimension] = sorted(filas_dimension, key=lambda fila: -fila['kg_por_minuto']) if dimension != 'hora' else filas_dimension
+    return resultado
+
+def rendimiento_descargas(desde, hasta, filtros=None):
+    """Rendimiento de las descargas, desde la caché si no cambió ninguna descarga"""
+    filtros = filtros or {}
+    clave = (desde, hasta, tuple(sorted(filtros.items())))
+    en_cache, resultado = cache_descargas.obtener(clave)
+    if en_cache:
+        return resultado
+
+    generacion = cache_descargas.generacion()
+    resultado = calcular_rendimiento(desde, hasta, filtros)
+    cache_descargas.guardar(clave, resultado, generacion)
+    return resultado
@@ -0,0 +1,321 @@
+"""
+Reportes de lote: construcción de los datos y renderizado a PDF.
+
+Los PDF se generan fuera de la petición (trabajo GENERAR_REPORTE_PDF) y se guardan en
+REPORTES_DIR con la versión de contenido del lote en el nombre, de modo que volver a
+descargar un reporte sin cambios solo lee el archivo.
+"""
+import hashlib
+import os
+import tempfile
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import CAMPOS_HEREDADOS_MAESTRO, EstadoAnalisisPropietario, LoteCafe, PropietarioCafe
+from .serializers import LoteCafeSerializer, PropietarioCafeSerializer
+
+# Presentación de cada estado materializado en el reporte de separación: (grupo, estado_muestra, acción, observaciones)
+DETALLE_ESTADO_REPORTE = {
+    'SIN_MUESTRA': ('sin_analizar', 'PENDIENTE', 'PENDIENTE_ANALISIS', None),
+    'PENDIENTE': ('sin_analizar', 'PENDIENTE', 'PENDIENTE_ANALISIS', None),
+    'APROBADA': ('aprobados', 'APROBADA', 'CONSERVAR', 'Aprobado en análisis inicial'),
+    'APROBADA_SEGUNDO': ('aprobados', 'APROBADA_SEGUNDO', 'CONSERVAR', 'Contaminación inicial, pero aprobado en segundo muestreo'),
+    'CONTAMINADA_CONFIRMADA': ('contaminados', 'CONTAMINADA_CONFIRMADA', 'SEPARAR', 'Contaminación confirmada en segundo muestreo'),
+    'SEGUNDO_PENDIENTE': ('sin_analizar', 'SEGUNDO_PENDIENTE', 'PENDIENTE_SEGUNDO_ANALISIS', None),
+    'CONTAMINADA': ('contaminados', 'CONTAMINADA', 'SEPARAR', 'Contaminación detectada (requiere confirmación)'),
+}
+
+# Reportes disponibles en PDF: tipo -> (función que construye los datos, función que renderiza)
+REPORTES_PDF = {
+    'separacion': ('users.reportes.construir_reporte_separacion', 'users.reportes.renderizar_reporte_separacion'),
+    'recepcion_final': ('users.reportes.construir_reporte_recepcion_final', 'users.reportes.renderizar_reporte_recepcion_final'),
+}
+
+def construir_reporte_separacion(lote):
+    """Datos del reporte de separación de quintales a partir de los estados materializados"""
+    propietarios = {'aprobados': [], 'contaminados': [], 'sin_analizar': []}
+    quintales = {'aprobados': 0, 'contaminados': 0, 'sin_analizar': 0}
+    total_propietarios = 0
+
+    for estado, estados_analisis in EstadoAnalisisPropietario.agrupar_por_estado(lote).items():
+        grupo, estado_muestra, accion, observaciones = DETALLE_ESTADO_REPORTE[estado]
+        for estado_analisis in estados_analisis:
+            item = {
+                'propietario': PropietarioCafeSerializer(estado_analisis.propietario).data,
+                'estado_muestra': estado_muestra,
+                'accion': accion
+            }
+            if observaciones:
+                item['observaciones'] = observaciones
+            propietarios[grupo].append(item)
+            quintales[grupo] += estado_analisis.quintales
+            total_propietarios += 1
+
+    propietarios_aprobados = propietarios['aprobados']
+    propietarios_contaminados = propietarios['contaminados']
+    propietarios_sin_analizar = propietarios['sin_analizar']
+
+    # Determinar recomendación del lote
+    if len(propietarios_contaminados) == 0 and len(propietarios_sin_analizar) == 0:
+        recomendacion_lote = "APROBAR_COMPLETO"
+        mensaje_recomendacion = "Todo el lote puede ser aprobado"
+    elif len(propietarios_contaminados) > 0 and len(propietarios_aprobados) > 0:
+        recomendacion_lote = "SEPARACION_PARCIAL"
+        mensaje_recomendacion = "Separar quintales contaminados, conservar el resto"
+    elif len(propietarios_contaminados) == total_propietarios:
+        recomendacion_lote = "RECHAZAR_COMPLETO"
+        mensaje_recomendacion = "Todo el lote debe ser rechazado"
+    else:
+        recomendacion_lote = "ANALISIS_PENDIENTE"
+        mensaje_recomendacion = "Completar análisis antes de tomar decisión final"
+
+    return {
+        'lote': LoteCafeSerializer(lote).data,
+        'propietarios_aprobados': propietarios_aprobados,
+        'propietarios_contaminados': propietarios_contaminados,
+        'propietarios_sin_analizar': propietarios_sin_analizar,
+        'totales': {
+            'quintales_aprobados': quintales['aprobados'],
+            'quintales_contaminados': quintales['contaminados'],
+            'quintales_pendientes': quintales['sin_analizar'],
+            'total_lote': lote.total_quintales
+        },
+        'recomendacion': {
+            'tipo': recomendacion_lote,
+            'mensaje': mensaje_recomendacion
+        },
+        'fecha_reporte': timezone.now().isoformat()
+    }
+
+def construir_reporte_recepcion_final(lote):
+    """Datos del reporte de recepción final: pesos, limpieza, separación por colores y propietarios"""
+    estados = EstadoAnalisisPropietario.objects.filter(lote=lote).select_related('propietario__propietario_maestro').order_by('propietario_id')
+    return {
+        'lote': {
+            'numero_lote': lote.numero_lote,
+            'organizacion': lote.organizacion.nombre,
+            'fecha_entrega': lote.fecha_entrega,
+            'total_quintales': lote.total_quintales,
+            'estado': lote.get_estado_display(),
+        },
+        'pesos': {
+            'peso_total_inicial': lote.peso_total_inicial,
+            'peso_total_final': lote.peso_total_final,
+            'diferencia_peso': lote.diferencia_peso,
+            'porcentaje_perdida': round(lote.porcentaje_perdida, 2) if lote.porcentaje_perdida is not None else None,
+        },
+        'limpieza': {
+            'fecha': lote.fecha_limpieza,
+            'responsable': lote.responsable_limpieza,
+            'tipo': lote.tipo_limpieza,
+            'peso_impurezas': lote.peso_impurezas,
+            'impurezas_encontradas': lote.impurezas_encontradas,
+            'duracion_minutos': lote.duracion_limpieza,
+        },
+        'separacion': {
+            'fecha': lote.fecha_separacion,
+            'responsable': lote.responsable_separacion,
+            'calidad_general': lote.calidad_general,
+            'duracion_minutos': lote.duracion_separacion,
+            'clasificacion_colores': lote.clasificacion_colores or {},
+        },
+        'recepcion': {
+            'fecha': lote.fecha_recepcion_final,
+            'responsable': lote.responsable_recepcion_final,
+            'calificacion_final': lote.calificacion_final,
+            'observaciones_finales': lote.observaciones_finales,
+        },
+        'propietarios': [
+            {
+                'nombre': e.propietario.nombre_completo,
+                'cedula': e.propietario.cedula,
+                'quintales': e.quintales,
+                'estado_analisis': e.get_estado_display(),
+            } for e in estados
+        ],
+        'fecha_reporte': timezone.now().isoformat()
+    }
+
+def version_contenido(lote):
+    """
+    Versión del contenido de los reportes del lote: cambia con cualquier escritura del lote
+    (versión optimista), de los estados de análisis de sus propietarios o de los datos
+    impresos de la organización, las entregas y sus propietarios maestros. Estos últimos no
+    tienen fecha de modificación (y bulk_update/update() no la mantendrían), así que se
+    incluyen sus valores, leídos en una sola consulta.
+    """
+    estados = EstadoAnalisisPropietario.objects.filter(lote=lote).aggregate(
+        ultima=Max('fecha_actualizacion'), total=Count('id')
+    )
+    ultima = estados['ultima'].isoformat() if estados['ultima'] else ''
+    contenido = hashlib.sha1(f"{lote.version}|{ultima}|{estados['total']}".encode())
+    contenido.update(lote.organizacion.nombre.encode())
+    for entrega in PropietarioCafe.objects.filter(lote=lote).order_by('id').values_list(*CAMPOS_ENTREGA_REPORTE):
+        contenido.update(repr(entrega).encode())
+    return contenido.hexdigest()[:12]
+
+# Datos de las entregas (propios y heredados del maestro) que se imprimen en los reportes
+CAMPOS_ENTREGA_REPORTE = ['id', 'cedula', 'quintales_entregados', 'direccion'] + [
+    f'{campo}_propio' for campo in CAMPOS_HEREDADOS_MAESTRO
+] + [f'propietario_maestro__{campo}' for campo in CAMPOS_HEREDADOS_MAESTRO]
+
+def ruta_reporte(tipo_reporte, lote_id, version):
+    return settings.REPORTES_DIR / f"{tipo_reporte}_lote{lote_id}_{version}.pdf"
+
+def generar_pdf(tipo_reporte, lote):
+    """Genera el PDF de la versión actual del lote si no existe y elimina las versiones anteriores"""
+    from django.utils.module_loading import import_string
+
+    version = version_contenido(lote)
+    ruta = ruta_reporte(tipo_reporte, lote.id, version)
+    if ruta.exists():
+        return ruta, version
+
+    os.makedirs(settings.REPORTES_DIR, exist_ok=True)
+    construir, renderizar = (import_string(nombre) for nombre in REPORTES_PDF[tipo_reporte])
+    # Un temporal propio por trabajo: dos trabajos del mismo reporte no escriben el mismo archivo
+    with tempfile.NamedTemporaryFile(dir=settings.REPORTES_DIR, suffix='.tmp', delete=False) as archivo:
+        temporal = archivo.name
+    try:
+        renderizar(construir(lote), temporal)
+        os.replace(temporal, ruta)
+    except BaseException:
+        os.unlink(temporal)
+        raise
+
+    for anterior in settings.REPORTES_DIR.glob(f"{tipo_reporte}_lote{lote.id}_*.pdf"):
+        if anterior != ruta:
+            anterior.unlink(missing_ok=True)
+    return ruta, version
+
+# Renderizado PDF
+
+def _formato(valor, sufijo=''):
+    if valor is None or valor == '':
+        return '-'
+    if hasattr(valor, 'strftime'):
+        return timezone.localtime(valor).strftime('%Y-%m-%d %H:%M') if timezone.is_aware(valor) else valor.strftime('%Y-%m-%d %H:%M')
+    return f"{valor}{sufijo}"
+
+def _documento(ruta, titulo, lote_numero, secciones):
+    """Escribe un PDF con un título y una lista de secciones (subtítulo, filas de tabla)"""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import cm
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+
+    estilos = getSampleStyleSheet()
+    documento = SimpleDocTemplate(str(ruta), pagesize=A4, title=titulo,
+                                  leftMargin=1.5 * cm, rightMargin=1.5 * cm, topMargin=1.5 * cm, bottomMargin=1.5 * cm)
+    elementos = [
+        Paragraph(escape(titulo), estilos['Title']),
+        Paragraph(f"Lote {escape(lote_numero)} - Generado el {timezone.localtime():%Y-%m-%d %H:%M}", estilos['Normal']),
+        Spacer(1, 0.5 * cm),
+    ]
+    for subtitulo, filas, encabezado in secciones:
+        elementos.append(Paragraph(escape(subtitulo), estilos['Heading2']))
+        if not filas:
+            elementos.append(Paragraph('Sin registros', estilos['Italic']))
+            continue
+        celdas = [[Paragraph(escape(str(celda)), estilos['BodyText']) for celda in fila] for fila in filas]
+        tabla = Table(celdas, repeatRows=1 if encabezado else 0, hAlign='LEFT')
+        estilo = [
+            ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ]
+        if encabezado:
+            estilo.append(('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e8e2d6')))
+        tabla.setStyle(TableStyle(estilo))
+        elementos.extend([tabla, Spacer(1, 0.4 * cm)])
+    documento.build(elementos)
+
+def renderizar_reporte_separacion(datos, ruta):
+    lote = datos['lote']
+    totales = datos['totales']
+
+    def filas_propietarios(items):
+        if not items:
+            return []
+        filas = [['Propietario', 'Cédula', 'Quintales', 'Estado', 'Acción']]
+        for item in items:
+            propietario = item['propietario']
+            filas.append([propietario['nombre_completo'], propietario['cedula'], propietario['quintales_entregados'],
+                          item['estado_muestra'], item['accion']])
+        return filas
+
+    _documento(ruta, 'Reporte de Separación de Quintales', lote['numero_lote'], [
+        ('Resumen', [
+            ['Organización', lote.get('organizacion_nombre', '')],
+            ['Estado del lote', lote['estado']],
+            ['Total del lote', _formato(totales['total_lote'], ' qq')],
+            ['Quintales aprobados', _formato(totales['quintales_aprobados'], ' qq')],
+            ['Quintales contaminados', _formato(totales['quintales_contaminados'], ' qq')],
+            ['Quintales pendientes', _formato(totales['quintales_pendientes'], ' qq')],
+            ['Recomendación', datos['recomendacion']['mensaje']],
+        ], False),
+        ('Propietarios aprobados (conservar)', filas_propietarios(datos['propietarios_aprobados']), True),
+        ('Propietarios contaminados (separar)', filas_propietarios(datos['propietarios_contaminados']), True),
+        ('Propietarios pendientes de análisis', filas_propietarios(datos['propietarios_sin_analizar']), True),
+    ])
+
+def renderizar_reporte_recepcion_final(datos, ruta):
+    lote = datos['lote']
+    pesos = datos['pesos']
+    limpieza = datos['limpieza']
+    separacion = datos['separacion']
+    recepcion = datos['recepcion']
+
+    colores = [['Color', 'Detalle']] + [
+        [color, ', '.join(f"{clave}: {valor}" for clave, valor in detalle.items()) if isinstance(detalle, dict) else detalle]
+        for color, detalle in separacion['clasificacion_colores'].items()
+    ] if separacion['clasificacion_colores'] else []
+    propietarios = [['Propietario', 'Cédula', 'Quintales', 'Análisis']] + [
+        [p['nombre'], p['cedula'], p['quintales'], p['estado_analisis']] for p in datos['propietarios']
+    ] if datos['propietarios'] else []
+
+    _documento(ruta, 'Reporte de Recepción Final', lote['numero_lote'], [
+        ('Lote', [
+            ['Organización', lote['organizacion']],
+            ['Fecha de entrega', _formato(lote['fecha_entrega'])],
+            ['Total de quintales', _formato(lote['total_quintales'], ' qq')],
+            ['Estado', lote['estado']],
+            ['Peso inicial', _formato(pesos['peso_total_inicial'], ' kg')],
+            ['Peso final', _formato(pesos['peso_total_final'], ' kg')],
+            ['Diferencia de peso', _formato(pesos['diferencia_peso'], ' kg')],
+            ['Pérdida', _formato(pesos['porcentaje_perdida'], ' %')],
+        ], False),
+        ('Limpieza', [
+            ['Fecha', _formato(limpieza['fecha'])],
+            ['Responsable', _formato(limpieza['responsable'])],
+            ['Tipo de limpieza', _formato(limpieza['tipo'])],
+            ['Impurezas removidas', _formato(limpieza['peso_impurezas'], ' kg')],
+            ['Impurezas encontradas', _formato(limpieza['impurezas_encontradas'])],
+            ['Duración', _formato(limpieza['duracion_minutos'], ' min')],
+        ], False),
+        ('Separación por colores', [
+            ['Fecha', _formato(separacion['fecha'])],
+            ['Responsable', _formato(separacion['responsable'])],
+            ['Calidad general', _formato(separacion['calidad_general'])],
+            ['Duración', _formato(separacion['duracion_minutos'], ' min')],
+        ], False),
+        ('Clasificación por colores', colores, True),
+        ('Recepción final', [
+            ['Fecha', _formato(recepcion['fecha'])],
+            ['Responsable', _formato(recepcion['responsable'])],
+            ['Calificación final', _formato(recepcion['calificacion_final'])],
+            ['Observaciones', _formato(recepcion['observaciones_finales'])],
+        ], False),
+        ('Propietarios', propietarios, True),
+    ])
+
+# Manejador del trabajo GENERAR_REPORTE_PDF
+
+def generar_reporte_pdf(trabajo):
+    lote = LoteCafe.objects.select_related('organizacion').get(id=trabajo.parametros['lote_id'])
+    trabajo.actualizar_progreso(10, 'Generando PDF')
+    ruta, version = generar_pdf(trabajo.parametros['reporte'], lote)
+    return {'lote_id': lote.id, 'reporte': trabajo.parametros['reporte'], 'version': version, 'archivo': ruta.name}
@@ -1,8 +1,16 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
+from django.db import transaction
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
+from .cache import cache_calidad, cache_propietarios, propietarios_por_id
 from .models import (Organizacion, LoteCafe, PropietarioCafe, MuestraCafe, ProcesoAnalisis, 
-                    RegistroBitacora, UserProfile, RegistroDescarga, Insumo, RegistroUsoMaquinaria, PropietarioMaestro, TareaInsumo, Proceso, TareaProceso)
+                    RegistroBitacora, UserProfile, RegistroDescarga, Insumo, RegistroUsoMaquinaria, PropietarioMaestro, TareaInsumo, Proceso, TareaProceso, LoteEvento,
+                    TrabajoAsincrono, EstadoAnalisisPropietario, CAMPOS_HEREDADOS_MAESTRO, normalizar_texto,
+                    MovimientoInventario)
 
 class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
@@ -106,8 +114,7 @@ class OrganizacionSerializer(serializers.ModelSerializer):
 
 class PropietarioMaestroSerializer(serializers.ModelSerializer):
     direccion_completa = serializers.ReadOnlyField()
-    total_entregas = serializers.ReadOnlyField()
-    total_quintales_historicos = serializers.ReadOnlyField()
+    total_quintales_historicos = serializers.FloatField(read_only=True)
     
     class Meta:
         model = PropietarioMaestro
@@ -117,9 +124,19 @@ class PropietarioCafeSerializer(serializers.ModelSerializer):
     direccion_completa = serializers.ReadOnlyField()
     propietario_maestro_nombre = serializers.CharField(source='propietario_maestro.nombre_completo', read_only=True)
     
+    # Datos de la entrega resueltos con los del propietario maestro (ver CAMPOS_HEREDADOS_MAESTRO)
+    nombre_completo = serializers.CharField(read_only=True)
+    telefono = serializers.CharField(read_only=True)
+    departamento = serializers.CharField(read_only=True)
+    municipio = serializers.CharField(read_only=True)
+    comunidad = serializers.CharField(read_only=True)
+    calle = serializers.CharField(read_only=True)
+    numero_casa = serializers.CharField(read_only=True)
+    referencias = serializers.CharField(read_only=True)
+    
     class Meta:
         model = PropietarioCafe
-        fields = '__all__'
+        exclude = [f'{campo}_propio' for campo in CAMPOS_HEREDADOS_MAESTRO]
 
 class MuestraCafeSerializer(serializers.ModelSerializer):
     propietario_nombre = serializers.CharField(source='propietario.nombre_completo', read_only=True)
@@ -146,6 +163,8 @@ class LoteCafeSerializer(serializers.ModelSerializer):
     class Meta:
         model = LoteCafe
         fields = '__all__'
+        # El estado solo cambia con las transiciones de cada etapa (LoteCafe.transicionar)
+        read_only_fields = ['version', 'estado']
     
     def get_total_muestras(self, obj):
         return obj.muestras.count()
@@ -183,6 +202,31 @@ class LoteCafeSerializer(serializers.ModelSerializer):
         
         return value
 
+class LoteResumenSerializer(serializers.ModelSerializer):
+    """Datos básicos de un lote para anidar en otros recursos, sin propietarios ni muestras"""
+    organizacion_nombre = serializers.CharField(source='organizacion.nombre', read_only=True)
+    estado_display = serializers.CharField(source='get_estado_display', read_only=True)
+    total_muestras = serializers.SerializerMethodField()
+    muestras_aprobadas = serializers.SerializerMethodField()
+    muestras_contaminadas = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = LoteCafe
+        fields = ['id', 'numero_lote', 'organizacion', 'organizacion_nombre', 'fecha_entrega', 'total_quintales',
+                  'peso_total_inicial', 'peso_total_final', 'estado', 'estado_display', 'version',
+                  'total_muestras', 'muestras_aprobadas', 'muestras_contaminadas']
+        read_only_fields = fields
+    
+    # Los conteos vienen anotados cuando el lote se precarga (ver views._procesos_con_lotes)
+    def get_total_muestras(self, obj):
+        return obj.total_muestras if hasattr(obj, 'total_muestras') else obj.muestras.count()
+    
+    def get_muestras_aprobadas(self, obj):
+        return obj.muestras_aprobadas if hasattr(obj, 'muestras_aprobadas') else obj.muestras.filter(estado='APROBADA').count()
+    
+    def get_muestras_contaminadas(self, obj):
+        return obj.muestras_contaminadas if hasattr(obj, 'muestras_contaminadas') else obj.muestras.filter(estado='CONTAMINADA').count()
+
 class ProcesoAnalisisSerializer(serializers.ModelSerializer):
     lote_numero = serializers.CharField(source='lote.numero_lote', read_only=True)
     usuario_nombre = serializers.CharField(source='usuario_proceso.get_full_name', read_only=True)
@@ -225,6 +269,8 @@ class CrearLoteConPropietariosSerializer(serializers.Serializer):
         return value
 
     def validate_propietarios(self, value):
+        maestros_ids = set()
+        cedulas = set()
         for propietario in value:
             # Validar campos requeridos
             if not propietario.get('quintales_entregados'):
@@ -234,10 +280,9 @@ class CrearLoteConPropietariosSerializer(serializers.Serializer):
             propietario_maestro_id = propietario.get('propietario_maestro_id')
             
             if propietario_maestro_id:
-                # Es un propietario existente, verificar que existe
                 try:
-                    PropietarioMaestro.objects.get(id=propietario_maestro_id, activo=True)
-                except PropietarioMaestro.DoesNotExist:
+                    maestros_ids.add(int(propietario_maestro_id))
+                except (ValueError, TypeError):
                     raise serializers.ValidationError(f"Propietario maestro con ID {propietario_maestro_id} no encontrado")
             else:
                 # Es un propietario nuevo, validar campos requeridos
@@ -245,6 +290,9 @@ class CrearLoteConPropietariosSerializer(serializers.Serializer):
                     raise serializers.ValidationError("nombre_completo es requerido para propietarios nuevos")
                 if not propietario.get('cedula'):
                     raise serializers.ValidationError("cedula es requerido para propietarios nuevos")
+                if propietario['cedula'] in cedulas:
+                    raise serializers.ValidationError(f"La cédula {propietario['cedula']} está repetida en el lote")
+                cedulas.add(propietario['cedula'])
             
             # Validar tipos de datos
             try:
@@ -252,6 +300,22 @@ class CrearLoteConPropietariosSerializer(serializers.Serializer):
             except (ValueError, TypeError):
                 raise serializers.ValidationError("quintales_entregados debe ser un número válido")
         
+        # Los propietarios existentes se verifican en la caché (una sola consulta para los que falten)
+        if maestros_ids:
+            existentes = {
+                id_: propietario.cedula
+                for id_, propietario in propietarios_por_id(maestros_ids).items()
+                if propietario.activo
+            }
+            faltantes = maestros_ids - existentes.keys()
+            if faltantes:
+                raise serializers.ValidationError(f"Propietario maestro con ID {min(faltantes)} no encontrado")
+            if len(maestros_ids) != sum(1 for p in value if p.get('propietario_maestro_id')):
+                raise serializers.ValidationError("Un propietario maestro no puede repetirse en el lote")
+            repetidas = cedulas & set(existentes.values())
+            if repetidas:
+                raise serializers.ValidationError(f"La cédula {repetidas.pop()} está repetida en el lote")
+        
         return value
     
     def validate_peso_total_inicial(self, value):
@@ -259,91 +323,96 @@ class CrearLoteConPropietariosSerializer(serializers.Serializer):
             raise serializers.ValidationError("El peso total inicial debe ser mayor a 0")
         return value
     
+    CAMPOS_PROPIETARIO = ['telefono', 'departamento', 'municipio', 'comunidad', 'calle', 'numero_casa', 'referencias']
+    
+    @transaction.atomic
     def create(self, validated_data):
+        """
+        Crea el lote y sus entregas en bloque: una consulta para los propietarios maestros,
+        bulk_create/bulk_update para los maestros y bulk_create para las entregas.
+        """
         propietarios_data = validated_data.pop('propietarios')
         validated_data['usuario_registro'] = self.context['request'].user
         lote = LoteCafe.objects.create(**validated_data)
         
+        maestros_ids = {int(p['propietario_maestro_id']) for p in propietarios_data if p.get('propietario_maestro_id')}
+        cedulas = {p['cedula'] for p in propietarios_data if not p.get('propietario_maestro_id')}
+        # Los maestros que se copian o actualizan se leen de la base de datos (la caché solo valida),
+        # bloqueados hasta el commit para no escribir encima de un cambio concurrente
+        maestros = list(PropietarioMaestro.objects.select_for_update().filter(
+            Q(id__in=maestros_ids) | Q(cedula__in=cedulas)
+        ).order_by('id'))
+        por_id = {maestro.id: maestro for maestro in maestros if maestro.id in maestros_ids}
+        por_cedula = {maestro.cedula: maestro for maestro in maestros}
+        faltantes = maestros_ids - por_id.keys()
+        if faltantes:
+            raise serializers.ValidationError({'propietarios': [f"Propietario maestro con ID {min(faltantes)} no encontrado"]})
+        
+        # Propietarios nuevos: crear el maestro o actualizarlo si los datos han cambiado
+        nuevos = []
+        actualizados = []
+        cambios = {}
         for propietario_data in propietarios_data:
-            quintales_entregados = float(propietario_data['quintales_entregados'])
-            propietario_maestro_id = propietario_data.get('propietario_maestro_id')
+            if propietario_data.get('propietario_maestro_id'):
+                continue
+            valores = {
+                'nombre_completo': propietario_data['nombre_completo'],
+                'nombre_normalizado': normalizar_texto(propietario_data['nombre_completo'])
+            }
+            valores.update({campo: propietario_data.get(campo, '') for campo in self.CAMPOS_PROPIETARIO})
             
+            propietario_maestro = por_cedula.get(propietario_data['cedula'])
+            if propietario_maestro is None:
+                nuevos.append(PropietarioMaestro(cedula=propietario_data['cedula'], activo=True, **valores))
+            elif any(getattr(propietario_maestro, campo) != valor for campo, valor in valores.items()):
+                cambios[propietario_maestro.id] = [
+                    campo for campo in CAMPOS_HEREDADOS_MAESTRO if getattr(propietario_maestro, campo) != valores[campo]
+                ]
+                for campo, valor in valores.items():
+                    setattr(propietario_maestro, campo, valor)
+                actualizados.append(propietario_maestro)
+        
+        for propietario_maestro in PropietarioMaestro.objects.bulk_create(nuevos):
+            por_cedula[propietario_maestro.cedula] = propietario_maestro
+        if actualizados:
+            # bulk_update no emite pre_save: las entregas anteriores conservan sus datos explícitamente
+            PropietarioCafe.fijar_datos_heredados(cambios)
+            PropietarioMaestro.objects.bulk_update(actualizados, ['nombre_completo', 'nombre_normalizado'] + self.CAMPOS_PROPIETARIO)
+        if nuevos or actualizados:
+            cache_propietarios.invalidar()
+        
+        # Crear los registros de entrega
+        entregas = []
+        for propietario_data in propietarios_data:
+            propietario_maestro_id = propietario_data.get('propietario_maestro_id')
             if propietario_maestro_id:
-                # Propietario existente
-                propietario_maestro = PropietarioMaestro.objects.get(id=propietario_maestro_id)
-                
-                # Crear el registro de entrega con datos del propietario maestro
-                PropietarioCafe.objects.create(
-                    lote=lote,
-                    propietario_maestro=propietario_maestro,
-                    quintales_entregados=quintales_entregados,
-                    nombre_completo=propietario_maestro.nombre_completo,
-                    cedula=propietario_maestro.cedula,
-                    telefono=propietario_maestro.telefono,
-                    departamento=propietario_maestro.departamento,
-                    municipio=propietario_maestro.municipio,
-                    comunidad=propietario_maestro.comunidad,
-                    calle=propietario_maestro.calle,
-                    numero_casa=propietario_maestro.numero_casa,
-                    referencias=propietario_maestro.referencias
-                )
+                # Propietario existente: copiar los datos del maestro
+                propietario_maestro = por_id[int(propietario_maestro_id)]
+                datos_entrega = {campo: getattr(propietario_maestro, campo) for campo in self.CAMPOS_PROPIETARIO}
+                datos_entrega['nombre_completo'] = propietario_maestro.nombre_completo
             else:
-                # Propietario nuevo
-                # Primero, verificar si ya existe un propietario maestro con esta cédula
-                cedula = propietario_data['cedula']
-                propietario_maestro, created = PropietarioMaestro.objects.get_or_create(
-                    cedula=cedula,
-                    defaults={
-                        'nombre_completo': propietario_data['nombre_completo'],
-                        'telefono': propietario_data.get('telefono', ''),
-                        'departamento': propietario_data.get('departamento', ''),
-                        'municipio': propietario_data.get('municipio', ''),
-                        'comunidad': propietario_data.get('comunidad', ''),
-                        'calle': propietario_data.get('calle', ''),
-                        'numero_casa': propietario_data.get('numero_casa', ''),
-                        'referencias': propietario_data.get('referencias', ''),
-                        'activo': True
-                    }
-                )
-                
-                # Si no fue creado pero los datos han cambiado, actualizar el maestro
-                if not created:
-                    actualizado = False
-                    if propietario_maestro.nombre_completo != propietario_data['nombre_completo']:
-                        propietario_maestro.nombre_completo = propietario_data['nombre_completo']
-                        actualizado = True
-                    if propietario_maestro.telefono != propietario_data.get('telefono', ''):
-                        propietario_maestro.telefono = propietario_data.get('telefono', '')
-                        actualizado = True
-                    
-                    # Actualizar campos de dirección si son diferentes
-                    campos_direccion = ['departamento', 'municipio', 'comunidad', 'calle', 'numero_casa', 'referencias']
-                    for campo in campos_direccion:
-                        nuevo_valor = propietario_data.get(campo, '')
-                        if getattr(propietario_maestro, campo) != nuevo_valor:
-                            setattr(propietario_maestro, campo, nuevo_valor)
-                            actualizado = True
-                    
-                    if actualizado:
-                        propietario_maestro.save()
-                
-                # Crear el registro de entrega
-                PropietarioCafe.objects.create(
-                    lote=lote,
-                    propietario_maestro=propietario_maestro,
-                    quintales_entregados=quintales_entregados,
-                    # Copiar datos específicos para esta entrega
-                    nombre_completo=propietario_data['nombre_completo'],
-                    cedula=cedula,
-                    telefono=propietario_data.get('telefono', ''),
-                    departamento=propietario_data.get('departamento', ''),
-                    municipio=propietario_data.get('municipio', ''),
-                    comunidad=propietario_data.get('comunidad', ''),
-                    calle=propietario_data.get('calle', ''),
-                    numero_casa=propietario_data.get('numero_casa', ''),
-                    referencias=propietario_data.get('referencias', ''),
-                    direccion=propietario_data.get('direccion', '')
-                )
+                # Propietario nuevo: copiar datos específicos para esta entrega
+                propietario_maestro = por_cedula[propietario_data['cedula']]
+                datos_entrega = {campo: propietario_data.get(campo, '') for campo in self.CAMPOS_PROPIETARIO}
+                datos_entrega['nombre_completo'] = propietario_data['nombre_completo']
+                datos_entrega['direccion'] = propietario_data.get('direccion', '')
+            
+            entrega = PropietarioCafe(
+                lote=lote,
+                propietario_maestro=propietario_maestro,
+                quintales_entregados=float(propietario_data['quintales_entregados']),
+                cedula=propietario_maestro.cedula,
+                **datos_entrega
+            )
+            # Solo se guardan los datos que difieren del maestro (bulk_create no llama a save())
+            entrega.compactar()
+            entregas.append(entrega)
+        
+        # bulk_create no emite post_save: estados de análisis y contadores se actualizan en bloque
+        entregas = PropietarioCafe.objects.bulk_create(entregas)
+        EstadoAnalisisPropietario.inicializar(entregas)
+        PropietarioMaestro.registrar_entregas(entregas)
+        cache_calidad.invalidar()
         
         return lote
 
@@ -376,6 +445,45 @@ class RegistroBitacoraSerializer(serializers.ModelSerializer):
             validated_data['usuario'] = request.user
         return super().create(validated_data)
 
+class LoteEventoSerializer(serializers.ModelSerializer):
+    tipo_display = serializers.CharField(source='get_tipo_display', read_only=True)
+    usuario_nombre = serializers.CharField(source='usuario.username', read_only=True)
+    
+    class Meta:
+        model = LoteEvento
+        fields = ['id', 'lote', 'fecha', 'tipo', 'tipo_display', 'usuario', 'usuario_nombre', 'datos']
+        read_only_fields = fields
+
+class MovimientoInventarioSerializer(serializers.ModelSerializer):
+    tipo_display = serializers.CharField(source='get_tipo_display', read_only=True)
+    insumo_nombre = serializers.CharField(source='insumo.nombre', read_only=True)
+    usuario_nombre = serializers.CharField(source='usuario.username', read_only=True, default=None)
+    
+    class Meta:
+        model = MovimientoInventario
+        fields = ['id', 'insumo', 'insumo_nombre', 'tipo', 'tipo_display', 'cantidad', 'saldo_resultante', 'fecha',
+                  'usuario', 'usuario_nombre', 'tarea', 'descarga', 'lote', 'observaciones']
+        read_only_fields = fields
+
+class TrabajoAsincronoSerializer(serializers.ModelSerializer):
+    estado_display = serializers.CharField(source='get_estado_display', read_only=True)
+    url_descarga = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = TrabajoAsincrono
+        fields = ['id', 'tipo', 'estado', 'estado_display', 'parametros', 'progreso', 'mensaje',
+                  'resultado', 'error', 'intentos', 'usuario', 'fecha_creacion', 'fecha_inicio',
+                  'fecha_finalizacion', 'url_descarga']
+        read_only_fields = fields
+    
+    def get_url_descarga(self, obj):
+        """URL del archivo generado cuando el trabajo terminó con archivo"""
+        if obj.estado != 'COMPLETADO' or not obj.archivo_resultado:
+            return None
+        url = reverse('trabajos-descargar', args=[obj.id])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
 class RegistroDescargaSerializer(serializers.ModelSerializer):
     empleado_nombre = serializers.CharField(source='empleado.get_full_name', read_only=True)
     empleado_username = serializers.CharField(source='empleado.username', read_only=True)
@@ -387,7 +495,7 @@ class RegistroDescargaSerializer(serializers.ModelSerializer):
     class Meta:
         model = RegistroDescarga
         fields = '__all__'
-        read_only_fields = ('empleado', 'tiempo_descarga_minutos', 'fecha_registro')
+        read_only_fields = ('empleado', 'tiempo_descarga_minutos', 'fecha_registro', 'clave_idempotencia')
     
     def create(self, validated_data):
         # Asignar automáticamente el empleado del request
@@ -412,8 +520,7 @@ class RegistroDescargaSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError("La cantidad de insumo usado debe ser mayor a 0")
             
             # Verificar si el tipo de insumo requiere descuento de stock
-            tipos_que_restan = ['CONTENEDOR', 'EQUIPO_MEDICION', 'OTRO']
-            if insumo.tipo in tipos_que_restan:
+            if insumo.tipo in RegistroDescarga.TIPOS_INSUMO_QUE_RESTAN:
                 # Verificar que hay suficiente stock
                 if cantidad_usada > insumo.cantidad_disponible:
                     raise serializers.ValidationError(
@@ -508,7 +615,7 @@ class RegistroUsoMaquinariaSerializer(serializers.ModelSerializer):
     class Meta:
         model = RegistroUsoMaquinaria
         fields = '__all__'
-        read_only_fields = ('empleado', 'tiempo_uso_minutos')
+        read_only_fields = ('empleado', 'tiempo_uso_minutos', 'clave_idempotencia')
     
     def get_tipo_maquinaria_display(self, obj):
         """Obtener el nombre legible del tipo de maquinaria"""
@@ -530,6 +637,11 @@ class RegistroUsoMaquinariaSerializer(serializers.ModelSerializer):
         if data.get('hora_inicio') and data.get('hora_fin'):
             if data['hora_fin'] <= data['hora_inicio']:
                 raise serializers.ValidationError("La hora de fin debe ser posterior a la hora de inicio")
+            if data['hora_fin'] - data['hora_inicio'] > timedelta(hours=RegistroUsoMaquinaria.MAXIMO_HORAS_USO):
+                raise serializers.ValidationError(f"Un uso de maquinaria no puede durar más de {RegistroUsoMaquinaria.MAXIMO_HORAS_USO} horas")
+        
+        # Validar que la máquina no esté registrada en uso en un intervalo que se cruce
+        self.validar_solapamiento(data)
         
         # Validar que se proporcione al menos el tipo de maquinaria o un insumo específico
         if not data.get('tipo_maquinaria') and not data.get('maquinaria'):
@@ -547,6 +659,51 @@ class RegistroUsoMaquinariaSerializer(serializers.ModelSerializer):
         
         return data
 
+    def validar_solapamiento(self, data):
+        """Rechaza el uso si la misma máquina ya tiene un uso registrado que se cruce con él"""
+        maquinaria = data.get('maquinaria', getattr(self.instance, 'maquinaria', None))
+        hora_inicio = data.get('hora_inicio', getattr(self.instance, 'hora_inicio', None))
+        hora_fin = data.get('hora_fin', getattr(self.instance, 'hora_fin', None))
+        if not (maquinaria and hora_inicio and hora_fin):
+            return
+        
+        conflicto = RegistroUsoMaquinaria.solapados(
+            maquinaria.id, hora_inicio, hora_fin, excluir_id=getattr(self.instance, 'id', None)
+        ).select_related('empleado').first()
+        if conflicto:
+            raise serializers.ValidationError(
+                f"{maquinaria.nombre} ya está registrada en uso de {timezone.localtime(conflicto.hora_inicio):%d/%m/%Y %H:%M} "
+                f"a {timezone.localtime(conflicto.hora_fin):%d/%m/%Y %H:%M} por {conflicto.empleado.get_full_name() or conflicto.empleado.username} "
+                f"(registro #{conflicto.id})"
+            )
+
+class RelacionPrecargadaField(serializers.PrimaryKeyRelatedField):
+    """Relación por id resuelta contra los objetos precargados en context['precargados'][modelo], sin consultas"""
+    
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return self.context['precargados'][self.queryset.model][int(data)]
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
+class SincronizacionDescargaSerializer(RegistroDescargaSerializer):
+    """Descarga enviada en una sincronización; el stock se valida contra los insumos precargados"""
+    lote = RelacionPrecargadaField(queryset=LoteCafe.objects.all())
+    insumo = RelacionPrecargadaField(queryset=Insumo.objects.all(), required=False, allow_null=True)
+
+class SincronizacionUsoMaquinariaSerializer(RegistroUsoMaquinariaSerializer):
+    """Uso de maquinaria enviado en una sincronización"""
+    lote = RelacionPrecargadaField(queryset=LoteCafe.objects.all())
+    maquinaria = RelacionPrecargadaField(queryset=Insumo.objects.all(), required=False, allow_null=True)
+    
+    def validar_solapamiento(self, data):
+        # Los solapamientos se validan después contra todos los usos del lote de sincronización
+        pass
+
 class TareaInsumoSerializer(serializers.ModelSerializer):
     """Serializer para el modelo TareaInsumo"""
     empleado_nombre = serializers.CharField(source='empleado.get_full_name', read_only=True)
@@ -599,7 +756,7 @@ class TareaInsumoSerializer(serializers.ModelSerializer):
 
 class ProcesoSerializer(serializers.ModelSerializer):
     """Serializer para el modelo Proceso"""
-    lotes_info = LoteCafeSerializer(source='lotes', many=True, read_only=True)
+    lotes_info = LoteResumenSerializer(source='lotes', many=True, read_only=True)
     responsable_nombre = serializers.CharField(source='responsable.get_full_name', read_only=True)
     usuario_creacion_nombre = serializers.CharField(source='usuario_creacion.get_full_name', read_only=True)
     
@@ -0,0 +1,194 @@
+"""
+Sincronización por lotes de los registros capturados sin conexión (descargas y usos de maquinaria).
+
+Cada registro trae una clave de idempotencia generada por el dispositivo: si la clave ya
+existe el registro se informa como duplicado sin volver a crearse, así la cola completa se
+puede reenviar sin riesgo. Los lotes e insumos referenciados se leen en una sola consulta
+(los insumos bloqueados hasta el fin de la transacción), cada registro se valida con el
+serializer de su endpoint y los válidos se insertan con bulk_create en una transacción, junto
+con las salidas de inventario de las descargas. Un registro inválido se informa con sus
+errores y no impide guardar los demás.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import cache_descargas, cache_inventario
+from .models import ConsumoRecursoLote, Insumo, LoteCafe, MovimientoInventario, RegistroDescarga, RegistroUsoMaquinaria
+from .serializers import SincronizacionDescargaSerializer, SincronizacionUsoMaquinariaSerializer
+
+MAXIMO_REGISTROS = 500
+LONGITUD_CLAVE = RegistroDescarga._meta.get_field('clave_idempotencia').max_length
+# Tipo de registro -> (modelo, serializer, campo que referencia un insumo)
+TIPOS = {
+    'DESCARGA': (RegistroDescarga, SincronizacionDescargaSerializer, 'insumo'),
+    'USO_MAQUINARIA': (RegistroUsoMaquinaria, SincronizacionUsoMaquinariaSerializer, 'maquinaria'),
+}
+
+def _id(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+def _resultado(indice, tipo, clave, estado, id_=None, errores=None):
+    resultado = {'indice': indice, 'tipo': tipo, 'clave_idempotencia': clave, 'estado': estado, 'id': id_}
+    if errores:
+        resultado['errores'] = errores
+    return resultado
+
+def _precargar(nuevos):
+    """Lotes e insumos referenciados por los registros nuevos, en una consulta por modelo"""
+    ids_lotes, ids_insumos = set(), set()
+    for _, tipo, _, datos in nuevos:
+        ids_lotes.add(_id(datos.get('lote')))
+        ids_insumos.add(_id(datos.get(TIPOS[tipo][2])))
+    ids_lotes.discard(None)
+    ids_insumos.discard(None)
+    lotes = {lote.id: lote for lote in LoteCafe.objects.filter(id__in=ids_lotes).only('id', 'numero_lote')}
+    # Bloqueados en orden de id: el stock y los usos de cada máquina no cambian hasta el commit
+    insumos = {insumo.id: insumo for insumo in Insumo.objects.select_for_update().filter(id__in=ids_insumos).order_by('id')}
+    return {LoteCafe: lotes, Insumo: insumos}
+
+def _conflictos_maquinaria(usos):
+    """
+    Índice de los usos que se cruzan con otro de la misma máquina, ya registrado o aceptado antes
+    en esta sincronización. Los registrados se leen en una sola consulta sobre la ventana de todos.
+    """
+    inicio = min(uso.hora_inicio for _, uso in usos)
+    fin = max(uso.hora_fin for _, uso in usos)
+    ocupados = defaultdict(list)
+    registrados = RegistroUsoMaquinaria.objects.filter(
+        maquinaria_id__in={uso.maquinaria_id for _, uso in usos},
+        hora_inicio__gt=inicio - timedelta(hours=RegistroUsoMaquinaria.MAXIMO_HORAS_USO),
+        hora_inicio__lt=fin,
+        hora_fin__gt=inicio
+    ).values_list('maquinaria_id', 'hora_inicio', 'hora_fin', 'id').order_by()
+    for maquinaria_id, hora_inicio, hora_fin, id_ in registrados:
+        ocupados[maquinaria_id].append((hora_inicio, hora_fin, f'registro #{id_}'))
+
+    conflictos = {}
+    for indice, uso in usos:
+        intervalos = ocupados[uso.maquinaria_id]
+        conflicto = next((intervalo for intervalo in intervalos if intervalo[0] < uso.hora_fin and intervalo[1] > uso.hora_inicio), None)
+        if conflicto:
+            conflictos[indice] = (
+                f"{uso.maquinaria.nombre} ya está registrada en uso de {timezone.localtime(conflicto[0]):%d/%m/%Y %H:%M} "
+                f"a {timezone.localtime(conflicto[1]):%d/%m/%Y %H:%M} ({conflicto[2]})"
+            )
+        else:
+            intervalos.append((uso.hora_inicio, uso.hora_fin, f'registro {indice} de esta sincronización'))
+    return conflictos
+
+def sincronizar(registros, request):
+    """
+    Guarda los registros `{tipo, clave_idempotencia, ...campos del endpoint}` del usuario del
+    request y retorna el estado de cada uno (CREADO, DUPLICADO o ERROR) en el orden recibido.
+    """
+    resultados = [None] * len(registros)
+    nuevos = []
+    primeros = {}
+    for indice, registro in enumerate(registros):
+        if not isinstance(registro, dict):
+            resultados[indice] = _resultado(indice, None, None, 'ERROR', errores={'non_field_errors': ['Formato inválido']})
+            continue
+        tipo = registro.get('tipo')
+        clave = str(registro.get('clave_idempotencia') or '').strip()
+        if tipo not in TIPOS:
+            resultados[indice] = _resultado(indice, tipo, clave, 'ERROR', errores={'tipo': [f"Tipo inválido. Use {' o '.join(TIPOS)}"]})
+        elif not clave or len(clave) > LONGITUD_CLAVE:
+            resultados[indice] = _resultado(indice, tipo, clave, 'ERROR', errores={'clave_idempotencia': [f'Se requiere una clave de hasta {LONGITUD_CLAVE} caracteres']})
+        elif (tipo, clave) in primeros:
+            # Repetido dentro del mismo envío: toma el resultado del primero
+            resultados[indice] = _resultado(indice, tipo, clave, 'DUPLICADO')
+        else:
+            primeros[(tipo, clave)] = indice
+            nuevos.append((indice, tipo, clave, registro))
+
+    creados = {tipo: [] for tipo in TIPOS}
+    with transaction.atomic():
+        existentes = {}
+        for tipo, (modelo, _, _) in TIPOS.items():
+            claves = [clave for _, tipo_registro, clave, _ in nuevos if tipo_registro == tipo]
+            if claves:
+                existentes.update(
+                    ((tipo, clave), id_) for clave, id_ in
+                    modelo.objects.filter(clave_idempotencia__in=claves).values_list('clave_idempotencia', 'id')
+                )
+        for indice, tipo, clave, _ in nuevos:
+            if (tipo, clave) in existentes:
+                resultados[indice] = _resultado(indice, tipo, clave, 'DUPLICADO', existentes[(tipo, clave)])
+        nuevos = [nuevo for nuevo in nuevos if resultados[nuevo[0]] is None]
+
+        contexto = {'request': request, 'precargados': _precargar(nuevos)}
+        validos = {}
+        usos_con_maquinaria = []
+        salidas = []
+        for indice, tipo, clave, datos in nuevos:
+            modelo, clase_serializer, _ = TIPOS[tipo]
+            serializer = clase_serializer(data=datos, context=contexto)
+            if not serializer.is_valid():
+                resultados[indice] = _resultado(indice, tipo, clave, 'ERROR', errores=serializer.errors)
+                continue
+            campos = dict(serializer.validated_data)
+            campos.pop('trabajador_nombre', None)
+            registro = modelo(empleado=request.user, clave_idempotencia=clave, **campos)
+            registro.completar_tiempo()
+            validos[indice] = (tipo, registro)
+            if tipo == 'USO_MAQUINARIA' and registro.maquinaria_id:
+                usos_con_maquinaria.append((indice, registro))
+            elif tipo == 'DESCARGA' and registro.insumo and registro.cantidad_insumo_usado \
+                    and registro.insumo.tipo in RegistroDescarga.TIPOS_INSUMO_QUE_RESTAN:
+                # Se descuenta ya del insumo precargado: las descargas siguientes validan su
+                # stock contra la existencia que dejan las anteriores
+                registro.insumo.cantidad_disponible -= registro.cantidad_insumo_usado
+                salidas.append((registro, registro.insumo.cantidad_disponible))
+
+        if usos_con_maquinaria:
+            for indice, mensaje in _conflictos_maquinaria(usos_con_maquinaria).items():
+                tipo, registro = validos.pop(indice)
+                resultados[indice] = _resultado(indice, tipo, registro.clave_idempotencia, 'ERROR', errores={'non_field_errors': [mensaje]})
+
+        for tipo, registro in validos.values():
+            creados[tipo].append(registro)
+        RegistroDescarga.objects.bulk_create(creados['DESCARGA'], batch_size=500)
+        RegistroUsoMaquinaria.objects.bulk_create(creados['USO_MAQUINARIA'], batch_size=500)
+
+        if salidas:
+            ahora = timezone.now()
+            MovimientoInventario.objects.bulk_create([
+                MovimientoInventario(
+                    insumo=descarga.insumo, tipo='SALIDA', cantidad=-descarga.cantidad_insumo_usado, saldo_resultante=saldo,
+                    fecha=ahora, usuario=request.user, descarga=descarga, lote=descarga.lote, observaciones='Uso en descarga de lote'
+                ) for descarga, saldo in salidas
+            ], batch_size=500)
+            insumos = list({descarga.insumo.id: descarga.insumo for descarga, _ in salidas}.values())
+            for insumo in insumos:
+                insumo.fecha_ultima_actualizacion = ahora
+            Insumo.objects.bulk_update(insumos, ['cantidad_disponible', 'fecha_ultima_actualizacion'])
+
+    for indice, (tipo, registro) in validos.items():
+        resultados[indice] = _resultado(indice, tipo, registro.clave_idempotencia, 'CREADO', registro.id)
+    for resultado in resultados:
+        if resultado['estado'] == 'DUPLICADO' and resultado['id'] is None:
+            primero = resultados[primeros[(resultado['tipo'], resultado['clave_idempotencia'])]]
+            resultado['id'] = primero['id']
+
+    # bulk_create no emite post_save
+    if creados['DESCARGA']:
+        cache_descargas.invalidar()
+    if salidas:
+        cache_inventario.invalidar()
+    ConsumoRecursoLote.recalcular({registro.lote_id for _, registro in validos.values()})
+
+    return {
+        'total': len(registros),
+        'creados': sum(1 for resultado in resultados if resultado['estado'] == 'CREADO'),
+        'duplicados': sum(1 for resultado in resultados if resultado['estado'] == 'DUPLICADO'),
+        'con_errores': sum(1 for resultado in resultados if resultado['estado'] == 'ERROR'),
+        'resultados': resultados,
+        'descargas': [descarga.id for descarga in creados['DESCARGA']],
+        'usos_maquinaria': [uso.id for uso in creados['USO_MAQUINARIA']],
+    }
@@ -1,3 +1,1692 @@
-from django.test import TestCase
+import importlib
+import random
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.apps import apps as django_apps
+from django.contrib import admin
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, F, Sum
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+
+from . import duplicados, importaciones, maquinaria, reportes, sincronizacion, trabajos
+from .cache import (CacheLRU, cache_calidad, cache_descargas, cache_inventario, cache_propietarios, propietario_por_cedula,
+                    propietarios_por_cedula)
+from .models import (ConflictoVersionLote, ConsumoRecursoLote, EstadoAnalisisPropietario, Insumo, LoteCafe, LoteEvento,
+                     MedicionFase, MovimientoInventario, MuestraCafe, Organizacion, Proceso, PropietarioCafe,
+                     PropietarioMaestro, RegistroBitacora, RegistroDescarga, RegistroUsoMaquinaria, StockInsuficiente,
+                     TareaInsumo, TareaProceso, TrabajoAsincrono, derivar_estado_analisis, extraer_mediciones_fase,
+                     normalizar_texto)
+from .views import reintentar_si_conflicto
+
+MEDIA_PRUEBAS = Path(tempfile.mkdtemp(prefix='fape-pruebas-'))
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_PRUEBAS,
+    TRABAJOS_DIR=MEDIA_PRUEBAS / 'trabajos',
+    REPORTES_DIR=MEDIA_PRUEBAS / 'reportes',
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pruebas'},
+        'generaciones': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pruebas-generaciones'},
+    },
+)
+class PruebaAPI(TestCase):
+    """Cliente autenticado como administrador, archivos en una carpeta temporal y cachés vacías"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.addClassCleanup(shutil.rmtree, MEDIA_PRUEBAS, ignore_errors=True)
+
+    def setUp(self):
+        # Las cachés en memoria sobreviven al rollback de cada prueba
+        for cache in (cache_propietarios, cache_calidad, cache_inventario, cache_descargas):
+            cache._invalidar_ahora()
+        self.usuario = User.objects.create_user('admin', password='clave', is_staff=True, is_superuser=True)
+        self.cliente = APIClient()
+        self.cliente.force_authenticate(self.usuario)
+        self.organizacion = Organizacion.objects.create(nombre='Cooperativa Pruebas')
+
+    def crear_lote(self, numero, propietarios, fecha_entrega='2026-01-01T10:00:00Z'):
+        """Crea el lote por la API; `propietarios` es una lista de (nombre, cédula, quintales)"""
+        respuesta = self.cliente.post('/api/users/lotes/crear-con-propietarios/', {
+            'organizacion': self.organizacion.id,
+            'numero_lote': numero,
+            'fecha_entrega': fecha_entrega,
+            'total_quintales': int(sum(quintales for _, _, quintales in propietarios)),
+            'peso_total_inicial': '1000.00',
+            'propietarios': [
+                {'nombre_completo': nombre, 'cedula': cedula, 'quintales_entregados': quintales, 'comunidad': 'San José'}
+                for nombre, cedula, quintales in propietarios
+            ],
+        }, format='json')
+        self.assertEqual(respuesta.status_code, 201, respuesta.content)
+        return respuesta.json()
+
+    def registrar_resultado(self, muestra_id, estado):
+        respuesta = self.cliente.post(f'/api/users/muestras/{muestra_id}/resultado/', {'estado': estado}, format='json')
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        return respuesta.json()
+
+def manejador_fallido(trabajo):
+    raise RuntimeError('Fallo del manejador')
+
+class EstadoAnalisisPropietarioTests(PruebaAPI):
+    def setUp(self):
+        super().setUp()
+        self.lote = self.crear_lote('L-026', [('Ana Pérez', '0100000001', 10), ('Luis Gómez', '0100000002', 5), ('Eva Ruiz', '0100000003', 5)])
+        self.propietarios = [propietario['id'] for propietario in self.lote['propietarios']]
+
+    def estados(self):
+        return dict(EstadoAnalisisPropietario.objects.filter(lote_id=self.lote['id']).values_list('propietario_id', 'estado'))
+
+    def test_estados_siguen_los_resultados_de_las_muestras(self):
+        self.assertEqual(set(self.estados().values()), {'SIN_MUESTRA'})
+
+        respuesta = self.cliente.post('/api/users/muestras/seleccionar/', {
+            'lote_id': self.lote['id'], 'propietarios_seleccionados': self.propietarios
+        }, format='json')
+        self.assertEqual(respuesta.status_code, 201)
+        muestras = [muestra['id'] for muestra in respuesta.json()['muestras']]
+        self.assertEqual(set(self.estados().values()), {'PENDIENTE'})
+
+        for muestra_id, estado in zip(muestras, ['APROBADA', 'CONTAMINADA', 'CONTAMINADA']):
+            self.registrar_resultado(muestra_id, estado)
+        ana, luis, eva = self.propietarios
+        self.assertEqual(self.estados(), {ana: 'APROBADA', luis: 'SEGUNDO_PENDIENTE', eva: 'SEGUNDO_PENDIENTE'})
+
+        segundas = MuestraCafe.objects.filter(lote_id=self.lote['id'], es_segundo_muestreo=True).order_by('propietario_id')
+        for muestra, estado in zip(segundas, ['APROBADA', 'CONTAMINADA']):
+            self.registrar_resultado(muestra.id, estado)
+        self.assertEqual(self.estados(), {ana: 'APROBADA', luis: 'APROBADA_SEGUNDO', eva: 'CONTAMINADA_CONFIRMADA'})
+
+        reporte = self.cliente.get(f"/api/users/lotes/{self.lote['id']}/reporte-separacion/").json()
+        self.assertEqual(reporte['totales']['quintales_aprobados'], 15.0)
+        self.assertEqual(reporte['totales']['quintales_contaminados'], 5.0)
+
+    def test_coincide_con_el_estado_derivado_de_las_muestras(self):
+        self.cliente.post('/api/users/muestras/seleccionar/', {
+            'lote_id': self.lote['id'], 'propietarios_seleccionados': self.propietarios[:2]
+        }, format='json')
+        primera = MuestraCafe.objects.filter(propietario_id=self.propietarios[0]).get()
+        self.registrar_resultado(primera.id, 'CONTAMINADA')
+
+        for estado_analisis in EstadoAnalisisPropietario.objects.filter(lote_id=self.lote['id']):
+            muestras = list(MuestraCafe.objects.filter(propietario_id=estado_analisis.propietario_id).order_by('id'))
+            estado, muestra_decisiva = derivar_estado_analisis(muestras)
+            self.assertEqual(estado_analisis.estado, estado)
+            self.assertEqual(estado_analisis.muestra_decisiva, muestra_decisiva)
+
+    def test_eliminar_muestra_y_cambiar_quintales_actualizan_el_estado(self):
+        propietario = PropietarioCafe.objects.get(id=self.propietarios[0])
+        muestra = MuestraCafe.objects.create(lote_id=self.lote['id'], propietario=propietario, numero_muestra='M-1', estado='APROBADA', analista=self.usuario)
+        self.assertEqual(self.estados()[propietario.id], 'APROBADA')
+
+        muestra.delete()
+        self.assertEqual(self.estados()[propietario.id], 'SIN_MUESTRA')
+
+        propietario.quintales_entregados = 12
+        propietario.save()
+        self.assertEqual(EstadoAnalisisPropietario.objects.get(propietario=propietario).quintales, 12)
+
+class VersionLoteTests(PruebaAPI):
+    def setUp(self):
+        super().setUp()
+        self.lote = LoteCafe.objects.get(id=self.crear_lote('L-027', [('Ana Pérez', '0200000001', 10)])['id'])
+        LoteCafe.objects.filter(id=self.lote.id).update(estado='APROBADO')
+        self.lote.refresh_from_db()
+
+    def limpiar(self, **datos):
+        return self.cliente.post('/api/users/lotes/procesar-limpieza/', {'lote_id': self.lote.id, 'peso_impurezas': '10', **datos}, format='json')
+
+    def simular_escritura_concurrente(self, veces):
+        """Antes de cada una de las primeras `veces` transiciones otra petición modifica el lote"""
+        transicionar = LoteCafe.transicionar
+        llamadas = []
+
+        def transicionar_tras_otra_escritura(lote, *args, **kwargs):
+            llamadas.append(lote.version)
+            if len(llamadas) <= veces:
+                LoteCafe.objects.filter(pk=lote.pk).update(version=F('version') + 1)
+            return transicionar(lote, *args, **kwargs)
+        return mock.patch.object(LoteCafe, 'transicionar', transicionar_tras_otra_escritura), llamadas
+
+    def test_transicion_con_version_del_cliente(self):
+        version = self.lote.version
+        respuesta = self.limpiar(version=version - 1)
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertEqual(respuesta.json()['version_actual'], version)
+        self.lote.refresh_from_db()
+        self.assertEqual((self.lote.estado, self.lote.version), ('APROBADO', version))
+
+        respuesta = self.limpiar(version=version)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['lote']['version'], version + 1)
+        self.assertEqual(respuesta.json()['lote']['estado'], 'LIMPIO')
+
+    def test_reintenta_la_vista_si_otra_peticion_modifico_el_lote(self):
+        parche, llamadas = self.simular_escritura_concurrente(veces=1)
+        with parche:
+            respuesta = self.limpiar()
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(llamadas), 2)
+        # El primer intento se deshizo completo: un solo evento y un solo proceso de limpieza
+        self.assertEqual(LoteEvento.objects.filter(lote=self.lote, tipo='LIMPIEZA').count(), 1)
+        self.assertEqual(self.lote.procesos.filter(tipo_proceso='LIMPIEZA').count(), 1)
+        self.lote.refresh_from_db()
+        self.assertEqual(self.lote.estado, 'LIMPIO')
+
+    def test_responde_409_al_agotar_los_reintentos(self):
+        parche, llamadas = self.simular_escritura_concurrente(veces=10)
+        with parche:
+            respuesta = self.limpiar()
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertEqual(len(llamadas), 3)
+        self.assertFalse(LoteEvento.objects.filter(lote=self.lote, tipo='LIMPIEZA').exists())
+
+    def test_save_con_una_instancia_vieja_lanza_conflicto(self):
+        vigente = LoteCafe.objects.get(id=self.lote.id)
+        vieja = LoteCafe.objects.get(id=self.lote.id)
+        vigente.observaciones = 'primera'
+        vigente.save()
+        self.assertEqual(vigente.version, self.lote.version + 1)
+
+        vieja.observaciones = 'segunda'
+        with self.assertRaises(ConflictoVersionLote):
+            vieja.save()
+        self.assertEqual(LoteCafe.objects.get(id=self.lote.id).observaciones, 'primera')
+
+    def test_patch_exige_la_version_y_no_cambia_el_estado(self):
+        url = f'/api/users/lotes/{self.lote.id}/'
+        respuesta = self.cliente.patch(url, {'observaciones': 'a', 'estado': 'FINALIZADO', 'version': self.lote.version}, format='json')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['estado'], 'APROBADO')
+
+        respuesta = self.cliente.patch(url, {'observaciones': 'b', 'version': self.lote.version}, format='json')
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertEqual(LoteCafe.objects.get(id=self.lote.id).observaciones, 'a')
+
+    def test_respuesta_de_error_descarta_lo_escrito(self):
+        @reintentar_si_conflicto
+        def vista(request):
+            Organizacion.objects.create(nombre='Escrita antes del error')
+            return Response({'error': 'inválido'}, status=400)
+
+        self.assertEqual(vista(SimpleNamespace(data={})).status_code, 400)
+        self.assertFalse(Organizacion.objects.filter(nombre='Escrita antes del error').exists())
+
+class LoteEventoTests(PruebaAPI):
+    def setUp(self):
+        super().setUp()
+        self.lote = self.crear_lote('L-028', [('Ana Pérez', '0300000001', 10), ('Luis Gómez', '0300000002', 5)])
+        self.url = f"/api/users/lotes/{self.lote['id']}/eventos/"
+
+    def test_historial_registra_cada_paso_sin_reescribir_observaciones(self):
+        respuesta = self.cliente.post('/api/users/muestras/seleccionar/', {
+            'lote_id': self.lote['id'], 'propietarios_seleccionados': [p['id'] for p in self.lote['propietarios']]
+        }, format='json')
+        for muestra in respuesta.json()['muestras']:
+            self.registrar_resultado(muestra['id'], 'APROBADA')
+
+        eventos = self.cliente.get(self.url).json()
+        self.assertEqual([evento['tipo'] for evento in eventos], ['LOTE_CREADO', 'MUESTRAS_SELECCIONADAS', 'RESULTADO_MUESTRA', 'RESULTADO_MUESTRA'])
+        self.assertEqual(eventos[0]['datos']['propietarios'], [p['id'] for p in self.lote['propietarios']])
+        self.assertEqual(LoteCafe.objects.get(id=self.lote['id']).observaciones, '')
+
+        self.assertEqual(len(self.cliente.get(self.url, {'tipo': 'RESULTADO_MUESTRA'}).json()), 2)
+
+    def test_filtro_desde(self):
+        self.assertEqual(len(self.cliente.get(self.url, {'desde': '2020-01-01'}).json()), 1)
+        self.assertEqual(len(self.cliente.get(self.url, {'desde': '2020-01-01T10:00:00-05:00'}).json()), 1)
+        self.assertEqual(self.cliente.get(self.url, {'desde': '2999-01-01'}).json(), [])
+        for desde in ['ayer', '2020-13-01']:
+            self.assertEqual(self.cliente.get(self.url, {'desde': desde}).status_code, 400)
+
+    def test_eventos_inmutables(self):
+        evento = LoteEvento.objects.get(lote_id=self.lote['id'])
+        evento.datos = {}
+        with self.assertRaises(ValueError):
+            evento.save()
+
+        solicitud = RequestFactory().get('/')
+        solicitud.user = self.usuario
+        modelo_admin = admin.site._registry[LoteEvento]
+        self.assertFalse(modelo_admin.has_add_permission(solicitud))
+        self.assertFalse(modelo_admin.has_delete_permission(solicitud, evento))
+
+class TrabajoAsincronoTests(PruebaAPI):
+    def test_reclama_el_mas_antiguo_una_sola_vez(self):
+        primero = trabajos.encolar('EXPORTAR_BITACORA_CSV', self.usuario)
+        segundo = trabajos.encolar('EXPORTAR_BITACORA_CSV', self.usuario)
+
+        reclamado = trabajos.reclamar_siguiente()
+        self.assertEqual(reclamado.id, primero.id)
+        self.assertEqual((reclamado.estado, reclamado.intentos), ('EN_EJECUCION', 1))
+        self.assertEqual(trabajos.reclamar_siguiente().id, segundo.id)
+        self.assertIsNone(trabajos.reclamar_siguiente())
+
+    def test_tipo_desconocido(self):
+        with self.assertRaises(ValueError):
+            trabajos.encolar('NO_EXISTE')
+
+    def test_exportacion_en_segundo_plano_y_descarga(self):
+        respuesta = self.cliente.post('/api/users/bitacora/exportar-csv/', {'asincrono': True, 'filtros': {}}, format='json')
+        self.assertEqual(respuesta.status_code, 202)
+        trabajo_id = respuesta.json()['trabajo']['id']
+        self.assertEqual(self.cliente.get(f'/api/users/trabajos/{trabajo_id}/descargar/').status_code, 409)
+
+        self.assertTrue(trabajos.ejecutar(trabajos.reclamar_siguiente().id))
+        trabajo = TrabajoAsincrono.objects.get(id=trabajo_id)
+        self.assertEqual((trabajo.estado, trabajo.progreso), ('COMPLETADO', 100))
+        self.assertEqual(trabajo.resultado, {'total_registros': 1})
+
+        respuesta = self.cliente.get(f'/api/users/trabajos/{trabajo_id}/descargar/')
+        self.assertEqual(respuesta.status_code, 200)
+        contenido = b''.join(respuesta.streaming_content).decode('utf-8-sig')
+        self.assertTrue(contenido.startswith('fecha,usuario,accion'))
+        self.assertIn('admin', contenido)
+
+    def test_error_del_manejador_marca_el_trabajo_fallido(self):
+        trabajo = trabajos.encolar('EXPORTAR_BITACORA_CSV')
+        with mock.patch.dict(trabajos.MANEJADORES, {'EXPORTAR_BITACORA_CSV': 'users.tests.manejador_fallido'}):
+            self.assertFalse(trabajos.ejecutar(trabajos.reclamar_siguiente().id))
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, 'FALLIDO')
+        self.assertIn('Fallo del manejador', trabajo.error)
+
+    @override_settings(TRABAJOS_TIEMPO_MAXIMO_MINUTOS=30, TRABAJOS_MAX_INTENTOS=3)
+    def test_recupera_los_trabajos_abandonados(self):
+        hace_una_hora = timezone.now() - timedelta(hours=1)
+        reintentable = TrabajoAsincrono.objects.create(tipo='EXPORTAR_BITACORA_CSV', estado='EN_EJECUCION', fecha_inicio=hace_una_hora, intentos=1)
+        agotado = TrabajoAsincrono.objects.create(tipo='EXPORTAR_BITACORA_CSV', estado='EN_EJECUCION', fecha_inicio=hace_una_hora, intentos=3)
+        propio = TrabajoAsincrono.objects.create(tipo='EXPORTAR_BITACORA_CSV', estado='EN_EJECUCION', fecha_inicio=hace_una_hora, intentos=1)
+        reciente = TrabajoAsincrono.objects.create(tipo='EXPORTAR_BITACORA_CSV', estado='EN_EJECUCION', fecha_inicio=timezone.now(), intentos=1)
+
+        self.assertEqual(trabajos.recuperar_abandonados(excluir=[propio.id]), (1, 1))
+        estados = dict(TrabajoAsincrono.objects.values_list('id', 'estado'))
+        self.assertEqual(estados, {
+            reintentable.id: 'PENDIENTE', agotado.id: 'FALLIDO', propio.id: 'EN_EJECUCION', reciente.id: 'EN_EJECUCION'
+        })
+
+class ReportePdfTests(PruebaAPI):
+    def setUp(self):
+        super().setUp()
+        self.lote = LoteCafe.objects.get(id=self.crear_lote('L-030', [('Ana <b>Pérez', '0400000001', 10), ('Luis & Co', '0400000002', 5)])['id'])
+        self.url = f'/api/users/lotes/{self.lote.id}/reporte-separacion/pdf/'
+
+    def test_se_genera_en_segundo_plano_y_se_sirve_con_etag_y_rangos(self):
+        respuesta = self.cliente.get(self.url)
+        self.assertEqual(respuesta.status_code, 202)
+        trabajo_id = respuesta.json()['trabajo']['id']
+        self.assertEqual(self.cliente.get(self.url).json()['trabajo']['id'], trabajo_id)
+
+        self.assertTrue(trabajos.ejecutar(trabajos.reclamar_siguiente().id))
+        respuesta = self.cliente.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(respuesta.streaming_content).startswith(b'%PDF'))
+        etag = respuesta['ETag']
+
+        respuesta = self.cliente.get(self.url, HTTP_RANGE='bytes=0-99')
+        self.assertEqual(respuesta.status_code, 206)
+        self.assertEqual(len(b''.join(respuesta.streaming_content)), 100)
+        self.assertEqual(self.cliente.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_version_cambia_con_los_datos_impresos(self):
+        version = reportes.version_contenido(self.lote)
+        self.assertEqual(reportes.version_contenido(self.lote), version)
+
+        maestro = PropietarioMaestro.objects.get(cedula='0400000001')
+        maestro.nombre_completo = 'Ana Pérez Gómez'
+        maestro.save()
+        renombrado = reportes.version_contenido(self.lote)
+        self.assertNotEqual(renombrado, version)
+
+        PropietarioCafe.objects.filter(lote=self.lote, cedula='0400000002').update(direccion='Nueva dirección')
+        self.assertNotEqual(reportes.version_contenido(self.lote), renombrado)
+
+    def test_nueva_version_reemplaza_la_anterior(self):
+        ruta, _ = reportes.generar_pdf('separacion', self.lote)
+        PropietarioCafe.objects.filter(lote=self.lote, cedula='0400000002').update(direccion='Otra')
+        nueva, _ = reportes.generar_pdf('separacion', self.lote)
+        self.assertNotEqual(nueva, ruta)
+        self.assertTrue(nueva.exists())
+        self.assertFalse(ruta.exists())
+        self.assertEqual(list(nueva.parent.glob('*.tmp')), [])
+
+    def test_recepcion_final_exige_lote_finalizado(self):
+        respuesta = self.cliente.get(f'/api/users/lotes/{self.lote.id}/reporte-recepcion-final/pdf/')
+        self.assertEqual(respuesta.status_code, 400)
+
+class CrearLoteConPropietariosTests(PruebaAPI):
+    def datos_lote(self, numero, propietarios):
+        return {
+            'organizacion': self.organizacion.id, 'numero_lote': numero, 'fecha_entrega': '2026-01-01T10:00:00Z',
+            'total_quintales': 10, 'peso_total_inicial': '1000.00', 'propietarios': propietarios,
+        }
+
+    def nuevos(self, prefijo, cantidad):
+        return [
+            {'nombre_completo': f'Productor {i}', 'cedula': f'{prefijo}{i:06d}', 'quintales_entregados': 1.5, 'telefono': '099'}
+            for i in range(cantidad)
+        ]
+
+    def test_consultas_no_crecen_con_los_propietarios(self):
+        consultas = []
+        for numero, prefijo, cantidad in [('L-031-A', '0510', 3), ('L-031-B', '0520', 40)]:
+            with CaptureQueriesContext(connection) as contexto:
+                respuesta = self.cliente.post('/api/users/lotes/crear-con-propietarios/', self.datos_lote(numero, self.nuevos(prefijo, cantidad)), format='json')
+            self.assertEqual(respuesta.status_code, 201)
+            consultas.append(len(contexto.captured_queries))
+        self.assertEqual(consultas[0], consultas[1])
+
+        lote = LoteCafe.objects.get(numero_lote='L-031-B')
+        self.assertEqual(lote.propietarios.count(), 40)
+        self.assertEqual(EstadoAnalisisPropietario.objects.filter(lote=lote, estado='SIN_MUESTRA').count(), 40)
+        self.assertEqual(PropietarioMaestro.objects.filter(cedula__startswith='0520').count(), 40)
+
+    def test_usa_y_actualiza_los_maestros_existentes(self):
+        por_id = PropietarioMaestro.objects.create(nombre_completo='Rosa Mora', cedula='0530000001', telefono='111')
+        por_cedula = PropietarioMaestro.objects.create(nombre_completo='Nombre Viejo', cedula='0530000002', telefono='222')
+        anterior = self.crear_lote('L-031-C', [('Nombre Viejo', '0530000002', 2)])
+
+        respuesta = self.cliente.post('/api/users/lotes/crear-con-propietarios/', self.datos_lote('L-031-D', [
+            {'propietario_maestro_id': por_id.id, 'quintales_entregados': 2},
+            {'nombre_completo': 'Nombre Nuevo', 'cedula': '0530000002', 'quintales_entregados': 3, 'comunidad': 'El Valle'},
+        ]), format='json')
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual(PropietarioMaestro.objects.filter(cedula__in=['0530000001', '0530000002']).count(), 2)
+
+        por_cedula.refresh_from_db()
+        self.assertEqual((por_cedula.nombre_completo, por_cedula.comunidad), ('Nombre Nuevo', 'El Valle'))
+        entrega = PropietarioCafe.objects.get(lote__numero_lote='L-031-D', propietario_maestro=por_id)
+        self.assertEqual((entrega.nombre_completo, entrega.telefono, entrega.cedula), ('Rosa Mora', '111', '0530000001'))
+        # La entrega anterior conserva los datos con los que se registró
+        self.assertEqual(PropietarioCafe.objects.get(lote_id=anterior['id']).nombre_completo, 'Nombre Viejo')
+
+    def test_datos_invalidos_no_crean_nada(self):
+        repetidos = self.nuevos('0540', 2) + self.nuevos('0540', 1)
+        respuesta = self.cliente.post('/api/users/lotes/crear-con-propietarios/', self.datos_lote('L-031-E', repetidos), format='json')
+        self.assertEqual(respuesta.status_code, 400)
+
+        respuesta = self.cliente.post('/api/users/lotes/crear-con-propietarios/', self.datos_lote('L-031-F', [
+            {'propietario_maestro_id': 999999, 'quintales_entregados': 1}
+        ]), format='json')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertFalse(LoteCafe.objects.filter(numero_lote__in=['L-031-E', 'L-031-F']).exists())
+        self.assertFalse(PropietarioMaestro.objects.filter(cedula__startswith='0540').exists())
+
+class BusquedaNormalizadaTests(PruebaAPI):
+    def setUp(self):
+        super().setUp()
+        PropietarioMaestro.objects.create(nombre_completo='José Pérez Ávila', cedula='0610000001')
+        PropietarioMaestro.objects.create(nombre_completo='Josefina Núñez', cedula='0610000002')
+        PropietarioMaestro.objects.create(nombre_completo='José Inactivo', cedula='0610000003', activo=False)
+        PropietarioMaestro.objects.create(nombre_completo='Ana Gómez', cedula='0620000001')
+
+    def autocompletar(self, recurso, **parametros):
+        respuesta = self.cliente.get(f'/api/users/autocompletar/{recurso}/', parametros)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()['resultados']
+
+    def test_normalizar_texto(self):
+        self.assertEqual(normalizar_texto('  José   PÉREZ  Ñuño '), 'jose perez nuno')
+        self.assertEqual(normalizar_texto(None), '')
+
+    def test_columna_normalizada_se_mantiene_al_guardar(self):
+        maestro = PropietarioMaestro.objects.get(cedula='0610000002')
+        self.assertEqual(maestro.nombre_normalizado, 'josefina nunez')
+        maestro.nombre_completo = 'Josefina Muñoz'
+        maestro.save()
+        maestro.refresh_from_db()
+        self.assertEqual(maestro.nombre_normalizado, 'josefina munoz')
+
+        lote = self.crear_lote('L-032', [('Ramón Íñiguez', '0630000001', 4)])
+        self.assertEqual(PropietarioCafe.objects.get(lote_id=lote['id']).nombre_normalizado, 'ramon iniguez')
+        self.assertEqual(PropietarioMaestro.objects.get(cedula='0630000001').nombre_normalizado, 'ramon iniguez')
+
+    def test_autocompletar_maestros_sin_tildes_ni_mayusculas(self):
+        resultados = self.autocompletar('propietarios-maestros', q='JOSE')
+        self.assertEqual([r['nombre_completo'] for r in resultados], ['José Pérez Ávila', 'Josefina Núñez'])
+        self.assertEqual([r['nombre_completo'] for r in self.autocompletar('propietarios-maestros', q='jose perez av')], ['José Pérez Ávila'])
+        self.assertEqual([r['cedula'] for r in self.autocompletar('propietarios-maestros', q='062')], ['0620000001'])
+        self.assertEqual(len(self.autocompletar('propietarios-maestros', q='jose', limite=1)), 1)
+        self.assertEqual(self.autocompletar('propietarios-maestros', q='  '), [])
+        respuesta = self.cliente.get('/api/users/autocompletar/propietarios-maestros/', {'q': 'jose', 'limite': 'x'})
+        self.assertEqual(respuesta.status_code, 400)
+
+    def test_autocompletar_entregas_y_organizaciones(self):
+        lote = self.crear_lote('L-032-B', [('Ramón Íñiguez', '0630000001', 4), ('Rosa Mora', '0630000002', 2)])
+        self.crear_lote('L-032-C', [('Ramón Íñiguez', '0630000001', 3)])
+        self.assertEqual(len(self.autocompletar('propietarios', q='ramon')), 2)
+        resultados = self.autocompletar('propietarios', q='ramon', lote=lote['id'])
+        self.assertEqual([(r['nombre_completo'], r['lote__numero_lote']) for r in resultados], [('Ramón Íñiguez', 'L-032-B')])
+
+        Organizacion.objects.create(nombre='Asociación Agroartesanal El Cóndor')
+        self.assertEqual([r['nombre'] for r in self.autocompletar('organizaciones', q='asociacion agro')], ['Asociación Agroartesanal El Cóndor'])
+
+class ContadoresPropietarioTests(PruebaAPI):
+    def assertContadoresReales(self):
+        reales = PropietarioMaestro.objects.annotate(entregas=Count('entregas_cafe'), quintales=Sum('entregas_cafe__quintales_entregados'))
+        for maestro in reales:
+            self.assertEqual(maestro.total_entregas, maestro.entregas, maestro.cedula)
+            self.assertEqual(maestro.total_quintales_historicos, maestro.quintales or 0, maestro.cedula)
+
+    def test_contadores_siguen_las_entregas(self):
+        primero = self.crear_lote('L-033-A', [('Rosa Mora', '0710000001', 2.5), ('Luis Gómez', '0710000002', 4)])
+        segundo = self.crear_lote('L-033-B', [('Rosa Mora', '0710000001', 1)])
+        rosa = PropietarioMaestro.objects.get(cedula='0710000001')
+        self.assertEqual((rosa.total_entregas, rosa.total_quintales_historicos), (2, Decimal('3.5')))
+
+        entrega = PropietarioCafe.objects.get(lote_id=primero['id'], propietario_maestro=rosa)
+        entrega.quintales_entregados = 5
+        entrega.save()
+        self.assertContadoresReales()
+
+        entrega.propietario_maestro = PropietarioMaestro.objects.get(cedula='0710000002')
+        entrega.save()
+        self.assertContadoresReales()
+
+        respuesta = self.cliente.put(f"/api/users/lotes/{primero['id']}/actualizar/", {
+            'propietarios': [{'nombre_completo': 'Eva Ruiz', 'cedula': '0710000003', 'quintales_entregados': 1}]
+        }, format='json')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertContadoresReales()
+
+        LoteCafe.objects.get(id=segundo['id']).delete()
+        self.assertContadoresReales()
+
+    def test_reconciliar_corrige_contadores(self):
+        self.crear_lote('L-033-C', [('Rosa Mora', '0720000001', 3), ('Luis Gómez', '0720000002', 4)])
+        PropietarioMaestro.objects.update(total_entregas=99, total_quintales_historicos=0)
+
+        salida = StringIO()
+        call_command('reconciliar_contadores_propietarios', stdout=salida)
+        self.assertIn('2 propietarios con contadores corregidos', salida.getvalue())
+        self.assertContadoresReales()
+        self.assertEqual(PropietarioMaestro.reconciliar(), 0)
+
+    def test_filtrar_y_ordenar_por_contadores(self):
+        self.crear_lote('L-033-D', [('Rosa Mora', '0730000001', 3), ('Luis Gómez', '0730000002', 8)])
+        self.crear_lote('L-033-E', [('Rosa Mora', '0730000001', 1)])
+        PropietarioMaestro.objects.create(nombre_completo='Sin Entregas', cedula='0730000003')
+
+        respuesta = self.cliente.get('/api/users/propietarios-maestros/', {'ordering': '-total_quintales_historicos', 'total_entregas__gte': 1})
+        datos = respuesta.json()
+        resultados = datos['results'] if isinstance(datos, dict) else datos
+        self.assertEqual([r['cedula'] for r in resultados], ['0730000002', '0730000001'])
+
+class ImportacionPropietariosTests(PruebaAPI):
+    def importar(self, nombre, contenido):
+        respuesta = self.cliente.post('/api/users/propietarios-maestros/importar/', {
+            'archivo': SimpleUploadedFile(nombre, contenido)
+        }, format='multipart')
+        self.assertEqual(respuesta.status_code, 202, respuesta.content)
+        trabajos.ejecutar(trabajos.reclamar_siguiente().id)
+        return TrabajoAsincrono.objects.get(id=respuesta.json()['trabajo']['id'])
+
+    def test_importa_csv_por_bloques(self):
+        lote = self.crear_lote('L-034', [('Nombre Viejo', '0810000002', 2)])
+        existente = PropietarioMaestro.objects.get(cedula='0810000002')
+        contenido = '\n'.join([
+            'Cédula;Nombre;Teléfono;Provincia',
+            '0810000001;Productor Ñandú;099;Loja',
+            '0810000002;Nombre Nuevo;222;Zamora',
+            '0810000003;Otro;;',
+            '0810000001;Repetido;;',
+            ';Sin cédula;;',
+        ]).encode('utf-8')
+
+        with mock.patch.object(importaciones, 'TAMANO_BLOQUE', 2):
+            trabajo = self.importar('padrón.csv', contenido)
+        self.assertEqual(trabajo.estado, 'COMPLETADO', trabajo.error)
+        resumen = trabajo.resultado
+        self.assertEqual(
+            {clave: resumen[clave] for clave in ['filas', 'creados', 'actualizados', 'duplicados', 'total_errores']},
+            {'filas': 5, 'creados': 2, 'actualizados': 1, 'duplicados': 1, 'total_errores': 1}
+        )
+        self.assertEqual(resumen['errores'], [{'fila': 6, 'cedula': '', 'error': 'Cédula vacía'}])
+
+        nuevo = PropietarioMaestro.objects.get(cedula='0810000001')
+        self.assertEqual((nuevo.nombre_completo, nuevo.nombre_normalizado, nuevo.departamento), ('Productor Ñandú', 'productor nandu', 'Loja'))
+        existente.refresh_from_db()
+        # Las columnas ausentes del archivo no se modifican
+        self.assertEqual((existente.nombre_completo, existente.telefono, existente.comunidad), ('Nombre Nuevo', '222', 'San José'))
+        self.assertEqual(PropietarioCafe.objects.get(lote_id=lote['id']).nombre_completo, 'Nombre Viejo')
+        self.assertFalse((settings.TRABAJOS_DIR / trabajo.parametros['archivo']).exists())
+
+    def test_importa_xlsx(self):
+        from openpyxl import Workbook
+
+        libro = Workbook()
+        libro.active.append(['cedula', 'nombre_completo', 'comunidad'])
+        libro.active.append([1712345678, 'Excel Uno', 'Río'])
+        contenido = BytesIO()
+        libro.save(contenido)
+
+        trabajo = self.importar('padron.xlsx', contenido.getvalue())
+        self.assertEqual(trabajo.estado, 'COMPLETADO', trabajo.error)
+        self.assertEqual(PropietarioMaestro.objects.get(cedula='1712345678').comunidad, 'Río')
+
+    def test_archivos_invalidos(self):
+        trabajo = self.importar('padron.csv', 'telefono,comunidad\n099,X\n'.encode('utf-8'))
+        self.assertEqual(trabajo.estado, 'FALLIDO')
+        self.assertIn('cedula y nombre_completo', trabajo.error)
+
+        respuesta = self.cliente.post('/api/users/propietarios-maestros/importar/', {
+            'archivo': SimpleUploadedFile('padron.txt', b'abc')
+        }, format='multipart')
+        self.assertEqual(respuesta.status_code, 400)
+
+class CacheLRUTests(PruebaAPI):
+    def test_desaloja_el_menos_usado_y_expira(self):
+        cache = CacheLRU('pruebas_lru', maximo=2, ttl_segundos=60)
+        cache.generacion()
+        cache.guardar('a', 1)
+        cache.guardar('b', 2)
+        cache.obtener('a')
+        cache.guardar('c', 3)
+        self.assertEqual(cache.obtener('b'), (False, None))
+        self.assertEqual(cache.obtener('a'), (True, 1))
+
+        with mock.patch('users.cache.time.monotonic', return_value=10 ** 9):
+            self.assertEqual(cache.obtener('a'), (False, None))
+        self.assertEqual(cache.estadisticas()['desalojados'], 1)
+
+    def test_invalidacion_al_confirmar_y_entre_workers(self):
+        cache = CacheLRU('pruebas_generacion', maximo=10, ttl_segundos=60)
+        otro_worker = CacheLRU('pruebas_generacion', maximo=10, ttl_segundos=60)
+        for instancia in (cache, otro_worker):
+            instancia.guardar('clave', 'viejo', instancia.generacion())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.invalidar()
+            # Antes del commit otras transacciones aún leen los datos anteriores
+            self.assertEqual(otro_worker.obtener('clave'), (True, 'viejo'))
+        self.assertEqual(cache.obtener('clave'), (False, None))
+        self.assertEqual(otro_worker.obtener('clave'), (False, None))
+
+    def test_no_guarda_valores_leidos_antes_de_una_invalidacion(self):
+        cache = CacheLRU('pruebas_obsoletos', maximo=10, ttl_segundos=60)
+        generacion = cache.generacion()
+        CacheLRU('pruebas_obsoletos', maximo=10, ttl_segundos=60)._invalidar_ahora()
+        cache.guardar('clave', 'obsoleto', generacion)
+        self.assertEqual(cache.obtener('clave'), (False, None))
+
+    def test_consulta_de_propietarios_por_cedula(self):
+        maestro = PropietarioMaestro.objects.create(nombre_completo='Rosa Mora', cedula='0910000001')
+        self.assertEqual(propietario_por_cedula('0910000001').nombre_completo, 'Rosa Mora')
+        with self.assertNumQueries(0):
+            self.assertEqual(propietario_por_cedula('0910000001').id, maestro.id)
+            propietario_por_cedula('0910000001').nombre_completo = 'Copia modificada'
+            self.assertEqual(propietario_por_cedula('0910000001').nombre_completo, 'Rosa Mora')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            maestro.nombre_completo = 'Rosa Mora Vera'
+            maestro.save()
+        self.assertEqual(propietario_por_cedula('0910000001').nombre_completo, 'Rosa Mora Vera')
+
+        self.assertIsNone(propietario_por_cedula('0919999999'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(propietario_por_cedula('0919999999'))
+
+    def test_lote_de_claves_sincroniza_la_generacion_una_vez(self):
+        cedulas = [f'09200000{numero:02d}' for numero in range(50)]
+        PropietarioMaestro.objects.bulk_create([
+            PropietarioMaestro(nombre_completo=f'Propietario {cedula}', cedula=cedula) for cedula in cedulas
+        ])
+        propietarios_por_cedula(cedulas)
+
+        cache_generaciones = caches[settings.CACHE_GENERACIONES_ALIAS]
+        with mock.patch.object(cache_generaciones, 'get', wraps=cache_generaciones.get) as leer_generacion:
+            with self.assertNumQueries(0):
+                self.assertEqual(set(propietarios_por_cedula(cedulas)), set(cedulas))
+        self.assertEqual(leer_generacion.call_count, 1)
+
+    def test_contadores_actualizados_invalidan_la_cache(self):
+        # Mismos datos que enviará el lote: el maestro no se modifica, solo sus contadores
+        maestro = PropietarioMaestro.objects.create(nombre_completo='Rosa Mora', cedula='0910000001', comunidad='San José')
+        buscar = lambda: self.cliente.get('/api/users/buscar-propietario/0910000001/').json()['propietario']
+        self.assertEqual(buscar()['total_entregas'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.crear_lote('L-035', [('Rosa Mora', '0910000001', 5)])
+        propietario = buscar()
+        self.assertEqual((propietario['total_entregas'], float(propietario['total_quintales_historicos'])), (1, 5.0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PropietarioMaestro.objects.filter(id=maestro.id).update(total_entregas=7)
+            PropietarioMaestro.reconciliar()
+        self.assertEqual(buscar()['total_entregas'], 1)
+
+class DuplicadosPropietariosTests(PruebaAPI):
+    def crear_maestro(self, nombre, cedula, comunidad='El Valle', **campos):
+        return PropietarioMaestro.objects.create(nombre_completo=nombre, cedula=cedula, comunidad=comunidad, **campos)
+
+    def pares(self, candidatos):
+        return {frozenset((candidato['propietario_a'], candidato['propietario_b'])) for candidato in candidatos}
+
+    def test_normalizar_cedula(self):
+        self.assertEqual(duplicados.normalizar_cedula('0102-030405'), duplicados.normalizar_cedula('102030405'))
+        self.assertEqual(duplicados.normalizar_cedula(None), '')
+
+    def test_detecta_nombres_parecidos_en_el_mismo_bloque(self):
+        original = self.crear_maestro('Pérez Gómez José', '0102030405')
+        tipeado = self.crear_maestro('Peréz Gomez Josee', '102030405')
+        invertido = self.crear_maestro('José Pérez Gómez', '1987654321')
+        self.crear_maestro('Torres Vera Ana', '1900000002')
+        self.crear_maestro('Pérez Gómez José', '1900000003', activo=False)
+
+        candidatos = duplicados.detectar_duplicados(umbral=0.8)
+        self.assertEqual(self.pares(candidatos), {frozenset((original.id, tipeado.id))})
+        self.assertTrue(candidatos[0]['misma_cedula'])
+        self.assertGreater(candidatos[0]['puntaje'], 0.9)
+
+        # Nombres y apellidos en otro orden comparten el bloque 'jose'; sin cédula parecida el puntaje es menor
+        self.assertIn(frozenset((original.id, invertido.id)), self.pares(duplicados.detectar_duplicados(umbral=0.6)))
+
+    def test_bloques_grandes_se_dividen_o_se_omiten(self):
+        for numero, nombre in enumerate(['Mora Ana', 'Mora Anita', 'Mora Andrea', 'Mora Bolívar', 'Mora Bolivar']):
+            self.crear_maestro(nombre, f'19100000{numero:02d}', comunidad='')
+
+        with mock.patch.object(duplicados, 'MAXIMO_MIEMBROS_BLOQUE', 2):
+            omitidos = []
+            candidatos = duplicados.detectar_duplicados(umbral=0.9, omitidos=omitidos)
+        # El bloque 'mora' (5) se divide por inicial: 'b' (2) se compara y 'a' (3) se omite
+        self.assertEqual(omitidos, [{'bloque': 'mora / a', 'propietarios': 3}])
+        nombres = {frozenset((candidato['nombre_a'], candidato['nombre_b'])) for candidato in candidatos}
+        self.assertEqual(nombres, {frozenset(('mora bolivar',))})
+
+        salida = StringIO()
+        with mock.patch.object(duplicados, 'MAXIMO_MIEMBROS_BLOQUE', 2):
+            call_command('detectar_propietarios_duplicados', '--umbral', '0.9', stdout=salida)
+        self.assertIn('Bloque omitido por su tamaño: mora / a (3 propietarios)', salida.getvalue())
+
+    def test_fusionar_reasigna_entregas_y_completa_datos(self):
+        lote = self.crear_lote('L-036', [('Rosa Mora', '0110000001', 3), ('Rosa Moraa', '0110000002', 2)])
+        principal = PropietarioMaestro.objects.get(cedula='0110000001')
+        duplicado = PropietarioMaestro.objects.get(cedula='0110000002')
+        PropietarioMaestro.objects.filter(id=principal.id).update(telefono='')
+        PropietarioMaestro.objects.filter(id=duplicado.id).update(telefono='0991234567')
+        principal.refresh_from_db()
+        duplicado.refresh_from_db()
+
+        self.assertEqual(duplicados.fusionar_propietarios(principal, [duplicado], usuario=self.usuario), 1)
+        principal.refresh_from_db()
+        duplicado.refresh_from_db()
+        self.assertEqual((principal.total_entregas, principal.total_quintales_historicos, principal.telefono), (2, 5, '0991234567'))
+        self.assertEqual((duplicado.activo, duplicado.total_entregas), (False, 0))
+        entrega = PropietarioCafe.objects.get(lote_id=lote['id'], cedula='0110000002')
+        self.assertEqual((entrega.propietario_maestro_id, entrega.nombre_completo), (principal.id, 'Rosa Moraa'))
+        self.assertTrue(RegistroBitacora.objects.filter(accion='FUSIONAR_PROPIETARIOS').exists())
+
+class HistorialCalidadTests(PruebaAPI):
+    def setUp(self):
+        super().setUp()
+        enero = self.crear_lote('L-037-1', [('Ana Pérez', '0120000001', 10), ('Luis Gómez', '0120000002', 5)])
+        febrero = self.crear_lote('L-037-2', [('Ana Pérez', '0120000001', 4)], fecha_entrega='2026-02-15T10:00:00Z')
+        ana_enero, luis = (PropietarioCafe.objects.get(id=p['id']) for p in enero['propietarios'])
+        ana_febrero = PropietarioCafe.objects.get(id=febrero['propietarios'][0]['id'])
+        self.ana, self.luis = ana_enero.propietario_maestro_id, luis.propietario_maestro_id
+
+        contaminada = self.crear_muestra(ana_enero, 'CONTAMINADA')
+        self.crear_muestra(ana_enero, 'APROBADA', muestra_original=contaminada, es_segundo_muestreo=True)
+        self.crear_muestra(ana_febrero, 'APROBADA')
+        self.crear_muestra(luis, 'PENDIENTE')
+
+    def crear_muestra(self, propietario, estado, **campos):
+        return MuestraCafe.objects.create(
+            lote_id=propietario.lote_id, propietario=propietario, numero_muestra=f'M-{MuestraCafe.objects.count() + 1}',
+            estado=estado, analista=self.usuario, **campos
+        )
+
+    def test_historial_de_un_propietario(self):
+        historial = self.cliente.get(f'/api/users/propietarios-maestros/{self.ana}/historial-calidad/').json()
+        self.assertEqual((historial['total_entregas'], historial['total_quintales']), (2, 14.0))
+        self.assertEqual((historial['entregas_contaminadas'], historial['quintales_contaminados']), (1, 10.0))
+        self.assertEqual(historial['primer_muestreo'], {'muestras': 2, 'analizadas': 2, 'contaminadas': 1, 'tasa_contaminacion': 0.5})
+        self.assertEqual(historial['segundo_muestreo'], {'muestras': 1, 'analizadas': 1, 'contaminadas': 0, 'tasa_contaminacion': 0.0})
+        # (1 + 0) contaminadas / (2 analizadas + 2 muestras previas)
+        self.assertEqual(historial['indice_riesgo'], 0.25)
+        self.assertEqual(historial['historial'], [
+            {'periodo': '2026-01', 'entregas': 1, 'quintales': 10.0, 'tasa_contaminacion_primer_muestreo': 1.0,
+             'tasa_contaminacion_segundo_muestreo': 0.0, 'muestras_analizadas': 2},
+            {'periodo': '2026-02', 'entregas': 1, 'quintales': 4.0, 'tasa_contaminacion_primer_muestreo': 0.0,
+             'tasa_contaminacion_segundo_muestreo': None, 'muestras_analizadas': 1},
+        ])
+
+        anual = self.cliente.get(f'/api/users/propietarios-maestros/{self.ana}/historial-calidad/', {'periodo': 'anio'}).json()
+        self.assertEqual([(p['periodo'], p['entregas']) for p in anual['historial']], [('2026', 2)])
+        self.assertEqual(self.cliente.get(f'/api/users/propietarios-maestros/{self.ana}/historial-calidad/', {'periodo': 'semana'}).status_code, 400)
+        self.assertEqual(self.cliente.get('/api/users/propietarios-maestros/999999/historial-calidad/').status_code, 404)
+
+    def test_lote_de_propietarios_en_una_consulta_y_cache(self):
+        with self.assertNumQueries(2):
+            respuesta = self.cliente.get('/api/users/propietarios-maestros/historial-calidad/', {'ids': f'{self.luis},{self.ana}'}).json()
+        self.assertEqual([p['propietario_maestro'] for p in respuesta['propietarios']], [self.luis, self.ana])
+        self.assertNotIn('historial', respuesta['propietarios'][0])
+        luis = respuesta['propietarios'][0]
+        self.assertEqual((luis['nombre_completo'], luis['primer_muestreo']['tasa_contaminacion']), ('Luis Gómez', None))
+
+        with self.assertNumQueries(0):
+            self.cliente.get('/api/users/propietarios-maestros/historial-calidad/', {'ids': f'{self.luis},{self.ana}'})
+
+        # Un nuevo resultado invalida la caché al confirmar la transacción
+        with self.captureOnCommitCallbacks(execute=True):
+            muestra = MuestraCafe.objects.get(propietario__propietario_maestro_id=self.luis)
+            muestra.estado = 'CONTAMINADA'
+            muestra.save()
+        respuesta = self.cliente.get('/api/users/propietarios-maestros/historial-calidad/', {'ids': str(self.luis)}).json()
+        self.assertEqual(respuesta['propietarios'][0]['primer_muestreo']['tasa_contaminacion'], 1.0)
+
+    def test_ranking_de_riesgo_por_organizacion(self):
+        respuesta = self.cliente.get('/api/users/propietarios-maestros/historial-calidad/', {
+            'organizacion': self.organizacion.id, 'incluir_historial': 'true'
+        }).json()
+        self.assertEqual([p['propietario_maestro'] for p in respuesta['propietarios']], [self.ana, self.luis])
+        self.assertEqual(len(respuesta['propietarios'][0]['historial']), 2)
+
+        otra = Organizacion.objects.create(nombre='Otra')
+        self.assertEqual(self.cliente.get('/api/users/propietarios-maestros/historial-calidad/', {'organizacion': otra.id}).json()['count'], 0)
+        self.assertEqual(self.cliente.get('/api/users/propietarios-maestros/historial-calidad/', {'organizacion': 999999}).status_code, 404)
+        self.assertEqual(self.cliente.get('/api/users/propietarios-maestros/historial-calidad/').status_code, 400)
+
+class ActualizarLoteTests(PruebaAPI):
+    def setUp(self):
+        super().setUp()
+        self.datos = [('Ana Pérez', '0130000001', 10), ('Luis Gómez', '0130000002', 5), ('Eva Ruiz', '0130000003', 5)]
+        self.lote = self.crear_lote('L-038', self.datos)
+        self.entregas = {p['cedula']: p['id'] for p in self.lote['propietarios']}
+        for numero, entrega_id in enumerate(self.entregas.values()):
+            MuestraCafe.objects.create(lote_id=self.lote['id'], propietario_id=entrega_id, numero_muestra=f'M-{numero}', analista=self.usuario)
+
+    def actualizar(self, propietarios):
+        return self.cliente.put(f"/api/users/lotes/{self.lote['id']}/actualizar/", {
+            'propietarios': [
+                {'nombre_completo': nombre, 'cedula': cedula, 'quintales_entregados': quintales}
+                for nombre, cedula, quintales in propietarios
+            ]
+        }, format='json')
+
+    def escrituras(self, consultas):
+        sentencias = [consulta['sql'] for consulta in consultas if 'users_propietariocafe' in consulta['sql'].split(' WHERE ')[0]]
+        return [sentencia.split()[0] for sentencia in sentencias if not sentencia.startswith('SELECT')]
+
+    def test_editar_quintales_modifica_solo_esa_entrega(self):
+        datos = list(self.datos)
+        datos[1] = ('Luis Gómez', '0130000002', 7)
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.actualizar(datos)
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        self.assertEqual(self.escrituras(consultas), ['UPDATE'])
+
+        # Las entregas conservan su id y sus muestras
+        self.assertEqual(dict(PropietarioCafe.objects.filter(lote_id=self.lote['id']).values_list('cedula', 'id')), self.entregas)
+        self.assertEqual(MuestraCafe.objects.filter(lote_id=self.lote['id']).count(), 3)
+        luis = PropietarioCafe.objects.get(id=self.entregas['0130000002'])
+        self.assertEqual(luis.quintales_entregados, Decimal('7.00'))
+        self.assertEqual(luis.propietario_maestro.total_quintales_historicos, 7)
+        self.assertEqual(EstadoAnalisisPropietario.objects.get(propietario=luis).quintales, 7)
+        evento = LoteEvento.objects.filter(lote_id=self.lote['id'], tipo='LOTE_ACTUALIZADO').get()
+        self.assertEqual(evento.datos['propietarios'], {'actualizados': ['0130000002'], 'creados': [], 'eliminados': []})
+
+    def test_agregar_y_quitar_propietarios(self):
+        respuesta = self.actualizar(self.datos[:2] + [('Rosa Mora', '0130000004', 8)])
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+
+        cedulas = set(PropietarioCafe.objects.filter(lote_id=self.lote['id']).values_list('cedula', flat=True))
+        self.assertEqual(cedulas, {'0130000001', '0130000002', '0130000004'})
+        self.assertFalse(MuestraCafe.objects.filter(propietario_id=self.entregas['0130000003']).exists())
+        self.assertEqual(MuestraCafe.objects.filter(lote_id=self.lote['id']).count(), 2)
+
+        eva = PropietarioMaestro.objects.get(cedula='0130000003')
+        self.assertEqual((eva.total_entregas, eva.total_quintales_historicos), (0, 0))
+        rosa = PropietarioCafe.objects.get(lote_id=self.lote['id'], cedula='0130000004')
+        self.assertEqual(EstadoAnalisisPropietario.objects.get(propietario=rosa).estado, 'SIN_MUESTRA')
+
+    def test_datos_omitidos_se_heredan_del_maestro(self):
+        PropietarioMaestro.objects.create(nombre_completo='Rosa Mora', cedula='0130000004', telefono='0981111111')
+        datos = [{'nombre_completo': nombre, 'cedula': cedula, 'quintales_entregados': quintales} for nombre, cedula, quintales in self.datos]
+        respuesta = self.cliente.put(f"/api/users/lotes/{self.lote['id']}/actualizar/", {
+            'propietarios': datos + [{'cedula': '0130000004', 'quintales_entregados': 8}]
+        }, format='json')
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+
+        rosa = PropietarioCafe.objects.get(lote_id=self.lote['id'], cedula='0130000004')
+        self.assertEqual((rosa.nombre_completo, rosa.telefono), ('Rosa Mora', '0981111111'))
+        self.assertEqual((rosa.nombre_completo_propio, rosa.telefono_propio), (None, None))
+
+    def test_maestros_se_leen_de_la_base_de_datos(self):
+        # La caché recuerda la cédula como inexistente; la invalidación llegaría recién al commit
+        self.assertIsNone(propietario_por_cedula('0130000004'))
+        maestro = PropietarioMaestro.objects.create(nombre_completo='Rosa Mora', cedula='0130000004')
+        self.assertIsNone(propietario_por_cedula('0130000004'))
+
+        self.assertEqual(self.actualizar(self.datos + [('Rosa Mora', '0130000004', 8)]).status_code, 200)
+        rosa = PropietarioCafe.objects.get(lote_id=self.lote['id'], cedula='0130000004')
+        self.assertEqual(rosa.propietario_maestro_id, maestro.id)
+        maestro.refresh_from_db()
+        self.assertEqual((maestro.total_entregas, maestro.total_quintales_historicos), (1, 8))
+
+    def test_cedula_repetida_no_modifica_el_lote(self):
+        respuesta = self.actualizar(self.datos + [('Ana Pérez', '0130000001', 2)])
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('repetida', respuesta.json()['error'])
+        self.assertEqual(PropietarioCafe.objects.filter(lote_id=self.lote['id']).count(), 3)
+
+class EntregaCompactaTests(PruebaAPI):
+    def setUp(self):
+        super().setUp()
+        self.lote = self.crear_lote('L-039', [('Ana Pérez', '0140000001', 10), ('Luis Gómez', '0140000002', 5)])
+        self.ana = PropietarioCafe.objects.get(lote_id=self.lote['id'], cedula='0140000001')
+
+    def test_entrega_guarda_solo_lo_que_difiere_del_maestro(self):
+        self.assertIsNone(self.ana.nombre_completo_propio)
+        self.assertIsNone(self.ana.comunidad_propio)
+        self.assertEqual((self.ana.nombre_completo, self.ana.comunidad), ('Ana Pérez', 'San José'))
+
+        self.ana.telefono = '0990000000'
+        self.ana.save()
+        self.ana.refresh_from_db()
+        self.assertEqual((self.ana.telefono_propio, self.ana.telefono), ('0990000000', '0990000000'))
+        self.assertIsNone(self.ana.nombre_completo_propio)
+
+    def test_datos_vacios_se_heredan_del_maestro(self):
+        maestro = self.ana.propietario_maestro
+        maestro.telefono = '0981111111'
+        maestro.save()
+        otro_lote = LoteCafe.objects.get(id=self.crear_lote('L-039-3', [('Luis Gómez', '0140000002', 1)])['id'])
+        entrega = PropietarioCafe(lote=otro_lote, propietario_maestro=maestro, quintales_entregados=2,
+                                  nombre_completo='', telefono='', comunidad='')
+        entrega.save()
+        entrega = PropietarioCafe.objects.get(id=entrega.id)
+        self.assertEqual((entrega.nombre_completo_propio, entrega.telefono_propio, entrega.comunidad_propio), (None, None, None))
+        self.assertEqual((entrega.nombre_completo, entrega.telefono, entrega.cedula), ('Ana Pérez', '0981111111', '0140000001'))
+
+    def test_cambios_del_maestro_no_alteran_entregas_anteriores(self):
+        maestro = self.ana.propietario_maestro
+        maestro.nombre_completo = 'Ana María Pérez'
+        maestro.comunidad = 'El Valle'
+        maestro.save()
+
+        self.ana.refresh_from_db()
+        self.assertEqual((self.ana.nombre_completo_propio, self.ana.comunidad_propio), ('Ana Pérez', 'San José'))
+        self.assertIsNone(self.ana.telefono_propio)
+
+        lote = self.crear_lote('L-039-2', [('Ana María Pérez', '0140000001', 3)])
+        nueva = PropietarioCafe.objects.get(lote_id=lote['id'])
+        self.assertEqual((nueva.nombre_completo_propio, nueva.nombre_completo), (None, 'Ana María Pérez'))
+
+    def test_listado_de_muestras_no_consulta_el_maestro_por_fila(self):
+        def consultas_listado():
+            with CaptureQueriesContext(connection) as consultas:
+                respuesta = self.cliente.get('/api/users/muestras/', {'lote_id': self.lote['id']})
+            self.assertEqual(respuesta.status_code, 200)
+            return len(consultas)
+
+        entregas = list(PropietarioCafe.objects.filter(lote_id=self.lote['id']))
+        MuestraCafe.objects.create(lote_id=self.lote['id'], propietario=entregas[0], numero_muestra='M-1', analista=self.usuario)
+        una = consultas_listado()
+        for numero, entrega in enumerate(entregas * 3):
+            MuestraCafe.objects.create(lote_id=self.lote['id'], propietario=entrega, numero_muestra=f'M-{numero + 2}', analista=self.usuario)
+        self.assertEqual(consultas_listado(), una)
+
+    def test_migracion_compacta_y_expande_las_entregas(self):
+        migracion = importlib.import_module('users.migrations.0010_compactar_propietario_cafe')
+        PropietarioCafe.objects.filter(lote_id=self.lote['id']).update(nombre_completo_propio='Repetido')
+        PropietarioCafe.objects.filter(id=self.ana.id).update(nombre_completo_propio='Ana Pérez', comunidad_propio='San José')
+
+        migracion.compactar_entregas(django_apps, None)
+        self.assertEqual(
+            dict(PropietarioCafe.objects.filter(lote_id=self.lote['id']).values_list('cedula', 'nombre_completo_propio')),
+            {'0140000001': None, '0140000002': 'Repetido'}
+        )
+        self.assertIsNone(PropietarioCafe.objects.get(id=self.ana.id).comunidad_propio)
+
+        migracion.expandir_entregas(django_apps, None)
+        ana = PropietarioCafe.objects.get(id=self.ana.id)
+        self.assertEqual((ana.nombre_completo_propio, ana.comunidad_propio, ana.calle_propio), ('Ana Pérez', 'San José', ''))
+
+    def test_informe_de_tamano_de_tablas(self):
+        salida = StringIO()
+        call_command('tamano_tablas', '--tabla', PropietarioCafe._meta.db_table, stdout=salida)
+        self.assertIn('Filas: 2', salida.getvalue())
+        self.assertIn('nombre_normalizado', salida.getvalue())
+
+class MovimientoInventarioTests(PruebaAPI):
+    def setUp(self):
+        super().setUp()
+        self.insumo = Insumo.objects.create(nombre='Sacos de yute', tipo='CONTENEDOR', codigo='SAC-040', cantidad_disponible=10, unidad_medida='SACO')
+        MovimientoInventario.registrar_existencia_inicial(self.insumo, usuario=self.usuario)
+
+    def saldo(self):
+        return Insumo.objects.get(id=self.insumo.id).cantidad_disponible
+
+    def test_el_libro_cuadra_con_la_existencia(self):
+        MovimientoInventario.registrar(self.insumo, 'ENTRADA', 5, usuario=self.usuario)
+        MovimientoInventario.registrar(self.insumo, 'SALIDA', 3, usuario=self.usuario)
+        ajuste = MovimientoInventario.ajustar(self.insumo, 7, usuario=self.usuario)
+        self.assertEqual((ajuste.tipo, ajuste.cantidad, ajuste.saldo_anterior, ajuste.saldo_resultante), ('AJUSTE', -5, 12, 7))
+
+        movimientos = list(MovimientoInventario.objects.filter(insumo=self.insumo).order_by('id'))
+        self.assertEqual([m.cantidad for m in movimientos], [10, 5, -3, -5])
+        self.assertEqual([m.saldo_resultante for m in movimientos], [10, 15, 12, 7])
+        self.assertEqual(self.saldo(), sum(m.cantidad for m in movimientos))
+        self.assertEqual(self.insumo.cantidad_disponible, 7)
+
+        # Un ajuste al mismo valor deja un movimiento en cero
+        self.assertEqual(MovimientoInventario.ajustar(self.insumo, 7).cantidad, 0)
+
+    def test_salida_mayor_que_la_existencia(self):
+        with self.assertRaises(StockInsuficiente):
+            MovimientoInventario.registrar(self.insumo, 'SALIDA', 11, exigir_existencia=True)
+        self.assertEqual(self.saldo(), 10)
+        self.assertEqual(MovimientoInventario.objects.filter(insumo=self.insumo).count(), 1)
+
+        respuesta = self.cliente.post(f'/api/users/insumos/{self.insumo.id}/actualizar-stock/', {'tipo_movimiento': 'SALIDA', 'cantidad': 11}, format='json')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('Stock insuficiente', respuesta.json()['error'])
+
+        respuesta = self.cliente.post(f'/api/users/insumos/{self.insumo.id}/actualizar-stock/', {'tipo_movimiento': 'SALIDA', 'cantidad': 4}, format='json')
+        self.assertEqual(respuesta.json()['movimiento'], {
+            'id': respuesta.json()['movimiento']['id'], 'cantidad_anterior': 10.0, 'cantidad_nueva': 6.0, 'diferencia': -4.0, 'tipo_movimiento': 'SALIDA'
+        })
+        self.assertEqual(self.saldo(), 6)
+
+    def test_existencias_a_una_fecha(self):
+        entrada = MovimientoInventario.registrar(self.insumo, 'ENTRADA', 5)
+        salida = MovimientoInventario.registrar(self.insumo, 'SALIDA', 8)
+        fechas = {'2026-03-01T12:00:00Z': self.insumo.movimientos.earliest('id'), '2026-03-05T12:00:00Z': entrada, '2026-03-10T12:00:00Z': salida}
+        for fecha, movimiento in fechas.items():
+            MovimientoInventario.objects.filter(id=movimiento.id).update(fecha=fecha)
+        otro = Insumo.objects.create(nombre='Balanza', tipo='BALANZA', codigo='BAL-040')
+
+        def existencias(fecha):
+            respuesta = self.cliente.get('/api/users/inventario/existencias/', {'fecha': fecha}).json()
+            return {insumo['codigo']: insumo['existencia'] for insumo in respuesta['insumos']}
+
+        self.assertEqual(existencias('2026-02-28'), {'SAC-040': 0.0, 'BAL-040': 0.0})
+        self.assertEqual(existencias('2026-03-05')['SAC-040'], 15.0)
+        self.assertEqual(existencias('2026-03-09')['SAC-040'], 15.0)
+        self.assertEqual(existencias('2026-03-10')['SAC-040'], 7.0)
+        anotados = MovimientoInventario.existencias_a_fecha(Insumo.objects.filter(id=otro.id), timezone.now())
+        self.assertIsNone(anotados.get().existencia)
+
+class PronosticoInventarioTests(PruebaAPI):
+    def crear_insumo(self, codigo, disponible, minima, consumos=()):
+        """`consumos` son (días atrás, cantidad) de salidas ya registradas"""
+        insumo = Insumo.objects.create(nombre=codigo, tipo='OTRO', codigo=codigo, cantidad_disponible=disponible, cantidad_minima=minima)
+        ahora = timezone.now()
+        for dias, cantidad in consumos:
+            MovimientoInventario.objects.create(insumo=insumo, tipo='SALIDA', cantidad=-cantidad, saldo_resultante=0, fecha=ahora - timedelta(days=dias))
+        return insumo
+
+    def pronostico(self, **parametros):
+        respuesta = self.cliente.get('/api/users/inventario/pronostico/', {'plazo_entrega': 7, **parametros})
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        return {insumo['codigo']: insumo for insumo in respuesta.json()['insumos']}
+
+    def test_tasas_cobertura_y_reorden(self):
+        self.crear_insumo('CONSTANTE', 40, 5, [(dias, 2) for dias in range(30)])
+        self.crear_insumo('ACELERADO', 100, 0, [(dias, 7) for dias in range(7)])
+        self.crear_insumo('BAJO_MINIMO', 3, 5)
+        self.crear_insumo('QUIETO', 50, 5, [(120, 10)])
+        hoy = timezone.localdate()
+
+        pronostico = self.pronostico()
+        self.assertEqual(list(pronostico), ['BAJO_MINIMO', 'ACELERADO', 'CONSTANTE', 'QUIETO'])
+
+        constante = pronostico['CONSTANTE']
+        self.assertEqual((constante['consumo_diario_7_dias'], constante['consumo_diario_30_dias'], constante['consumo_diario']), (2.0, 2.0, 2.0))
+        # Sin variación el punto de reorden es el consumo del plazo: 2 × 7
+        self.assertEqual((constante['punto_reorden'], constante['dias_cobertura']), (14.0, 20.0))
+        self.assertEqual(constante['fecha_reorden'], (hoy + timedelta(days=13)).isoformat())
+        self.assertFalse(constante['reponer_ahora'])
+
+        # La última semana manda sobre la media de 30 días
+        acelerado = pronostico['ACELERADO']
+        self.assertEqual((acelerado['consumo_diario'], acelerado['consumo_diario_30_dias']), (7.0, round(49 / 30, 4)))
+        media = 49 / 30
+        desviacion = ((7 * (7 - media) ** 2 + 23 * media ** 2) / 30) ** 0.5
+        self.assertAlmostEqual(acelerado['punto_reorden'], round(49 + 1.65 * desviacion * 7 ** 0.5, 2))
+        self.assertEqual(acelerado['pico_consumo_semanal'], 7.0)
+
+        self.assertTrue(pronostico['BAJO_MINIMO']['reponer_ahora'])
+        self.assertEqual(pronostico['BAJO_MINIMO']['fecha_reorden'], hoy.isoformat())
+        # Consumos fuera de los 90 días no cuentan
+        self.assertEqual((pronostico['QUIETO']['consumo_total_periodo'], pronostico['QUIETO']['fecha_reorden']), (0.0, None))
+
+    def test_cache_se_invalida_con_un_movimiento(self):
+        insumo = self.crear_insumo('CACHE', 40, 0, [(1, 7)])
+        self.assertEqual(self.pronostico()['CACHE']['consumo_diario'], 1.0)
+        with self.assertNumQueries(0):
+            self.pronostico()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            MovimientoInventario.registrar(insumo, 'SALIDA', 14)
+        self.assertEqual(self.pronostico()['CACHE']['consumo_diario'], 3.0)
+
+    def test_plazo_invalido(self):
+        self.assertEqual(self.cliente.get('/api/users/inventario/pronostico/', {'plazo_entrega': -1}).status_code, 400)
+
+class AjusteMasivoStockTests(PruebaAPI):
+    def setUp(self):
+        super().setUp()
+        self.insumos = [
+            Insumo.objects.create(nombre=f'Insumo {numero}', tipo='OTRO', codigo=f'AJ-{numero}', cantidad_disponible=10)
+            for numero in range(3)
+        ]
+
+    def ajustar(self, items):
+        return self.cliente.post('/api/users/insumos/ajuste-masivo/', {'items': items, 'observaciones': 'Conteo de fin de mes'}, format='json')
+
+    def existencias(self):
+        return dict(Insumo.objects.filter(codigo__startswith='AJ-').values_list('codigo', 'cantidad_disponible'))
+
+    def test_aplica_el_conteo_en_una_transaccion(self):
+        primero, segundo, tercero = self.insumos
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.ajustar([
+                {'id': primero.id, 'nueva_cantidad': 7},
+                {'codigo': 'AJ-1', 'nueva_cantidad': '12.5', 'tipo_movimiento': 'ENTRADA'},
+                {'id': tercero.id, 'nueva_cantidad': 10},
+            ])
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        self.assertEqual((respuesta.json()['modificados'], respuesta.json()['sin_cambio']), (2, 1))
+        self.assertEqual(self.existencias(), {'AJ-0': 7, 'AJ-1': Decimal('12.5'), 'AJ-2': 10})
+        # Una lectura de los insumos, sin consultas por ítem
+        self.assertEqual(sum(1 for consulta in consultas if consulta['sql'].startswith('SELECT') and 'users_insumo' in consulta['sql'].split(' WHERE ')[0]), 1)
+
+        movimientos = MovimientoInventario.objects.filter(insumo__in=self.insumos).order_by('insumo_id')
+        self.assertEqual([(m.insumo_id, m.tipo, m.cantidad, m.saldo_resultante) for m in movimientos], [
+            (primero.id, 'AJUSTE', -3, 7), (segundo.id, 'ENTRADA', Decimal('2.5'), Decimal('12.5'))
+        ])
+        self.assertEqual(RegistroBitacora.objects.filter(accion='ACTUALIZAR_STOCK').count(), 1)
+
+    def test_un_item_invalido_cancela_todo_el_ajuste(self):
+        respuesta = self.ajustar([
+            {'id': self.insumos[0].id, 'nueva_cantidad': 7},
+            {'codigo': 'NO-EXISTE', 'nueva_cantidad': 1},
+            {'id': self.insumos[1].id, 'nueva_cantidad': -1},
+            {'id': self.insumos[2].id, 'nueva_cantidad': 15, 'tipo_movimiento': 'SALIDA'},
+            {'codigo': 'AJ-0', 'nueva_cantidad': 3},
+        ])
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual([error['item'] for error in respuesta.json()['errores']], [1, 2, 3, 4])
+        self.assertEqual(set(self.existencias().values()), {10})
+        self.assertFalse(MovimientoInventario.objects.exists())
+
+        self.assertEqual(self.ajustar([]).status_code, 400)
+        with mock.patch('users.views.MAXIMO_ITEMS_AJUSTE_MASIVO', 1):
+            self.assertEqual(self.ajustar([{'id': self.insumos[0].id, 'nueva_cantidad': 1}] * 2).status_code, 400)
+
+    def test_cantidades_que_exceden_el_campo_son_errores_del_item(self):
+        respuesta = self.ajustar([
+            {'id': self.insumos[0].id, 'nueva_cantidad': '1e30'},
+            {'id': self.insumos[1].id, 'nueva_cantidad': '100000000'},
+            {'id': self.insumos[2].id, 'nueva_cantidad': '99999999.99', 'tipo_movimiento': 'ENTRADA'},
+        ])
+        self.assertEqual(respuesta.status_code, 400, respuesta.content)
+        self.assertEqual([error['item'] for error in respuesta.json()['errores']], [0, 1])
+        self.assertIn('99999999.99', respuesta.json()['errores'][0]['error'])
+
+        respuesta = self.ajustar([{'id': self.insumos[2].id, 'nueva_cantidad': '99999999.99', 'tipo_movimiento': 'ENTRADA'}])
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        self.assertEqual(self.existencias()['AJ-2'], Decimal('99999999.99'))
+
+class PruebaMaquinaria(PruebaAPI):
+    """Una máquina y un lote para registrar usos; `inicio` y `fin` son 'DDTHH:MM' de mayo de 2026 (UTC)"""
+
+    def setUp(self):
+        super().setUp()
+        self.lote_id = self.crear_lote('L-043', [('Ana Pérez', '0150000001', 10)])['id']
+        self.maquina = Insumo.objects.create(nombre='Montacargas 1', tipo='MAQUINARIA', codigo='MQ-1')
+
+    def crear_uso(self, inicio, fin, kg=0, maquina=None):
+        return RegistroUsoMaquinaria.objects.create(
+            empleado=self.usuario, maquinaria=maquina or self.maquina, lote_id=self.lote_id,
+            hora_inicio=parse_datetime(f'2026-05-{inicio}:00Z'), hora_fin=parse_datetime(f'2026-05-{fin}:00Z'), peso_total_descargado=kg
+        )
+
+class UtilizacionMaquinariaTests(PruebaMaquinaria):
+    def utilizacion(self, **parametros):
+        respuesta = self.cliente.get('/api/users/uso-maquinaria/utilizacion/', {'desde': '2026-05-04', 'hasta': '2026-05-05', **parametros})
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        return {maquina['codigo']: maquina for maquina in respuesta.json()['maquinas']}
+
+    def crear_usos_del_dia(self):
+        self.crear_uso('04T08:00', '04T09:00', 60)
+        self.crear_uso('04T08:30', '04T10:00', 90)
+        self.crear_uso('04T11:00', '04T12:00', 30)
+        self.crear_uso('04T13:00', '04T15:00', 120)
+        self.crear_uso('04T23:00', '05T01:00', 40)
+        self.crear_uso('04T16:00', '04T16:00', 10)
+
+    def test_utilizacion_por_dia(self):
+        self.crear_usos_del_dia()
+        Insumo.objects.create(nombre='Balanza', tipo='BALANZA', codigo='BAL-043')
+        Insumo.objects.create(nombre='Grúa', tipo='MAQUINARIA', codigo='MQ-2')
+
+        maquinas = self.utilizacion()
+        self.assertEqual(set(maquinas), {'MQ-1', 'MQ-2'})
+        self.assertEqual((maquinas['MQ-2']['minutos_ocupados'], maquinas['MQ-2']['periodos']), (0.0, []))
+
+        maquina = maquinas['MQ-1']
+        # Unión: 8-10, 11-12, 13-15 y 23-24 el día 4; 0-1 el día 5
+        self.assertEqual(maquina['periodos'], [
+            {'fecha': '2026-05-04', 'minutos_ocupados': 360.0, 'minutos_ociosos': 1080.0, 'utilizacion': 0.25, 'huecos': 3,
+             'hueco_maximo_minutos': 480.0, 'concurrencia_maxima': 2, 'usos': 5, 'kg_movidos': 320.0, 'kg_por_hora': 53.33},
+            {'fecha': '2026-05-05', 'minutos_ocupados': 60.0, 'minutos_ociosos': 1380.0, 'utilizacion': 0.0417, 'huecos': 0,
+             'hueco_maximo_minutos': 0.0, 'concurrencia_maxima': 1, 'usos': 1, 'kg_movidos': 20.0, 'kg_por_hora': 20.0},
+        ])
+        self.assertEqual(
+            {clave: maquina[clave] for clave in ('minutos_ocupados', 'utilizacion', 'kg_movidos', 'kg_por_hora', 'concurrencia_maxima', 'usos')},
+            {'minutos_ocupados': 420.0, 'utilizacion': 0.1458, 'kg_movidos': 340.0, 'kg_por_hora': 48.57, 'concurrencia_maxima': 2, 'usos': 5}
+        )
+
+    def test_utilizacion_por_turno(self):
+        self.crear_usos_del_dia()
+        periodos = self.utilizacion(agrupacion='turno')['MQ-1']['periodos']
+        resumen = [
+            (p['fecha'], p['turno'], p['minutos_ocupados'], p['utilizacion'], p['huecos'], p['concurrencia_maxima'], p['usos'], p['kg_movidos'])
+            for p in periodos
+        ]
+        self.assertEqual(resumen, [
+            ('2026-05-04', 'MANANA', 240.0, 0.5, 2, 2, 4, 240.0),
+            ('2026-05-04', 'TARDE', 60.0, 0.125, 0, 1, 1, 60.0),
+            ('2026-05-04', 'NOCHE', 120.0, 0.25, 0, 1, 1, 40.0),
+        ])
+
+    def test_coincide_con_el_conteo_minuto_a_minuto(self):
+        aleatorio = random.Random(43)
+        segunda = Insumo.objects.create(nombre='Banda', tipo='MAQUINARIA', codigo='MQ-3')
+        base = parse_datetime('2026-05-03T00:00:00Z')
+        usos = []
+        for _ in range(60):
+            maquina = aleatorio.choice([self.maquina, segunda])
+            inicio = aleatorio.randrange(0, 3 * 1440 - 30)
+            fin = inicio + aleatorio.randrange(1, 300)
+            usos.append((maquina.codigo, inicio, fin))
+            RegistroUsoMaquinaria.objects.create(
+                empleado=self.usuario, maquinaria=maquina, lote_id=self.lote_id, peso_total_descargado=0,
+                hora_inicio=base + timedelta(minutes=inicio), hora_fin=base + timedelta(minutes=fin)
+            )
+
+        maquinas = self.utilizacion(desde='2026-05-03', hasta='2026-05-05')
+        for codigo in ('MQ-1', 'MQ-3'):
+            ocupacion = [0] * (3 * 1440)
+            for uso_codigo, inicio, fin in usos:
+                if uso_codigo == codigo:
+                    for minuto in range(inicio, min(fin, 3 * 1440)):
+                        ocupacion[minuto] += 1
+            esperado = [
+                (f'2026-05-0{dia + 3}', float(sum(1 for c in ocupacion[dia * 1440:(dia + 1) * 1440] if c)), max(ocupacion[dia * 1440:(dia + 1) * 1440]))
+                for dia in range(3) if any(ocupacion[dia * 1440:(dia + 1) * 1440])
+            ]
+            obtenido = [(p['fecha'], p['minutos_ocupados'], p['concurrencia_maxima']) for p in maquinas[codigo]['periodos']]
+            self.assertEqual(obtenido, esperado)
+
+    def test_parametros_invalidos(self):
+        for parametros in ({'agrupacion': 'semana'}, {'desde': '2026-05-06', 'hasta': '2026-05-05'}, {'desde': '2025-01-01', 'hasta': '2026-05-05'}):
+            self.assertEqual(self.cliente.get('/api/users/uso-maquinaria/utilizacion/', parametros).status_code, 400)
+
+class ConflictosMaquinariaTests(PruebaMaquinaria):
+    def conflictos(self, **parametros):
+        respuesta = self.cliente.get('/api/users/uso-maquinaria/conflictos/', parametros)
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        return respuesta.json()
+
+    def test_coincide_con_la_comparacion_de_todos_los_pares(self):
+        aleatorio = random.Random(44)
+        segunda = Insumo.objects.create(nombre='Banda', tipo='MAQUINARIA', codigo='MQ-4')
+        usos = []
+        for _ in range(50):
+            dia, hora, minutos = aleatorio.randint(10, 12), aleatorio.randint(0, 20), aleatorio.choice([0, 15, 30, 45])
+            fin = parse_datetime(f'2026-05-{dia}T{hora:02d}:{minutos:02d}:00Z') + timedelta(minutes=aleatorio.randrange(15, 240, 15))
+            uso = self.crear_uso(f'{dia}T{hora:02d}:{minutos:02d}', f'{fin.day}T{fin:%H:%M}', maquina=aleatorio.choice([self.maquina, segunda]))
+            usos.append(uso)
+
+        esperados = {
+            frozenset((a.id, b.id)): (min(a.hora_fin, b.hora_fin) - max(a.hora_inicio, b.hora_inicio)).total_seconds() / 60
+            for posicion, a in enumerate(usos) for b in usos[posicion + 1:]
+            if a.maquinaria_id == b.maquinaria_id and a.hora_inicio < b.hora_fin and b.hora_inicio < a.hora_fin
+        }
+        self.assertTrue(esperados)
+        respuesta = self.conflictos()
+        obtenidos = {
+            frozenset((c['registro_a']['id'], c['registro_b']['id'])): c['minutos_solapados'] for c in respuesta['conflictos']
+        }
+        self.assertEqual(obtenidos, esperados)
+        self.assertEqual((respuesta['count'], respuesta['truncado']), (len(esperados), False))
+        self.assertEqual(respuesta['minutos_solapados'], round(sum(esperados.values()), 1))
+
+        solo_segunda = self.conflictos(maquinaria=segunda.id)['conflictos']
+        self.assertTrue(all(c['maquinaria_id'] == segunda.id for c in solo_segunda))
+        self.assertEqual(len(self.conflictos(desde='2026-05-13')['conflictos']), 0)
+
+    def test_limite_de_conflictos(self):
+        for hora in range(5):
+            self.crear_uso(f'10T{hora:02d}:00', '10T06:00')
+        # Cinco usos abiertos a la vez: 10 pares
+        self.assertEqual(len(maquinaria.detectar_solapamientos()[0]), 10)
+        conflictos, truncado = maquinaria.detectar_solapamientos(limite=4)
+        self.assertEqual((len(conflictos), truncado), (4, True))
+        self.assertEqual(self.conflictos(limite=4)['truncado'], True)
+
+        self.assertEqual(self.cliente.get('/api/users/uso-maquinaria/conflictos/', {'limite': 0}).status_code, 400)
+        self.assertEqual(self.cliente.get('/api/users/uso-maquinaria/conflictos/', {'limite': 'x'}).status_code, 400)
+
+    def test_usos_que_exceden_la_duracion_maxima(self):
+        largo = self.crear_uso('10T00:00', '11T06:00')
+        corto = self.crear_uso('11T02:00', '11T03:00')
+        self.crear_uso('12T00:00', '12T23:00')
+
+        respuesta = self.conflictos()
+        self.assertEqual([(u['id'], u['horas']) for u in respuesta['usos_excedidos']], [(largo.id, 30.0)])
+        # La validación de nuevos usos no ve el cruce porque el uso largo empezó más de 24 horas antes
+        self.assertFalse(RegistroUsoMaquinaria.solapados(self.maquina.id, corto.hora_inicio, corto.hora_fin, excluir_id=corto.id).exists())
+        self.assertEqual([(c['registro_a']['id'], c['registro_b']['id']) for c in respuesta['conflictos']], [(largo.id, corto.id)])
+
+class RendimientoDescargasTests(PruebaAPI):
+    def setUp(self):
+        super().setUp()
+        self.lote_id = self.crear_lote('L-045', [('Ana Pérez', '0160000001', 10)])['id']
+        self.operador = User.objects.create_user('operador', password='clave')
+        self.banda = Insumo.objects.create(nombre='Banda', tipo='MAQUINARIA', codigo='BAN-045')
+
+    def crear_descarga(self, empleado, kg, minutos, hora, insumo=None, dia='10'):
+        return RegistroDescarga.objects.create(
+            lote_id=self.lote_id, empleado=empleado, insumo=insumo, peso_descargado=kg, tiempo_descarga_minutos=minutos,
+            hora_inicio=parse_datetime(f'2026-06-{dia}T{hora:02d}:15:00Z'), fecha_registro=parse_datetime(f'2026-06-{dia}T{hora:02d}:30:00Z')
+        )
+
+    def rendimiento(self, **parametros):
+        respuesta = self.cliente.get('/api/users/descargas/rendimiento/', {'desde': '2026-06-01', 'hasta': '2026-06-30', **parametros})
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        return respuesta.json()
+
+    def test_totales_y_percentiles_por_dimension(self):
+        descargas = [
+            (self.usuario, 100, 10, 8, None), (self.usuario, 300, 20, 8, None), (self.usuario, 50, 5, 9, None),
+            (self.operador, 200, 40, 9, self.banda), (self.operador, 90, 30, 10, self.banda),
+        ]
+        for empleado, kg, minutos, hora, insumo in descargas:
+            self.crear_descarga(empleado, kg, minutos, hora, insumo)
+        # Sin duración o fuera del rango no cuentan
+        self.crear_descarga(self.usuario, 500, None, 11)
+        RegistroDescarga.objects.create(lote_id=self.lote_id, empleado=self.usuario, peso_descargado=80, tiempo_descarga_minutos=8,
+                                        fecha_registro=parse_datetime('2026-07-01T08:00:00Z'))
+
+        resultado = self.rendimiento()
+        self.assertEqual((resultado['descargas'], resultado['kg_total'], resultado['minutos_total']), (5, 740.0, 105))
+        self.assertEqual(resultado['kg_por_minuto'], round(740 / 105, 3))
+        todos = [10, 15, 10, 5, 3]
+        self.assertEqual(resultado['percentiles_kg_por_minuto'], {f'p{p}': round(float(np.percentile(todos, p)), 3) for p in (10, 25, 50, 75, 90)})
+
+        empleados = {fila['nombre']: fila for fila in resultado['empleado']}
+        self.assertEqual([fila['nombre'] for fila in resultado['empleado']], ['admin', 'operador'])
+        self.assertEqual((empleados['admin']['kg_por_minuto'], empleados['operador']['kg_por_minuto']), (round(450 / 35, 3), round(290 / 70, 3)))
+        for nombre, valores in (('admin', [10, 15, 10]), ('operador', [5, 3])):
+            self.assertEqual(empleados[nombre]['percentiles_kg_por_minuto'], {f'p{p}': round(float(np.percentile(valores, p)), 3) for p in (10, 25, 50, 75, 90)})
+
+        self.assertEqual([(fila['id'], fila['descargas'], fila['kg_total']) for fila in resultado['hora']], [(8, 2, 400.0), (9, 2, 250.0), (10, 1, 90.0)])
+        self.assertEqual({fila['nombre']: fila['descargas'] for fila in resultado['insumo']}, {None: 3, 'Banda': 2})
+
+        filtrado = self.rendimiento(empleado=self.operador.id)
+        self.assertEqual((filtrado['descargas'], [fila['nombre'] for fila in filtrado['empleado']]), (2, ['operador']))
+
+    def test_cache_se_invalida_con_una_descarga(self):
+        self.crear_descarga(self.usuario, 100, 10, 8)
+        self.assertEqual(self.rendimiento()['descargas'], 1)
+        with self.assertNumQueries(0):
+            self.rendimiento()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.crear_descarga(self.usuario, 100, 10, 9)
+        self.assertEqual(self.rendimiento()['descargas'], 2)
+
+        vacio = self.rendimiento(desde='2026-05-01', hasta='2026-05-02')
+        self.assertEqual((vacio['descargas'], vacio['kg_por_minuto'], vacio['empleado']), (0, None, []))
+        self.assertEqual(self.cliente.get('/api/users/descargas/rendimiento/', {'desde': '2026-06-02', 'hasta': '2026-06-01'}).status_code, 400)
+
+class SincronizacionRegistrosTests(PruebaAPI):
+    def setUp(self):
+        super().setUp()
+        self.lote_id = self.crear_lote('L-046', [('Ana Pérez', '0170000001', 10)])['id']
+        self.sacos = Insumo.objects.create(nombre='Sacos', tipo='CONTENEDOR', codigo='SAC-046', cantidad_disponible=10)
+        self.montacargas = Insumo.objects.create(nombre='Montacargas', tipo='MAQUINARIA', codigo='MQ-046')
+
+    def descarga(self, clave, cantidad_insumo=None, **campos):
+        registro = {'tipo': 'DESCARGA', 'clave_idempotencia': clave, 'lote': self.lote_id, 'peso_descargado': '120.00', 'tiempo_descarga_minutos': 15}
+        if cantidad_insumo:
+            registro.update({'insumo': self.sacos.id, 'cantidad_insumo_usado': cantidad_insumo})
+        return {**registro, **campos}
+
+    def uso(self, clave, inicio, fin):
+        return {
+            'tipo': 'USO_MAQUINARIA', 'clave_idempotencia': clave, 'lote': self.lote_id, 'maquinaria': self.montacargas.id,
+            'hora_inicio': f'2026-06-10T{inicio}:00Z', 'hora_fin': f'2026-06-10T{fin}:00Z', 'peso_total_descargado': '300.00',
+            'trabajador_nombre': 'Operador de turno'
+        }
+
+    def sincronizar(self, registros):
+        respuesta = self.cliente.post('/api/users/sincronizar/', {'registros': registros}, format='json')
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        return respuesta.json()
+
+    def test_reenviar_la_cola_no_duplica_registros(self):
+        cola = [self.descarga('d-1', 3), self.descarga('d-2'), self.uso('u-1', '08:00', '09:00')]
+        primero = self.sincronizar(cola)
+        self.assertEqual((primero['creados'], primero['duplicados'], primero['con_errores']), (3, 0, 0))
+        self.assertEqual(Insumo.objects.get(id=self.sacos.id).cantidad_disponible, 7)
+        salida = MovimientoInventario.objects.get(insumo=self.sacos)
+        self.assertEqual((salida.cantidad, salida.saldo_resultante, salida.descarga_id), (-3, 7, primero['resultados'][0]['id']))
+
+        segundo = self.sincronizar(cola)
+        self.assertEqual((segundo['creados'], segundo['duplicados']), (0, 3))
+        self.assertEqual([r['id'] for r in segundo['resultados']], [r['id'] for r in primero['resultados']])
+        self.assertEqual((RegistroDescarga.objects.count(), RegistroUsoMaquinaria.objects.count(), MovimientoInventario.objects.count()), (2, 1, 1))
+        self.assertEqual(Insumo.objects.get(id=self.sacos.id).cantidad_disponible, 7)
+        self.assertEqual(RegistroBitacora.objects.filter(accion='SINCRONIZAR_REGISTROS').count(), 1)
+        self.assertEqual(RegistroDescarga.objects.get(clave_idempotencia='d-1').empleado, self.usuario)
+
+    def test_errores_de_un_registro_no_impiden_guardar_los_demas(self):
+        resultado = self.sincronizar([
+            self.descarga('d-1', 6),
+            self.descarga('d-1', 6),
+            self.descarga('d-2', 6),
+            self.descarga('d-3', lote=999999),
+            self.descarga(''),
+            {'tipo': 'OTRO', 'clave_idempotencia': 'x-1'},
+            self.uso('u-1', '08:00', '09:00'),
+            self.uso('u-2', '08:30', '09:30'),
+            self.uso('u-3', '09:00', '10:00'),
+        ])
+        estados = [(r['clave_idempotencia'], r['estado']) for r in resultado['resultados']]
+        self.assertEqual(estados, [
+            ('d-1', 'CREADO'), ('d-1', 'DUPLICADO'), ('d-2', 'ERROR'), ('d-3', 'ERROR'), ('', 'ERROR'), ('x-1', 'ERROR'),
+            ('u-1', 'CREADO'), ('u-2', 'ERROR'), ('u-3', 'CREADO'),
+        ])
+        self.assertEqual(resultado['resultados'][1]['id'], resultado['resultados'][0]['id'])
+        # La segunda descarga valida el stock contra lo que dejó la primera
+        self.assertIn('suficiente stock', str(resultado['resultados'][2]['errores']))
+        self.assertIn('lote', resultado['resultados'][3]['errores'])
+        self.assertIn('registro 6 de esta sincronización', str(resultado['resultados'][7]['errores']))
+        self.assertEqual(Insumo.objects.get(id=self.sacos.id).cantidad_disponible, 4)
+
+        # Un uso que cruza uno ya registrado también se rechaza
+        self.assertEqual(self.sincronizar([self.uso('u-4', '09:45', '10:15')])['resultados'][0]['estado'], 'ERROR')
+
+    def test_limites_del_envio(self):
+        self.assertEqual(self.cliente.post('/api/users/sincronizar/', {'registros': []}, format='json').status_code, 400)
+        with mock.patch.object(sincronizacion, 'MAXIMO_REGISTROS', 1):
+            respuesta = self.cliente.post('/api/users/sincronizar/', {'registros': [self.descarga('d-1'), self.descarga('d-2')]}, format='json')
+        self.assertEqual(respuesta.status_code, 400)
+
+class ConsumoRecursoLoteTests(PruebaAPI):
+    def setUp(self):
+        super().setUp()
+        self.lote_a = self.crear_lote('L-047-A', [('Ana Pérez', '0180000001', 30)])['id']
+        self.lote_b = self.crear_lote('L-047-B', [('Luis Gómez', '0180000002', 10)])['id']
+        self.sacos = Insumo.objects.create(nombre='Sacos', tipo='CONTENEDOR', codigo='SAC-047', cantidad_disponible=100)
+        self.banda = Insumo.objects.create(nombre='Banda', tipo='MAQUINARIA', codigo='BAN-047')
+
+    def consumos(self, lote_id):
+        return {
+            (tipo, insumo_id): (cantidad, minutos, registros)
+            for tipo, insumo_id, cantidad, minutos, registros in ConsumoRecursoLote.objects.filter(lote_id=lote_id).values_list(
+                'tipo_recurso', 'insumo_id', 'cantidad', 'minutos', 'registros'
+            )
+        }
+
+    def crear_registros(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            TareaInsumo.objects.create(lote_id=self.lote_a, insumo=self.sacos, empleado=self.usuario, descripcion='Ensacado', cantidad=4, tiempo_uso=30)
+            self.descarga = RegistroDescarga.objects.create(
+                lote_id=self.lote_a, empleado=self.usuario, insumo=self.banda, tiempo_uso_insumo=15, peso_descargado=500, tiempo_descarga_minutos=20
+            )
+            RegistroUsoMaquinaria.objects.create(
+                lote_id=self.lote_a, empleado=self.usuario, maquinaria=self.banda, peso_total_descargado=300,
+                hora_inicio=parse_datetime('2026-06-10T08:00:00Z'), hora_fin=parse_datetime('2026-06-10T08:45:00Z')
+            )
+
+    def test_registros_se_atribuyen_al_lote(self):
+        self.crear_registros()
+        self.assertEqual(self.consumos(self.lote_a), {
+            ('INSUMO', self.sacos.id): (4, 30, 1),
+            ('MAQUINARIA', self.banda.id): (0, 15 + 45, 2),
+            ('MANO_OBRA', None): (0, 20, 1),
+        })
+
+        # Cambiar la descarga de lote recalcula los dos
+        with self.captureOnCommitCallbacks(execute=True):
+            self.descarga.lote_id = self.lote_b
+            self.descarga.save()
+        self.assertEqual(self.consumos(self.lote_a)[('MAQUINARIA', self.banda.id)], (0, 45, 1))
+        self.assertNotIn(('MANO_OBRA', None), self.consumos(self.lote_a))
+        self.assertEqual(self.consumos(self.lote_b), {('MAQUINARIA', self.banda.id): (0, 15, 1), ('MANO_OBRA', None): (0, 20, 1)})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.descarga.delete()
+        self.assertEqual(self.consumos(self.lote_b), {})
+
+    def test_minutos_de_proceso_se_reparten_por_quintales(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            proceso = Proceso.objects.create(numero='P-047', nombre='Proceso', responsable=self.usuario, usuario_creacion=self.usuario)
+            proceso.lotes.add(self.lote_a, self.lote_b)
+            TareaProceso.objects.create(proceso=proceso, tipo_tarea='OTRO', descripcion='Pilado', fase='PILADO', empleado=self.usuario, duracion_minutos=80)
+        self.assertEqual(self.consumos(self.lote_a), {('MANO_OBRA', None): (0, 60, 1)})
+        self.assertEqual(self.consumos(self.lote_b), {('MANO_OBRA', None): (0, 20, 1)})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            proceso.lotes.remove(self.lote_b)
+        self.assertEqual(self.consumos(self.lote_a), {('MANO_OBRA', None): (0, 80, 1)})
+        self.assertEqual(self.consumos(self.lote_b), {})
+
+    def test_endpoint_por_quintal_y_comando_de_recalculo(self):
+        self.crear_registros()
+        respuesta = self.cliente.get('/api/users/lotes/consumo-recursos/', {'lote': self.lote_a}).json()
+        lote = respuesta['lotes'][0]
+        self.assertEqual((lote['minutos_maquinaria'], lote['minutos_mano_obra']), (60.0, 20.0))
+        self.assertEqual((lote['minutos_maquinaria_por_quintal'], lote['minutos_mano_obra_por_quintal']), (2.0, 0.67))
+        sacos = next(insumo for insumo in lote['insumos'] if insumo['insumo_id'] == self.sacos.id)
+        self.assertEqual(sacos['cantidad_por_quintal'], round(4 / 30, 4))
+
+        ConsumoRecursoLote.objects.all().delete()
+        call_command('recalcular_consumos_lotes', stdout=StringIO())
+        self.assertEqual(len(self.consumos(self.lote_a)), 3)
+
+class ProcesoSerializerTests(PruebaAPI):
+    def crear_proceso(self, numero, lotes):
+        proceso = Proceso.objects.create(numero=numero, nombre=f'Proceso {numero}', responsable=self.usuario, usuario_creacion=self.usuario)
+        proceso.lotes.add(*lotes)
+        return proceso
+
+    def crear_lotes(self, prefijo, cantidad):
+        lotes = [self.crear_lote(f'{prefijo}-{numero}', [('Ana Pérez', '0190000001', 5)])['id'] for numero in range(cantidad)]
+        for lote_id in lotes:
+            entrega = PropietarioCafe.objects.filter(lote_id=lote_id).get()
+            MuestraCafe.objects.create(lote_id=lote_id, propietario=entrega, numero_muestra=f'M-{lote_id}', estado='CONTAMINADA', analista=self.usuario)
+        # Los procesos solo admiten lotes aprobados o con la separación aplicada
+        LoteCafe.objects.filter(id__in=lotes).update(estado='SEPARACION_APLICADA')
+        return lotes
+
+    def listar(self):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.cliente.get('/api/users/procesos/')
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        datos = respuesta.json()
+        return datos.get('results', datos) if isinstance(datos, dict) else datos, len(consultas)
+
+    def test_lotes_anidados_resumidos_con_consultas_fijas(self):
+        self.crear_proceso('P-1', self.crear_lotes('L-048-A', 2))
+        procesos, consultas = self.listar()
+        lote = procesos[0]['lotes_info'][0]
+        self.assertNotIn('propietarios', lote)
+        self.assertEqual((lote['total_muestras'], lote['muestras_aprobadas'], lote['muestras_contaminadas']), (1, 0, 1))
+        self.assertEqual((procesos[0]['total_lotes'], lote['organizacion_nombre']), (2, 'Cooperativa Pruebas'))
+
+        for numero in range(3):
+            self.crear_proceso(f'P-{numero + 2}', self.crear_lotes(f'L-048-{numero}', 3))
+        procesos, mas_consultas = self.listar()
+        self.assertEqual(len(procesos), 4)
+        self.assertEqual(mas_consultas, consultas)
+
+    def test_detalle_refleja_el_cambio_de_lotes(self):
+        lotes = self.crear_lotes('L-048-D', 3)
+        proceso = self.crear_proceso('P-D', lotes[:1])
+        respuesta = self.cliente.patch(f'/api/users/procesos/{proceso.id}/', {'lotes': lotes}, format='json')
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        self.assertEqual((respuesta.json()['total_lotes'], [lote['id'] for lote in respuesta.json()['lotes_info']]), (3, lotes))
+
+class TotalesProcesoTests(PruebaAPI):
+    def setUp(self):
+        super().setUp()
+        self.lote_a = LoteCafe.objects.get(id=self.crear_lote('L-049-A', [('Ana Pérez', '0200000001', 30)])['id'])
+        self.lote_b = LoteCafe.objects.get(id=self.crear_lote('L-049-B', [('Luis Gómez', '0200000002', 10)])['id'])
+        self.proceso = Proceso.objects.create(numero='P-049', nombre='Proceso', responsable=self.usuario, usuario_creacion=self.usuario)
+
+    def totales(self, proceso=None):
+        return Proceso.objects.filter(id=(proceso or self.proceso).id).values_list(*Proceso.CAMPOS_TOTALES).get()
+
+    def test_totales_siguen_los_lotes_del_proceso(self):
+        self.proceso.lotes.add(self.lote_a, self.lote_b)
+        self.assertEqual(self.totales(), (40, Decimal('2000.00'), Decimal('2000.00')))
+
+        # El peso actual de cada lote es el final si ya lo tiene
+        self.lote_a.peso_total_final = Decimal('900.00')
+        self.lote_a.save()
+        self.assertEqual(self.totales(), (40, Decimal('2000.00'), Decimal('1900.00')))
+        self.lote_b.transicionar(peso_total_final=Decimal('800.00'))
+        self.assertEqual(self.totales(), (40, Decimal('2000.00'), Decimal('1700.00')))
+
+        self.proceso.lotes.remove(self.lote_b)
+        self.assertEqual(self.totales(), (30, Decimal('1000.00'), Decimal('900.00')))
+        self.proceso.lotes.clear()
+        self.assertEqual(self.totales(), (0, None, None))
+
+    def test_cambios_desde_el_lado_del_lote(self):
+        otro = Proceso.objects.create(numero='P-049-2', nombre='Otro', responsable=self.usuario, usuario_creacion=self.usuario)
+        self.lote_a.procesos_produccion.add(self.proceso, otro)
+        self.proceso.lotes.add(self.lote_b)
+        self.assertEqual((self.totales()[0], self.totales(otro)[0]), (40, 30))
+
+        self.lote_a.procesos_produccion.clear()
+        self.assertEqual((self.totales()[0], self.totales(otro)[0]), (10, 0))
+
+        self.lote_b.delete()
+        self.assertEqual(self.totales(), (0, None, None))
+
+    def test_guardar_el_proceso_no_pisa_los_totales(self):
+        self.proceso.lotes.add(self.lote_a)
+        desactualizado = Proceso.objects.get(id=self.proceso.id)
+        self.lote_a.transicionar(peso_total_final=Decimal('900.00'))
+
+        desactualizado.agregar_nota_tecnica('PILADO', 'Humedad estable')
+        self.assertEqual(self.totales(), (30, Decimal('1000.00'), Decimal('900.00')))
+        self.assertEqual(self.cliente.post(f'/api/users/procesos/{self.proceso.id}/avanzar-fase/').status_code, 200)
+        self.assertEqual(self.totales(), (30, Decimal('1000.00'), Decimal('900.00')))
+        self.assertEqual(Proceso.objects.get(id=self.proceso.id).fase_actual, 'CLASIFICACION')
+
+    def test_comando_recalcula_los_procesos_activos(self):
+        self.proceso.lotes.add(self.lote_a)
+        Proceso.objects.filter(id=self.proceso.id).update(quintales_totales=999, peso_total_inicial=None)
+        salida = StringIO()
+        call_command('recalcular_totales_procesos', stdout=salida)
+        self.assertIn('Totales recalculados para 1 procesos', salida.getvalue())
+        self.assertEqual(self.totales(), (30, Decimal('1000.00'), Decimal('1000.00')))
+
+class MedicionFaseTests(PruebaAPI):
+    def setUp(self):
+        super().setUp()
+        self.proceso = Proceso.objects.create(numero='P-050', nombre='Proceso', responsable=self.usuario, usuario_creacion=self.usuario)
+
+    def mediciones(self, proceso=None):
+        return dict(MedicionFase.objects.filter(proceso=proceso or self.proceso).values_list('metrica', 'valor'))
+
+    def test_extraer_valores_numericos(self):
+        datos = {
+            'peso_impurezas_removidas': '12,5',
+            'tareas_realizadas': {'canteado': True, 'tiempo_canteado': 45},
+            'fecha_guardado': '2026-07-01T10:00:00',
+        }
+        self.assertEqual(extraer_mediciones_fase('PILADO', datos), [
+            ('peso_impurezas_removidas', Decimal('12.5'), 'kg', parse_datetime('2026-07-01T10:00:00Z')),
+            ('tiempo_canteado', Decimal('45'), 'min', parse_datetime('2026-07-01T10:00:00Z')),
+        ])
+        # Vacíos, textos, booleanos, no finitos o fuera de rango no son mediciones
+        for valor in ('', 'mucho', True, 'NaN', '1e12', None):
+            self.assertEqual(extraer_mediciones_fase('PILADO', {'peso_impurezas_removidas': valor}), [])
+        self.assertEqual(extraer_mediciones_fase('PILADO', 'no es un diccionario'), [])
+
+        color = extraer_mediciones_fase('COLOR', {'duracion_proceso': '90', 'clasificacion_colores': {'verde': {'peso': 30}, 'negro': '2.5', 'gris': {}}})
+        self.assertEqual([(metrica, valor) for metrica, valor, _, _ in color], [
+            ('duracion_proceso', Decimal('90')), ('peso_color_verde', Decimal('30')), ('peso_color_negro', Decimal('2.5'))
+        ])
+
+    def test_guardar_datos_de_fase_reemplaza_sus_mediciones(self):
+        url = f'/api/users/procesos/{self.proceso.id}/guardar-pilado/'
+        respuesta = self.cliente.post(url, {'peso_impurezas_removidas': '8.5', 'tareas_realizadas': {'tiempo_canteado': '30'}}, format='json')
+        self.assertEqual(respuesta.status_code, 200, respuesta.content)
+        self.assertEqual(self.mediciones(), {'peso_impurezas_removidas': Decimal('8.5'), 'tiempo_canteado': Decimal('30')})
+
+        self.cliente.post(url, {'peso_impurezas_removidas': '9'}, format='json')
+        self.assertEqual(self.mediciones(), {'peso_impurezas_removidas': Decimal('9')})
+
+        self.cliente.post(f'/api/users/procesos/{self.proceso.id}/guardar-color/', {
+            'duracion_proceso': '60', 'clasificacion_colores': {'verde': {'peso': 40}}
+        }, format='json')
+        self.assertEqual(MedicionFase.objects.filter(proceso=self.proceso, fase='COLOR').count(), 2)
+        self.assertEqual(MedicionFase.objects.filter(proceso=self.proceso, fase='PILADO').count(), 1)
+
+    def test_resumen_entre_procesos(self):
+        otro = Proceso.objects.create(numero='P-050-2', nombre='Otro', responsable=self.usuario, usuario_creacion=self.usuario)
+        MedicionFase.registrar(self.proceso, 'PILADO', {'peso_impurezas_removidas': 10, 'fecha_guardado': '2026-07-01T10:00:00Z'})
+        MedicionFase.registrar(otro, 'PILADO', {'peso_impurezas_removidas': 4, 'fecha_guardado': '2026-07-03T10:00:00Z'})
+        MedicionFase.registrar(otro, 'EMPAQUE', {'cafe_exportacion': 700, 'fecha_guardado': '2026-07-03T10:00:00Z'})
+
+        respuesta = self.cliente.get('/api/users/procesos/mediciones/resumen/', {'fase': 'PILADO'}).json()
+        self.assertEqual(respuesta['metricas'], [{
+            'fase': 'PILADO', 'metrica': 'peso_impurezas_removidas', 'unidad': 'kg', 'mediciones': 2, 'procesos': 2,
+            'promedio': 7.0, 'minimo': 4.0, 'maximo': 10.0, 'suma': 14.0,
+        }])
+        self.assertEqual(self.cliente.get('/api/users/procesos/mediciones/resumen/').json()['count'], 2)
+        por_fecha = self.cliente.get('/api/users/procesos/mediciones/resumen/', {'fecha_hasta': '2026-07-02'}).json()['metricas']
+        self.assertEqual([(m['metrica'], m['suma']) for m in por_fecha], [('peso_impurezas_removidas', 10.0)])
+        self.assertEqual(self.cliente.get('/api/users/procesos/mediciones/resumen/', {'fecha_desde': 'ayer'}).status_code, 400)
+
+    def test_migracion_pobla_las_mediciones_de_datos_existentes(self):
+        migracion = importlib.import_module('users.migrations.0016_medicion_fase')
+        datos = {'numero_malla_ocupada': '18', 'peso_cafe_exportacion': '320,75', 'peso_cafe_caracolillo': ''}
+        Proceso.objects.filter(id=self.proceso.id).update(
+            datos_clasificacion=datos,
+            datos_empaquetado={'cafe_descarte': 15, 'fecha_guardado': '2026-07-05T08:00:00Z'},
+        )
+        proceso = Proceso.objects.get(id=self.proceso.id)
+
+        migracion.poblar_mediciones(django_apps, None)
+        mediciones = {m.metrica: (m.fase, m.valor, m.fecha_registro) for m in MedicionFase.objects.filter(proceso=proceso)}
+        self.assertEqual(mediciones, {
+            'numero_malla_ocupada': ('CLASIFICACION', Decimal('18'), proceso.fecha_actualizacion),
+            'peso_cafe_exportacion': ('CLASIFICACION', Decimal('320.75'), proceso.fecha_actualizacion),
+            'cafe_descarte': ('EMPAQUE', Decimal('15'), parse_datetime('2026-07-05T08:00:00Z')),
+        })
+        # La copia de la migración extrae lo mismo que el modelo
+        self.assertEqual(migracion.extraer_mediciones_fase('CLASIFICACION', datos), extraer_mediciones_fase('CLASIFICACION', datos))
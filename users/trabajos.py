@@ -0,0 +1,157 @@
+"""
+Trabajos en segundo plano respaldados por la base de datos.
+
+Las vistas encolan un TrabajoAsincrono con `encolar()` y responden de inmediato;
+el comando `python manage.py procesar_trabajos` reclama los trabajos pendientes y
+los ejecuta en un pool de procesos. Los archivos generados quedan en TRABAJOS_DIR.
+"""
+import csv
+import os
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import TrabajoAsincrono, RegistroBitacora
+
+try:
+    import fcntl
+except ImportError:  # Windows: se usa solo la actualización condicional
+    fcntl = None
+
+# Tipo de trabajo -> función que lo ejecuta. La función recibe el TrabajoAsincrono
+# y retorna un diccionario con el resultado.
+MANEJADORES = {
+    'EXPORTAR_BITACORA_CSV': 'users.trabajos.exportar_bitacora_csv',
+    'GENERAR_REPORTE_PDF': 'users.reportes.generar_reporte_pdf',
+    'IMPORTAR_PROPIETARIOS': 'users.importaciones.importar_propietarios',
+    'DETECTAR_DUPLICADOS': 'users.duplicados.detectar_duplicados_trabajo',
+}
+
+def encolar(tipo, usuario=None, **parametros):
+    """Crea un trabajo pendiente para que lo ejecute el comando procesar_trabajos"""
+    if tipo not in MANEJADORES:
+        raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+    return TrabajoAsincrono.objects.create(tipo=tipo, usuario=usuario, parametros=parametros)
+
+@contextmanager
+def _bloqueo_archivo():
+    """Bloqueo exclusivo entre procesos para reclamar trabajos en SQLite"""
+    os.makedirs(settings.TRABAJOS_DIR, exist_ok=True)
+    with open(settings.TRABAJOS_DIR / '.reclamar.lock', 'w') as archivo:
+        if fcntl:
+            fcntl.flock(archivo, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(archivo, fcntl.LOCK_UN)
+
+def reclamar_siguiente():
+    """
+    Marca como EN_EJECUCION el trabajo pendiente más antiguo y lo retorna (None si no hay).
+    En PostgreSQL varios workers reclaman en paralelo con SKIP LOCKED; en SQLite se
+    serializa con un archivo de bloqueo y una actualización condicional.
+    """
+    pendientes = TrabajoAsincrono.objects.filter(estado='PENDIENTE').order_by('fecha_creacion', 'id')
+    ahora = timezone.now()
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            trabajo = pendientes.select_for_update(skip_locked=True).first()
+            if trabajo is None:
+                return None
+            trabajo.estado = 'EN_EJECUCION'
+            trabajo.fecha_inicio = ahora
+            trabajo.intentos += 1
+            trabajo.save(update_fields=['estado', 'fecha_inicio', 'intentos'])
+            return trabajo
+
+    with _bloqueo_archivo():
+        trabajo = pendientes.first()
+        if trabajo is None:
+            return None
+        reclamado = TrabajoAsincrono.objects.filter(id=trabajo.id, estado='PENDIENTE').update(
+            estado='EN_EJECUCION', fecha_inicio=ahora, intentos=F('intentos') + 1
+        )
+        if not reclamado:
+            return None
+        trabajo.refresh_from_db()
+        return trabajo
+
+def recuperar_abandonados(excluir=()):
+    """
+    Devuelve a PENDIENTE los trabajos que quedaron EN_EJECUCION más allá del tiempo
+    máximo (worker reiniciado o caído); tras agotar los intentos se marcan FALLIDO.
+    `excluir` son los trabajos que el worker que llama sigue ejecutando.
+    """
+    limite = timezone.now() - timedelta(minutes=settings.TRABAJOS_TIEMPO_MAXIMO_MINUTOS)
+    abandonados = TrabajoAsincrono.objects.filter(estado='EN_EJECUCION', fecha_inicio__lt=limite).exclude(id__in=list(excluir))
+    fallidos = abandonados.filter(intentos__gte=settings.TRABAJOS_MAX_INTENTOS).update(
+        estado='FALLIDO', error='El trabajo excedió el tiempo máximo de ejecución', fecha_finalizacion=timezone.now()
+    )
+    reintentados = abandonados.update(estado='PENDIENTE', progreso=0, mensaje='Reintentando')
+    return reintentados, fallidos
+
+def ejecutar(trabajo_id):
+    """Ejecuta un trabajo ya reclamado y guarda su resultado o error"""
+    trabajo = TrabajoAsincrono.objects.get(id=trabajo_id)
+    try:
+        manejador = import_string(MANEJADORES[trabajo.tipo])
+        resultado = manejador(trabajo) or {}
+    except Exception as e:
+        TrabajoAsincrono.objects.filter(id=trabajo.id).update(
+            estado='FALLIDO',
+            error=f"{e}\n{traceback.format_exc()}",
+            fecha_finalizacion=timezone.now()
+        )
+        return False
+
+    TrabajoAsincrono.objects.filter(id=trabajo.id).update(
+        estado='COMPLETADO',
+        progreso=100,
+        resultado=resultado,
+        archivo_resultado=trabajo.archivo_resultado,
+        fecha_finalizacion=timezone.now()
+    )
+    return True
+
+def ruta_resultado(trabajo, nombre_archivo):
+    """Reserva la ruta del archivo de resultado del trabajo y la retorna"""
+    carpeta = settings.TRABAJOS_DIR / str(trabajo.id)
+    os.makedirs(carpeta, exist_ok=True)
+    trabajo.archivo_resultado = f"{trabajo.id}/{nombre_archivo}"
+    return carpeta / nombre_archivo
+
+# Manejadores
+
+def exportar_bitacora_csv(trabajo):
+    """Escribe la bitácora filtrada en un CSV sin cargarla completa en memoria"""
+    queryset = RegistroBitacora.filtrar(trabajo.parametros.get('filtros', {}))
+    total = queryset.count()
+    ruta = ruta_resultado(trabajo, f"bitacora_{timezone.now():%Y%m%d_%H%M%S}.csv")
+
+    registros = queryset.select_related('usuario', 'lote', 'muestra').order_by('-fecha')
+    with open(ruta, 'w', newline='', encoding='utf-8-sig') as archivo:
+        escritor = csv.writer(archivo)
+        escritor.writerow(['fecha', 'usuario', 'accion', 'modulo', 'descripcion', 'lote', 'muestra', 'ip_address'])
+        for indice, registro in enumerate(registros.iterator(chunk_size=2000), 1):
+            escritor.writerow([
+                registro.fecha.strftime('%Y-%m-%d %H:%M:%S'),
+                registro.usuario.username,
+                registro.get_accion_display(),
+                registro.get_modulo_display(),
+                registro.descripcion,
+                registro.lote.numero_lote if registro.lote else '',
+                registro.muestra.numero_muestra if registro.muestra else '',
+                registro.ip_address or ''
+            ])
+            if indice % 2000 == 0:
+                trabajo.actualizar_progreso(indice * 100 // max(total, 1), f'{indice} de {total} registros')
+
+    return {'total_registros': total}
@@ -20,7 +20,7 @@ from .views import (
     TareaProcesoListCreateView, TareaProcesoDetailView, avanzar_fase_proceso, finalizar_fase_proceso,
     estadisticas_procesos_produccion, lotes_disponibles_para_proceso,
     guardar_datos_pilado, guardar_datos_clasificacion, guardar_datos_densidad_1,
-    guardar_datos_densidad_2, guardar_datos_color, guardar_datos_empaquetado
+    guardar_datos_densidad_2, guardar_datos_color, guardar_datos_empaquetado, resumen_mediciones_fases
 )
 
 router = DefaultRouter()
@@ -52,6 +52,9 @@ urlpatterns = [
     
     # Lotes - Reporte de separación
     path('lotes/<int:lote_id>/reporte-separacion/', generar_reporte_separacion, name='reporte-separacion'),
+    path('lotes/<int:lote_id>/reporte-separacion/pdf/', views.reporte_lote_pdf, {'tipo_reporte': 'separacion'}, name='reporte-separacion-pdf'),
+    path('lotes/<int:lote_id>/reporte-recepcion-final/pdf/', views.reporte_lote_pdf, {'tipo_reporte': 'recepcion_final'}, name='reporte-recepcion-final-pdf'),
+    path('lotes/<int:lote_id>/eventos/', views.LoteEventoListView.as_view(), name='lote-eventos'),
     
     # Procesos de separación inteligente
     path('lotes/<int:lote_id>/enviar-parte-limpia-limpieza/', enviar_parte_limpia_limpieza, name='enviar-parte-limpia-limpieza'),
@@ -65,6 +68,7 @@ urlpatterns = [
     
     # Lotes para recepción final
     path('lotes/listos-recepcion-final/', views.lotes_listos_recepcion_final, name='lotes-listos-recepcion-final'),
+    path('lotes/consumo-recursos/', views.consumo_recursos_lotes, name='lotes-consumo-recursos'),
     
     # Estadísticas generales
     path('estadisticas/', estadisticas_procesos, name='estadisticas-procesos'),
@@ -72,10 +76,16 @@ urlpatterns = [
     # URLs para bitácora
     path('bitacora/estadisticas/', views.estadisticas_bitacora, name='bitacora-estadisticas'),
     path('bitacora/exportar-csv/', views.exportar_bitacora_csv, name='bitacora-exportar-csv'),
+    
+    # Trabajos en segundo plano
+    path('trabajos/', views.TrabajoAsincronoListView.as_view(), name='trabajos-list'),
+    path('trabajos/<int:pk>/', views.TrabajoAsincronoDetailView.as_view(), name='trabajos-detail'),
+    path('trabajos/<int:trabajo_id>/descargar/', views.descargar_resultado_trabajo, name='trabajos-descargar'),
 
     # URLs para empleados - Descargas
     path('descargas/', RegistroDescargaListCreateView.as_view(), name='descarga-list-create'),
     path('descargas/<int:pk>/', RegistroDescargaDetailView.as_view(), name='descarga-detail'),
+    path('descargas/rendimiento/', views.rendimiento_descargas, name='descarga-rendimiento'),
     
     # URLs para empleados - Insumos
     path('insumos/', InsumoListCreateView.as_view(), name='insumos-list-create'),
@@ -83,10 +93,18 @@ urlpatterns = [
     path('tipos-insumos/', obtener_tipos_insumos, name='tipos-insumos'),
     path('inventario/estadisticas/', estadisticas_inventario, name='estadisticas-inventario'),
     path('insumos/<int:insumo_id>/actualizar-stock/', actualizar_stock_insumo, name='actualizar-stock-insumo'),
+    path('insumos/ajuste-masivo/', views.ajustar_stock_masivo, name='ajuste-masivo-stock'),
+    path('inventario/movimientos/', views.MovimientoInventarioListView.as_view(), name='movimientos-inventario'),
+    path('inventario/existencias/', views.existencias_inventario, name='existencias-inventario'),
+    path('inventario/consumo/', views.consumo_inventario, name='consumo-inventario'),
+    path('inventario/pronostico/', views.pronostico_inventario, name='pronostico-inventario'),
     
     # URLs para uso de maquinaria
     path('uso-maquinaria/', RegistroUsoMaquinariaListCreateView.as_view(), name='uso-maquinaria-list-create'),
     path('uso-maquinaria/<int:pk>/', RegistroUsoMaquinariaDetailView.as_view(), name='uso-maquinaria-detail'),
+    path('uso-maquinaria/utilizacion/', views.utilizacion_maquinaria, name='uso-maquinaria-utilizacion'),
+    path('uso-maquinaria/conflictos/', views.conflictos_maquinaria, name='uso-maquinaria-conflictos'),
+    path('sincronizar/', views.sincronizar_registros, name='sincronizar-registros'),
     
     # URLs para tareas con insumos
     path('tareas/', TareaInsumoListCreateView.as_view(), name='tareas-list-create'),
@@ -94,10 +112,17 @@ urlpatterns = [
     
     # URLs para propietarios maestros
     path('propietarios-maestros/', PropietarioMaestroListCreateView.as_view(), name='propietarios-maestros-list-create'),
+    path('propietarios-maestros/importar/', views.importar_propietarios_maestros, name='propietarios-maestros-importar'),
+    path('propietarios-maestros/historial-calidad/', views.historial_calidad_propietarios, name='propietarios-maestros-historial-calidad'),
     path('propietarios-maestros/<int:pk>/', PropietarioMaestroDetailView.as_view(), name='propietarios-maestros-detail'),
     path('propietarios-maestros/<int:propietario_id>/reactivar/', views.reactivar_propietario_maestro, name='reactivar-propietario-maestro'),
+    path('propietarios-maestros/<int:propietario_id>/historial-calidad/', views.historial_calidad_propietario, name='historial-calidad-propietario'),
     path('propietarios-inactivos/', views.propietarios_inactivos, name='propietarios-inactivos'),
     path('buscar-propietario/<str:cedula>/', views.buscar_propietario_por_cedula, name='buscar_propietario_por_cedula'),
+    path('sistema/metricas/', views.metricas_sistema, name='metricas-sistema'),
+    path('autocompletar/propietarios-maestros/', views.autocompletar_propietarios_maestros, name='autocompletar-propietarios-maestros'),
+    path('autocompletar/propietarios/', views.autocompletar_propietarios, name='autocompletar-propietarios'),
+    path('autocompletar/organizaciones/', views.autocompletar_organizaciones, name='autocompletar-organizaciones'),
     
     # URLs para estadísticas e historial del empleado
     path('empleados/mis-estadisticas/', estadisticas_empleado, name='estadisticas-empleado'),
@@ -122,6 +147,7 @@ urlpatterns = [
     path('procesos/<int:proceso_id>/guardar-densidad-2/', guardar_datos_densidad_2, name='guardar-datos-densidad-2'),
     path('procesos/<int:proceso_id>/guardar-color/', guardar_datos_color, name='guardar-datos-color'),
     path('procesos/<int:proceso_id>/guardar-empaquetado/', guardar_datos_empaquetado, name='guardar-datos-empaquetado'),
+    path('procesos/mediciones/resumen/', resumen_mediciones_fases, name='procesos-mediciones-resumen'),
     
     # URLs del router
     path('', include(router.urls)),
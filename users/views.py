@@ -1,27 +1,95 @@
 from django.shortcuts import render
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from rest_framework import generics, permissions, status, viewsets, filters
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth.models import User
+from django.conf import settings
 from django.utils import timezone
-from django.db.models import Count, Sum, Q, F
-from django.db import models
-from datetime import timedelta
+from django.utils.dateparse import parse_date, parse_datetime
+from django.db.models import Count, Sum, Q, F, Prefetch
+from django.db.models.functions import Coalesce, TruncDay, TruncWeek, TruncMonth, TruncQuarter, TruncYear
+from django.db import IntegrityError, connection, models, transaction
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from functools import wraps
+from django.utils.decorators import method_decorator
 from django_filters.rest_framework import DjangoFilterBackend
 from .serializers import (RegisterSerializer, UserSerializer, OrganizacionSerializer,
-                         LoteCafeSerializer, PropietarioCafeSerializer, MuestraCafeSerializer,
+                         LoteCafeSerializer, MuestraCafeSerializer,
                          ProcesoAnalisisSerializer, CrearLoteConPropietariosSerializer,
                          SeleccionarMuestrasSerializer, RegistroBitacoraSerializer,
                          RegistroDescargaSerializer, InsumoSerializer, RegistroUsoMaquinariaSerializer,
                          PropietarioMaestroSerializer, TareaInsumoSerializer, ProcesoSerializer,
-                         TareaProcesoSerializer)
+                         TareaProcesoSerializer, LoteEventoSerializer, TrabajoAsincronoSerializer,
+                         MovimientoInventarioSerializer)
+from . import trabajos, reportes, importaciones, calidad, pronostico, maquinaria, rendimiento, sincronizacion
+from .cache import cache_calidad, cache_descargas, cache_inventario, cache_propietarios, propietario_por_cedula
 from .models import (Organizacion, LoteCafe, PropietarioCafe, MuestraCafe, ProcesoAnalisis, 
                     RegistroBitacora, RegistroDescarga, Insumo, RegistroUsoMaquinaria,
-                    PropietarioMaestro, TareaInsumo, Proceso, TareaProceso)
+                    PropietarioMaestro, TareaInsumo, Proceso, TareaProceso, EstadoAnalisisPropietario,
+                    ConflictoVersionLote, LoteEvento, TrabajoAsincrono, CAMPOS_HEREDADOS_MAESTRO, normalizar_texto,
+                    MovimientoInventario, StockInsuficiente, ConsumoRecursoLote, MedicionFase)
 
 # Create your views here.
 
+# Número de intentos de una transición de lote antes de responder 409
+REINTENTOS_CONFLICTO_LOTE = 3
+
+def _version_cliente(request):
+    """Versión del lote enviada por el cliente (None si no la envió)"""
+    version = request.data.get('version') if hasattr(request, 'data') else None
+    if version in (None, ''):
+        return None
+    return int(version)
+
+def _obtener_lote_para_transicion(request, lote_id):
+    """
+    Obtiene el lote a transicionar. Si el cliente envió la versión que tenía,
+    la transición se condiciona a esa versión en lugar de la recién leída.
+    """
+    lote = LoteCafe.objects.get(id=lote_id)
+    version = _version_cliente(request)
+    if version is not None:
+        lote.version = version
+    return lote
+
+def reintentar_si_conflicto(vista):
+    """
+    Ejecuta la vista en una transacción y la reintenta si una transición de lote
+    encuentra que otra operación lo modificó. Si el cliente envió la versión
+    esperada, o se agotan los intentos, responde 409 con la versión actual.
+    """
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        try:
+            version = _version_cliente(request)
+        except (TypeError, ValueError):
+            return Response({'error': 'La versión del lote debe ser un número entero'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        intentos = 1 if version is not None else REINTENTOS_CONFLICTO_LOTE
+        for _ in range(intentos):
+            try:
+                with transaction.atomic():
+                    respuesta = vista(request, *args, **kwargs)
+                    # Las vistas responden sus errores sin lanzar: se descarta lo que alcanzaron a escribir
+                    if respuesta.status_code >= 400:
+                        transaction.set_rollback(True)
+                    return respuesta
+            except ConflictoVersionLote as conflicto:
+                lote_id = conflicto.lote_id
+        
+        lote_actual = LoteCafe.objects.filter(id=lote_id).values('version', 'estado').first() or {}
+        return Response({
+            'error': 'El lote fue modificado por otro usuario. Recargue los datos e intente nuevamente.',
+            'lote_id': lote_id,
+            'version_actual': lote_actual.get('version'),
+            'estado_actual': lote_actual.get('estado')
+        }, status=status.HTTP_409_CONFLICT)
+    return envoltura
+
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     permission_classes = (permissions.AllowAny,)
@@ -82,15 +150,32 @@ class OrganizacionDetailView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
 # Vistas para Lotes de Café
+def _lotes_con_muestras(queryset):
+    """Lotes con sus muestras precargadas, cada una con la entrega y su propietario maestro"""
+    return queryset.prefetch_related(
+        Prefetch('muestras', queryset=MuestraCafe.objects.select_related('propietario__propietario_maestro'))
+    )
+
 class LoteCafeListCreateView(generics.ListCreateAPIView):
-    queryset = LoteCafe.objects.all().order_by('-fecha_creacion')
+    queryset = _lotes_con_muestras(LoteCafe.objects.all()).order_by('-fecha_creacion')
     serializer_class = LoteCafeSerializer
     permission_classes = [permissions.IsAuthenticated]
 
 class LoteCafeDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = LoteCafe.objects.all()
+    queryset = _lotes_con_muestras(LoteCafe.objects.all())
     serializer_class = LoteCafeSerializer
     permission_classes = [permissions.IsAuthenticated]
+    
+    @method_decorator(reintentar_si_conflicto)
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+    
+    def perform_update(self, serializer):
+        # La escritura se condiciona a la versión que tenía el cliente, si la envió
+        version = _version_cliente(self.request)
+        if version is not None:
+            serializer.instance.version = version
+        serializer.save()
 
 # Vista para crear lote con propietarios
 @api_view(['POST'])
@@ -110,6 +195,12 @@ def crear_lote_con_propietarios(request):
             lote=lote,
             organizacion=lote.organizacion
         )
+        LoteEvento.registrar(
+            lote, 'LOTE_CREADO', request.user,
+            total_quintales=lote.total_quintales,
+            peso_total_inicial=lote.peso_total_inicial,
+            propietarios=[p.id for p in lote.propietarios.all()]
+        )
         
         return Response(LoteCafeSerializer(lote).data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -117,6 +208,7 @@ def crear_lote_con_propietarios(request):
 # Vista para seleccionar muestras de un lote
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@reintentar_si_conflicto
 def seleccionar_muestras(request):
     serializer = SeleccionarMuestrasSerializer(data=request.data)
     if serializer.is_valid():
@@ -124,7 +216,7 @@ def seleccionar_muestras(request):
         propietarios_ids = serializer.validated_data['propietarios_seleccionados']
         
         try:
-            lote = LoteCafe.objects.get(id=lote_id)
+            lote = _obtener_lote_para_transicion(request, lote_id)
             propietarios = PropietarioCafe.objects.filter(
                 lote=lote, 
                 id__in=propietarios_ids
@@ -146,8 +238,12 @@ def seleccionar_muestras(request):
                 muestras_creadas.append(muestra)
             
             # Actualizar estado del lote
-            lote.estado = 'APROBADO'
-            lote.save()
+            lote.transicionar(estado='APROBADO')
+            LoteEvento.registrar(
+                lote, 'MUESTRAS_SELECCIONADAS', request.user,
+                muestras=[m.id for m in muestras_creadas],
+                propietarios=[p.id for p in propietarios]
+            )
             
             # Registrar acción en bitácora
             RegistroBitacora.registrar_accion(
@@ -173,13 +269,76 @@ def seleccionar_muestras(request):
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+def _aplicar_separacion_final(lote, grupos, usuario):
+    """
+    Calcula el resultado del segundo muestreo a partir de los estados materializados,
+    lo registra en el historial del lote y finaliza los procesos abiertos.
+    Retorna los campos a transicionar en el lote y el mensaje.
+    """
+    from decimal import Decimal
+
+    conservados_inicio = grupos['APROBADA']
+    recuperados = grupos['APROBADA_SEGUNDO']
+    confirmados = grupos['CONTAMINADA_CONFIRMADA']
+
+    quintales_originales = lote.total_quintales
+    quintales_finales_contaminados = sum(e.quintales for e in confirmados)
+    quintales_finales_aprobados = sum(e.quintales for e in conservados_inicio) + sum(e.quintales for e in recuperados)
+
+    campos = {}
+    if confirmados:
+        # ✅ ACTUALIZAR FÍSICAMENTE LOS QUINTALES DEL LOTE
+        campos['total_quintales'] = quintales_finales_aprobados
+
+        # Ajustar peso proporcionalmente si existe
+        if quintales_originales > 0:
+            proporcion_limpia = Decimal(str(quintales_finales_aprobados)) / Decimal(str(quintales_originales))
+            if lote.peso_total_inicial:
+                campos['peso_total_inicial'] = lote.peso_total_inicial * proporcion_limpia
+            if lote.peso_total_final:
+                campos['peso_total_final'] = lote.peso_total_final * proporcion_limpia
+
+        # Aplicar separación inteligente - Solo separar los confirmados contaminados
+        campos['estado'] = 'SEPARACION_APLICADA'
+        tipo_evento = 'SEPARACION_APLICADA'
+        mensaje = f'Segundo muestreo completado. Se separaron {quintales_finales_contaminados} quintales contaminados. {quintales_finales_aprobados} quintales continúan en el proceso.'
+    else:
+        # Todos los del segundo muestreo salieron aprobados - recuperación total
+        campos['estado'] = 'APROBADO'
+        tipo_evento = 'LOTE_RECUPERADO'
+        mensaje = '¡Excelente! Segundo muestreo exitoso. Toda la contaminación inicial se ha resuelto. El lote completo puede continuar.'
+
+    LoteEvento.registrar(
+        lote, tipo_evento, usuario,
+        quintales_originales=quintales_originales,
+        quintales_conservados=quintales_finales_aprobados,
+        quintales_separados=quintales_finales_contaminados,
+        propietarios_aprobados=[e.propietario_id for e in conservados_inicio],
+        propietarios_recuperados=[e.propietario_id for e in recuperados],
+        propietarios_separados=[e.propietario_id for e in confirmados]
+    )
+
+    # Finalizar todos los procesos abiertos
+    procesos_abiertos = lote.procesos.filter(fecha_finalizacion__isnull=True)
+    for proceso in procesos_abiertos:
+        proceso.fecha_finalizacion = timezone.now()
+        proceso.aprobado = (campos['estado'] in ['APROBADO', 'SEPARACION_APLICADA'])
+        proceso.resultado_general = mensaje
+        proceso.save()
+
+    return campos, mensaje
+
+def _segundo_muestreo_completo(grupos):
+    """El segundo muestreo está completo si existe y no quedan muestras de seguimiento pendientes"""
+    tiene_segundo_muestreo = any(grupos[estado] for estado in EstadoAnalisisPropietario.ESTADOS_SEGUNDO_MUESTREO)
+    return tiene_segundo_muestreo and not grupos['SEGUNDO_PENDIENTE']
+
 # Vista para registrar resultados de análisis
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@reintentar_si_conflicto
 def registrar_resultado_muestra(request, muestra_id):
     try:
-        muestra = MuestraCafe.objects.get(id=muestra_id)
-        
         estado = request.data.get('estado')
         resultado_analisis = request.data.get('resultado_analisis', '')
         observaciones = request.data.get('observaciones', '')
@@ -187,11 +346,15 @@ def registrar_resultado_muestra(request, muestra_id):
         if estado not in ['APROBADA', 'CONTAMINADA']:
             return Response({'error': 'Estado inválido'}, status=status.HTTP_400_BAD_REQUEST)
         
+        muestra = MuestraCafe.objects.select_related('propietario__propietario_maestro').get(id=muestra_id)
+        lote = _obtener_lote_para_transicion(request, muestra.lote_id)
+        muestra.lote = lote
+        
         muestra.estado = estado
         muestra.resultado_analisis = resultado_analisis
         muestra.observaciones = observaciones
         muestra.fecha_analisis = timezone.now()
-        muestra.save()
+        muestra.save()  # Actualiza el estado materializado del propietario en la misma transacción
         
         # Registrar análisis en bitácora
         RegistroBitacora.registrar_accion(
@@ -200,7 +363,7 @@ def registrar_resultado_muestra(request, muestra_id):
             modulo='PROCESOS',
             descripcion=f'Análisis registrado para muestra {muestra.numero_muestra}: {estado} - {resultado_analisis[:100]}...' if len(resultado_analisis) > 100 else f'Análisis registrado para muestra {muestra.numero_muestra}: {estado} - {resultado_analisis}',
             request=request,
-            lote=muestra.lote,
+            lote=lote,
             muestra=muestra,
             detalles_adicionales={
                 'estado_anterior': 'PENDIENTE',
@@ -210,6 +373,17 @@ def registrar_resultado_muestra(request, muestra_id):
             }
         )
         
+        LoteEvento.registrar(
+            lote, 'RESULTADO_MUESTRA', request.user,
+            muestra=muestra.id,
+            propietario=muestra.propietario_id,
+            estado=estado,
+            es_segundo_muestreo=muestra.es_segundo_muestreo
+        )
+        
+        grupos = EstadoAnalisisPropietario.agrupar_por_estado(lote)
+        campos = {}
+        
         # ✅ CORRECCIÓN PRINCIPAL: Verificar si la muestra actual ya es un segundo muestreo
         if muestra.es_segundo_muestreo and estado == 'CONTAMINADA':
             # Esta es una muestra de segundo muestreo que sale contaminada
@@ -217,109 +391,24 @@ def registrar_resultado_muestra(request, muestra_id):
             response_data = {
                 'mensaje': 'Segundo muestreo completado. La muestra está confirmada como contaminada.',
                 'muestra': MuestraCafeSerializer(muestra).data,
-                'lote_estado': muestra.lote.estado,
+                'lote_estado': lote.estado,
                 'requiere_segundo_muestreo': False,
                 'separacion_definitiva': True,
                 'es_segundo_muestreo_contaminado': True,
                 'mensaje_separacion': f'El propietario {muestra.propietario.nombre_completo} debe ser separado definitivamente del lote. La contaminación se ha confirmado en el segundo análisis.'
             }
             
-            # Actualizar estado del lote si es necesario
-            lote = muestra.lote
-            # Verificar si todas las muestras de segundo muestreo están completas
-            muestras_segundo = lote.muestras.filter(es_segundo_muestreo=True)
-            muestras_segundo_pendientes = muestras_segundo.filter(estado='PENDIENTE').count()
-            
-            if muestras_segundo_pendientes == 0:
-                # Todas las muestras de segundo muestreo están completas, aplicar separación final
-                muestras_iniciales = lote.muestras.filter(es_segundo_muestreo=False)
-                muestras_segundo_contaminadas = muestras_segundo.filter(estado='CONTAMINADA')
-                muestras_segundo_aprobadas = muestras_segundo.filter(estado='APROBADA')
-                muestras_iniciales_aprobadas = muestras_iniciales.filter(estado='APROBADA')
-                
-                # ✅ CALCULAR QUINTALES REALES DESPUÉS DE SEPARACIÓN
-                quintales_originales = lote.total_quintales
-                quintales_finales_contaminados = sum(m.propietario.quintales_entregados for m in muestras_segundo_contaminadas)
-                quintales_finales_aprobados = sum(m.propietario.quintales_entregados for m in muestras_iniciales_aprobadas) + sum(m.propietario.quintales_entregados for m in muestras_segundo_aprobadas)
-                
-                propietarios_definitivamente_contaminados = [m.propietario.nombre_completo for m in muestras_segundo_contaminadas]
-                propietarios_recuperados_segundo_muestreo = [m.propietario.nombre_completo for m in muestras_segundo_aprobadas]
-                
-                if muestras_segundo_contaminadas.exists():
-                    # ✅ ACTUALIZAR FÍSICAMENTE LOS QUINTALES DEL LOTE
-                    lote.total_quintales = quintales_finales_aprobados
-                    
-                    # Ajustar peso proporcionalmente si existe
-                    if lote.peso_total_inicial and quintales_originales > 0:
-                        from decimal import Decimal
-                        proporcion_limpia = Decimal(str(quintales_finales_aprobados)) / Decimal(str(quintales_originales))
-                        lote.peso_total_inicial = lote.peso_total_inicial * proporcion_limpia
-                    
-                    if lote.peso_total_final and quintales_originales > 0:
-                        from decimal import Decimal
-                        proporcion_limpia = Decimal(str(quintales_finales_aprobados)) / Decimal(str(quintales_originales))
-                        lote.peso_total_final = lote.peso_total_final * proporcion_limpia
-                    
-                    # Aplicar separación inteligente
-                    lote.estado = 'SEPARACION_APLICADA'
-                    lote.observaciones = f"""SEPARACIÓN INTELIGENTE APLICADA - SEGUNDO MUESTREO COMPLETADO
-                    
-Resultado final del análisis:
-- Total propietarios original: {lote.propietarios.count()}
-- Muestras iniciales: {muestras_iniciales.count()}
-- Segundo muestreo: {muestras_segundo.count()}
-
-SEPARACIÓN REALIZADA:
-✅ QUINTALES CONSERVADOS: {quintales_finales_aprobados} qq
-   - Propietarios aprobados desde inicio: {', '.join([m.propietario.nombre_completo for m in muestras_iniciales_aprobadas])}
-   {"- Propietarios recuperados en 2do muestreo: " + ', '.join(propietarios_recuperados_segundo_muestreo) if propietarios_recuperados_segundo_muestreo else ""}
-
-❌ QUINTALES SEPARADOS: {quintales_finales_contaminados} qq  
-   - Propietarios con contaminación confirmada: {', '.join(propietarios_definitivamente_contaminados)}
-
-RESUMEN:
-- Quintales originales: {quintales_originales} qq
-- El {round((quintales_finales_aprobados/quintales_originales)*100, 1)}% del lote ({quintales_finales_aprobados} qq) se conserva para continuar el proceso
-- El {round((quintales_finales_contaminados/quintales_originales)*100, 1)}% del lote ({quintales_finales_contaminados} qq) se separa por contaminación confirmada
-
-RESULTADO: SEPARACIÓN EXITOSA - El lote principal puede continuar el proceso de producción con {quintales_finales_aprobados} quintales."""
-                    
-                    response_data['mensaje'] = f'Segundo muestreo completado. Se separaron {quintales_finales_contaminados} quintales contaminados. {quintales_finales_aprobados} quintales continúan en el proceso.'
-                else:
-                    # Todos aprobados en segundo muestreo - mantener quintales originales
-                    lote.estado = 'APROBADO'
-                    lote.observaciones = f"""LOTE COMPLETAMENTE RECUPERADO - SEGUNDO MUESTREO EXITOSO
-                    
-Resultado excepcional:
-- Todas las muestras de segundo muestreo: APROBADAS ✅
-- El 100% del lote ({lote.total_quintales} quintales) ha sido aprobado
-- No se requiere separación de quintales
-
-RESULTADO: LOTE COMPLETAMENTE APROBADO - Café en óptimas condiciones para continuar producción."""
-                    
-                    response_data['mensaje'] = '¡Excelente! Segundo muestreo exitoso. Toda la contaminación inicial se ha resuelto. El lote completo puede continuar.'
-                
-                # Finalizar procesos abiertos
-                procesos_abiertos = lote.procesos.filter(fecha_finalizacion__isnull=True)
-                for proceso in procesos_abiertos:
-                    proceso.fecha_finalizacion = timezone.now()
-                    proceso.aprobado = (lote.estado in ['APROBADO', 'SEPARACION_APLICADA'])
-                    proceso.resultado_general = lote.observaciones
-                    proceso.save()
-                
-                lote.save()
+            # Si todas las muestras de segundo muestreo están completas, aplicar separación final
+            if _segundo_muestreo_completo(grupos):
+                campos, response_data['mensaje'] = _aplicar_separacion_final(lote, grupos, request.user)
             
-            response_data['lote_estado'] = muestra.lote.estado
+            # Todo resultado incrementa la versión del lote: si dos analistas cierran el
+            # muestreo a la vez, el segundo se reintenta viendo el resultado del primero
+            lote.transicionar(**campos)
+            response_data['lote_estado'] = lote.estado
             return Response(response_data)
         
         # ✅ LÓGICA ORIGINAL PARA PRIMER MUESTREO
-        # Verificar si todas las muestras del lote han sido analizadas
-        lote = muestra.lote
-        
-        # Solo considerar muestras del muestreo inicial (no segundo muestreo)
-        muestras_iniciales = lote.muestras.filter(es_segundo_muestreo=False)
-        muestras_iniciales_pendientes = muestras_iniciales.filter(estado='PENDIENTE').count()
-        
         response_data = {
             'mensaje': 'Resultado registrado exitosamente',
             'muestra': MuestraCafeSerializer(muestra).data,
@@ -330,237 +419,118 @@ RESULTADO: LOTE COMPLETAMENTE APROBADO - Café en óptimas condiciones para cont
             'propietarios_a_separar': []
         }
         
+        # Propietarios cuya muestra inicial salió contaminada (con o sin segundo muestreo)
+        contaminados_inicio = grupos['CONTAMINADA'] + [
+            e for estado_segundo in EstadoAnalisisPropietario.ESTADOS_SEGUNDO_MUESTREO for e in grupos[estado_segundo]
+        ]
+        
         # Si todas las muestras iniciales han sido analizadas
-        if muestras_iniciales_pendientes == 0:
-            muestras_contaminadas = muestras_iniciales.filter(estado='CONTAMINADA')
-            muestras_aprobadas = muestras_iniciales.filter(estado='APROBADA')
+        if not grupos['PENDIENTE'] and contaminados_inicio:
+            # Propietarios contaminados que todavía no tienen muestra de seguimiento
+            sin_seguimiento = grupos['CONTAMINADA']
             
-            if muestras_contaminadas.exists():
-                # Hay contaminación, verificar si ya existe segundo muestreo
-                tiene_segundo_muestreo = lote.muestras.filter(
-                    es_segundo_muestreo=True,
-                    muestra_original__in=muestras_contaminadas
-                ).exists()
+            if sin_seguimiento:
+                # ✅ CREAR SEGUNDO MUESTREO AUTOMÁTICAMENTE
+                # Crear nuevas muestras para los propietarios con contaminación
+                nuevas_muestras = []
                 
-                if not tiene_segundo_muestreo:
-                    # ✅ CREAR SEGUNDO MUESTREO AUTOMÁTICAMENTE
-                    # Crear nuevas muestras para los propietarios con contaminación
-                    nuevas_muestras = []
-                    
-                    # Obtener el número máximo de muestra existente para este lote
-                    ultima_muestra = MuestraCafe.objects.filter(lote=lote).order_by('-id').first()
-                    if ultima_muestra:
-                        # Extraer el número de la última muestra (formato: LOTE-M##)
-                        partes = ultima_muestra.numero_muestra.split('-M')
-                        if len(partes) > 1:
-                            ultimo_numero_str = partes[-1].replace('-S', '')  # Remover sufijo -S si existe
-                            try:
-                                contador_base = int(ultimo_numero_str) + 1
-                            except (ValueError, IndexError):
-                                contador_base = MuestraCafe.objects.filter(lote=lote).count() + 1
-                        else:
+                # Obtener el número máximo de muestra existente para este lote
+                ultima_muestra = MuestraCafe.objects.filter(lote=lote).order_by('-id').first()
+                if ultima_muestra:
+                    # Extraer el número de la última muestra (formato: LOTE-M##)
+                    partes = ultima_muestra.numero_muestra.split('-M')
+                    if len(partes) > 1:
+                        ultimo_numero_str = partes[-1].replace('-S', '')  # Remover sufijo -S si existe
+                        try:
+                            contador_base = int(ultimo_numero_str) + 1
+                        except (ValueError, IndexError):
                             contador_base = MuestraCafe.objects.filter(lote=lote).count() + 1
                     else:
-                        contador_base = 1
-                    
-                    contador_actual = contador_base
+                        contador_base = MuestraCafe.objects.filter(lote=lote).count() + 1
+                else:
+                    contador_base = 1
+                
+                contador_actual = contador_base
+                
+                for estado_contaminado in sin_seguimiento:
+                    # Generar número único de muestra para segundo muestreo
+                    numero_muestra_segundo = f"{lote.numero_lote}-M{contador_actual:02d}-S"
                     
-                    for muestra_contaminada in muestras_contaminadas:
-                        # Generar número único de muestra para segundo muestreo
-                        numero_muestra_segundo = f"{lote.numero_lote}-M{contador_actual:02d}-S"
-                        
-                        # Verificar que no exista ya una muestra con este número
-                        while MuestraCafe.objects.filter(lote=lote, numero_muestra=numero_muestra_segundo).exists():
-                            contador_actual += 1
-                            numero_muestra_segundo = f"{lote.numero_lote}-M{contador_actual:02d}-S"
-                        
-                        nueva_muestra = MuestraCafe.objects.create(
-                            lote=lote,
-                            propietario=muestra_contaminada.propietario,
-                            numero_muestra=numero_muestra_segundo,
-                            analista=request.user,
-                            es_segundo_muestreo=True,
-                            muestra_original=muestra_contaminada
-                        )
-                        nuevas_muestras.append(nueva_muestra)
+                    # Verificar que no exista ya una muestra con este número
+                    while MuestraCafe.objects.filter(lote=lote, numero_muestra=numero_muestra_segundo).exists():
                         contador_actual += 1
+                        numero_muestra_segundo = f"{lote.numero_lote}-M{contador_actual:02d}-S"
                     
-                    # Crear el proceso de seguimiento
-                    proceso_seguimiento = ProcesoAnalisis.objects.create(
-                        lote=lote,
-                        tipo_proceso='SEGUIMIENTO',
-                        usuario_proceso=request.user
-                    )
-                    
-                    # Registrar creación automática del segundo muestreo en bitácora
-                    RegistroBitacora.registrar_accion(
-                        usuario=request.user,
-                        accion='SEGUNDO_MUESTREO_AUTOMATICO',
-                        modulo='PROCESOS',
-                        descripcion=f'Segundo muestreo creado automáticamente para lote {lote.numero_lote} - {len(nuevas_muestras)} muestras de seguimiento creadas',
-                        request=request,
+                    nueva_muestra = MuestraCafe.objects.create(
                         lote=lote,
-                        detalles_adicionales={
-                            'propietarios_afectados': [m.propietario.nombre_completo for m in muestras_contaminadas],
-                            'muestras_originales': [m.numero_muestra for m in muestras_contaminadas],
-                            'nuevas_muestras': [m.numero_muestra for m in nuevas_muestras],
-                            'proceso_seguimiento_id': proceso_seguimiento.id
-                        }
+                        propietario=estado_contaminado.propietario,
+                        numero_muestra=numero_muestra_segundo,
+                        analista=request.user,
+                        es_segundo_muestreo=True,
+                        muestra_original=estado_contaminado.muestra_decisiva
                     )
-                    
-                    # Actualizar respuesta para indicar que se creó automáticamente
-                    response_data['requiere_segundo_muestreo'] = False  # Ya se creó automáticamente
-                    response_data['segundo_muestreo_creado'] = True
-                    response_data['nuevas_muestras'] = MuestraCafeSerializer(nuevas_muestras, many=True).data
-                    response_data['mensaje'] = f'Análisis completado. Se crearon automáticamente {len(nuevas_muestras)} muestras de segundo muestreo para confirmar contaminación.'
-                    
-                    # Mantener información de separación inteligente
-                    response_data['separacion_requerida'] = True
-                    propietarios_contaminados = []
-                    quintales_contaminados = 0
-                    for m_cont in muestras_contaminadas:
-                        propietarios_contaminados.append({
-                            'id': m_cont.propietario.id,
-                            'nombre': m_cont.propietario.nombre_completo,
-                            'quintales': m_cont.propietario.quintales_entregados,
-                            'cedula': m_cont.propietario.cedula
-                        })
-                        quintales_contaminados += m_cont.propietario.quintales_entregados
-                    
-                    response_data['propietarios_a_separar'] = propietarios_contaminados
-                    
-                    # Actualizar observaciones del lote con separación inteligente
-                    quintales_aprobados = sum([m.propietario.quintales_entregados for m in muestras_aprobadas])
-                    total_quintales = lote.total_quintales
-                    
-                    lote.observaciones = f"""ANÁLISIS INICIAL COMPLETADO - SEGUNDO MUESTREO AUTOMÁTICO CREADO
-                    
-Resultado del primer análisis:
-- Muestras analizadas: {muestras_iniciales.count()}
-- Muestras aprobadas: {muestras_aprobadas.count()} 
-- Muestras contaminadas: {muestras_contaminadas.count()}
-
-SEGUNDO MUESTREO AUTOMÁTICO:
-- Se crearon {len(nuevas_muestras)} muestras de seguimiento
-- Propietarios en segundo muestreo: {', '.join([p['nombre'] for p in propietarios_contaminados])}
-
-Separación potencial de quintales:
-- Quintales APROBADOS (conservar): {quintales_aprobados} qq de {muestras_aprobadas.count()} propietarios
-- Quintales EN SEGUNDO MUESTREO: {quintales_contaminados} qq de {muestras_contaminadas.count()} propietarios
-- Total del lote: {total_quintales} qq
-
-ESTADO ACTUAL: Esperando resultados del segundo muestreo para confirmar separación definitiva.
-
-NOTA: El café de los propietarios con muestras aprobadas puede continuar en el proceso normal."""
-                    
-                    # Cambiar estado del lote a "SEPARACION_PENDIENTE"
-                    lote.estado = 'SEPARACION_PENDIENTE'
+                    nuevas_muestras.append(nueva_muestra)
+                    contador_actual += 1
                 
-                # Ya existe segundo muestreo, verificar si está completo
-                muestras_segundo = lote.muestras.filter(es_segundo_muestreo=True)
-                muestras_segundo_pendientes = muestras_segundo.filter(estado='PENDIENTE').count()
+                # Crear el proceso de seguimiento
+                proceso_seguimiento = ProcesoAnalisis.objects.create(
+                    lote=lote,
+                    tipo_proceso='SEGUIMIENTO',
+                    usuario_proceso=request.user
+                )
                 
-                if muestras_segundo_pendientes == 0:
-                    # Segundo muestreo completado, aplicar separación inteligente
-                    muestras_segundo_contaminadas = muestras_segundo.filter(estado='CONTAMINADA')
-                    muestras_segundo_aprobadas = muestras_segundo.filter(estado='APROBADA')
-                    
-                    # Calcular quintales para separación final
-                    quintales_originales = lote.total_quintales
-                    propietarios_definitivamente_contaminados = []
-                    propietarios_recuperados_segundo_muestreo = []
-                    quintales_finales_contaminados = 0
-                    quintales_finales_aprobados = 0
-                    
-                    # Propietarios que se confirmaron contaminados en segundo muestreo
-                    for m_segundo_cont in muestras_segundo_contaminadas:
-                        propietario = m_segundo_cont.propietario
-                        propietarios_definitivamente_contaminados.append(propietario.nombre_completo)
-                        quintales_finales_contaminados += propietario.quintales_entregados
-                    
-                    # Propietarios que se recuperaron en segundo muestreo
-                    for m_segundo_aprob in muestras_segundo_aprobadas:
-                        propietario = m_segundo_aprob.propietario
-                        propietarios_recuperados_segundo_muestreo.append(propietario.nombre_completo)
-                    
-                    # Propietarios que estuvieron aprobados desde el inicio
-                    for m_inicial_aprob in muestras_aprobadas:
-                        quintales_finales_aprobados += m_inicial_aprob.propietario.quintales_entregados
-                    
-                    # Agregar quintales de propietarios recuperados en segundo muestreo
-                    for m_segundo_aprob in muestras_segundo_aprobadas:
-                        quintales_finales_aprobados += m_segundo_aprob.propietario.quintales_entregados
-                    
-                    if muestras_segundo_contaminadas.exists():
-                        # ✅ ACTUALIZAR FÍSICAMENTE LOS QUINTALES DEL LOTE
-                        lote.total_quintales = quintales_finales_aprobados
-                        
-                        # Ajustar peso proporcionalmente si existe
-                        if lote.peso_total_inicial and quintales_originales > 0:
-                            from decimal import Decimal
-                            proporcion_limpia = Decimal(str(quintales_finales_aprobados)) / Decimal(str(quintales_originales))
-                            lote.peso_total_inicial = lote.peso_total_inicial * proporcion_limpia
-                        
-                        if lote.peso_total_final and quintales_originales > 0:
-                            from decimal import Decimal
-                            proporcion_limpia = Decimal(str(quintales_finales_aprobados)) / Decimal(str(quintales_originales))
-                            lote.peso_total_final = lote.peso_total_final * proporcion_limpia
-                        
-                        # Aplicar separación inteligente - Solo separar los confirmados contaminados
-                        lote.estado = 'SEPARACION_APLICADA'
-                        lote.observaciones = f"""SEPARACIÓN INTELIGENTE APLICADA - SEGUNDO MUESTREO COMPLETADO
-                        
-Resultado final del análisis:
-- Total propietarios original: {lote.propietarios.count()}
-- Muestras iniciales: {muestras_iniciales.count()}
-- Segundo muestreo: {muestras_segundo.count()}
-
-SEPARACIÓN REALIZADA:
-✅ QUINTALES CONSERVADOS: {quintales_finales_aprobados} qq
-   - Propietarios aprobados desde inicio: {', '.join([m.propietario.nombre_completo for m in muestras_aprobadas])}
-   {"- Propietarios recuperados en 2do muestreo: " + ', '.join(propietarios_recuperados_segundo_muestreo) if propietarios_recuperados_segundo_muestreo else ""}
-
-❌ QUINTALES SEPARADOS: {quintales_finales_contaminados} qq  
-   - Propietarios con contaminación confirmada: {', '.join(propietarios_definitivamente_contaminados)}
-
-RESUMEN:
-- Quintales originales: {quintales_originales} qq
-- El {round((quintales_finales_aprobados/quintales_originales)*100, 1)}% del lote ({quintales_finales_aprobados} qq) se conserva para continuar el proceso
-- El {round((quintales_finales_contaminados/quintales_originales)*100, 1)}% del lote ({quintales_finales_contaminados} qq) se separa por contaminación confirmada
-
-RESULTADO: SEPARACIÓN EXITOSA - El lote principal puede continuar el proceso de producción con {quintales_finales_aprobados} quintales."""
-                        
-                        response_data['mensaje'] = f'Segundo muestreo completado. Se separaron {quintales_finales_contaminados} quintales contaminados. {quintales_finales_aprobados} quintales continúan en el proceso.'
-                        
-                    else:
-                        # Todos los del segundo muestreo salieron aprobados - recuperación total
-                        lote.estado = 'APROBADO'
-                        lote.observaciones = f"""LOTE COMPLETAMENTE RECUPERADO - SEGUNDO MUESTREO EXITOSO
-                        
-Resultado excepcional:
-- Muestras iniciales contaminadas: {muestras_contaminadas.count()}
-- Todas las muestras de segundo muestreo: APROBADAS ✅
-
-RECUPERACIÓN TOTAL:
-- El 100% del lote ({lote.total_quintales} quintales) ha sido aprobado
-- No se requiere separación de quintales
-- Todos los propietarios pueden continuar en el proceso
-
-Este resultado indica que la contaminación inicial fue un falso positivo o se corrigió satisfactoriamente.
-
-RESULTADO: LOTE COMPLETAMENTE APROBADO - Café en óptimas condiciones para continuar producción."""
-                        
-                        response_data['mensaje'] = '¡Excelente! Segundo muestreo exitoso. Toda la contaminación inicial se ha resuelto. El lote completo puede continuar.'
-                    
-                    # Finalizar todos los procesos abiertos
-                    procesos_abiertos = lote.procesos.filter(fecha_finalizacion__isnull=True)
-                    for proceso in procesos_abiertos:
-                        proceso.fecha_finalizacion = timezone.now()
-                        proceso.aprobado = (lote.estado in ['APROBADO', 'SEPARACION_APLICADA'])
-                        proceso.resultado_general = lote.observaciones
-                        proceso.save()
+                # Registrar creación automática del segundo muestreo en bitácora
+                RegistroBitacora.registrar_accion(
+                    usuario=request.user,
+                    accion='SEGUNDO_MUESTREO_AUTOMATICO',
+                    modulo='PROCESOS',
+                    descripcion=f'Segundo muestreo creado automáticamente para lote {lote.numero_lote} - {len(nuevas_muestras)} muestras de seguimiento creadas',
+                    request=request,
+                    lote=lote,
+                    detalles_adicionales={
+                        'propietarios_afectados': [e.propietario.nombre_completo for e in sin_seguimiento],
+                        'muestras_originales': [e.muestra_decisiva.numero_muestra for e in sin_seguimiento],
+                        'nuevas_muestras': [m.numero_muestra for m in nuevas_muestras],
+                        'proceso_seguimiento_id': proceso_seguimiento.id
+                    }
+                )
+                
+                # Actualizar respuesta para indicar que se creó automáticamente
+                response_data['requiere_segundo_muestreo'] = False  # Ya se creó automáticamente
+                response_data['segundo_muestreo_creado'] = True
+                response_data['nuevas_muestras'] = MuestraCafeSerializer(nuevas_muestras, many=True).data
+                response_data['mensaje'] = f'Análisis completado. Se crearon automáticamente {len(nuevas_muestras)} muestras de segundo muestreo para confirmar contaminación.'
+                
+                # Mantener información de separación inteligente
+                response_data['separacion_requerida'] = True
+                propietarios_contaminados = [{
+                    'id': e.propietario.id,
+                    'nombre': e.propietario.nombre_completo,
+                    'quintales': e.quintales,
+                    'cedula': e.propietario.cedula
+                } for e in sin_seguimiento]
+                quintales_contaminados = sum(e.quintales for e in sin_seguimiento)
+                
+                response_data['propietarios_a_separar'] = propietarios_contaminados
+                
+                # Registrar la separación potencial en el historial del lote
+                LoteEvento.registrar(
+                    lote, 'SEGUNDO_MUESTREO_CREADO', request.user,
+                    muestras=[m.id for m in nuevas_muestras],
+                    propietarios=[e.propietario_id for e in sin_seguimiento],
+                    quintales_aprobados=sum(e.quintales for e in grupos['APROBADA']),
+                    quintales_en_segundo_muestreo=quintales_contaminados,
+                    total_quintales=lote.total_quintales
+                )
                 
-        lote.save()
+                # Cambiar estado del lote a "SEPARACION_PENDIENTE"
+                campos['estado'] = 'SEPARACION_PENDIENTE'
+            
+            # Segundo muestreo completado, aplicar separación inteligente
+            elif _segundo_muestreo_completo(grupos):
+                campos, response_data['mensaje'] = _aplicar_separacion_final(lote, grupos, request.user)
+        
+        lote.transicionar(**campos)
         response_data['lote_estado'] = lote.estado
         
         return Response(response_data)
@@ -568,13 +538,12 @@ RESULTADO: LOTE COMPLETAMENTE APROBADO - Café en óptimas condiciones para cont
     except MuestraCafe.DoesNotExist:
         return Response({'error': 'Muestra no encontrada'}, status=status.HTTP_404_NOT_FOUND)
 
-# Vistas para listar muestras
 class MuestraCafeListView(generics.ListAPIView):
     serializer_class = MuestraCafeSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        queryset = MuestraCafe.objects.all().order_by('-fecha_toma_muestra')
+        queryset = MuestraCafe.objects.select_related('propietario__propietario_maestro').order_by('-fecha_toma_muestra')
         lote_id = self.request.query_params.get('lote_id')
         estado = self.request.query_params.get('estado')
         
@@ -585,6 +554,38 @@ class MuestraCafeListView(generics.ListAPIView):
             
         return queryset
 
+# Vista para consultar el historial de eventos de un lote
+class LoteEventoListView(generics.ListAPIView):
+    serializer_class = LoteEventoSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        # Rango sobre el índice (lote, fecha)
+        queryset = LoteEvento.objects.filter(lote_id=self.kwargs['lote_id']).select_related('usuario').order_by('fecha', 'id')
+        tipo = self.request.query_params.get('tipo')
+        desde = self.request.query_params.get('desde')
+        
+        if tipo:
+            queryset = queryset.filter(tipo=tipo)
+        if desde:
+            queryset = queryset.filter(fecha__gte=self._fecha_desde(desde))
+            
+        return queryset
+    
+    @staticmethod
+    def _fecha_desde(texto):
+        """Fecha y hora ISO, o fecha AAAA-MM-DD desde el inicio del día; 400 si no es válida"""
+        try:
+            fecha = parse_datetime(texto)
+            if fecha is None:
+                dia = parse_date(texto)
+                fecha = datetime.combine(dia, time.min) if dia else None
+        except ValueError:
+            fecha = None
+        if fecha is None:
+            raise ValidationError({'desde': f'Fecha inválida: {texto}. Use AAAA-MM-DD o fecha y hora ISO 8601'})
+        return timezone.make_aware(fecha) if timezone.is_naive(fecha) else fecha
+
 # Vista para obtener estadísticas
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
@@ -718,123 +719,246 @@ def generar_reporte_separacion(request, lote_id):
     """
     try:
         lote = LoteCafe.objects.get(id=lote_id)
+        return Response(reportes.construir_reporte_separacion(lote))
         
-        # Obtener todas las muestras del lote (iniciales y de seguimiento)
-        muestras_iniciales = lote.muestras.filter(es_segundo_muestreo=False)
-        muestras_seguimiento = lote.muestras.filter(es_segundo_muestreo=True)
+    except LoteCafe.DoesNotExist:
+        return Response({'error': 'Lote no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+
+def _rango_solicitado(cabecera, tamano):
+    """
+    Interpreta una cabecera Range de un solo rango en bytes.
+    Retorna (inicio, fin), None si no aplica, o False si el rango no es satisfacible.
+    """
+    if not cabecera or not cabecera.startswith('bytes=') or ',' in cabecera:
+        return None
+    inicio, _, fin = cabecera[len('bytes='):].strip().partition('-')
+    try:
+        if inicio == '':
+            # Sufijo: los últimos N bytes
+            longitud = int(fin)
+            if longitud <= 0:
+                return False
+            return max(tamano - longitud, 0), tamano - 1
+        inicio = int(inicio)
+        fin = min(int(fin), tamano - 1) if fin else tamano - 1
+    except ValueError:
+        return None
+    if inicio >= tamano or inicio > fin:
+        return False
+    return inicio, fin
+
+def _leer_rango(archivo, inicio, longitud, bloque=64 * 1024):
+    try:
+        archivo.seek(inicio)
+        while longitud > 0:
+            datos = archivo.read(min(bloque, longitud))
+            if not datos:
+                break
+            longitud -= len(datos)
+            yield datos
+    finally:
+        archivo.close()
+
+def _respuesta_archivo(request, ruta, nombre, content_type, etag=None):
+    """
+    Sirve un archivo del disco con soporte de Range (206), ETag e If-None-Match (304)
+    """
+    if etag:
+        etag = f'"{etag}"'
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            respuesta = HttpResponseNotModified()
+            respuesta['ETag'] = etag
+            return respuesta
+    
+    tamano = ruta.stat().st_size
+    rango = _rango_solicitado(request.META.get('HTTP_RANGE'), tamano)
+    if rango is False:
+        respuesta = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        respuesta['Content-Range'] = f'bytes */{tamano}'
+        return respuesta
+    
+    if rango is None:
+        respuesta = FileResponse(open(ruta, 'rb'), as_attachment=True, filename=nombre, content_type=content_type)
+    else:
+        inicio, fin = rango
+        respuesta = StreamingHttpResponse(_leer_rango(open(ruta, 'rb'), inicio, fin - inicio + 1),
+                                          status=status.HTTP_206_PARTIAL_CONTENT, content_type=content_type)
+        respuesta['Content-Range'] = f'bytes {inicio}-{fin}/{tamano}'
+        respuesta['Content-Length'] = str(fin - inicio + 1)
+        respuesta['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    
+    respuesta['Accept-Ranges'] = 'bytes'
+    if etag:
+        respuesta['ETag'] = etag
+        respuesta['Cache-Control'] = 'private, no-cache'
+    return respuesta
+
+# Vista para descargar reportes de lote en PDF
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def reporte_lote_pdf(request, lote_id, tipo_reporte):
+    """
+    Descargar el PDF de un reporte del lote. Si la versión actual todavía no está
+    generada, se encola su generación y se responde 202 con el trabajo a consultar.
+    """
+    try:
+        lote = LoteCafe.objects.select_related('organizacion').get(id=lote_id)
         
-        # Analizar propietarios y sus estados
-        propietarios_aprobados = []
-        propietarios_contaminados = []
-        propietarios_sin_analizar = []
+        if tipo_reporte == 'recepcion_final' and lote.estado != 'FINALIZADO':
+            return Response({'error': f'El lote debe estar en estado FINALIZADO. Estado actual: {lote.estado}'},
+                          status=status.HTTP_400_BAD_REQUEST)
         
-        for propietario in lote.propietarios.all():
-            # Buscar muestra inicial del propietario
-            muestra_inicial = muestras_iniciales.filter(propietario=propietario).first()
-            
-            if not muestra_inicial or muestra_inicial.estado == 'PENDIENTE':
-                # Sin analizar
-                propietarios_sin_analizar.append({
-                    'propietario': PropietarioCafeSerializer(propietario).data,
-                    'estado_muestra': 'PENDIENTE',
-                    'accion': 'PENDIENTE_ANALISIS'
-                })
-                continue
+        version = reportes.version_contenido(lote)
+        ruta = reportes.ruta_reporte(tipo_reporte, lote.id, version)
+        
+        if not ruta.exists():
+            parametros = {'reporte': tipo_reporte, 'lote_id': lote.id, 'version': version}
+            trabajo = TrabajoAsincrono.objects.filter(
+                tipo='GENERAR_REPORTE_PDF',
+                estado__in=['PENDIENTE', 'EN_EJECUCION'],
+                parametros=parametros
+            ).first()
+            if trabajo is None:
+                trabajo = trabajos.encolar('GENERAR_REPORTE_PDF', usuario=request.user, **parametros)
             
-            if muestra_inicial.estado == 'APROBADA':
-                # Aprobado en primera instancia
-                propietarios_aprobados.append({
-                    'propietario': PropietarioCafeSerializer(propietario).data,
-                    'estado_muestra': 'APROBADA',
-                    'accion': 'CONSERVAR',
-                    'observaciones': 'Aprobado en análisis inicial'
-                })
-            elif muestra_inicial.estado == 'CONTAMINADA':
-                # Contaminado en primera instancia, verificar segundo muestreo
-                muestra_seguimiento = muestras_seguimiento.filter(propietario=propietario).first()
-                
-                if muestra_seguimiento:
-                    if muestra_seguimiento.estado == 'APROBADA':
-                        # Recuperado en segundo muestreo
-                        propietarios_aprobados.append({
-                            'propietario': PropietarioCafeSerializer(propietario).data,
-                            'estado_muestra': 'APROBADA_SEGUNDO',
-                            'accion': 'CONSERVAR',
-                            'observaciones': 'Contaminación inicial, pero aprobado en segundo muestreo'
-                        })
-                    elif muestra_seguimiento.estado == 'CONTAMINADA':
-                        # Confirmado contaminado
-                        propietarios_contaminados.append({
-                            'propietario': PropietarioCafeSerializer(propietario).data,
-                            'estado_muestra': 'CONTAMINADA_CONFIRMADA',
-                            'accion': 'SEPARAR',
-                            'observaciones': 'Contaminación confirmada en segundo muestreo'
-                        })
-                    else:
-                        # Segundo muestreo pendiente
-                        propietarios_sin_analizar.append({
-                            'propietario': PropietarioCafeSerializer(propietario).data,
-                            'estado_muestra': 'SEGUNDO_PENDIENTE',
-                            'accion': 'PENDIENTE_SEGUNDO_ANALISIS'
-                        })
-                else:
-                    # Contaminado pero sin segundo muestreo
-                    propietarios_contaminados.append({
-                        'propietario': PropietarioCafeSerializer(propietario).data,
-                        'estado_muestra': 'CONTAMINADA',
-                        'accion': 'SEPARAR',
-                        'observaciones': 'Contaminación detectada (requiere confirmación)'
-                    })
-        
-        # Calcular totales
-        total_quintales_aprobados = sum([p['propietario']['quintales_entregados'] for p in propietarios_aprobados])
-        total_quintales_contaminados = sum([p['propietario']['quintales_entregados'] for p in propietarios_contaminados])
-        total_quintales_pendientes = sum([p['propietario']['quintales_entregados'] for p in propietarios_sin_analizar])
-        
-        # Determinar recomendación del lote
-        if len(propietarios_contaminados) == 0 and len(propietarios_sin_analizar) == 0:
-            recomendacion_lote = "APROBAR_COMPLETO"
-            mensaje_recomendacion = "Todo el lote puede ser aprobado"
-        elif len(propietarios_contaminados) > 0 and len(propietarios_aprobados) > 0:
-            recomendacion_lote = "SEPARACION_PARCIAL"
-            mensaje_recomendacion = "Separar quintales contaminados, conservar el resto"
-        elif len(propietarios_contaminados) == len(lote.propietarios.all()):
-            recomendacion_lote = "RECHAZAR_COMPLETO"
-            mensaje_recomendacion = "Todo el lote debe ser rechazado"
-        else:
-            recomendacion_lote = "ANALISIS_PENDIENTE"
-            mensaje_recomendacion = "Completar análisis antes de tomar decisión final"
+            respuesta = Response({
+                'mensaje': 'El reporte se está generando. Consulte el trabajo y vuelva a solicitarlo al completarse.',
+                'trabajo': TrabajoAsincronoSerializer(trabajo, context={'request': request}).data
+            }, status=status.HTTP_202_ACCEPTED)
+            respuesta['Retry-After'] = '2'
+            return respuesta
+        
+        # Registrar solo descargas completas (no cada fragmento de un Range ni las revalidaciones)
+        if not request.META.get('HTTP_RANGE') and request.META.get('HTTP_IF_NONE_MATCH') != f'"{version}"':
+            RegistroBitacora.registrar_accion(
+                usuario=request.user,
+                accion='EXPORTAR_PDF',
+                modulo='REPORTES',
+                descripcion=f'Reporte PDF ({tipo_reporte}) descargado para lote {lote.numero_lote}',
+                request=request,
+                lote=lote,
+                detalles_adicionales={'reporte': tipo_reporte, 'version': version}
+            )
         
-        return Response({
-            'lote': LoteCafeSerializer(lote).data,
-            'propietarios_aprobados': propietarios_aprobados,
-            'propietarios_contaminados': propietarios_contaminados,
-            'propietarios_sin_analizar': propietarios_sin_analizar,
-            'totales': {
-                'quintales_aprobados': total_quintales_aprobados,
-                'quintales_contaminados': total_quintales_contaminados,
-                'quintales_pendientes': total_quintales_pendientes,
-                'total_lote': lote.total_quintales
-            },
-            'recomendacion': {
-                'tipo': recomendacion_lote,
-                'mensaje': mensaje_recomendacion
-            },
-            'fecha_reporte': timezone.now().isoformat()
-        })
+        return _respuesta_archivo(request, ruta, f'{tipo_reporte}_{lote.numero_lote}.pdf', 'application/pdf', etag=version)
         
     except LoteCafe.DoesNotExist:
         return Response({'error': 'Lote no encontrado'}, status=status.HTTP_404_NOT_FOUND)
 
+# Campos de la entrega que puede modificar actualizar_lote
+CAMPOS_ENTREGA_EDITABLES = ['nombre_completo', 'quintales_entregados', 'telefono', 'direccion']
+
+def _sincronizar_propietarios_lote(lote, propietarios_data):
+    """
+    Aplica al lote la lista de propietarios recibida comparándola por cédula con la actual:
+    solo se actualizan las entregas que cambiaron, se crean las nuevas y se eliminan las que
+    ya no están, de modo que las muestras de las entregas que se conservan no se pierden.
+    Debe llamarse dentro de una transacción. Retorna el resumen de cambios.
+    """
+    entrantes = {}
+    for prop_data in propietarios_data:
+        cedula = str(prop_data.get('cedula') or '').strip()
+        if not cedula:
+            raise ValueError('Todos los propietarios deben tener cédula')
+        if cedula in entrantes:
+            raise ValueError(f'La cédula {cedula} está repetida en el lote')
+        entrantes[cedula] = prop_data
+    
+    existentes = {propietario.cedula: propietario for propietario in PropietarioCafe.objects.filter(lote=lote)}
+    
+    actualizados = []
+    quintales_modificados = []
+    ajustes_contadores = {}
+    for cedula, propietario in existentes.items():
+        prop_data = entrantes.get(cedula)
+        if prop_data is None:
+            continue
+        cambio = False
+        for campo in CAMPOS_ENTREGA_EDITABLES:
+            if campo not in prop_data:
+                continue
+            valor = prop_data[campo]
+            if campo == 'quintales_entregados':
+                valor = Decimal(str(valor)).quantize(Decimal('0.01'))
+                diferencia = valor - propietario.quintales_entregados
+                if diferencia:
+                    entregas, quintales = ajustes_contadores.get(propietario.propietario_maestro_id, (0, Decimal('0')))
+                    ajustes_contadores[propietario.propietario_maestro_id] = (entregas, quintales + diferencia)
+                    quintales_modificados.append(propietario)
+            else:
+                valor = valor or ''
+                if not valor and campo in CAMPOS_HEREDADOS_MAESTRO and getattr(propietario, f'{campo}_propio') is None:
+                    # Vacío equivale a heredar del maestro, que es lo que la entrega ya hace
+                    continue
+            if getattr(propietario, campo) != valor:
+                setattr(propietario, campo, valor)
+                cambio = True
+        if cambio:
+            propietario.compactar()
+            actualizados.append(propietario)
+    
+    nuevos_data = [prop_data for cedula, prop_data in entrantes.items() if cedula not in existentes]
+    # Escritura: los maestros se leen de la base de datos (la caché podría estar desactualizada),
+    # bloqueados hasta el commit para no asociar uno que se elimina de forma concurrente
+    maestros = {
+        maestro.cedula: maestro
+        for maestro in PropietarioMaestro.objects.select_for_update().filter(
+            cedula__in=[str(prop_data['cedula']).strip() for prop_data in nuevos_data]
+        )
+    } if nuevos_data else {}
+    nuevos = []
+    for prop_data in nuevos_data:
+        cedula = str(prop_data['cedula']).strip()
+        if prop_data.get('quintales_entregados') in (None, ''):
+            raise ValueError(f'Indique los quintales entregados por {cedula}')
+        maestro = maestros.get(cedula)
+        # Los datos no indicados se heredan del maestro (compactar)
+        entrega = PropietarioCafe(
+            lote=lote,
+            propietario_maestro=maestro,
+            cedula=cedula,
+            quintales_entregados=Decimal(str(prop_data['quintales_entregados'])).quantize(Decimal('0.01')),
+            **{campo: prop_data[campo] for campo in ['nombre_completo', 'telefono', 'direccion'] if prop_data.get(campo) is not None}
+        )
+        entrega.compactar()
+        nuevos.append(entrega)
+    
+    eliminados = [propietario.id for cedula, propietario in existentes.items() if cedula not in entrantes]
+    
+    # bulk_update y bulk_create no emiten señales: estados de análisis, contadores y caché
+    # de calidad se ajustan explícitamente. delete() sí las emite por cada entrega.
+    if actualizados:
+        PropietarioCafe.objects.bulk_update(actualizados, [
+            f'{campo}_propio' if campo in CAMPOS_HEREDADOS_MAESTRO else campo for campo in CAMPOS_ENTREGA_EDITABLES
+        ] + ['nombre_normalizado'])
+        EstadoAnalisisPropietario.actualizar_quintales(quintales_modificados)
+        PropietarioMaestro.ajustar_contadores_en_bloque(ajustes_contadores)
+    if nuevos:
+        nuevos = PropietarioCafe.objects.bulk_create(nuevos)
+        EstadoAnalisisPropietario.inicializar(nuevos)
+        PropietarioMaestro.registrar_entregas(nuevos)
+    if eliminados:
+        PropietarioCafe.objects.filter(id__in=eliminados).delete()
+    if actualizados or nuevos:
+        cache_calidad.invalidar()
+    
+    return {
+        'actualizados': [propietario.cedula for propietario in actualizados],
+        'creados': [propietario.cedula for propietario in nuevos],
+        'eliminados': [cedula for cedula in existentes if cedula not in entrantes],
+    }
+
 # Vista para actualizar lote existente
 @api_view(['PUT'])
 @permission_classes([permissions.IsAuthenticated])
+@reintentar_si_conflicto
 def actualizar_lote(request, lote_id):
     """
-    Actualizar un lote existente con propietarios
+    Actualizar un lote existente con propietarios. Los propietarios se comparan por cédula
+    con los actuales y solo se modifican los que cambiaron
     """
     try:
-        lote = LoteCafe.objects.get(id=lote_id)
+        lote = _obtener_lote_para_transicion(request, lote_id)
         
         # Actualizar campos del lote
         lote.numero_lote = request.data.get('numero_lote', lote.numero_lote)
@@ -843,24 +967,20 @@ def actualizar_lote(request, lote_id):
         lote.total_quintales = request.data.get('total_quintales', lote.total_quintales)
         lote.observaciones = request.data.get('observaciones', lote.observaciones)
         
-        # Actualizar propietarios si se proporcionan
+        # Actualizar propietarios si se proporcionan; los contadores de los propietarios
+        # maestros se ajustan en la misma transacción que los cambios de las entregas
         propietarios_data = request.data.get('propietarios', [])
-        if propietarios_data:
-            # Eliminar propietarios existentes
-            PropietarioCafe.objects.filter(lote=lote).delete()
+        cambios_propietarios = None
+        with transaction.atomic():
+            if propietarios_data:
+                cambios_propietarios = _sincronizar_propietarios_lote(lote, propietarios_data)
             
-            # Crear nuevos propietarios
-            for prop_data in propietarios_data:
-                PropietarioCafe.objects.create(
-                    lote=lote,
-                    nombre_completo=prop_data.get('nombre_completo'),
-                    cedula=prop_data.get('cedula'),
-                    quintales_entregados=prop_data.get('quintales_entregados'),
-                    telefono=prop_data.get('telefono', ''),
-                    direccion=prop_data.get('direccion', '')
-                )
-        
-        lote.save()
+            lote.save()
+        LoteEvento.registrar(
+            lote, 'LOTE_ACTUALIZADO', request.user,
+            campos=[campo for campo in ['numero_lote', 'organizacion', 'fecha_entrega', 'total_quintales', 'observaciones', 'propietarios'] if campo in request.data],
+            **({'propietarios': cambios_propietarios} if cambios_propietarios else {})
+        )
         
         return Response({
             'mensaje': 'Lote actualizado exitosamente',
@@ -869,6 +989,8 @@ def actualizar_lote(request, lote_id):
         
     except LoteCafe.DoesNotExist:
         return Response({'error': 'Lote no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    except ConflictoVersionLote:
+        raise
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -976,20 +1098,25 @@ def exportar_bitacora_csv(request):
     try:
         # Obtener filtros del request
         filtros = request.data.get('filtros', {})
+        asincrono = request.data.get('asincrono', False)
         
-        queryset = RegistroBitacora.objects.all()
+        queryset = RegistroBitacora.filtrar(filtros)
         
-        # Aplicar filtros
-        if filtros.get('fecha_desde'):
-            queryset = queryset.filter(fecha__date__gte=filtros['fecha_desde'])
-        if filtros.get('fecha_hasta'):
-            queryset = queryset.filter(fecha__date__lte=filtros['fecha_hasta'])
-        if filtros.get('accion'):
-            queryset = queryset.filter(accion=filtros['accion'])
-        if filtros.get('modulo'):
-            queryset = queryset.filter(modulo=filtros['modulo'])
-        if filtros.get('usuario'):
-            queryset = queryset.filter(usuario_id=filtros['usuario'])
+        # Exportaciones grandes: generar el archivo CSV en segundo plano
+        if asincrono:
+            trabajo = trabajos.encolar('EXPORTAR_BITACORA_CSV', usuario=request.user, filtros=filtros)
+            RegistroBitacora.registrar_accion(
+                usuario=request.user,
+                accion='EXPORTAR_CSV',
+                modulo='REPORTES',
+                descripcion=f'Exportación CSV de bitácora encolada (trabajo #{trabajo.id})',
+                request=request,
+                detalles_adicionales={'filtros_aplicados': filtros, 'trabajo_id': trabajo.id}
+            )
+            return Response({
+                'success': True,
+                'trabajo': TrabajoAsincronoSerializer(trabajo, context={'request': request}).data
+            }, status=status.HTTP_202_ACCEPTED)
         
         # Registrar la acción de exportación
         RegistroBitacora.registrar_accion(
@@ -1078,6 +1205,61 @@ class CustomTokenObtainPairView(TokenObtainPairView):
         
         return response
 
+# Vistas para consultar trabajos en segundo plano
+class TrabajoAsincronoListView(generics.ListAPIView):
+    serializer_class = TrabajoAsincronoSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = TrabajoAsincrono.objects.all().order_by('-fecha_creacion')
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(usuario=self.request.user)
+        
+        estado = self.request.query_params.get('estado')
+        tipo = self.request.query_params.get('tipo')
+        if estado:
+            queryset = queryset.filter(estado=estado)
+        if tipo:
+            queryset = queryset.filter(tipo=tipo)
+        
+        return queryset
+
+class TrabajoAsincronoDetailView(generics.RetrieveAPIView):
+    serializer_class = TrabajoAsincronoSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = TrabajoAsincrono.objects.all()
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(usuario=self.request.user)
+        return queryset
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def descargar_resultado_trabajo(request, trabajo_id):
+    """
+    Descargar el archivo generado por un trabajo completado
+    """
+    try:
+        trabajo = TrabajoAsincrono.objects.get(id=trabajo_id)
+        if not request.user.is_staff and trabajo.usuario_id != request.user.id:
+            return Response({'error': 'Trabajo no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+        
+        if trabajo.estado != 'COMPLETADO':
+            return Response({
+                'error': f'El trabajo aún no está completado. Estado actual: {trabajo.estado}',
+                'progreso': trabajo.progreso
+            }, status=status.HTTP_409_CONFLICT)
+        
+        ruta = trabajo.ruta_archivo
+        if ruta is None or not ruta.exists():
+            return Response({'error': 'El trabajo no generó un archivo o ya fue eliminado'}, status=status.HTTP_404_NOT_FOUND)
+        
+        return _respuesta_archivo(request, ruta, ruta.name, 'application/octet-stream')
+        
+    except TrabajoAsincrono.DoesNotExist:
+        return Response({'error': 'Trabajo no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+
 # Vista para listar y crear insumos
 class InsumoListCreateView(generics.ListCreateAPIView):
     queryset = Insumo.objects.filter(activo=True)
@@ -1090,7 +1272,9 @@ class InsumoListCreateView(generics.ListCreateAPIView):
     filterset_fields = ['tipo', 'activo', 'unidad_medida']
     
     def perform_create(self, serializer):
-        insumo = serializer.save()
+        with transaction.atomic():
+            insumo = serializer.save()
+            MovimientoInventario.registrar_existencia_inicial(insumo, usuario=self.request.user)
         
         # Registrar en bitácora
         RegistroBitacora.registrar_accion(
@@ -1119,7 +1303,12 @@ class InsumoDetailView(generics.RetrieveUpdateDestroyAPIView):
         insumo_anterior = self.get_object()
         cantidad_anterior = insumo_anterior.cantidad_disponible
         
-        insumo = serializer.save()
+        # La cantidad no se guarda con el resto del insumo: se registra como ajuste del inventario
+        nueva_cantidad = serializer.validated_data.pop('cantidad_disponible', None)
+        with transaction.atomic():
+            insumo = serializer.save()
+            if nueva_cantidad is not None and nueva_cantidad != cantidad_anterior:
+                MovimientoInventario.ajustar(insumo, nueva_cantidad, usuario=self.request.user, observaciones='Edición del insumo')
         
         # Registrar cambios en bitácora
         cambios = []
@@ -1245,33 +1434,41 @@ def estadisticas_inventario(request):
 @permission_classes([permissions.IsAuthenticated])
 def actualizar_stock_insumo(request, insumo_id):
     """
-    Actualizar el stock de un insumo específico
+    Actualizar el stock de un insumo específico.
+    ENTRADA y SALIDA mueven la existencia en `cantidad` unidades; AJUSTE (o `nueva_cantidad`
+    sin `cantidad`) la lleva al valor contado. Cada cambio queda en el libro de movimientos.
     """
     try:
-        from decimal import Decimal
-        
         insumo = Insumo.objects.get(id=insumo_id, activo=True)
         
+        cantidad = request.data.get('cantidad')
         nueva_cantidad = request.data.get('nueva_cantidad')
         tipo_movimiento = request.data.get('tipo_movimiento', 'AJUSTE')  # ENTRADA, SALIDA, AJUSTE
         observaciones = request.data.get('observaciones', '')
         
-        if nueva_cantidad is None:
+        if tipo_movimiento not in dict(MovimientoInventario.TIPOS_MOVIMIENTO):
+            return Response({'error': 'Tipo de movimiento inválido. Use ENTRADA, SALIDA o AJUSTE'}, status=status.HTTP_400_BAD_REQUEST)
+        if cantidad is None and nueva_cantidad is None:
             return Response({'error': 'La nueva cantidad es requerida'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            nueva_cantidad = Decimal(str(nueva_cantidad))
-            if nueva_cantidad < 0:
+            valor = Decimal(str(cantidad if cantidad is not None else nueva_cantidad))
+            if valor < 0:
                 return Response({'error': 'La cantidad no puede ser negativa'}, status=status.HTTP_400_BAD_REQUEST)
-        except (ValueError, TypeError):
+        except (ValueError, TypeError, ArithmeticError):
             return Response({'error': 'La cantidad debe ser un número válido'}, status=status.HTTP_400_BAD_REQUEST)
         
-        cantidad_anterior = Decimal(str(insumo.cantidad_disponible))
-        diferencia = nueva_cantidad - cantidad_anterior
+        # El saldo se mueve con F() dentro de la transacción: dos peticiones simultáneas no se pisan
+        if cantidad is not None and tipo_movimiento != 'AJUSTE':
+            movimiento = MovimientoInventario.registrar(
+                insumo, tipo_movimiento, valor, usuario=request.user,
+                exigir_existencia=tipo_movimiento == 'SALIDA', observaciones=observaciones
+            )
+        else:
+            movimiento = MovimientoInventario.ajustar(insumo, valor, usuario=request.user, observaciones=observaciones)
         
-        # Actualizar la cantidad
-        insumo.cantidad_disponible = nueva_cantidad
-        insumo.save()
+        cantidad_anterior = movimiento.saldo_anterior
+        diferencia = movimiento.cantidad
         
         # Determinar el tipo de acción para la bitácora
         if diferencia > 0:
@@ -1286,15 +1483,16 @@ def actualizar_stock_insumo(request, insumo_id):
             usuario=request.user,
             accion='ACTUALIZAR_STOCK',
             modulo='INVENTARIO',
-            descripcion=f'{accion_descripcion} - {insumo.nombre} - Cantidad anterior: {cantidad_anterior} → Nueva: {nueva_cantidad}',
+            descripcion=f'{accion_descripcion} - {insumo.nombre} - Cantidad anterior: {cantidad_anterior} → Nueva: {movimiento.saldo_resultante}',
             request=request,
             detalles_adicionales={
                 'insumo_id': insumo.id,
                 'insumo_nombre': insumo.nombre,
+                'movimiento_id': movimiento.id,
                 'cantidad_anterior': float(cantidad_anterior),
-                'cantidad_nueva': float(nueva_cantidad),
+                'cantidad_nueva': float(movimiento.saldo_resultante),
                 'diferencia': float(diferencia),
-                'tipo_movimiento': tipo_movimiento,
+                'tipo_movimiento': movimiento.tipo,
                 'observaciones': observaciones
             }
         )
@@ -1303,15 +1501,285 @@ def actualizar_stock_insumo(request, insumo_id):
             'mensaje': 'Stock actualizado exitosamente',
             'insumo': InsumoSerializer(insumo).data,
             'movimiento': {
+                'id': movimiento.id,
                 'cantidad_anterior': float(cantidad_anterior),
-                'cantidad_nueva': float(nueva_cantidad),
+                'cantidad_nueva': float(movimiento.saldo_resultante),
                 'diferencia': float(diferencia),
-                'tipo_movimiento': tipo_movimiento
+                'tipo_movimiento': movimiento.tipo
             }
         })
         
     except Insumo.DoesNotExist:
         return Response({'error': 'Insumo no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    except StockInsuficiente as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+MAXIMO_ITEMS_AJUSTE_MASIVO = 2000
+
+def _maximo_decimal(campo):
+    """Mayor valor que admite un DecimalField (p. ej. 99999999.99 con max_digits=10, decimal_places=2)"""
+    return Decimal(10) ** (campo.max_digits - campo.decimal_places) - Decimal(10) ** -campo.decimal_places
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def ajustar_stock_masivo(request):
+    """
+    Aplica un conteo físico de inventario: `items` es una lista de {id o codigo, nueva_cantidad,
+    tipo_movimiento}. Si algún ítem es inválido no se aplica ninguno. Los insumos se leen en una
+    sola consulta y se actualizan con bulk_update en una transacción, con un movimiento de
+    inventario por ítem y un único registro en bitácora.
+    """
+    try:
+        items = request.data.get('items')
+        observaciones = request.data.get('observaciones', '')
+        
+        if not isinstance(items, list) or not items:
+            return Response({'error': 'Se requiere la lista de items'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > MAXIMO_ITEMS_AJUSTE_MASIVO:
+            return Response({'error': f'Se permiten como máximo {MAXIMO_ITEMS_AJUSTE_MASIVO} items por ajuste'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        maximo_cantidad = _maximo_decimal(Insumo._meta.get_field('cantidad_disponible'))
+        errores = []
+        filas = []
+        for indice, item in enumerate(items):
+            if not isinstance(item, dict):
+                errores.append({'item': indice, 'error': 'Formato inválido'})
+                continue
+            tipo_movimiento = item.get('tipo_movimiento') or 'AJUSTE'
+            try:
+                insumo_id = int(item['id']) if item.get('id') not in (None, '') else None
+                nueva_cantidad = Decimal(str(item.get('nueva_cantidad')))
+            except (ValueError, TypeError, ArithmeticError):
+                errores.append({'item': indice, 'error': 'El id y la nueva cantidad deben ser números válidos'})
+                continue
+            codigo = str(item.get('codigo') or '').strip()
+            if insumo_id is None and not codigo:
+                errores.append({'item': indice, 'error': 'Indique el id o el código del insumo'})
+            elif not nueva_cantidad.is_finite() or nueva_cantidad < 0:
+                errores.append({'item': indice, 'error': 'La cantidad no puede ser negativa'})
+            elif nueva_cantidad > maximo_cantidad:
+                errores.append({'item': indice, 'error': f'La cantidad no puede superar {maximo_cantidad}'})
+            elif tipo_movimiento not in dict(MovimientoInventario.TIPOS_MOVIMIENTO):
+                errores.append({'item': indice, 'error': 'Tipo de movimiento inválido. Use ENTRADA, SALIDA o AJUSTE'})
+            else:
+                filas.append((indice, insumo_id, codigo, nueva_cantidad.quantize(Decimal('0.01')), tipo_movimiento))
+        
+        with transaction.atomic():
+            # Una sola lectura, con las filas bloqueadas hasta aplicar el conteo
+            insumos = list(Insumo.objects.select_for_update().filter(
+                Q(id__in=[fila[1] for fila in filas if fila[1] is not None]) |
+                Q(codigo__in=[fila[2] for fila in filas if fila[1] is None]),
+                activo=True
+            ))
+            por_id = {insumo.id: insumo for insumo in insumos}
+            por_codigo = {insumo.codigo: insumo for insumo in insumos}
+            
+            ajustes = {}
+            for indice, insumo_id, codigo, nueva_cantidad, tipo_movimiento in filas:
+                insumo = por_id.get(insumo_id) if insumo_id is not None else por_codigo.get(codigo)
+                if insumo is None:
+                    errores.append({'item': indice, 'error': f'Insumo {insumo_id or codigo} no encontrado o inactivo'})
+                elif insumo.id in ajustes:
+                    errores.append({'item': indice, 'error': f'El insumo {insumo.codigo} está repetido en el ajuste'})
+                elif (tipo_movimiento == 'ENTRADA' and nueva_cantidad < insumo.cantidad_disponible) or \
+                        (tipo_movimiento == 'SALIDA' and nueva_cantidad > insumo.cantidad_disponible):
+                    errores.append({'item': indice, 'error': f'Una {tipo_movimiento.lower()} no puede llevar {insumo.codigo} de {insumo.cantidad_disponible} a {nueva_cantidad}'})
+                else:
+                    ajustes[insumo.id] = (insumo, nueva_cantidad, tipo_movimiento)
+            
+            if errores:
+                return Response({'error': 'El ajuste contiene items inválidos; no se aplicó ningún cambio', 'errores': sorted(errores, key=lambda e: e['item'])},
+                                status=status.HTTP_400_BAD_REQUEST)
+            
+            ahora = timezone.now()
+            modificados = []
+            movimientos = []
+            detalle = []
+            for insumo, nueva_cantidad, tipo_movimiento in ajustes.values():
+                cantidad_anterior = insumo.cantidad_disponible
+                diferencia = nueva_cantidad - cantidad_anterior
+                detalle.append({
+                    'insumo_id': insumo.id,
+                    'codigo': insumo.codigo,
+                    'cantidad_anterior': float(cantidad_anterior),
+                    'cantidad_nueva': float(nueva_cantidad),
+                    'diferencia': float(diferencia),
+                    'tipo_movimiento': tipo_movimiento
+                })
+                if not diferencia:
+                    continue
+                insumo.cantidad_disponible = nueva_cantidad
+                insumo.fecha_ultima_actualizacion = ahora
+                modificados.append(insumo)
+                movimientos.append(MovimientoInventario(
+                    insumo=insumo, tipo=tipo_movimiento, cantidad=diferencia, saldo_resultante=nueva_cantidad,
+                    fecha=ahora, usuario=request.user, observaciones=observaciones or 'Ajuste masivo de inventario'
+                ))
+            
+            Insumo.objects.bulk_update(modificados, ['cantidad_disponible', 'fecha_ultima_actualizacion'], batch_size=500)
+            MovimientoInventario.objects.bulk_create(movimientos, batch_size=500)
+            
+            RegistroBitacora.registrar_accion(
+                usuario=request.user,
+                accion='ACTUALIZAR_STOCK',
+                modulo='INVENTARIO',
+                descripcion=f'Ajuste masivo de inventario: {len(modificados)} insumos modificados de {len(ajustes)} contados',
+                request=request,
+                detalles_adicionales={
+                    'tipo_movimiento': 'AJUSTE_MASIVO',
+                    'total_items': len(ajustes),
+                    'modificados': len(modificados),
+                    'observaciones': observaciones,
+                    'items': detalle
+                }
+            )
+        
+        # bulk_create no emite post_save
+        cache_inventario.invalidar()
+        
+        return Response({
+            'mensaje': 'Ajuste de inventario aplicado exitosamente',
+            'total_items': len(ajustes),
+            'modificados': len(modificados),
+            'sin_cambio': len(ajustes) - len(modificados),
+            'items': detalle
+        })
+        
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+PERIODOS_INVENTARIO = {'dia': TruncDay, 'semana': TruncWeek, 'mes': TruncMonth, 'trimestre': TruncQuarter, 'anio': TruncYear}
+
+def _inicio_del_dia(texto, dias_despues=0):
+    """Inicio (con zona horaria) del día YYYY-MM-DD, para filtrar por rango sobre el índice de fecha"""
+    fecha = parse_date(texto or '')
+    if fecha is None:
+        raise ValueError(f'Fecha inválida: {texto}. Use el formato AAAA-MM-DD')
+    return timezone.make_aware(datetime.combine(fecha + timedelta(days=dias_despues), time.min))
+
+def _filtrar_movimientos(queryset, params):
+    """Filtros comunes de los movimientos: insumo, tipo y rango de fechas (ambos días incluidos)"""
+    if params.get('insumo'):
+        queryset = queryset.filter(insumo_id=params['insumo'])
+    if params.get('tipo'):
+        queryset = queryset.filter(tipo=params['tipo'])
+    if params.get('fecha_desde'):
+        queryset = queryset.filter(fecha__gte=_inicio_del_dia(params['fecha_desde']))
+    if params.get('fecha_hasta'):
+        queryset = queryset.filter(fecha__lt=_inicio_del_dia(params['fecha_hasta'], dias_despues=1))
+    return queryset
+
+# Libro de movimientos del inventario
+class MovimientoInventarioListView(generics.ListAPIView):
+    serializer_class = MovimientoInventarioSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['lote', 'tarea', 'descarga', 'usuario']
+    
+    def get_queryset(self):
+        queryset = MovimientoInventario.objects.select_related('insumo', 'usuario')
+        try:
+            return _filtrar_movimientos(queryset, self.request.query_params)
+        except ValueError:
+            return queryset.none()
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def existencias_inventario(request):
+    """
+    Existencia de los insumos activos al cierre de un día (?fecha=AAAA-MM-DD, por defecto la
+    actual). Se toma el saldo del último movimiento de cada insumo hasta esa fecha.
+    """
+    try:
+        insumos = Insumo.objects.filter(activo=True)
+        if request.query_params.get('tipo'):
+            insumos = insumos.filter(tipo=request.query_params['tipo'])
+        
+        fecha = request.query_params.get('fecha')
+        if fecha:
+            insumos = MovimientoInventario.existencias_a_fecha(insumos, _inicio_del_dia(fecha, dias_despues=1))
+        else:
+            insumos = insumos.annotate(existencia=F('cantidad_disponible'))
+        
+        existencias = [
+            {
+                'insumo_id': id_,
+                'nombre': nombre,
+                'codigo': codigo,
+                'unidad_medida': unidad_medida,
+                'existencia': float(existencia or 0)
+            }
+            for id_, nombre, codigo, unidad_medida, existencia in insumos.values_list(
+                'id', 'nombre', 'codigo', 'unidad_medida', 'existencia'
+            ).order_by('nombre')
+        ]
+        return Response({'fecha': fecha or timezone.localdate().isoformat(), 'count': len(existencias), 'insumos': existencias})
+        
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def consumo_inventario(request):
+    """
+    Entradas, salidas y ajustes por insumo y periodo (?periodo=dia|semana|mes|trimestre|anio),
+    filtrables por insumo, tipo y rango de fechas.
+    """
+    try:
+        periodo = request.query_params.get('periodo', 'mes')
+        if periodo not in PERIODOS_INVENTARIO:
+            raise ValueError(f"Periodo inválido. Use uno de: {', '.join(PERIODOS_INVENTARIO)}")
+        
+        movimientos = _filtrar_movimientos(MovimientoInventario.objects.all(), request.query_params)
+        resumen = [
+            {
+                'insumo_id': fila['insumo'],
+                'nombre': fila['insumo__nombre'],
+                'codigo': fila['insumo__codigo'],
+                'unidad_medida': fila['insumo__unidad_medida'],
+                'periodo': fila['periodo'].date().isoformat() if isinstance(fila['periodo'], datetime) else str(fila['periodo']),
+                'entradas': float(fila['entradas']),
+                'salidas': float(fila['salidas']),
+                'ajustes': float(fila['ajustes']),
+                'movimientos': fila['movimientos']
+            }
+            for fila in MovimientoInventario.resumen_por_periodo(movimientos, PERIODOS_INVENTARIO[periodo])
+        ]
+        return Response({'periodo': periodo, 'count': len(resumen), 'consumo': resumen})
+        
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def pronostico_inventario(request):
+    """
+    Consumo diario, días de cobertura y fecha sugerida de reorden de todos los insumos
+    activos (?plazo_entrega=días que tarda un pedido, ?tipo=tipo de insumo)
+    """
+    try:
+        plazo_entrega = int(request.query_params.get('plazo_entrega') or settings.INVENTARIO_PLAZO_ENTREGA_DIAS)
+        if plazo_entrega < 1:
+            raise ValueError('El plazo de entrega debe ser de al menos un día')
+        
+        insumos = pronostico.pronostico_inventario(plazo_entrega, request.query_params.get('tipo'))
+        return Response({
+            'fecha': timezone.localdate().isoformat(),
+            'plazo_entrega': plazo_entrega,
+            'dias_historial': pronostico.DIAS_HISTORIAL,
+            'count': len(insumos),
+            'por_reponer': sum(1 for insumo in insumos if insumo['reponer_ahora']),
+            'insumos': insumos
+        })
+        
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -1331,13 +1799,14 @@ class RegistroDescargaListCreateView(generics.ListCreateAPIView):
         
         # Manejar descuento de stock automático para ciertos tipos de insumos
         if descarga.insumo and descarga.cantidad_insumo_usado:
-            tipos_que_restan = ['CONTENEDOR', 'EQUIPO_MEDICION', 'OTRO']
-            if descarga.insumo.tipo in tipos_que_restan:
+            if descarga.insumo.tipo in RegistroDescarga.TIPOS_INSUMO_QUE_RESTAN:
                 # Restar del stock
                 insumo = descarga.insumo
-                cantidad_anterior = insumo.cantidad_disponible
-                insumo.cantidad_disponible -= descarga.cantidad_insumo_usado
-                insumo.save()
+                movimiento = MovimientoInventario.registrar(
+                    insumo, 'SALIDA', descarga.cantidad_insumo_usado, usuario=self.request.user,
+                    descarga=descarga, lote=descarga.lote, observaciones='Uso en descarga de lote'
+                )
+                cantidad_anterior = movimiento.saldo_anterior
                 
                 # Registrar el movimiento de stock en bitácora adicional
                 RegistroBitacora.registrar_accion(
@@ -1353,6 +1822,7 @@ class RegistroDescargaListCreateView(generics.ListCreateAPIView):
                         'cantidad_nueva': float(insumo.cantidad_disponible),
                         'cantidad_usada': float(descarga.cantidad_insumo_usado),
                         'descarga_id': descarga.id,
+                        'movimiento_id': movimiento.id,
                         'tipo_movimiento': 'DESCUENTO_AUTOMATICO',
                         'razon': 'Uso en descarga de lote'
                     }
@@ -1385,12 +1855,52 @@ class RegistroDescargaListCreateView(generics.ListCreateAPIView):
             }
         )
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def rendimiento_descargas(request):
+    """
+    Kg por minuto de las descargas por empleado, lote, insumo y hora del día, con percentiles
+    (?desde=&hasta=AAAA-MM-DD, por defecto los últimos 30 días; ?empleado=, ?lote=, ?insumo=)
+    """
+    try:
+        hasta = parse_date(request.query_params.get('hasta') or '') or timezone.localdate()
+        desde = parse_date(request.query_params.get('desde') or '') or hasta - timedelta(days=29)
+        if hasta < desde:
+            raise ValueError('La fecha final debe ser posterior a la inicial')
+        filtros = {
+            f'{campo}_id': int(request.query_params[campo])
+            for campo in ['empleado', 'lote', 'insumo'] if request.query_params.get(campo)
+        }
+        
+        return Response({
+            'desde': desde.isoformat(),
+            'hasta': hasta.isoformat(),
+            **rendimiento.rendimiento_descargas(desde, hasta, filtros)
+        })
+        
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 class RegistroDescargaDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = RegistroDescarga.objects.all()
     serializer_class = RegistroDescargaSerializer
     permission_classes = [permissions.IsAuthenticated]
 
 # Vistas para uso de maquinaria/insumos
+def _guardar_uso_maquinaria(serializer):
+    """
+    Guarda el uso con la fila de la máquina bloqueada y repite la validación de solapamiento:
+    dos registros simultáneos de la misma máquina no pueden pasar ambos la validación
+    """
+    with transaction.atomic():
+        maquinaria_uso = serializer.validated_data.get('maquinaria', getattr(serializer.instance, 'maquinaria', None))
+        if maquinaria_uso:
+            list(Insumo.objects.select_for_update().filter(id=maquinaria_uso.id).values_list('id', flat=True))
+            serializer.validar_solapamiento(serializer.validated_data)
+        return serializer.save()
+
 class RegistroUsoMaquinariaListCreateView(generics.ListCreateAPIView):
     queryset = RegistroUsoMaquinaria.objects.all().order_by('-fecha_registro')
     serializer_class = RegistroUsoMaquinariaSerializer
@@ -1402,7 +1912,7 @@ class RegistroUsoMaquinariaListCreateView(generics.ListCreateAPIView):
     filterset_fields = ['empleado', 'maquinaria', 'tipo_maquinaria', 'lote']
     
     def perform_create(self, serializer):
-        uso_maquinaria = serializer.save()
+        uso_maquinaria = _guardar_uso_maquinaria(serializer)
         
         # Registrar en bitácora
         RegistroBitacora.registrar_accion(
@@ -1426,16 +1936,188 @@ class RegistroUsoMaquinariaDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = RegistroUsoMaquinaria.objects.all()
     serializer_class = RegistroUsoMaquinariaSerializer
     permission_classes = [permissions.IsAuthenticated]
+    
+    def perform_update(self, serializer):
+        _guardar_uso_maquinaria(serializer)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def utilizacion_maquinaria(request):
+    """
+    Minutos ocupados, huecos entre usos, concurrencia máxima y kg por hora de cada máquina,
+    por día o por turno (?desde=&hasta=AAAA-MM-DD, ?agrupacion=dia|turno, ?maquinaria=id)
+    """
+    try:
+        hasta = parse_date(request.query_params.get('hasta') or '') or timezone.localdate()
+        desde = parse_date(request.query_params.get('desde') or '') or hasta - timedelta(days=29)
+        agrupacion = request.query_params.get('agrupacion', 'dia')
+        maquinaria_id = request.query_params.get('maquinaria')
+        
+        maquinas = maquinaria.calcular_utilizacion(desde, hasta, agrupacion, int(maquinaria_id) if maquinaria_id else None)
+        return Response({
+            'desde': desde.isoformat(),
+            'hasta': hasta.isoformat(),
+            'agrupacion': agrupacion,
+            'count': len(maquinas),
+            'maquinas': maquinas
+        })
+        
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def conflictos_maquinaria(request):
+    """
+    Auditoría de usos de maquinaria que se cruzan en el tiempo para la misma máquina
+    (?desde=&hasta=AAAA-MM-DD, ?maquinaria=id, ?limite=). También lista los usos que
+    exceden la duración máxima, cuyos cruces la validación de nuevos usos no alcanza a ver.
+    """
+    try:
+        desde = parse_date(request.query_params.get('desde') or '')
+        hasta = parse_date(request.query_params.get('hasta') or '')
+        maquinaria_id = request.query_params.get('maquinaria')
+        maquinaria_id = int(maquinaria_id) if maquinaria_id else None
+        limite = min(int(request.query_params.get('limite', 1000)), maquinaria.MAXIMO_CONFLICTOS)
+        
+        conflictos, truncado = maquinaria.detectar_solapamientos(desde, hasta, maquinaria_id, limite)
+        return Response({
+            'count': len(conflictos),
+            'truncado': truncado,
+            'minutos_solapados': round(sum(conflicto['minutos_solapados'] for conflicto in conflictos), 1),
+            'conflictos': conflictos,
+            'usos_excedidos': maquinaria.usos_excedidos(desde, hasta, maquinaria_id)
+        })
+        
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def sincronizar_registros(request):
+    """
+    Recibe la cola de registros capturados sin conexión: `registros` es una lista de
+    {tipo: DESCARGA o USO_MAQUINARIA, clave_idempotencia, ...campos del endpoint de cada tipo}.
+    Retorna el estado de cada registro; los ya recibidos antes se informan como duplicados.
+    """
+    try:
+        registros = request.data.get('registros')
+        
+        if not isinstance(registros, list) or not registros:
+            return Response({'error': 'Se requiere la lista de registros'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(registros) > sincronizacion.MAXIMO_REGISTROS:
+            return Response({'error': f'Se permiten como máximo {sincronizacion.MAXIMO_REGISTROS} registros por sincronización'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        resultado = sincronizacion.sincronizar(registros, request)
+        
+        if resultado['creados']:
+            RegistroBitacora.registrar_accion(
+                usuario=request.user,
+                accion='SINCRONIZAR_REGISTROS',
+                modulo='PERSONAL',
+                descripcion=f"Sincronización de registros sin conexión: {len(resultado['descargas'])} descargas y {len(resultado['usos_maquinaria'])} usos de maquinaria creados, {resultado['duplicados']} duplicados, {resultado['con_errores']} con errores",
+                request=request,
+                detalles_adicionales={
+                    'total_registros': resultado['total'],
+                    'descargas_ids': resultado['descargas'],
+                    'usos_maquinaria_ids': resultado['usos_maquinaria'],
+                    'duplicados': resultado['duplicados'],
+                    'con_errores': resultado['con_errores']
+                }
+            )
+        
+        return Response(resultado)
+        
+    except IntegrityError:
+        # Otra sincronización guardó al mismo tiempo alguna de las claves
+        return Response({'error': 'Algunos registros se están sincronizando desde otra conexión. Reintente el envío'}, status=status.HTTP_409_CONFLICT)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def consumo_recursos_lotes(request):
+    """
+    Insumos, minutos de maquinaria y minutos de mano de obra consumidos por cada lote, en total
+    y por quintal (?lote=, ?estado=, ?organizacion=, ?fecha_desde=&fecha_hasta= de entrega)
+    """
+    try:
+        consumos = ConsumoRecursoLote.objects.all()
+        params = request.query_params
+        if params.get('lote'):
+            consumos = consumos.filter(lote_id=params['lote'])
+        if params.get('estado'):
+            consumos = consumos.filter(lote__estado=params['estado'])
+        if params.get('organizacion'):
+            consumos = consumos.filter(lote__organizacion_id=params['organizacion'])
+        if params.get('fecha_desde'):
+            consumos = consumos.filter(lote__fecha_entrega__gte=_inicio_del_dia(params['fecha_desde']))
+        if params.get('fecha_hasta'):
+            consumos = consumos.filter(lote__fecha_entrega__lt=_inicio_del_dia(params['fecha_hasta'], dias_despues=1))
+        
+        lotes = {}
+        for (lote_id, numero_lote, quintales, tipo_recurso, insumo_id, insumo_nombre, unidad_medida,
+             cantidad, minutos, registros) in consumos.order_by('lote_id', 'tipo_recurso', 'insumo_id').values_list(
+                'lote_id', 'lote__numero_lote', 'lote__total_quintales', 'tipo_recurso', 'insumo_id',
+                'insumo__nombre', 'insumo__unidad_medida', 'cantidad', 'minutos', 'registros'):
+            lote = lotes.get(lote_id)
+            if lote is None:
+                lote = lotes[lote_id] = {
+                    'lote_id': lote_id,
+                    'numero_lote': numero_lote,
+                    'total_quintales': quintales,
+                    'minutos_maquinaria': 0.0,
+                    'minutos_mano_obra': 0.0,
+                    'insumos': [],
+                }
+            if tipo_recurso == 'MANO_OBRA':
+                lote['minutos_mano_obra'] += float(minutos)
+            else:
+                if tipo_recurso == 'MAQUINARIA':
+                    lote['minutos_maquinaria'] += float(minutos)
+                lote['insumos'].append({
+                    'insumo_id': insumo_id,
+                    'nombre': insumo_nombre,
+                    'tipo_recurso': tipo_recurso,
+                    'unidad_medida': unidad_medida,
+                    'cantidad': float(cantidad),
+                    'cantidad_por_quintal': round(float(cantidad) / quintales, 4) if quintales else None,
+                    'minutos': float(minutos),
+                    'registros': registros,
+                })
+        
+        for lote in lotes.values():
+            quintales = lote['total_quintales']
+            lote['minutos_maquinaria_por_quintal'] = round(lote['minutos_maquinaria'] / quintales, 2) if quintales else None
+            lote['minutos_mano_obra_por_quintal'] = round(lote['minutos_mano_obra'] / quintales, 2) if quintales else None
+        
+        return Response({
+            'count': len(lotes),
+            'lotes': list(lotes.values())
+        })
+        
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 # Vistas para propietarios maestros
 class PropietarioMaestroListCreateView(generics.ListCreateAPIView):
     queryset = PropietarioMaestro.objects.filter(activo=True).order_by('nombre_completo')
     serializer_class = PropietarioMaestroSerializer
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [filters.SearchFilter, filters.OrderingFilter, DjangoFilterBackend]
     search_fields = ['nombre_completo', 'cedula', 'telefono']
-    ordering_fields = ['nombre_completo', 'fecha_registro']
+    ordering_fields = ['nombre_completo', 'fecha_registro', 'total_entregas', 'total_quintales_historicos']
     ordering = ['nombre_completo']
+    filterset_fields = {
+        'total_entregas': ['exact', 'gte', 'lte'],
+        'total_quintales_historicos': ['gte', 'lte'],
+    }
 
 class PropietarioMaestroDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = PropietarioMaestro.objects.all()
@@ -1491,6 +2173,41 @@ class PropietarioMaestroDetailView(generics.RetrieveUpdateDestroyAPIView):
             }
         )
 
+# Vista para importar padrones de propietarios maestros desde CSV/XLSX
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def importar_propietarios_maestros(request):
+    """
+    Recibir un padrón de productores (CSV o XLSX) y encolar su importación.
+    Las filas se insertan o actualizan por cédula; el avance se consulta en el trabajo.
+    """
+    try:
+        archivo = request.FILES.get('archivo')
+        if not archivo:
+            return Response({'error': 'Debe adjuntar el archivo del padrón en el campo "archivo"'}, status=status.HTTP_400_BAD_REQUEST)
+        if not archivo.name.lower().endswith(importaciones.EXTENSIONES_PERMITIDAS):
+            return Response({'error': 'Formato no soportado. Use un archivo CSV o XLSX'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        ruta = importaciones.guardar_archivo(archivo)
+        trabajo = trabajos.encolar('IMPORTAR_PROPIETARIOS', usuario=request.user, archivo=ruta, nombre_original=archivo.name)
+        
+        RegistroBitacora.registrar_accion(
+            usuario=request.user,
+            accion='IMPORTAR_PROPIETARIOS',
+            modulo='PERSONAL',
+            descripcion=f'Importación de padrón de propietarios encolada: {archivo.name} (trabajo #{trabajo.id})',
+            request=request,
+            detalles_adicionales={'archivo': archivo.name, 'tamano': archivo.size, 'trabajo_id': trabajo.id}
+        )
+        
+        return Response({
+            'mensaje': 'Importación encolada',
+            'trabajo': TrabajoAsincronoSerializer(trabajo, context={'request': request}).data
+        }, status=status.HTTP_202_ACCEPTED)
+        
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 # Vista adicional para reactivar propietarios
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
@@ -1544,6 +2261,82 @@ def propietarios_inactivos(request):
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+# Historial de calidad (contaminación por muestreo) de los propietarios maestros
+MAXIMO_PROPIETARIOS_HISTORIAL = 500
+
+def _periodo_historial(request):
+    periodo = request.query_params.get('periodo', calidad.PERIODO_PREDETERMINADO)
+    if periodo not in calidad.PERIODOS:
+        raise ValueError(f"Periodo inválido. Use uno de: {', '.join(calidad.PERIODOS)}")
+    return periodo
+
+def _sin_historial(historial):
+    """Copia del resumen sin la serie por periodo (los historiales en caché no se modifican)"""
+    return {clave: valor for clave, valor in historial.items() if clave != 'historial'}
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def historial_calidad_propietario(request, propietario_id):
+    """
+    Obtener entregas, quintales y tasas de contaminación del primer y segundo muestreo
+    de un propietario maestro, en total y por periodo (?periodo=mes|trimestre|anio)
+    """
+    try:
+        periodo = _periodo_historial(request)
+        if not PropietarioMaestro.objects.filter(id=propietario_id).exists():
+            return Response({'error': 'Propietario no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+        
+        historial = calidad.historial_propietarios([propietario_id], periodo).get(propietario_id)
+        if historial is None:
+            return Response({'propietario_maestro': propietario_id, 'total_entregas': 0, 'historial': []})
+        return Response(historial)
+        
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def historial_calidad_propietarios(request):
+    """
+    Historial de calidad de varios propietarios maestros en una sola petición:
+    - ?ids=1,2,3 para propietarios concretos
+    - ?organizacion=<id> para el ranking de riesgo de los propietarios que entregaron a la
+      organización (solo sus entregas en lotes de esa organización), del más riesgoso al menos
+    La serie por periodo se incluye con ?incluir_historial=true.
+    """
+    try:
+        periodo = _periodo_historial(request)
+        incluir_historial = request.query_params.get('incluir_historial', '').lower() in ('1', 'true', 'si')
+        ids = request.query_params.get('ids', '')
+        organizacion_id = request.query_params.get('organizacion')
+        
+        if organizacion_id:
+            if not Organizacion.objects.filter(id=organizacion_id).exists():
+                return Response({'error': 'Organización no encontrada'}, status=status.HTTP_404_NOT_FOUND)
+            limite = min(int(request.query_params.get('limite', 50)), MAXIMO_PROPIETARIOS_HISTORIAL)
+            historiales = calidad.ranking_organizacion(int(organizacion_id), periodo)[:limite]
+        elif ids:
+            ids = list(dict.fromkeys(int(id_) for id_ in ids.split(',') if id_.strip()))
+            if len(ids) > MAXIMO_PROPIETARIOS_HISTORIAL:
+                raise ValueError(f'Se permiten como máximo {MAXIMO_PROPIETARIOS_HISTORIAL} propietarios por consulta')
+            encontrados = calidad.historial_propietarios(ids, periodo)
+            historiales = [encontrados[id_] for id_ in ids if id_ in encontrados]
+        else:
+            raise ValueError('Indique los ids de los propietarios o la organización')
+        
+        return Response({
+            'periodo': periodo,
+            'count': len(historiales),
+            'propietarios': historiales if incluir_historial else [_sin_historial(h) for h in historiales]
+        })
+        
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 # Vistas para estadísticas del empleado y su historial de actividades
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
@@ -1812,6 +2605,27 @@ def historial_actividades_empleado(request):
     except Exception as e:
         return Response({'error': f'Error al obtener historial: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+# Vista con métricas de funcionamiento del proceso que atiende la petición
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def metricas_sistema(request):
+    """
+    Obtener métricas internas (cachés en memoria). Los valores son del worker que
+    responde; cada proceso mantiene su propia caché y sus propias estadísticas.
+    """
+    if not request.user.is_staff:
+        return Response({'error': 'No tiene permisos para consultar las métricas'}, status=status.HTTP_403_FORBIDDEN)
+    
+    return Response({
+        'fecha': timezone.now(),
+        'cache': [
+            cache_propietarios.estadisticas(),
+            cache_calidad.estadisticas(),
+            cache_inventario.estadisticas(),
+            cache_descargas.estadisticas(),
+        ],
+    })
+
 # Vista para buscar propietario por cédula
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
@@ -1820,7 +2634,9 @@ def buscar_propietario_por_cedula(request, cedula):
     Buscar un propietario en la base de datos maestro por su cédula
     """
     try:
-        propietario = PropietarioMaestro.objects.get(cedula=cedula, activo=True)
+        propietario = propietario_por_cedula(cedula)
+        if propietario is None or not propietario.activo:
+            raise PropietarioMaestro.DoesNotExist
         return Response({
             'encontrado': True,
             'propietario': PropietarioMaestroSerializer(propietario).data
@@ -1835,6 +2651,97 @@ def buscar_propietario_por_cedula(request, cedula):
             'error': f'Error en la búsqueda: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+# Búsqueda tipo autocompletado sobre las columnas normalizadas (sin tildes ni mayúsculas)
+LIMITE_AUTOCOMPLETAR = 10
+LIMITE_MAXIMO_AUTOCOMPLETAR = 50
+
+def _rango_prefijo(campo, prefijo):
+    """Filtro por prefijo expresado como rango, para que use el índice B-tree del campo en cualquier motor"""
+    siguiente = prefijo[:-1] + chr(ord(prefijo[-1]) + 1)
+    return Q(**{f'{campo}__gte': prefijo, f'{campo}__lt': siguiente, f'{campo}__startswith': prefijo})
+
+def _autocompletar(request, queryset, campos, campo_codigo=None):
+    """
+    Primero coincidencias por prefijo del nombre normalizado (o del código/cédula si el texto
+    empieza con un dígito) y, si faltan resultados, nombres que contienen todas las palabras.
+    La búsqueda por contenido solo se hace en PostgreSQL, donde la respalda el índice de
+    trigramas; en SQLite recorrería la tabla completa.
+    """
+    texto = request.query_params.get('q', '').strip()
+    consulta = normalizar_texto(texto)
+    try:
+        limite = min(int(request.query_params.get('limite', LIMITE_AUTOCOMPLETAR)), LIMITE_MAXIMO_AUTOCOMPLETAR)
+    except ValueError:
+        return Response({'error': 'El límite debe ser un número entero'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if not consulta or limite < 1:
+        return Response({'consulta': consulta, 'resultados': []})
+    
+    if campo_codigo and texto[0].isdigit():
+        filtro = _rango_prefijo(campo_codigo, texto)
+        orden = campo_codigo
+    else:
+        filtro = _rango_prefijo('nombre_normalizado', consulta)
+        orden = 'nombre_normalizado'
+    resultados = list(queryset.filter(filtro).order_by(orden).values(*campos)[:limite])
+    
+    if len(resultados) < limite and len(consulta) >= 3 and connection.vendor == 'postgresql':
+        contiene = Q()
+        for palabra in consulta.split():
+            contiene &= Q(nombre_normalizado__contains=palabra)
+        encontrados = [resultado['id'] for resultado in resultados]
+        resultados += list(
+            queryset.filter(contiene).exclude(id__in=encontrados).order_by('nombre_normalizado')
+            .values(*campos)[:limite - len(resultados)]
+        )
+    
+    return Response({'consulta': consulta, 'resultados': resultados})
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def autocompletar_propietarios_maestros(request):
+    """
+    Autocompletar propietarios maestros activos por nombre (sin tildes) o por cédula
+    """
+    return _autocompletar(
+        request,
+        PropietarioMaestro.objects.filter(activo=True),
+        ['id', 'nombre_completo', 'cedula', 'telefono', 'comunidad', 'municipio'],
+        campo_codigo='cedula'
+    )
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def autocompletar_propietarios(request):
+    """
+    Autocompletar entregas de propietarios por nombre o cédula, opcionalmente dentro de un lote
+    """
+    # values() no pasa por las propiedades del modelo: el nombre heredado se resuelve en SQL
+    queryset = PropietarioCafe.objects.annotate(
+        nombre_completo=Coalesce('nombre_completo_propio', 'propietario_maestro__nombre_completo')
+    )
+    if request.query_params.get('lote', '').isdigit():
+        queryset = queryset.filter(lote_id=request.query_params['lote'])
+    return _autocompletar(
+        request,
+        queryset,
+        ['id', 'nombre_completo', 'cedula', 'quintales_entregados', 'lote_id', 'lote__numero_lote'],
+        campo_codigo='cedula'
+    )
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def autocompletar_organizaciones(request):
+    """
+    Autocompletar organizaciones por nombre (sin tildes) o por RUC
+    """
+    return _autocompletar(
+        request,
+        Organizacion.objects.all(),
+        ['id', 'nombre', 'tipo', 'ruc', 'ciudad'],
+        campo_codigo='ruc'
+    )
+
 # Vista para obtener lotes disponibles para descarga
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
@@ -1985,6 +2892,7 @@ def lotes_listos_recepcion_final(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@reintentar_si_conflicto
 def procesar_separacion_colores(request):
     """
     Procesar la separación por colores de un lote que ha completado la limpieza
@@ -2008,7 +2916,7 @@ def procesar_separacion_colores(request):
         return Response({'error': 'Clasificación por colores es requerida'}, status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        lote = LoteCafe.objects.get(id=lote_id)
+        lote = _obtener_lote_para_transicion(request, lote_id)
         
         # Verificar que el lote esté en estado LIMPIO
         if lote.estado != 'LIMPIO':
@@ -2016,14 +2924,22 @@ def procesar_separacion_colores(request):
                           status=status.HTTP_400_BAD_REQUEST)
         
         # Actualizar el lote con los datos de separación
-        lote.responsable_separacion = responsable_separacion
-        lote.fecha_separacion = fecha_separacion
-        lote.calidad_general = calidad_general
-        lote.duracion_separacion = duracion_proceso
-        lote.observaciones_separacion = observaciones_separacion
-        lote.clasificacion_colores = clasificacion_colores
-        lote.estado = 'SEPARADO'
-        lote.save()
+        lote.transicionar(
+            estados_validos=['LIMPIO'],
+            responsable_separacion=responsable_separacion,
+            fecha_separacion=fecha_separacion,
+            calidad_general=calidad_general,
+            duracion_separacion=duracion_proceso,
+            observaciones_separacion=observaciones_separacion,
+            clasificacion_colores=clasificacion_colores,
+            estado='SEPARADO'
+        )
+        LoteEvento.registrar(
+            lote, 'SEPARACION_COLORES', request.user,
+            calidad_general=calidad_general,
+            duracion=duracion_proceso,
+            responsable=responsable_separacion
+        )
         
         # Crear un proceso de análisis para el seguimiento
         proceso_separacion = ProcesoAnalisis.objects.create(
@@ -2064,12 +2980,15 @@ def procesar_separacion_colores(request):
         
     except LoteCafe.DoesNotExist:
         return Response({'error': 'Lote no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    except ConflictoVersionLote:
+        raise
     except Exception as e:
         return Response({'error': f'Error al procesar separación: {str(e)}'}, 
                       status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@reintentar_si_conflicto
 def enviar_recepcion_final(request):
     """
     Enviar lote a recepción final después de la separación por colores
@@ -2088,7 +3007,7 @@ def enviar_recepcion_final(request):
         return Response({'error': 'Responsable de recepción es requerido'}, status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        lote = LoteCafe.objects.get(id=lote_id)
+        lote = _obtener_lote_para_transicion(request, lote_id)
         
         # Verificar que el lote esté en estado SEPARADO
         if lote.estado != 'SEPARADO':
@@ -2096,12 +3015,19 @@ def enviar_recepcion_final(request):
                           status=status.HTTP_400_BAD_REQUEST)
         
         # Actualizar el lote con los datos de recepción final
-        lote.responsable_recepcion_final = responsable_recepcion
-        lote.fecha_recepcion_final = fecha_recepcion_final
-        lote.calificacion_final = calificacion_final
-        lote.observaciones_finales = observaciones_finales
-        lote.estado = 'FINALIZADO'
-        lote.save()
+        lote.transicionar(
+            estados_validos=['SEPARADO'],
+            responsable_recepcion_final=responsable_recepcion,
+            fecha_recepcion_final=fecha_recepcion_final,
+            calificacion_final=calificacion_final,
+            observaciones_finales=observaciones_finales,
+            estado='FINALIZADO'
+        )
+        LoteEvento.registrar(
+            lote, 'RECEPCION_FINAL', request.user,
+            calificacion_final=calificacion_final,
+            responsable=responsable_recepcion
+        )
         
         # Finalizar el proceso de separación
         proceso_separacion = lote.procesos.filter(tipo_proceso='SEPARACION', fecha_finalizacion__isnull=True).first()
@@ -2131,12 +3057,15 @@ def enviar_recepcion_final(request):
         
     except LoteCafe.DoesNotExist:
         return Response({'error': 'Lote no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    except ConflictoVersionLote:
+        raise
     except Exception as e:
         return Response({'error': f'Error al enviar a recepción final: {str(e)}'}, 
                       status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@reintentar_si_conflicto
 def procesar_limpieza(request):
     """
     Procesar la limpieza de un lote que ha completado el análisis
@@ -2167,7 +3096,7 @@ def procesar_limpieza(request):
         return Response({'error': 'El peso de impurezas debe ser un número válido'}, status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        lote = LoteCafe.objects.get(id=lote_id)
+        lote = _obtener_lote_para_transicion(request, lote_id)
         
         # Verificar que el lote esté en estado que permite limpieza
         estados_permitidos = ['APROBADO', 'SEPARACION_APLICADA']
@@ -2186,17 +3115,27 @@ def procesar_limpieza(request):
             return Response({'error': 'El peso de impurezas no puede ser mayor al peso total del lote'}, 
                           status=status.HTTP_400_BAD_REQUEST)
         
-        # Actualizar el lote con los datos de limpieza
-        lote.fecha_limpieza = timezone.now()
-        lote.responsable_limpieza = responsable_limpieza
-        lote.peso_impurezas = peso_impurezas
-        lote.impurezas_encontradas = impurezas_encontradas
-        lote.tipo_limpieza = tipo_limpieza
-        lote.duracion_limpieza = duracion_limpieza
-        lote.observaciones_limpieza = observaciones_limpieza
-        lote.peso_total_final = peso_despues_limpieza
-        lote.estado = 'LIMPIO'  # Listo para separación por colores
-        lote.save()
+        # Actualizar el lote con los datos de limpieza (el peso se calculó sobre la versión leída)
+        lote.transicionar(
+            estados_validos=estados_permitidos,
+            fecha_limpieza=timezone.now(),
+            responsable_limpieza=responsable_limpieza,
+            peso_impurezas=peso_impurezas,
+            impurezas_encontradas=impurezas_encontradas,
+            tipo_limpieza=tipo_limpieza,
+            duracion_limpieza=duracion_limpieza,
+            observaciones_limpieza=observaciones_limpieza,
+            peso_total_final=peso_despues_limpieza,
+            estado='LIMPIO'  # Listo para separación por colores
+        )
+        LoteEvento.registrar(
+            lote, 'LIMPIEZA', request.user,
+            peso_antes=peso_antes_limpieza,
+            peso_impurezas=peso_impurezas,
+            peso_despues=peso_despues_limpieza,
+            tipo_limpieza=tipo_limpieza,
+            responsable=responsable_limpieza
+        )
         
         # Crear un proceso de análisis para el seguimiento
         proceso_limpieza = ProcesoAnalisis.objects.create(
@@ -2244,6 +3183,8 @@ def procesar_limpieza(request):
         
     except LoteCafe.DoesNotExist:
         return Response({'error': 'Lote no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    except ConflictoVersionLote:
+        raise
     except Exception as e:
         return Response({'error': f'Error al procesar limpieza: {str(e)}'}, 
                       status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -2251,6 +3192,7 @@ def procesar_limpieza(request):
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@reintentar_si_conflicto
 def enviar_parte_limpia_limpieza(request, lote_id):
     """
     Enviar la parte limpia de un lote con separación inteligente aplicada al proceso de limpieza.
@@ -2259,7 +3201,7 @@ def enviar_parte_limpia_limpieza(request, lote_id):
     from decimal import Decimal
     
     try:
-        lote = LoteCafe.objects.get(id=lote_id)
+        lote = _obtener_lote_para_transicion(request, lote_id)
         
         # Verificar que el lote esté en estado que permite esta operación
         estados_permitidos = ['SEPARACION_APLICADA', 'SEPARACION_PENDIENTE']
@@ -2268,31 +3210,13 @@ def enviar_parte_limpia_limpieza(request, lote_id):
                 'error': f'El lote debe estar en estado SEPARACION_APLICADA o SEPARACION_PENDIENTE. Estado actual: {lote.estado}'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Obtener muestras iniciales y de segundo muestreo
-        muestras_iniciales = lote.muestras.filter(es_segundo_muestreo=False)
-        muestras_segundo = lote.muestras.filter(es_segundo_muestreo=True)
-        
-        # Identificar propietarios que deben ser separados (contaminados confirmados)
+        # Identificar propietarios que deben ser separados (contaminados, confirmados o sin segundo muestreo)
         propietarios_a_separar = []
         propietarios_limpios = []
         
-        for propietario in lote.propietarios.all():
-            muestra_inicial = muestras_iniciales.filter(propietario=propietario).first()
-            muestra_segundo = muestras_segundo.filter(propietario=propietario).first()
-            
-            if muestra_inicial and muestra_inicial.estado == 'CONTAMINADA':
-                if muestra_segundo:
-                    # Hay segundo muestreo, usar ese resultado
-                    if muestra_segundo.estado == 'CONTAMINADA':
-                        propietarios_a_separar.append(propietario)
-                    else:
-                        propietarios_limpios.append(propietario)
-                else:
-                    # No hay segundo muestreo, se considera contaminado
-                    propietarios_a_separar.append(propietario)
-            else:
-                # Muestra inicial aprobada
-                propietarios_limpios.append(propietario)
+        for estado, estados_analisis in EstadoAnalisisPropietario.agrupar_por_estado(lote).items():
+            destino = propietarios_a_separar if estado in EstadoAnalisisPropietario.ESTADOS_SEPARAR else propietarios_limpios
+            destino.extend(e.propietario for e in estados_analisis)
         
         # Calcular quintales que se van a separar
         quintales_originales = lote.total_quintales
@@ -2310,19 +3234,15 @@ def enviar_parte_limpia_limpieza(request, lote_id):
                 'error': 'No hay quintales limpios para enviar a limpieza.'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Crear un registro histórico de la separación antes de modificar
-        observaciones_separacion = f"""SEPARACIÓN INTELIGENTE APLICADA - {lote.observaciones}
-
-PROPIETARIOS SEPARADOS ({len(propietarios_a_separar)} propietarios - {quintales_separados} qq):
-{chr(10).join([f'• {prop.nombre_completo} ({prop.cedula}): {prop.quintales_entregados} qq' for prop in propietarios_a_separar])}
-
-PROPIETARIOS QUE CONTINÚAN ({len(propietarios_limpios)} propietarios - {quintales_limpios} qq):
-{chr(10).join([f'• {prop.nombre_completo} ({prop.cedula}): {prop.quintales_entregados} qq' for prop in propietarios_limpios])}
-
-RESUMEN DE SEPARACIÓN:
-- Quintales originales: {quintales_originales} qq
-- Quintales separados: {quintales_separados} qq ({round((quintales_separados/quintales_originales)*100, 1)}%)
-- Quintales que continúan: {quintales_limpios} qq ({round((quintales_limpios/quintales_originales)*100, 1)}%)"""
+        # Registrar la separación en el historial del lote antes de modificarlo
+        LoteEvento.registrar(
+            lote, 'PARTE_LIMPIA_ENVIADA', request.user,
+            quintales_originales=quintales_originales,
+            quintales_separados=quintales_separados,
+            quintales_limpios=quintales_limpios,
+            propietarios_separados=[prop.id for prop in propietarios_a_separar],
+            propietarios_limpios=[prop.id for prop in propietarios_limpios]
+        )
         
         # Marcar propietarios separados como inactivos (no los eliminamos para mantener historial)
         for propietario in propietarios_a_separar:
@@ -2331,21 +3251,22 @@ RESUMEN DE SEPARACIÓN:
             propietario.save()
         
         # Actualizar el lote con los nuevos totales
-        lote.total_quintales = quintales_limpios
-        lote.observaciones = observaciones_separacion
-        lote.estado = 'APROBADO'  # Ahora puede ir a limpieza
+        campos = {
+            'total_quintales': quintales_limpios,
+            'estado': 'APROBADO'  # Ahora puede ir a limpieza
+        }
         
         # Ajustar el peso total si existe
         if lote.peso_total_inicial:
             # Calcular proporción de peso que se mantiene
             proporcion_limpia = Decimal(str(quintales_limpios)) / Decimal(str(quintales_originales))
-            lote.peso_total_inicial = lote.peso_total_inicial * proporcion_limpia
+            campos['peso_total_inicial'] = lote.peso_total_inicial * proporcion_limpia
         
         if lote.peso_total_final:
             proporcion_limpia = Decimal(str(quintales_limpios)) / Decimal(str(quintales_originales))
-            lote.peso_total_final = lote.peso_total_final * proporcion_limpia
+            campos['peso_total_final'] = lote.peso_total_final * proporcion_limpia
         
-        lote.save()
+        lote.transicionar(estados_validos=estados_permitidos, **campos)
         
         # Registrar en bitácora
         RegistroBitacora.registrar_accion(
@@ -2394,6 +3315,8 @@ RESUMEN DE SEPARACIÓN:
         
     except LoteCafe.DoesNotExist:
         return Response({'error': 'Lote no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    except ConflictoVersionLote:
+        raise
     except Exception as e:
         return Response({'error': f'Error al procesar separación inteligente: {str(e)}'}, 
                       status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -2461,9 +3384,22 @@ class TareaInsumoDetailView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
 # Vistas para Procesos de Producción
+def _procesos_con_lotes(queryset):
+    """
+    Procesos con responsables y lotes precargados, y los conteos de muestras de cada lote
+    anotados: serializar cualquier cantidad de procesos cuesta un número fijo de consultas
+    """
+    return queryset.select_related('responsable', 'usuario_creacion').prefetch_related(
+        Prefetch('lotes', queryset=LoteCafe.objects.select_related('organizacion').annotate(
+            total_muestras=Count('muestras'),
+            muestras_aprobadas=Count('muestras', filter=Q(muestras__estado='APROBADA')),
+            muestras_contaminadas=Count('muestras', filter=Q(muestras__estado='CONTAMINADA'))
+        ).order_by('id'))
+    )
+
 class ProcesoListCreateView(generics.ListCreateAPIView):
     """Vista para listar y crear procesos de producción"""
-    queryset = Proceso.objects.all().order_by('-fecha_inicio')
+    queryset = _procesos_con_lotes(Proceso.objects.all()).order_by('-fecha_inicio')
     serializer_class = ProcesoSerializer
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter, DjangoFilterBackend]
@@ -2472,6 +3408,10 @@ class ProcesoListCreateView(generics.ListCreateAPIView):
     ordering = ['-fecha_inicio']
     filterset_fields = ['estado', 'fase_actual', 'responsable', 'activo']
     
+    @method_decorator(reintentar_si_conflicto)
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+    
     def perform_create(self, serializer):
         proceso = serializer.save()
         
@@ -2480,10 +3420,10 @@ class ProcesoListCreateView(generics.ListCreateAPIView):
         if lotes_ids:
             # Incluir tanto lotes APROBADO como SEPARACION_APLICADA
             estados_validos = ['APROBADO', 'SEPARACION_APLICADA']
-            lotes = LoteCafe.objects.filter(id__in=lotes_ids, estado__in=estados_validos)
+            lotes = list(LoteCafe.objects.filter(id__in=lotes_ids, estado__in=estados_validos))
             
             # Verificar que se encontraron lotes
-            if not lotes.exists():
+            if not lotes:
                 # Log de debugging para identificar el problema
                 lotes_solicitados = LoteCafe.objects.filter(id__in=lotes_ids)
                 estados_encontrados = [f"{lote.numero_lote}: {lote.estado}" for lote in lotes_solicitados]
@@ -2497,12 +3437,12 @@ class ProcesoListCreateView(generics.ListCreateAPIView):
                 
                 # Luego cambiar el estado de cada lote
                 for lote in lotes:
-                    lote.estado = 'EN_PROCESO'
-                    lote.save()
+                    lote.transicionar(estados_validos=estados_validos, estado='EN_PROCESO')
+                    LoteEvento.registrar(lote, 'INGRESO_PROCESO', self.request.user, proceso=proceso.id, numero_proceso=proceso.numero)
                     print(f"✅ Lote {lote.numero_lote} agregado al proceso y estado cambiado a EN_PROCESO")
                 
-                # Calcular totales basado en los lotes
-                proceso.calcular_totales()
+                # Los totales ya se recalcularon al asignar los lotes (m2m_changed)
+                proceso.refresh_from_db(fields=Proceso.CAMPOS_TOTALES)
                 
                 # Verificar que los lotes se agregaron correctamente
                 print(f"✅ Proceso {proceso.id} creado con {proceso.lotes.count()} lotes")
@@ -2527,7 +3467,7 @@ class ProcesoListCreateView(generics.ListCreateAPIView):
 
 class ProcesoDetailView(generics.RetrieveUpdateDestroyAPIView):
     """Vista para obtener, actualizar y eliminar procesos específicos"""
-    queryset = Proceso.objects.all()
+    queryset = _procesos_con_lotes(Proceso.objects.all())
     serializer_class = ProcesoSerializer
     permission_classes = [permissions.IsAuthenticated]
     
@@ -2535,9 +3475,9 @@ class ProcesoDetailView(generics.RetrieveUpdateDestroyAPIView):
         proceso_anterior = self.get_object()
         proceso = serializer.save()
         
-        # Recalcular totales si se modificaron los lotes
+        # Los totales se recalculan al cambiar los lotes (m2m_changed)
         if 'lotes' in self.request.data:
-            proceso.calcular_totales()
+            proceso.refresh_from_db(fields=Proceso.CAMPOS_TOTALES)
         
         # Registrar cambios en bitácora
         cambios = []
@@ -2586,7 +3526,7 @@ def avanzar_fase_proceso(request, proceso_id):
             
             return Response({
                 'mensaje': f'Proceso avanzado a fase {proceso.fase_actual}',
-                'proceso': ProcesoSerializer(proceso).data
+                'proceso': ProcesoSerializer(_procesos_con_lotes(Proceso.objects.all()).get(id=proceso.id)).data
             })
         else:
             return Response({
@@ -2600,6 +3540,7 @@ def avanzar_fase_proceso(request, proceso_id):
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@reintentar_si_conflicto
 def finalizar_fase_proceso(request, proceso_id):
     """Finalizar una fase específica del proceso"""
     try:
@@ -2624,8 +3565,8 @@ def finalizar_fase_proceso(request, proceso_id):
             
             # Cambiar estado de los lotes a FINALIZADO
             for lote in proceso.lotes.all():
-                lote.estado = 'FINALIZADO'
-                lote.save()
+                lote.transicionar(estado='FINALIZADO')
+                LoteEvento.registrar(lote, 'PROCESO_FINALIZADO', request.user, proceso=proceso.id, numero_proceso=proceso.numero)
         
         proceso.save()
         
@@ -2646,11 +3587,13 @@ def finalizar_fase_proceso(request, proceso_id):
         
         return Response({
             'mensaje': f'Fase {fase} finalizada exitosamente',
-            'proceso': ProcesoSerializer(proceso).data
+            'proceso': ProcesoSerializer(_procesos_con_lotes(Proceso.objects.all()).get(id=proceso.id)).data
         })
         
     except Proceso.DoesNotExist:
         return Response({'error': 'Proceso no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    except ConflictoVersionLote:
+        raise
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -2881,9 +3824,11 @@ def guardar_datos_pilado(request, proceso_id):
             'usuario_registro': request.user.get_full_name() or request.user.username
         }
         
-        # Guardar en el proceso
-        proceso.datos_pilado = datos_pilado
-        proceso.save()
+        # Guardar en el proceso junto con sus mediciones
+        with transaction.atomic():
+            proceso.datos_pilado = datos_pilado
+            proceso.save(update_fields=['datos_pilado', 'fecha_actualizacion'])
+            MedicionFase.registrar(proceso, 'PILADO', datos_pilado)
         
         # Registrar en bitácora
         RegistroBitacora.registrar_accion(
@@ -2929,9 +3874,11 @@ def guardar_datos_clasificacion(request, proceso_id):
             'usuario_registro': request.user.get_full_name() or request.user.username
         }
         
-        # Guardar en el proceso
-        proceso.datos_clasificacion = datos_clasificacion
-        proceso.save()
+        # Guardar en el proceso junto con sus mediciones
+        with transaction.atomic():
+            proceso.datos_clasificacion = datos_clasificacion
+            proceso.save(update_fields=['datos_clasificacion', 'fecha_actualizacion'])
+            MedicionFase.registrar(proceso, 'CLASIFICACION', datos_clasificacion)
         
         # Registrar en bitácora
         RegistroBitacora.registrar_accion(
@@ -2975,9 +3922,11 @@ def guardar_datos_densidad_1(request, proceso_id):
             'usuario_registro': request.user.get_full_name() or request.user.username
         }
         
-        # Guardar en el proceso
-        proceso.datos_densidad_1 = datos_densidad_1
-        proceso.save()
+        # Guardar en el proceso junto con sus mediciones
+        with transaction.atomic():
+            proceso.datos_densidad_1 = datos_densidad_1
+            proceso.save(update_fields=['datos_densidad_1', 'fecha_actualizacion'])
+            MedicionFase.registrar(proceso, 'DENSIDAD_1', datos_densidad_1)
         
         # Registrar en bitácora
         RegistroBitacora.registrar_accion(
@@ -3021,9 +3970,11 @@ def guardar_datos_densidad_2(request, proceso_id):
             'usuario_registro': request.user.get_full_name() or request.user.username
         }
         
-        # Guardar en el proceso
-        proceso.datos_densidad_2 = datos_densidad_2
-        proceso.save()
+        # Guardar en el proceso junto con sus mediciones
+        with transaction.atomic():
+            proceso.datos_densidad_2 = datos_densidad_2
+            proceso.save(update_fields=['datos_densidad_2', 'fecha_actualizacion'])
+            MedicionFase.registrar(proceso, 'DENSIDAD_2', datos_densidad_2)
         
         # Registrar en bitácora
         RegistroBitacora.registrar_accion(
@@ -3071,9 +4022,11 @@ def guardar_datos_color(request, proceso_id):
             'usuario_registro': request.user.get_full_name() or request.user.username
         }
         
-        # Guardar en el proceso
-        proceso.datos_color = datos_color
-        proceso.save()
+        # Guardar en el proceso junto con sus mediciones
+        with transaction.atomic():
+            proceso.datos_color = datos_color
+            proceso.save(update_fields=['datos_color', 'fecha_actualizacion'])
+            MedicionFase.registrar(proceso, 'COLOR', datos_color)
         
         # Registrar en bitácora
         RegistroBitacora.registrar_accion(
@@ -3119,9 +4072,11 @@ def guardar_datos_empaquetado(request, proceso_id):
             'usuario_registro': request.user.get_full_name() or request.user.username
         }
         
-        # Guardar en el proceso
-        proceso.datos_empaquetado = datos_empaquetado
-        proceso.save()
+        # Guardar en el proceso junto con sus mediciones
+        with transaction.atomic():
+            proceso.datos_empaquetado = datos_empaquetado
+            proceso.save(update_fields=['datos_empaquetado', 'fecha_actualizacion'])
+            MedicionFase.registrar(proceso, 'EMPAQUE', datos_empaquetado)
         
         # Registrar en bitácora
         RegistroBitacora.registrar_accion(
@@ -3147,3 +4102,50 @@ def guardar_datos_empaquetado(request, proceso_id):
         return Response({'error': 'Proceso no encontrado'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({'error': f'Error interno: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def resumen_mediciones_fases(request):
+    """
+    Cantidad, promedio, mínimo, máximo y suma de cada métrica de las fases de los procesos
+    (?fase=, ?metrica=, ?proceso=, ?fecha_desde=&fecha_hasta= de guardado de los datos)
+    """
+    try:
+        mediciones = MedicionFase.objects.all()
+        params = request.query_params
+        if params.get('fase'):
+            mediciones = mediciones.filter(fase=params['fase'])
+        if params.get('metrica'):
+            mediciones = mediciones.filter(metrica=params['metrica'])
+        if params.get('proceso'):
+            mediciones = mediciones.filter(proceso_id=params['proceso'])
+        if params.get('fecha_desde'):
+            mediciones = mediciones.filter(fecha_registro__gte=_inicio_del_dia(params['fecha_desde']))
+        if params.get('fecha_hasta'):
+            mediciones = mediciones.filter(fecha_registro__lt=_inicio_del_dia(params['fecha_hasta'], dias_despues=1))
+        
+        metricas = mediciones.order_by('fase', 'metrica', 'unidad').values('fase', 'metrica', 'unidad').annotate(
+            mediciones=Count('id'),
+            procesos=Count('proceso_id', distinct=True),
+            promedio=models.Avg('valor'),
+            minimo=models.Min('valor'),
+            maximo=models.Max('valor'),
+            suma=Sum('valor'),
+        )
+        resultado = [{
+            **metrica,
+            'promedio': round(float(metrica['promedio']), 4),
+            'minimo': float(metrica['minimo']),
+            'maximo': float(metrica['maximo']),
+            'suma': float(metrica['suma']),
+        } for metrica in metricas]
+        
+        return Response({
+            'count': len(resultado),
+            'metricas': resultado
+        })
+        
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)